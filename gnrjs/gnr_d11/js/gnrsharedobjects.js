@@ -32,17 +32,27 @@ dojo.declare("gnr.GnrSharedObjectHandler", null, {
     },
    
     do_sharedObjectChange:function(data){
-        var shared_id = data.getItem('shared_id');
-        var path = data.getItem('path');
-        var value = data.getItem('value');
         var attr = data.getItem('attr');
         if(attr && attr instanceof gnr.GnrBag){
             attr = attr.asDict();
         }
-        var evt = data.getItem('evt');
-        var fired = data.getItem('fired');
+        this.applySharedObjectChange(data.getItem('shared_id'),data.getItem('path'),data.getItem('value'),
+                                     attr,data.getItem('evt'),data.getItem('fired'));
+    },
+
+    do_sharedObjectChanges:function(data){
+        //a batch of changes in a json frame: values are typed text
+        var that = this;
+        dojo.forEach(data.changes,function(change){
+            if(change.from_page_id==genro.page_id){
+                return;
+            }
+            that.applySharedObjectChange(data.shared_id,change.path,convertFromText(change.value),
+                                         genro.wsk.typedAttributes(change.attr),change.evt,change.fired);
+        });
+    },
 
-        var from_page_id = data.getItem('from_page_id');
+    applySharedObjectChange:function(shared_id,path,value,attr,evt,fired){
         var so = genro._sharedObjects[shared_id];
         if(!so){
             return;
@@ -91,6 +91,14 @@ dojo.declare("gnr.GnrWebSocketHandler", null, {
             }else{
                 this.receivedCommand(result.getItem('command'),result.getItem('data'))
             }
+        }else if (data.indexOf('{')==0){
+            //json frames: the envelope of a result is typed, the data of a command is passed as is
+            var frame=dojo.fromJson(data);
+            if (frame.token){
+                this.receivedToken(frame.token,this.fromTypedJson(frame.envelope))
+            }else{
+                this.receivedCommand(frame.command,frame.data)
+            }
         }else{
             genro.publish('websocketMessage',data)
         }
@@ -234,6 +242,31 @@ dojo.declare("gnr.GnrWebSocketHandler", null, {
         this.socket.send(msg);
     },
     
+    fromTypedJson:function(value){
+        if (value===null || typeof(value)!='object'){
+            return convertFromText(value);
+        }
+        var result = new gnr.GnrBag();
+        for (var k in value){
+            if (stringEndsWith(k,'_attr')){
+                continue;
+            }
+            result.setItem(k,this.fromTypedJson(value[k]),this.typedAttributes(value[k+'_attr']));
+        }
+        return result;
+    },
+
+    typedAttributes:function(attr){
+        if (!attr){
+            return null;
+        }
+        var result = {};
+        for (var k in attr){
+            result[k] = convertFromText(attr[k]);
+        }
+        return result;
+    },
+
     parseResponse:function(response){
         var result = new gnr.GnrBag();
         var parser=new window.DOMParser()
@@ -230,6 +230,23 @@ class GnrSqlAppDb(GnrSqlDb):
         self.application.notifyDbEvent(tblobj, record, 'I')
        
 
+    def bulkInsert(self, tblobj, records, triggers='batch', **kwargs):
+        """Insert many records in the database (see :meth:`GnrSqlDb.bulkInsert()
+        <gnr.sql.gnrsql.GnrSqlDb.bulkInsert>`). With ``triggers='batch'`` the insert of
+        every record is notified
+
+        :param tblobj: the :ref:`database table <table>` object
+        :param records: an iterable of records
+        :param triggers: ``batch`` or ``none``"""
+        self.checkTransactionWritable(tblobj)
+        return GnrSqlDb.bulkInsert(self, tblobj, records, triggers=triggers, **kwargs)
+
+    def _onBulkInserted(self, tblobj, records, triggers=None):
+        if triggers != 'batch' or self.systemDbEvent():
+            return
+        for record in records:
+            self.application.notifyDbEvent(tblobj, record, 'I')
+
     def raw_delete(self, tblobj, record, **kwargs):
 
         """Delete a record in the database
@@ -304,7 +321,7 @@ class GnrSqlAppDb(GnrSqlDb):
             return
         maintable = getattr(page,'maintable',None)
         result = Bag()
-        fmethods = [v for v in [getattr(page,k) for k in dir(page) if k.startswith('formulacolumn_')]]
+        fmethods = [getattr(page,k) for k in self.model.virtualColumnRegistry.methodNames(page,'formulacolumn_')]
         for f in fmethods:
             fckw = dict(f.formulaColumn_kw)
             ftable = fckw.get('table',maintable)
@@ -1373,7 +1390,7 @@ class GnrApp(object):
                 adaptLegacyRow(r)
             rows.append(r)
         if rows:
-            destbl.insertMany(rows)
+            destbl.bulkInsert(rows, triggers='none')
         print 'imported',tbl
 
     def getAuxInstance(self, name=None,check=False):
@@ -167,7 +167,7 @@ class GnrDboPackage(object):
                     continue
                 recordsToInsert.append(r)
             if recordsToInsert:
-                tblobj.insertMany(recordsToInsert)
+                tblobj.bulkInsert(recordsToInsert, triggers='none')
         db.commit()
         os.remove('%s.pik' %bagpath)
 
@@ -24,6 +24,7 @@ import os
 from datetime import datetime, timedelta
 import time
 import logging
+import threading
 
 gnrlogger = logging.getLogger('gnr')
 
@@ -32,26 +33,75 @@ from logging import Formatter
 
 #gnrlogger = logging.getLogger('gnr.app.gnrtransactiond')
 
-from gnr.core.gnrlang import errorLog
+from gnr.core.gnrlang import errorLog, GnrException
 from gnr.core.gnrbag import Bag
 from gnr.app.gnrapp import GnrApp
+from gnr.app.gnrtransactionqueue import TransactionQueue
 
 from gnr.sql.gnrsql_exceptions import NotMatchingModelError
 from gnr.xtnd.sync4Dtransaction import TransactionManager4D
 
+STATS_INTERVAL = 60
+DAEMON_LOCK = 'gnr_transaction_daemon'
+
+class TransactionDaemonStats(object):
+    """Thread safe counters of the expanded transactions: the throughput and
+    the lag between the request and the execution start"""
+    def __init__(self):
+        self.start_ts = time.time()
+        self.processed = 0
+        self.errors = 0
+        self.last_lag = 0.
+        self.max_lag = 0.
+        self.workers = dict()
+        self._lock = threading.Lock()
+
+    def onTransaction(self, transaction, execution_start, ok=True):
+        lag = (execution_start - transaction['request']).total_seconds() if transaction['request'] else 0.
+        worker = threading.current_thread().name
+        with self._lock:
+            self.processed += 1
+            if not ok:
+                self.errors += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.workers[worker] = self.workers.get(worker, 0) + 1
+
+    def result(self, pending=None, oldest_request=None):
+        """Return a dict with the counters, the throughput (transactions per second)
+        and the lag in seconds of the last and of the oldest pending transaction"""
+        elapsed = time.time() - self.start_ts
+        with self._lock:
+            result = dict(processed=self.processed, errors=self.errors,
+                          throughput=round(self.processed / elapsed, 2) if elapsed else 0.,
+                          last_lag=round(self.last_lag, 2), max_lag=round(self.max_lag, 2),
+                          workers=dict(self.workers))
+        result['pending'] = pending
+        result['pending_lag'] = None
+        if oldest_request:
+            result['pending_lag'] = int((datetime.now() - oldest_request).total_seconds())
+        return result
+
 
 class GnrAppTransactionAgent(GnrApp):
     def onInited(self):
         self._startLog()
         gnrpkg = self.db.package('gnr')
         self.listen_timeout = int(gnrpkg.getAttr('listen_timeout_seconds', 10)) or 10
+        self.workers = int(gnrpkg.getAttr('transaction_workers', 1)) or 1
         self.running = False
+        self.stats = TransactionDaemonStats()
+        self._last_stats_ts = 0
+        self._worker_threads = []
+        self._wakeup = threading.Condition()
+        self._generation = 0
         self.db.inTransactionDaemon = True
         self.checkModel = False
         self.transaction4d = TransactionManager4D(self, 'gnr')
         self.transaction_pkgid = 'gnr'
         self.transaction_tname = '%s.transaction' % self.transaction_pkgid
         self.error_tname = '%s.error' % self.transaction_pkgid
+        self.queue = TransactionQueue(self.db, self.transaction_tname)
         if self.config['logging.email']:
             mailhost = self.config['logging.email?host'] 
             fromaddr = self.config['logging.email?fromaddr'] 
@@ -89,12 +139,32 @@ class GnrAppTransactionAgent(GnrApp):
             if changes:
                 raise NotMatchingModelError('\n'.join(self.db.model.modelChanges))
         self.running = True
-        self.checkTransactions()
-        self.db.listen('gnr_transaction_new', timeout=self.listen_timeout, onNotify=self.checkTransactions,
-                       onTimeout=self.checkTransactions)
+        if self.workers > 1 and not self.db.adapter.support_skip_locked:
+            gnrlogger.warning('%s: the adapter cannot skip locked rows, running with a single worker' % self.processName)
+            self.workers = 1
+        if self.workers > 1:
+            self.startWorkers()
+        try:
+            self.checkTransactions()
+            self.db.listen('gnr_transaction_new', timeout=self.listen_timeout, onNotify=self.checkTransactions,
+                           onTimeout=self.checkTransactions)
+        finally:
+            self.stopWorkers()
 
     def checkTransactions(self, notify=None):
         print "Checking -- [%i-%i-%i %02i:%02i:%02i]" % (time.localtime()[:6])
+        if time.time() - self._last_stats_ts > STATS_INTERVAL:
+            self._last_stats_ts = time.time()
+            try:
+                self.logStats()
+            except Exception, e:
+                self.db.rollback()
+                gnrlogger.error('%s: stats not written: %s' % (self.processName, e))
+        if self._worker_threads:
+            with self._wakeup:
+                self._generation += 1
+                self._wakeup.notify_all()
+            return self.running
         try:
             todo = True
             while todo:
@@ -107,6 +177,72 @@ class GnrAppTransactionAgent(GnrApp):
             raise
         return self.running
 
+    def startWorkers(self):
+        """Start ``transaction_workers`` threads claiming the transactions with
+        :meth:`claimTransaction`. The transactions claimed by a previous run and never
+        completed are released first: so only one daemon with workers can run on a db,
+        and it holds a session lock of the db until it stops"""
+        if self.db.adapter.trySessionLock(DAEMON_LOCK) is False:
+            raise GnrException('%s: another transaction daemon with workers is running on the db'
+                               % self.processName)
+        self.queue.releaseClaims()
+        for i in range(self.workers):
+            worker = threading.Thread(target=self._worker, name='trworker_%i' % i)
+            worker.daemon = True
+            worker.start()
+            self._worker_threads.append(worker)
+
+    def stopWorkers(self):
+        self.running = False
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for worker in self._worker_threads:
+            worker.join()
+        if self._worker_threads:
+            try:
+                self.db.adapter.releaseSessionLock(DAEMON_LOCK)
+            except Exception:
+                pass #the lock is released anyway when the connection is closed
+        self._worker_threads = []
+
+    def _worker(self):
+        generation = None
+        try:
+            while self.running:
+                try:
+                    while self.running:
+                        transaction = self.claimTransaction()
+                        if not transaction:
+                            break
+                        self.expandTransaction(transaction)
+                except:
+                    self.db.rollback()
+                    gnrlogger.error(errorLog(self.processName))
+                with self._wakeup:
+                    if self.running and generation == self._generation:
+                        self._wakeup.wait(self.listen_timeout)
+                    generation = self._generation
+        finally:
+            self.db.closeConnection()
+
+    def claimTransaction(self):
+        """Claim the next transaction to expand (see :meth:`TransactionQueue.claim`)"""
+        return self.queue.claim()
+
+    def transactionStats(self):
+        """Return the :class:`TransactionDaemonStats` result with the number of the pending
+        transactions and the lag of the oldest one"""
+        pending, oldest = self.queue.pending()
+        return self.stats.result(pending=pending, oldest_request=oldest)
+
+    def logStats(self):
+        stats = self.transactionStats()
+        gnrlogger.info('%(processed)i transactions (%(errors)i errors) %(throughput)s/s, '
+                       'lag %(last_lag)ss (max %(max_lag)ss), %(pending)s pending (lag %(pending_lag)ss)' % stats)
+        stats = Bag(stats)
+        stats['workers'] = Bag(stats['workers'])
+        stats.toXml(os.path.join(self.instanceFolder, 'logs', 'gnrtrdaemon_stats.xml'))
+
     def _get_processName(self):
         return 'transaction daemon: %s' % self.instanceFolder
 
@@ -172,6 +308,7 @@ class GnrAppTransactionAgent(GnrApp):
             self.db.table(self.transaction_tname).update(trargs)
             self.db.commit() # commit all: before was: actually commit only modification to the transaction. do_ methods commits by themself
             result = True
+            self.stats.onTransaction(transaction, trargs['execution_start'])
         except:
             self.db.rollback()
 
@@ -190,6 +327,7 @@ class GnrAppTransactionAgent(GnrApp):
             errtbl.insert(dict(id=errid, ts=trargs['execution_end'], data=tb_text))
             self.db.commit()
             result = False
+            self.stats.onTransaction(transaction, trargs['execution_start'], ok=False)
         self.db.clearCurrentEnv()
         return result
     
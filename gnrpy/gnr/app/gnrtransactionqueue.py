@@ -0,0 +1,74 @@
+#-*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy app - see LICENSE for details
+# module gnrtransactionqueue : the transactions claimed by the workers of the transaction daemon.
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+from datetime import datetime
+
+CLAIMABLE_WHERE = """$execution_start IS NULL AND ($queue_id IS NULL OR NOT EXISTS (
+                        SELECT 1 FROM %(tbl)s AS prev WHERE prev.queue_id = $queue_id AND
+                        (prev.error_id IS NOT NULL OR (prev.execution_end IS NULL AND
+                         (prev.request < $request OR (prev.request = $request AND prev.id < $id))))))"""
+
+class TransactionQueue(object):
+    """The pending transactions of a transaction table, claimed one at a time by
+    concurrent workers. Every worker thread uses its own connection of the db
+
+    :param db: the :class:`GnrSqlDb`
+    :param tname: the transaction table (e.g. ``gnr.transaction``)"""
+    def __init__(self, db, tname):
+        self.db = db
+        self.tname = tname
+
+    @property
+    def tblobj(self):
+        return self.db.table(self.tname)
+
+    def claim(self):
+        """Claim the next transaction to expand and return it, or ``None``. A transaction
+        without queue can be claimed at any time, a queued one only when all the previous
+        transactions of its queue are completed without errors: so the queues are expanded
+        in order, and different queues in parallel. The row is locked skipping the ones
+        locked by the other workers and it's marked as started before committing"""
+        tblobj = self.tblobj
+        rows = tblobj.query(columns='*,$data', where=CLAIMABLE_WHERE % dict(tbl=tblobj.model.sqlfullname),
+                            order_by='$request,$id', limit=1, for_update='skip_locked').fetch()
+        if not rows:
+            self.db.commit()
+            return None
+        transaction = rows[0]
+        tblobj.update({'id': transaction['id'], 'execution_start': datetime.now()})
+        self.db.commit()
+        return transaction
+
+    def releaseClaims(self):
+        """Release the transactions claimed and never completed, e.g. by a daemon that
+        was stopped while expanding them"""
+        self.tblobj.batchUpdate(dict(execution_start=None),
+                                where='$execution_start IS NOT NULL AND $execution_end IS NULL')
+        self.db.commit()
+
+    def pending(self):
+        """Return the number of the transactions not claimed yet and the request
+        timestamp of the oldest one"""
+        query = self.tblobj.query(columns='$request', where='$execution_start IS NULL',
+                                  order_by='$request', limit=1)
+        oldest = query.fetch()
+        return query.count(), oldest[0]['request'] if oldest else None
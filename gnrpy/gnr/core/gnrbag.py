@@ -95,6 +95,126 @@ class BagDeprecatedCall(BagException):
         self.errcode = errcode
         self.message = message
         
+class BagNodeList(list):
+    """The list of the nodes of a Bag. It keeps an index of the labels, mapping every label
+    to the position of the first node with that label, so that :meth:`labelIndex` doesn't
+    scan the list. The index is built at the first lookup, it is updated by the appends,
+    it is rebuilt when the nodes are replaced by a slice assignment (as ``fillFrom`` does)
+    and it is dropped by any other change of the list"""
+    __slots__ = ('_labels',)
+
+    def __init__(self, nodes=()):
+        list.__init__(self, nodes)
+        self._labels = None
+
+    def __reduce__(self):
+        return (BagNodeList, (), None, iter(self))
+
+    def labelIndex(self, label):
+        """Return the position of the first node with the given label, or -1
+        
+        :param label: a not hierarchical label"""
+        labels = self._labels
+        if labels is None:
+            labels = self._buildIndex()
+        else:
+            idx = labels.get(label, -1)
+            if idx < 0 or (idx < len(self) and self[idx]._label == label):
+                return idx
+            labels = self._buildIndex()
+        if labels is None:
+            for idx, node in enumerate(self):
+                if node._label == label:
+                    return idx
+            return -1
+        return labels.get(label, -1)
+
+    def _buildIndex(self):
+        labels = {}
+        try:
+            for idx, node in enumerate(self):
+                labels.setdefault(node._label, idx)
+        except TypeError:
+            labels = None
+        self._labels = labels
+        return labels
+
+    def resetIndex(self):
+        """Drop the label index: it will be rebuilt at the next lookup"""
+        self._labels = None
+
+    def append(self, node):
+        if self._labels is not None:
+            try:
+                self._labels.setdefault(node._label, len(self))
+            except TypeError:
+                self._labels = None
+        list.append(self, node)
+
+    def extend(self, nodes):
+        for node in nodes:
+            self.append(node)
+
+    def insert(self, position, node):
+        if position >= len(self):
+            self.append(node)
+        else:
+            self._labels = None
+            list.insert(self, position, node)
+
+    def pop(self, position=-1):
+        node = list.pop(self, position)
+        labels = self._labels
+        if labels is not None:
+            if position == -1 or position == len(self):
+                if labels.get(node._label) == len(self):
+                    del labels[node._label]
+            else:
+                self._labels = None
+        return node
+
+    def remove(self, node):
+        self._labels = None
+        list.remove(self, node)
+
+    def reverse(self):
+        self._labels = None
+        list.reverse(self)
+
+    def sort(self, *args, **kwargs):
+        self._labels = None
+        list.sort(self, *args, **kwargs)
+
+    def __setitem__(self, idx, value):
+        indexed = self._labels is not None
+        self._labels = None
+        list.__setitem__(self, idx, value)
+        if indexed and isinstance(idx, slice):
+            self._buildIndex()
+
+    def __delitem__(self, idx):
+        self._labels = None
+        list.__delitem__(self, idx)
+
+    def __setslice__(self, i, j, nodes):
+        indexed = self._labels is not None
+        self._labels = None
+        list.__setslice__(self, i, j, nodes)
+        if indexed:
+            self._buildIndex()
+
+    def __delslice__(self, i, j):
+        self._labels = None
+        list.__delslice__(self, i, j)
+
+    def __iadd__(self, nodes):
+        self.extend(nodes)
+        return self
+
+    def __imul__(self, n):
+        self._labels = None
+        return list.__imul__(self, n)
+
 class BagNode(object):
     """BagNode is the element type which a Bag is composed of. That's why it's possible to say that a Bag
     is a collection of BagNodes. A BagNode is an object that gather within itself, three main things:
@@ -102,10 +222,12 @@ class BagNode(object):
     * *label*: can be only a string.
     * *value*: can be anything even a BagNode. If you got the xml of the Bag it should be serializable
     * *attributes*: dictionary that contains node's metadata"""
+    __slots__ = ('_label', 'locked', '_value', '_resolver', '_parentbag', '_node_subscribers',
+                 '_validators', 'attr', '_tail_list', '__dict__')
 
     def __init__(self, parentbag, label, value=None, attr=None, resolver=None,
                  validators=None, _removeNullAttributes=True):
-        self.label = label
+        self._label = label
         self.locked = False
         self._value = None
         self.resolver = resolver
@@ -135,6 +257,18 @@ class BagNode(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', None) or {})
+        for k in BagNode.__slots__[:-1]:
+            if hasattr(self, k):
+                state[k] = getattr(self, k)
+        return state
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            if k == 'label':
+                k = '_label'
+            setattr(self, k, v)
             
     def setValidators(self, validators):
         """TODO"""
@@ -166,11 +300,16 @@ class BagNode(object):
 
     def getLabel(self):
         """Return the node's label"""
-        return self.label
+        return self._label
 
     def setLabel(self, label):
         """Set node's label"""
-        self.label = label
+        self._label = label
+        parentbag = getattr(self, '_parentbag', None)
+        if parentbag is not None:
+            parentbag._nodes.resetIndex()
+
+    label = property(getLabel, setLabel)
 
     def getValue(self, mode=''):
         """Return the value of the BagNode. It is called by the property .value
@@ -416,7 +555,7 @@ class Bag(GnrObject):
         * converting a dictionary into a Bag
         * passing a list or a tuple just like for the builtin dict() command"""
         GnrObject.__init__(self)
-        self._nodes = []
+        self._nodes = BagNodeList()
         self._backref = False
         self._node = None
         self._parent = None
@@ -1033,7 +1172,7 @@ class Bag(GnrObject):
     def clear(self):
         """Clear the Bag"""
         oldnodes = self._nodes
-        self._nodes = []
+        self._nodes = BagNodeList()
         if self.backref:
             self._onNodeDeleted(oldnodes, -1)
 
@@ -1104,6 +1243,11 @@ class Bag(GnrObject):
         result['_parentNode'] = None
         return result
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not isinstance(self._nodes, BagNodeList):
+            self._nodes = BagNodeList(self._nodes)
+
 
 
     def merge(self, otherbag, upd_values=True, add_values=True, upd_attr=True, add_attr=True):
@@ -1740,13 +1884,7 @@ class Bag(GnrObject):
                 if idx < len(self._nodes): result = idx
 
         else:
-        #f=filter(lambda x: x[1].label==label, enumerate(self._nodes))
-        #if len(f)>0:
-        #result=f[0][0]
-            for idx, el in enumerate(self._nodes):
-                if el.label == label:
-                    result = idx
-                    break
+            result = self._nodes.labelIndex(label)
         return result
 
     #-------------------- pickle --------------------------------
@@ -1783,7 +1921,24 @@ class Bag(GnrObject):
         else:
             result = pickle.loads(source)
         return result
-        
+
+    #-------------------- binary --------------------------------
+    def toBinary(self, compress=False):
+        """Return the Bag in a compact binary format (see the :mod:`gnr.core.gnrbagbinary` module)
+
+        :param compress: boolean. If ``True``, the data is compressed with zlib"""
+        from gnr.core.gnrbagbinary import BagToBinary
+
+        return BagToBinary().build(self, compress=compress)
+
+    def fromBinary(self, data):
+        """Fill the Bag with the data returned by :meth:`toBinary`
+
+        :param data: the binary data"""
+        from gnr.core.gnrbagbinary import BagFromBinary
+
+        BagFromBinary().build(data, bag=self)
+
     def setCallable(self, name, argstring=None, func='pass'):
         """TODO
         
@@ -1797,7 +1952,7 @@ class Bag(GnrObject):
               addBagTypeAttr=True,
               autocreate=False, translate_cb=None, self_closed_tags=None,
               omitUnknownTypes=False, catalog=None, omitRoot=False, forcedTagAttr=None, docHeader=None,
-              mode4d=False,pretty=False):
+              mode4d=False,pretty=False,output=None):
         """Return a complete standard XML version of the Bag, including the encoding
         tag <?xml version=\'1.0\' encoding=\'UTF-8\'?> (the *docHeader* default value)
         
@@ -1821,6 +1976,8 @@ class Bag(GnrObject):
         :param omitRoot: boolean. If ``False``, add the ``<GenRoBag>`` tag root
         :param forcedTagAttr: TODO
         :param docHeader: set an header tag external the ``<GenRoBag>`` tag
+        :param output: a file object. If given, the XML is streamed to it and nothing is returned.
+                       It cannot be given with *filename*
         
         >>> mybag=Bag()
         >>> mybag['aa.bb']=4567
@@ -1836,7 +1993,7 @@ class Bag(GnrObject):
                                 unresolved=unresolved, autocreate=autocreate, forcedTagAttr=forcedTagAttr,
                                 translate_cb=translate_cb, self_closed_tags=self_closed_tags,
                                 omitUnknownTypes=omitUnknownTypes, catalog=catalog, omitRoot=omitRoot,
-                                docHeader=docHeader,mode4d=mode4d,pretty=pretty)
+                                docHeader=docHeader,mode4d=mode4d,pretty=pretty,output=output)
                                 
     def fillFrom(self, source):
         """Fill a void Bag from a source (basestring, Bag or list)
@@ -1845,10 +2002,10 @@ class Bag(GnrObject):
         if isinstance(source, basestring):
             b = self._fromSource(*self._sourcePrepare(source))
             if not b: b = Bag()
-            self._nodes[:] = b._nodes[:]
+            self._nodes[:] = b._nodes
 
         elif isinstance(source, Bag):
-            self._nodes = [BagNode(self, *x.asTuple()) for x in source]
+            self._nodes = BagNodeList([BagNode(self, *x.asTuple()) for x in source])
             
         elif callable(getattr(source, 'items',None)):
             for key, value in source.items():
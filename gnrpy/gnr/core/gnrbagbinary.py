@@ -0,0 +1,437 @@
+# -*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy core - see LICENSE for details
+# module gnrbagbinary : bag from/to binary methods
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""A compact binary format for the :class:`Bag <gnr.core.gnrbag.Bag>`.
+
+The data starts with the ``GBB`` mark, the version of the format and a flags byte
+(zlib compression, backref). Then comes the root Bag: its root attributes, the
+number of its nodes and the nodes. A node is its label, a flags byte, its attributes,
+its static value and, if it has one, its pickled resolver. Labels and attribute names
+are written once and then referred by their position.
+
+Values are typed: ``None``, ``bool``, ``int``, ``long``, ``float``, ``str``, ``unicode``,
+``Decimal``, ``date``, naive ``datetime`` and ``time``, ``list``, ``tuple``, ``dict``,
+``set``, ``frozenset`` and Bag have their own encoding, any other value is pickled.
+Validators and subscriptions are not written, as it happens with pickle"""
+
+import struct
+import zlib
+import datetime
+import cPickle as pickle
+from decimal import Decimal
+
+from gnr.core.gnrbag import Bag, BagNode, BagNodeList, BagException
+
+BINARY_MARK = 'GBB'
+BINARY_VERSION = 1
+
+FLAG_ZLIB = 1
+FLAG_BACKREF = 2
+
+NODE_ATTR = 1
+NODE_RESOLVER = 2
+NODE_LOCKED = 4
+
+_INT64 = struct.Struct('<q')
+_DOUBLE = struct.Struct('<d')
+_DATE = struct.Struct('<HBB')
+_DATETIME = struct.Struct('<HBBBBBI')
+_TIME = struct.Struct('<BBBI')
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+class BagBinaryError(BagException):
+    """Raised when the data is not in the binary Bag format or its version is not supported"""
+    pass
+
+class BagToBinary(object):
+    """The class that handles the conversion from the :class:`Bag <gnr.core.gnrbag.Bag>`
+    class to the binary format"""
+    def build(self, bag, compress=False):
+        """Return the binary version of the Bag
+
+        :param bag: the Bag to transform
+        :param compress: boolean. If ``True``, the data is compressed with zlib"""
+        self.out = []
+        self.names = {}
+        self.writers = {type(None): self.writeNone, bool: self.writeBool, int: self.writeInt,
+                        long: self.writeLong, float: self.writeFloat, str: self.writeStr,
+                        unicode: self.writeUnicode, Decimal: self.writeDecimal,
+                        datetime.date: self.writeDate, datetime.datetime: self.writeDatetime,
+                        datetime.time: self.writeTime, list: self.writeList, tuple: self.writeTuple,
+                        dict: self.writeDict, set: self.writeSet, frozenset: self.writeFrozenset,
+                        Bag: self.writeBag}
+        self.writeBagContent(bag)
+        body = ''.join(self.out)
+        self.out = self.names = self.writers = None
+        flags = 0
+        if compress:
+            body = zlib.compress(body)
+            flags |= FLAG_ZLIB
+        if bag.backref:
+            flags |= FLAG_BACKREF
+        return '%s%s%s%s' % (BINARY_MARK, chr(BINARY_VERSION), chr(flags), body)
+
+    def writeSize(self, n):
+        if n < 0x80:
+            self.out.append(chr(n))
+            return
+        chunks = []
+        while n >= 0x80:
+            chunks.append(chr((n & 0x7f) | 0x80))
+            n >>= 7
+        chunks.append(chr(n))
+        self.out.append(''.join(chunks))
+
+    def writeName(self, name):
+        key = name if type(name) is str else (type(name), name)
+        ref = self.names.get(key)
+        if ref:
+            self.writeSize(ref)
+        else:
+            self.names[key] = len(self.names) + 1
+            self.out.append('\x00')
+            self.writeValue(name)
+
+    def writeValue(self, value):
+        writer = self.writers.get(type(value))
+        if writer:
+            writer(value)
+        else:
+            self.writePickle(value)
+
+    def writeNone(self, value):
+        self.out.append('N')
+
+    def writeBool(self, value):
+        self.out.append('T' if value else 'F')
+
+    def writeInt(self, value):
+        if 0 <= value < 0x100:
+            self.out.append('b%s' % chr(value))
+        elif _INT64_MIN <= value <= _INT64_MAX:
+            self.out.append('i%s' % _INT64.pack(value))
+        else:
+            self.writeText('l', str(value))
+
+    def writeLong(self, value):
+        self.writeText('l', str(value))
+
+    def writeFloat(self, value):
+        self.out.append('d%s' % _DOUBLE.pack(value))
+
+    def writeText(self, tag, value):
+        self.out.append(tag)
+        self.writeSize(len(value))
+        self.out.append(value)
+
+    def writeStr(self, value):
+        self.writeText('s', value)
+
+    def writeUnicode(self, value):
+        self.writeText('u', value.encode('utf8'))
+
+    def writeDecimal(self, value):
+        self.writeText('m', str(value))
+
+    def writeDate(self, value):
+        self.out.append('D%s' % _DATE.pack(value.year, value.month, value.day))
+
+    def writeDatetime(self, value):
+        if value.tzinfo is not None:
+            return self.writePickle(value)
+        self.out.append('Z%s' % _DATETIME.pack(value.year, value.month, value.day, value.hour,
+                                               value.minute, value.second, value.microsecond))
+
+    def writeTime(self, value):
+        if value.tzinfo is not None:
+            return self.writePickle(value)
+        self.out.append('H%s' % _TIME.pack(value.hour, value.minute, value.second, value.microsecond))
+
+    def writeSequence(self, tag, value):
+        self.out.append(tag)
+        self.writeSize(len(value))
+        for v in value:
+            self.writeValue(v)
+
+    def writeList(self, value):
+        self.writeSequence('L', value)
+
+    def writeTuple(self, value):
+        self.writeSequence('t', value)
+
+    def writeSet(self, value):
+        self.writeSequence('S', value)
+
+    def writeFrozenset(self, value):
+        self.writeSequence('f', value)
+
+    def writeDict(self, value):
+        self.out.append('M')
+        self.writeSize(len(value))
+        for k, v in value.iteritems():
+            self.writeValue(k)
+            self.writeValue(v)
+
+    def writePickle(self, value):
+        self.writeText('P', pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def writeBag(self, bag):
+        self.out.append('B')
+        self.writeBagContent(bag)
+
+    def writeBagContent(self, bag):
+        self.writeValue(bag._rootattributes)
+        nodes = bag._nodes
+        self.writeSize(len(nodes))
+        for node in nodes:
+            self.writeName(node._label)
+            attr = node.attr
+            resolver = node._resolver
+            flags = 0
+            if attr:
+                flags |= NODE_ATTR
+            if resolver is not None:
+                flags |= NODE_RESOLVER
+            if node.locked:
+                flags |= NODE_LOCKED
+            self.out.append(chr(flags))
+            if attr:
+                self.writeSize(len(attr))
+                for k, v in attr.iteritems():
+                    self.writeName(k)
+                    self.writeValue(v)
+            self.writeValue(node._value)
+            if resolver is not None:
+                parentNode = resolver.parentNode
+                resolver.parentNode = None
+                try:
+                    self.writePickle(resolver)
+                finally:
+                    resolver.parentNode = parentNode
+
+class BagFromBinary(object):
+    """The class that handles the conversion from the binary format to the
+    :class:`Bag <gnr.core.gnrbag.Bag>` class"""
+    def build(self, data, bag=None):
+        """Fill the Bag with the content of the binary data and return it
+
+        :param data: the data returned by :meth:`BagToBinary.build`
+        :param bag: the Bag to fill. If ``None``, a new Bag is created"""
+        if data[:3] != BINARY_MARK:
+            raise BagBinaryError('Not a binary Bag')
+        version = ord(data[3])
+        if version > BINARY_VERSION:
+            raise BagBinaryError('Unsupported binary Bag version %i' % version)
+        flags = ord(data[4])
+        data = data[5:]
+        if flags & FLAG_ZLIB:
+            data = zlib.decompress(data)
+        self.data = data
+        self.pos = 0
+        self.names = [None]
+        self.readers = {'N': self.readNone, 'T': self.readTrue, 'F': self.readFalse, 'b': self.readByte,
+                        'i': self.readInt, 'l': self.readLong, 'd': self.readFloat, 's': self.readStr,
+                        'u': self.readUnicode, 'm': self.readDecimal, 'D': self.readDate,
+                        'Z': self.readDatetime, 'H': self.readTime, 'L': self.readList, 't': self.readTuple,
+                        'M': self.readDict, 'S': self.readSet, 'f': self.readFrozenset, 'B': self.readBag,
+                        'P': self.readPickle}
+        if bag is None:
+            bag = Bag()
+        self.readBagContent(bag)
+        self.data = self.names = self.readers = None
+        if flags & FLAG_BACKREF:
+            bag.setBackRef()
+        return bag
+
+    def readSize(self):
+        data = self.data
+        pos = self.pos
+        n = ord(data[pos])
+        pos += 1
+        if n >= 0x80:
+            n &= 0x7f
+            shift = 7
+            while True:
+                b = ord(data[pos])
+                pos += 1
+                n |= (b & 0x7f) << shift
+                if b < 0x80:
+                    break
+                shift += 7
+        self.pos = pos
+        return n
+
+    def readName(self):
+        ref = ord(self.data[self.pos])
+        if 0 < ref < 0x80:
+            self.pos += 1
+            return self.names[ref]
+        ref = self.readSize()
+        if ref:
+            return self.names[ref]
+        name = self.readValue()
+        self.names.append(name)
+        return name
+
+    def readValue(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        try:
+            reader = self.readers[tag]
+        except KeyError:
+            raise BagBinaryError('Unknown value type %r at %i' % (tag, self.pos - 1))
+        return reader()
+
+    def readNone(self):
+        return None
+
+    def readTrue(self):
+        return True
+
+    def readFalse(self):
+        return False
+
+    def readByte(self):
+        self.pos += 1
+        return ord(self.data[self.pos - 1])
+
+    def readStruct(self, fmt):
+        value = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return value
+
+    def readInt(self):
+        return self.readStruct(_INT64)[0]
+
+    def readText(self):
+        size = self.readSize()
+        pos = self.pos
+        self.pos = pos + size
+        return self.data[pos:pos + size]
+
+    def readLong(self):
+        return long(self.readText())
+
+    def readFloat(self):
+        return self.readStruct(_DOUBLE)[0]
+
+    def readStr(self):
+        return self.readText()
+
+    def readUnicode(self):
+        return self.readText().decode('utf8')
+
+    def readDecimal(self):
+        return Decimal(self.readText())
+
+    def readDate(self):
+        return datetime.date(*self.readStruct(_DATE))
+
+    def readDatetime(self):
+        return datetime.datetime(*self.readStruct(_DATETIME))
+
+    def readTime(self):
+        return datetime.time(*self.readStruct(_TIME))
+
+    def readList(self):
+        return [self.readValue() for k in xrange(self.readSize())]
+
+    def readTuple(self):
+        return tuple(self.readList())
+
+    def readSet(self):
+        return set(self.readList())
+
+    def readFrozenset(self):
+        return frozenset(self.readList())
+
+    def readDict(self):
+        result = {}
+        for k in xrange(self.readSize()):
+            key = self.readValue()
+            result[key] = self.readValue()
+        return result
+
+    def readPickle(self):
+        return pickle.loads(self.readText())
+
+    def readBag(self):
+        bag = Bag()
+        self.readBagContent(bag)
+        return bag
+
+    def readBagContent(self, bag):
+        bag._rootattributes = self.readValue()
+        nodes = []
+        for k in xrange(self.readSize()):
+            node = BagNode.__new__(BagNode)
+            node._label = self.readName()
+            flags = ord(self.data[self.pos])
+            self.pos += 1
+            attr = {}
+            if flags & NODE_ATTR:
+                for j in xrange(self.readSize()):
+                    name = self.readName()
+                    attr[name] = self.readValue()
+            node.attr = attr
+            node.locked = bool(flags & NODE_LOCKED)
+            node._node_subscribers = {}
+            node._validators = None
+            node._parentbag = bag
+            node._value = self.readValue()
+            node._resolver = None
+            if flags & NODE_RESOLVER:
+                self.pos += 1
+                node.resolver = self.readPickle()
+            nodes.append(node)
+        bag._nodes = BagNodeList(nodes)
+        return bag
+
+class PackedBag(object):
+    """A wrapper that makes a Bag pickled in the binary format: unpickling it returns
+    the Bag itself, of the same class (see :func:`unpackBag`)
+
+    :param bag: the Bag
+    :param compress: boolean. If ``True``, the binary data is compressed"""
+    def __init__(self, bag, compress=False):
+        self.bag = bag
+        self.compress = compress
+
+    def __reduce__(self):
+        return (unpackBag, (BagToBinary().build(self.bag, compress=self.compress), self.bag.__class__))
+
+def packBag(value, compress=False):
+    """Return a :class:`PackedBag` if the value is a Bag, otherwise the value itself
+
+    :param value: the value to pack
+    :param compress: boolean. If ``True``, the binary data is compressed"""
+    if isinstance(value, Bag):
+        return PackedBag(value, compress=compress)
+    return value
+
+def unpackBag(data, bagcls=None):
+    """Return a new Bag, of class ``bagcls``, filled with the binary data
+
+    :param data: the binary data
+    :param bagcls: the class of the Bag. Default: :class:`Bag <gnr.core.gnrbag.Bag>`"""
+    return BagFromBinary().build(data, bag=(bagcls or Bag)())
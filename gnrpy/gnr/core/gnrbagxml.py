@@ -22,6 +22,7 @@
 
 import re, os
 import datetime
+import itertools
 
 from xml import sax
 from xml.sax import saxutils
@@ -35,7 +36,10 @@ import time
 import StringIO
 
 REGEX_XML_ILLEGAL = re.compile(r'<|>|&')
+REGEX_XML_AMP = re.compile("&(?!([a-zA-Z][a-zA-Z0-9]*|#\d+);)")
 ZERO_TIME=datetime.time(0,0)
+XML_CHUNKSIZE = 65536
+_STREAM_MARK = u'\x00GNRSTREAM\x00'
 
 def isValidValue(value):
     """A check method for the validity of a :class:`Bag <gnr.core.gnrbag.Bag>` value
@@ -119,7 +123,7 @@ class BagFromXml(object):
             if source.startswith('<?xml'):
                 source = source[source.index('?>'):]
             source = "<?xml version='1.0' encoding='UTF-8'?>%s" % source.encode('UTF-8')
-        source = re.sub("&(?!([a-zA-Z][a-zA-Z0-9]*|#\d+);)", "&amp;", source)
+        source = REGEX_XML_AMP.sub("&amp;", source)
         sax.parseString(source, bagImport)
         if not testmode:
             result = bagImport.bags[0][0]
@@ -127,6 +131,70 @@ class BagFromXml(object):
             if result == None: result = []
             return result
 
+    def iterNodes(self, source, fromFile, path=None, catalog=None, bagcls=Bag, empty=None,
+                  chunksize=XML_CHUNKSIZE):
+        """Parse the XML source a chunk at a time and yield the nodes of the Bag at ``path``
+        as soon as they are closed, without building the whole Bag. The nodes are identical
+        to the ones of :meth:`build`
+        
+        :param source: a file path, a file object or an XML string
+        :param fromFile: boolean. If ``True``, source is a file path
+        :param path: the path of the Bag whose nodes are yielded, relative to the Bag
+                     that :meth:`build` would return. If ``None``, its top-level nodes are yielded
+        :param catalog: TODO
+        :param bagcls: TODO
+        :param empty: TODO
+        :param chunksize: the size of the chunks read from the source"""
+        if not bagcls: bagcls = Bag
+        if fromFile:
+            infile = open(source)
+        elif hasattr(source, 'read'):
+            infile = source
+        else:
+            if isinstance(source, unicode):
+                source = source.encode('utf8')
+            infile = StringIO.StringIO(source)
+        bagImport = _SaxStreamImporter()
+        bagImport.catalog = catalog or gnrclasses.GnrClassCatalog()
+        bagImport.bagcls = bagcls
+        bagImport.empty = empty
+        bagImport.path = path.split('.') if path else []
+        parser = sax.make_parser()
+        parser.setContentHandler(bagImport)
+        try:
+            for chunk in self._xmlChunks(infile, chunksize):
+                parser.feed(chunk)
+                for node in bagImport.closedNodes():
+                    yield node
+            parser.close()
+            result = bagImport.bags[0][0]
+            if bagImport.format == 'GenRoBag':
+                result = result['GenRoBag']
+            if bagImport.path and isinstance(result, Bag):
+                result = result['.'.join(bagImport.path)]
+            if isinstance(result, Bag):
+                for node in bagImport.detachNodes(result):
+                    yield node
+        finally:
+            if fromFile:
+                infile.close()
+
+    def _xmlChunks(self, infile, chunksize):
+        tail = ''
+        while True:
+            chunk = infile.read(chunksize)
+            if not chunk:
+                break
+            chunk = tail + chunk
+            tail = ''
+            amp = chunk.rfind('&')
+            if amp >= 0 and len(chunk) - amp < 64 and not ';' in chunk[amp:]:
+                #an entity could be split between two chunks
+                chunk, tail = chunk[:amp], chunk[amp:]
+            yield REGEX_XML_AMP.sub("&amp;", chunk)
+        if tail:
+            yield REGEX_XML_AMP.sub("&amp;", tail)
+
 class _SaxImporterError(sax.handler.ErrorHandler):
     def error(self, error):
         pass
@@ -241,14 +309,55 @@ class _SaxImporter(sax.handler.ContentHandler):
         else:
             dest.nodes.append(BagNode(dest, tagLabel, curr))
             
+class _SaxStreamImporter(_SaxImporter):
+    """The :class:`_SaxImporter` of :meth:`BagFromXml.iterNodes`: it keeps the labels of
+    the open elements to find the Bag whose nodes are streamed"""
+    def startDocument(self):
+        _SaxImporter.startDocument(self)
+        self.labels = []
+
+    def startElement(self, tagLabel, attributes):
+        depth = len(self.bags)
+        _SaxImporter.startElement(self, tagLabel, attributes)
+        if len(self.bags) > depth:
+            self.labels.append(self.bags[-1][1].get('_tag', tagLabel))
+
+    def endElement(self, tagLabel):
+        depth = len(self.bags)
+        _SaxImporter.endElement(self, tagLabel)
+        if len(self.bags) < depth:
+            self.labels.pop()
+
+    def closedNodes(self):
+        """Remove and return the nodes already closed in the streamed Bag"""
+        if not self.format:
+            return []
+        offset = 1 if self.format == 'GenRoBag' else 0
+        depth = len(self.path) + offset
+        if len(self.bags) <= depth or self.labels[offset:depth] != self.path:
+            return []
+        container = self.bags[depth][0]
+        if not isinstance(container, Bag):
+            return []
+        return self.detachNodes(container)
+
+    def detachNodes(self, bag):
+        nodes = list(bag.nodes)
+        del bag.nodes[:]
+        for node in nodes:
+            node.parentbag = None
+        return nodes
+
 class BagToXml(object):
     """The class that handles the conversion from the :class:`Bag <gnr.core.gnrbag.Bag>`
     class to the XML format"""
-    def nodeToXmlBlock(self, node, namespaces=None):
+    def nodeToXmlBlock(self, node, namespaces=None, streaming=False):
         """Handle all the different node types, call the method build tag. Return
         the XML tag that represent the BagNode
         
-        :param node: the :meth:`BagNode <gnr.core.gnrbag.BagNode>`"""
+        :param node: the :meth:`BagNode <gnr.core.gnrbag.BagNode>`
+        :param streaming: boolean. If ``True``, the tag of a node whose value is a Bag is
+                          returned as an iterator of strings (see :meth:`iterBagXmlBlock`)"""
         nodeattr = dict(node.attr)
         local_namespaces = [k[6:] for k in nodeattr.keys() if k.startswith('xmlns:')]
         current_namespaces = namespaces+local_namespaces
@@ -261,11 +370,17 @@ class BagToXml(object):
                 nodeattr['_resolver'] = gnrstring.toJson(node.resolver.resolverSerialize())
             value = ''
             if isinstance(node._value, Bag):
+                if streaming:
+                    return self._iterTag(node._value, current_namespaces, node.label, nodeattr, '',
+                                         xmlMode=True, namespaces=namespaces)
                 value = self.bagToXmlBlock(node._value,namespaces=current_namespaces)
             return self.buildTag(node.label, value, nodeattr, '', xmlMode=True,namespaces=namespaces)
 
         nodeValue = node.getValue()
-        if isinstance(nodeValue, Bag) and nodeValue: #<---Add the second condition in order to type the empty bag.
+        if streaming and isinstance(nodeValue, Bag) and nodeValue:
+            result = self._iterTag(nodeValue, current_namespaces, node.label, nodeattr, '',
+                                   xmlMode=True, localize=False, namespaces=namespaces)
+        elif isinstance(nodeValue, Bag) and nodeValue: #<---Add the second condition in order to type the empty bag.
             result = self.buildTag(node.label,
                                    self.bagToXmlBlock(nodeValue,namespaces=current_namespaces), 
                                    nodeattr, '', xmlMode=True,localize=False,namespaces=namespaces)
@@ -312,12 +427,45 @@ class BagToXml(object):
         >>> mybag.toXmlBlock()
         ['<aa>', u'<cc>test</cc>', u'<bb T="L">4567</bb>', '</aa>']"""
         return '\n'.join([self.nodeToXmlBlock(node,namespaces=namespaces) for node in bag.nodes])
+
+    def iterBagXmlBlock(self, bag, namespaces=None):
+        """Yield the XML block of :meth:`bagToXmlBlock` as a sequence of strings, without
+        building the whole block
+        
+        :param bag: the Bag to transform in a XML block version
+        :param namespaces: TODO"""
+        for k, node in enumerate(bag.nodes):
+            if k:
+                yield '\n'
+            block = self.nodeToXmlBlock(node, namespaces=namespaces, streaming=True)
+            if isinstance(block, basestring):
+                yield block
+            else:
+                for chunk in block:
+                    yield chunk
+
+    def _iterTag(self, bag, bag_namespaces, tagName, *args, **kwargs):
+        #the tag is built around a mark that is then replaced by the streamed content
+        content = self.iterBagXmlBlock(bag, namespaces=bag_namespaces)
+        for first in content:
+            if first:
+                break
+        else:
+            yield self.buildTag(tagName, '', *args, **kwargs)
+            return
+        head, tail = self.buildTag(tagName, _STREAM_MARK, *args, **kwargs).split(_STREAM_MARK)
+        yield head
+        yield first
+        for chunk in content:
+            yield chunk
+        yield tail
         
     #-------------------- toXml --------------------------------
     def build(self, bag, filename=None, encoding='UTF-8', catalog=None, typeattrs=True, typevalue=True,
               addBagTypeAttr=True,
               unresolved=False, autocreate=False, docHeader=None, self_closed_tags=None,
-              translate_cb=None, omitUnknownTypes=False, omitRoot=False, forcedTagAttr=None,mode4d=False,pretty=None):
+              translate_cb=None, omitUnknownTypes=False, omitRoot=False, forcedTagAttr=None,mode4d=False,pretty=None,
+              output=None):
         """Return a complete standard XML version of the Bag, including the encoding tag 
         ``<?xml version=\'1.0\' encoding=\'UTF-8\'?>``; the Bag's content is hierarchically represented 
         as an XML block sub-element of the ``<GenRoBag>`` node.
@@ -339,11 +487,15 @@ class BagToXml(object):
         :param omitUnknownTypes: TODO
         :param omitRoot: TODO
         :param forceTagAttr: TODO
+        :param output: a file object. If given, the XML is written to it while it is built
+                       and nothing is returned. It cannot be given with *filename*
         
         >>> mybag = Bag()
         >>> mybag['aa.bb'] = 4567
         >>> mybag.toXml()
         '<?xml version=\'1.0\' encoding=\'iso-8859-15\'?><GenRoBag><aa><bb T="L">4567</bb></aa></GenRoBag>'"""
+        if filename and output is not None:
+            raise ValueError('toXml: filename and output cannot be given together')
         result = ''
         if docHeader!=False:
             result = docHeader or "<?xml version='1.0' encoding='" + encoding + "'?>\n"
@@ -362,6 +514,13 @@ class BagToXml(object):
             self.catalog.addSerializer("asText", bool, lambda b: 'y' * int(b))
             
         self.unresolved = unresolved
+        if output is not None and not pretty:
+            if omitRoot:
+                chunks = self.iterBagXmlBlock(bag, namespaces=[])
+            else:
+                chunks = self._iterTag(bag, [], 'GenRoBag', xmlMode=True, localize=False)
+            self._writeChunks(output, itertools.chain([result], chunks), encoding)
+            return
         if omitRoot:
             result = result + self.bagToXmlBlock(bag,namespaces=[])
         else:
@@ -377,10 +536,26 @@ class BagToXml(object):
                 dirname = os.path.dirname(filename)
                 if dirname and not os.path.exists(dirname):
                     os.makedirs(dirname)
-            output = open(filename, 'w')
+            outfile = open(filename, 'w')
+            outfile.write(result)
+            outfile.close()
+        if output is not None:
             output.write(result)
-            output.close()
+            return
         return result
+
+    def _writeChunks(self, output, chunks, encoding):
+        buffered = []
+        size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= XML_CHUNKSIZE:
+                output.write(unicode(''.join(buffered)).encode(encoding, 'replace'))
+                buffered = []
+                size = 0
+        if buffered:
+            output.write(unicode(''.join(buffered)).encode(encoding, 'replace'))
         
     def buildTag(self, tagName, value, attributes=None, cls='', xmlMode=False,localize=True,namespaces=None):
         """TODO Return the XML tag that represent self BagNode
@@ -528,10 +703,9 @@ class XmlOutputBag(object):
     def addItemBag(self, label, value, _attributes=None, **kwargs):
         tempbag = Bag()
         tempbag.addItem(label, value, _attributes=_attributes, **kwargs)
-        bagxml= BagToXml().build(tempbag,typeattrs=self.typeattrs, typevalue=self.typevalue,
-                                unresolved=True, omitRoot=True,
-                                docHeader=False,pretty=False)
-        self.output.write(bagxml)
+        BagToXml().build(tempbag,typeattrs=self.typeattrs, typevalue=self.typevalue,
+                         unresolved=True, omitRoot=True,
+                         docHeader=False,pretty=False,output=self.output)
                           
     def __exit__(self, type, value, traceback):
         if not self.omitRoot:
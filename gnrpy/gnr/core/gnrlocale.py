@@ -1,13 +1,19 @@
 # -*- coding: UTF-8 -*-
 
 import datetime
+import threading
 
+from collections import OrderedDict
 from decimal import Decimal
 import pytz
 from babel import numbers, dates, Locale
 from gnr.core.gnrlang import GnrException
 
 DEFAULT_LOCALE = 'en_US'
+FORMATTERS_CACHE_SIZE = 1000
+
+_formatters = OrderedDict()
+_formattersLock = threading.Lock()
 
 def localize(obj, format=None, currency=None, locale=None):
     """TODO
@@ -16,25 +22,137 @@ def localize(obj, format=None, currency=None, locale=None):
     :param format: TODO
     :param currency: TODO
     :param locale: the current locale (e.g: en, en_us, it)"""
-    locale = (locale or DEFAULT_LOCALE).replace('-', '_').split(';')[0]
     if obj is None: return u''
-    if format and format.startswith('auto_'):
-        format = DEFAULT_FORMATS_DICT.get(format[5:])
-        
-    obj,handler = formatHandler(obj)
-    if handler:
-        return handler(obj, locale, format=format, currency=currency)
-    else:
-        return unicode(obj)
+    obj,dtype = formatDtype(obj)
+    return getFormatter(dtype, format=format, currency=currency, locale=locale)(obj)
+
+def formatColumn(values, format=None, currency=None, locale=None):
+    """Localize a sequence of values with the same format and locale: return the list
+    of the :func:`localize` results, looking up the formatter once per dtype
+    
+    :param values: the values to localize
+    :param format: TODO
+    :param currency: TODO
+    :param locale: the current locale (e.g: en, en_us, it)"""
+    formatters = dict()
+    result = []
+    for obj in values:
+        if obj is None:
+            result.append(u'')
+            continue
+        obj,dtype = formatDtype(obj)
+        formatter = formatters.get(dtype)
+        if formatter is None:
+            formatter = formatters[dtype] = getFormatter(dtype, format=format, currency=currency, locale=locale)
+        result.append(formatter(obj))
+    return result
 
 def formatHandler(obj):
+    obj,dtype = formatDtype(obj)
+    return obj,TYPES_LOCALIZERS_DICT.get(dtype)
+
+def formatDtype(obj):
     if isinstance(obj,basestring) and '::' in obj:
         obj,dtype = obj.rsplit('::',1)
     else:
         dtype = type(obj)
     if dtype=='HTML':
         obj = '%s::HTML' %obj
-    return obj,TYPES_LOCALIZERS_DICT.get(dtype)
+    return obj,dtype
+
+def getFormatter(dtype, format=None, currency=None, locale=None):
+    """Return a function that localizes a value of the given dtype with the same
+    result of :func:`localize`. The locale data and the format patterns are parsed
+    once: the formatters are kept in a process wide LRU cache
+    
+    :param dtype: a python type or a genro dtype (e.g: ``'P'``)
+    :param format: TODO
+    :param currency: TODO
+    :param locale: the current locale (e.g: en, en_us, it)"""
+    locale = (locale or DEFAULT_LOCALE).replace('-', '_').split(';')[0]
+    if format and isinstance(format, basestring) and format.startswith('auto_'):
+        format = DEFAULT_FORMATS_DICT.get(format[5:])
+    key = (locale, dtype, format, currency)
+    try:
+        with _formattersLock:
+            formatter = _formatters.pop(key)
+            _formatters[key] = formatter
+        return formatter
+    except KeyError:
+        pass
+    except TypeError: # unhashable format, e.g. a dict for localize_img
+        return compileFormatter(dtype, locale, format=format, currency=currency)
+    formatter = compileFormatter(dtype, locale, format=format, currency=currency)
+    with _formattersLock:
+        _formatters[key] = formatter
+        while len(_formatters) > FORMATTERS_CACHE_SIZE:
+            _formatters.popitem(last=False)
+    return formatter
+
+def compileFormatter(dtype, locale, format=None, currency=None):
+    handler = TYPES_LOCALIZERS_DICT.get(dtype)
+    if not handler:
+        return unicode
+    compiler = FORMATTERS_COMPILERS_DICT.get(handler)
+    if compiler:
+        return compiler(locale, format=format, currency=currency)
+    return lambda obj: handler(obj, locale, format=format, currency=currency)
+
+def compile_number(locale, format=None, currency=None):
+    """Compiled version of :func:`localize_number`"""
+    locale = Locale.parse(locale)
+    if not format:
+        pattern = numbers.parse_pattern(locale.decimal_formats.get(None))
+        return lambda obj: pattern.apply(obj, locale)
+    zero = None
+    flist = format.split(';')
+    if len(flist) > 2:
+        zero = flist[2]
+        format = '%s;%s' % (flist[0], flist[1])
+    pattern = numbers.parse_pattern(format)
+    if currency:
+        formatter = lambda obj: pattern.apply(obj, locale, currency=currency)
+    else:
+        formatter = lambda obj: pattern.apply(obj, locale)
+    if zero is None:
+        return formatter
+    return lambda obj: zero if obj == 0 else formatter(obj)
+
+def compile_date(locale, format=None, **kwargs):
+    """Compiled version of :func:`localize_date`"""
+    locale = Locale.parse(locale)
+    format = format or 'short'
+    if format in ('full', 'long', 'medium', 'short'):
+        format = dates.get_date_format(format, locale=locale)
+    pattern = dates.parse_pattern(format)
+    def formatter(obj):
+        if isinstance(obj, datetime.datetime):
+            obj = obj.date()
+        return pattern.apply(obj, locale)
+    return formatter
+
+def compile_datetime(locale, format=None, **kwargs):
+    """Compiled version of :func:`localize_datetime`"""
+    locale = Locale.parse(locale)
+    format = format or 'short'
+    return lambda obj: dates.format_datetime(obj, format=format, locale=locale)
+
+def compile_time(locale, format=None, **kwargs):
+    """Compiled version of :func:`localize_time`"""
+    locale = Locale.parse(locale)
+    format = format or 'short'
+    return lambda obj: dates.format_time(obj, format=format, locale=locale)
+
+def compile_boolean(locale, format=None, **kwargs):
+    """Compiled version of :func:`localize_boolean`"""
+    format = getBoolKeywords(format or 'tf', locale=locale)[0].split(';')
+    def formatter(obj):
+        if obj is None and len(format)>2:
+            return format[2]
+        if obj:
+            return format[0]
+        return format[1]
+    return formatter
 
         
 def localize_number(obj, locale, format=None, currency=None):
@@ -320,6 +438,12 @@ TYPES_LOCALPARSERS_DICT = {int: parselocal_number,
                            datetime.datetime: parselocal_datetime,
                            datetime.time: parselocal_time
 }
+FORMATTERS_COMPILERS_DICT = {localize_number: compile_number,
+                             localize_date: compile_date,
+                             localize_datetime: compile_datetime,
+                             localize_time: compile_time,
+                             localize_boolean: compile_boolean
+}
 DEFAULT_FORMATS_DICT = {'R': '0.00', 'D': 'short'}
 
 DATEKEYWORDS = {
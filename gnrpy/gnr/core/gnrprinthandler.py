@@ -8,15 +8,18 @@ except ImportError:
     HAS_CUPS = False
     
 import os.path
+import shutil
 import tempfile
-from subprocess import call
+import time
+from collections import deque
+from multiprocessing import cpu_count
+from subprocess import call, Popen
 
 try:
     import warnings
 
     warnings.filterwarnings(category=DeprecationWarning, module='pyPdf', action='ignore')
     from pyPdf import PdfFileWriter, PdfFileReader
-    from cStringIO import StringIO
 
     HAS_PYPDF = True
 except ImportError:
@@ -27,10 +30,118 @@ from gnr.core.gnrbaseservice import GnrBaseService
 from gnr.core.gnrdecorator import extract_kwargs
 import sys
 
+JOINPDF_CHUNK_SIZE = 200
+RENDERPOOL_POLL_INTERVAL = 0.05
 
 class PrintHandlerError(GnrException):
     pass
     
+class PdfRenderPool(object):
+    """Run up to ``size`` html to pdf converters at the same time
+    
+    :meth:`PrintHandler.htmlToPdf` called with a ``pool`` starts the converter and returns
+    at once: the pdf files are complete only after :meth:`join`. The source html is copied
+    when the job is submitted, so the caller can overwrite it, and the jobs writing the same
+    pdf are run one after another. The callbacks registered with :meth:`whenDone` are called
+    in the order they are registered, each one when its pdf is complete
+    
+    :param size: the maximum number of converters. Default is the number of cpus"""
+    def __init__(self, size=None):
+        self.size = size or cpu_count()
+        self.running = []
+        self.callbacks = deque()
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type:
+            self.terminate()
+        else:
+            self.join()
+            
+    def submit(self, args, srcPath, destPath):
+        """Start a converter as soon as there is a free slot
+        
+        :param args: the converter command line, ending with the source and destination paths
+        :param srcPath: the source html
+        :param destPath: the destination pdf"""
+        while len(self.running) >= self.size or destPath in [job[2] for job in self.running]:
+            self.poll(wait=True)
+        snapshot = tempfile.NamedTemporaryFile(prefix='temp', suffix='.html', delete=False,
+                                               dir=os.path.dirname(srcPath) or None)
+        with open(srcPath, 'rb') as src:
+            shutil.copyfileobj(src, snapshot)
+        snapshot.close()
+        args = args[:-2] + [snapshot.name, destPath]
+        self.running.append((Popen(args), snapshot.name, destPath))
+        
+    def poll(self, wait=False):
+        """Collect the exited converters
+        
+        :param wait: if ``True`` sleep until at least a converter exits"""
+        while True:
+            done = [job for job in self.running if job[0].poll() is not None]
+            if done or not wait or not self.running:
+                break
+            time.sleep(RENDERPOOL_POLL_INTERVAL)
+        failed = False
+        for job in done:
+            self.running.remove(job)
+            process, snapshot, destPath = job
+            os.remove(snapshot)
+            failed = failed or process.returncode < 0
+        if failed:
+            self.terminate()
+            raise PrintHandlerError('wkhtmltopdf error')
+        self._doCallbacks()
+            
+    def whenDone(self, destPath, cb):
+        """Call ``cb()`` when the pdf ``destPath`` is complete and the callbacks registered
+        before have been called
+        
+        :param destPath: the destination pdf
+        :param cb: the callback"""
+        job = None
+        for running in self.running:
+            if running[2] == destPath:
+                job = running
+        self.callbacks.append((job, cb))
+        self._doCallbacks()
+        
+    def _doCallbacks(self):
+        while self.callbacks:
+            job, cb = self.callbacks[0]
+            if job in self.running:
+                return
+            self.callbacks.popleft()
+            cb()
+            
+    def waitFor(self, destPath):
+        """Wait until the pdf ``destPath`` is not being written
+        
+        :param destPath: the destination pdf"""
+        while destPath in [job[2] for job in self.running]:
+            self.poll(wait=True)
+            
+    def join(self):
+        """Wait for all the converters"""
+        while self.running:
+            self.poll(wait=True)
+        self._doCallbacks()
+            
+    def terminate(self):
+        """Stop the running converters"""
+        running = self.running
+        self.running = []
+        self.callbacks.clear()
+        for process, snapshot, destPath in running:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+            os.remove(snapshot)
+                
+
 class PrinterConnection(GnrBaseService):
     """TODO"""
     service_name='print'
@@ -160,23 +271,48 @@ class PrintHandler(object):
         return url
 
     @extract_kwargs(pdf=True)
-    def htmlToPdf(self, srcPath, destPath, orientation=None, page_height=None, page_width=None, pdf_kwargs=None,htmlTemplate=None,bodyStyle=None): #srcPathList per ridurre i processi?
+    def htmlToPdf(self, srcPath, destPath, orientation=None, page_height=None, page_width=None, pdf_kwargs=None,htmlTemplate=None,bodyStyle=None,pool=None):
             
         """TODO
         
         :param src_path: TODO
         :param destPath: TODO
-        :param orientation: TODO"""
+        :param orientation: TODO
+        :param pool: a :class:`PdfRenderPool`. If given the conversion is submitted
+                     to the pool and the pdf is complete after ``pool.join()``"""
 
         if '<' in srcPath:
             srcPath = self.createTempHtmlFile(srcPath,htmlTemplate=htmlTemplate,bodyStyle=bodyStyle)
-            self.htmlToPdf(srcPath,destPath,orientation,pdf_kwargs=pdf_kwargs)
+            if pool:
+                args,destPath = self.htmlToPdfArgs(srcPath,destPath,orientation,pdf_kwargs=pdf_kwargs)
+                pool.submit(args, srcPath, destPath)
+            else:
+                self.htmlToPdf(srcPath,destPath,orientation,pdf_kwargs=pdf_kwargs)
             os.remove(srcPath)
             return
+        args,destPath = self.htmlToPdfArgs(srcPath, destPath, orientation=orientation, page_height=page_height,
+                                           page_width=page_width, pdf_kwargs=pdf_kwargs)
+        if pool:
+            pool.submit(args, srcPath, destPath)
+            return destPath
+        #import shutil
+        #shutil.copy(srcPath, '/Users/ale/last.html')
+        result = call(args)
+
+       #if sys.platform.startswith('linux'):
+       #    result = call(['wkhtmltopdf', '-q', '-O', orientation, srcPath, destPath])
+       #else:
+       #    result = call(['wkhtmltopdf', '-q', '-O', orientation, srcPath, destPath,])
+        if result < 0:
+            raise PrintHandlerError('wkhtmltopdf error')
+        return destPath
+
+    def htmlToPdfArgs(self, srcPath, destPath, orientation=None, page_height=None, page_width=None, pdf_kwargs=None):
+        """Return the wkhtmltopdf command line and the destination path of :meth:`htmlToPdf`"""
+        pdf_kwargs = dict(pdf_kwargs or {})
         pdf_pref = self.parent.getPreference('.pdf_render',pkg='sys') if self.parent else None
         if pdf_pref:
             pdf_pref = pdf_pref.asDict(ascii=True)
-            pdf_kwargs = pdf_kwargs or dict()
             pdf_pref.update(pdf_kwargs)
             pdf_kwargs = pdf_pref
         pdf_kwargs['orientation'] = orientation or 'Portrait'
@@ -206,17 +342,7 @@ class PrintHandler(object):
             destPath = os.path.join(destPath, '%s.pdf' % baseName)
         args.append(srcPath)
         args.append(destPath)
-        #import shutil
-        #shutil.copy(srcPath, '/Users/ale/last.html')
-        result = call(args)
-
-       #if sys.platform.startswith('linux'):
-       #    result = call(['wkhtmltopdf', '-q', '-O', orientation, srcPath, destPath])
-       #else:
-       #    result = call(['wkhtmltopdf', '-q', '-O', orientation, srcPath, destPath,])
-        if result < 0:
-            raise PrintHandlerError('wkhtmltopdf error')
-        return destPath
+        return args,destPath
 
     def autoConvertFiles(self, files, storeFolder, orientation=None):
         """TODO
@@ -280,25 +406,39 @@ class PrintHandler(object):
         return PrinterConnection(self, printer_name=printer_name, printerParams=printerParams or dict(), **kwargs)
         
     def joinPdf(self, pdf_list, output_filepath):
-        """TODO
+        """Join the pdf files in a single pdf. The input files are read from disk while
+        the output is written: more than ``JOINPDF_CHUNK_SIZE`` files are joined in
+        temporary chunks first, to bound the open files and the pages held in memory
         
         :param pdf_list: TODO
         :param output_filepath: TODO"""
+        pdf_list = list(pdf_list)
+        if len(pdf_list) > JOINPDF_CHUNK_SIZE:
+            chunk_folder = tempfile.mkdtemp()
+            try:
+                chunks = []
+                for i in range(0, len(pdf_list), JOINPDF_CHUNK_SIZE):
+                    chunk_path = os.path.join(chunk_folder, 'chunk_%i.pdf' % i)
+                    self.joinPdf(pdf_list[i:i + JOINPDF_CHUNK_SIZE], chunk_path)
+                    chunks.append(chunk_path)
+                self.joinPdf(chunks, output_filepath)
+            finally:
+                shutil.rmtree(chunk_folder, ignore_errors=True)
+            return
         output_pdf = PdfFileWriter()
         open_files = []
-        for input_path in pdf_list:
-            input_file = open(input_path, 'rb')
-            memory_file = StringIO(input_file.read())
-            open_files.append(memory_file)
-            input_file.close()
-            input_pdf = PdfFileReader(memory_file)
-            for page in input_pdf.pages:
-                output_pdf.addPage(page)
-        output_file = open(output_filepath, 'wb')
-        output_pdf.write(output_file)
-        output_file.close()
-        for input_file in open_files:
-            input_file.close()
+        try:
+            for input_path in pdf_list:
+                input_file = open(input_path, 'rb')
+                open_files.append(input_file)
+                input_pdf = PdfFileReader(input_file)
+                for page in input_pdf.pages:
+                    output_pdf.addPage(page)
+            with open(output_filepath, 'wb') as output_file:
+                output_pdf.write(output_file)
+        finally:
+            for input_file in open_files:
+                input_file.close()
             
     def zipPdf(self, file_list=None, zipPath=None):
         """TODO
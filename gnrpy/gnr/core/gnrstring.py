@@ -26,11 +26,16 @@ import zipfile
 import StringIO
 import logging
 import datetime
+import threading
 
 from decimal import Decimal
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 CONDITIONAL_PATTERN = re.compile("\\${([^}]*)}",flags=re.S)
+CONDITIONAL_FIELD = re.compile("\\$([_a-zA-Z\\@][_a-zA-Z0-9\\.\\@]*)")
+TEMPLATE_CACHE_SIZE = 500
+TEXT_CHUNK_SIZE = 500
 FLATTENER = re.compile('\W+')
 
 try:
@@ -53,7 +58,7 @@ try:
     class LocalizedWrapper(object):
         """Missin doc"""
         def __init__(self,data, locale=None,templates=None, formats=None,masks=None,editcols=None,df_templates=None,dtypes=None,
-                         localizer=None,urlformatter=None,noneIsBlank=None,emptyMode=None):
+                         localizer=None,urlformatter=None,noneIsBlank=None,emptyMode=None,fields=None):
             self.data=data
             self.locale=locale
             self.formats=formats or dict()
@@ -67,13 +72,22 @@ try:
             self.urlformatter = urlformatter
             self.dtypes = dtypes or dict()
             self.emptyMode=emptyMode
+            self.fields = fields if fields is not None else dict()
+
+        def getField(self,k):
+            """Return the path, the name, the format, the mask and the dtype of a symbol"""
+            field = self.fields.get(k)
+            if field is None:
+                as_name = k.replace('@','_').replace('.','_')
+                path = k
+                if '^' in k:
+                    path,as_name = k.split('^')[:2]
+                field = (path,as_name,self.formats.get(as_name),self.masks.get(as_name),self.dtypes.get(as_name))
+                self.fields[k] = field
+            return field
 
         def __getitem__(self,k):
-            as_name = k.replace('@','_').replace('.','_')
-            if '^' in k:
-                k = k.split('^')
-                as_name = k[1]
-                k = k[0]
+            k,as_name,fieldformat,fieldmask,dtype = self.getField(k)
             value = self.data[k if k in self.data else as_name]
             format = None
             mask = None
@@ -89,11 +103,9 @@ try:
                         if templateNode:
                             template = templateNode.value
                             joiner = templateNode.getAttr('joiner','')
-                            result = []
-                            for v in value.values():
-                                result.append(templateReplace(template,v, locale=self.locale, 
-                                                formats=self.formats,masks=self.masks,editcols=self.editcols,dtypes=self.dtypes, noneIsBlank=self.noneIsBlank))
-                            return joiner.join(result)
+                            compiled = compiledTemplate(template,formats=self.formats,masks=self.masks,dtypes=self.dtypes)
+                            return joiner.join(compiled.renderMany(value.values(),locale=self.locale,
+                                                                   editcols=self.editcols,noneIsBlank=self.noneIsBlank))
                     elif as_name in self.df_templates:
                         templatepath = self.df_templates[as_name]
                         template = self.data[templatepath]
@@ -117,9 +129,8 @@ try:
                 format = attrs.get('format')
                 mask = attrs.get('mask')
                 caption = attrs.get('name_long','')
-            format = self.formats.get(as_name) or format
-            mask = self.masks.get(as_name) or mask
-            dtype = self.dtypes.get(as_name)
+            format = fieldformat or format
+            mask = fieldmask or mask
             if dtype =='P' and self.urlformatter:
                 value = self.urlformatter(value)
             if (isinstance(value,basestring) or isinstance(value,unicode)) and dtype:
@@ -193,7 +204,7 @@ try:
 except:
     pass
 
-from gnr.core.gnrlocale import localize, parselocal
+from gnr.core.gnrlocale import localize, formatColumn, parselocal
 
 REGEX_WRDSPLIT = re.compile(r'\W+')
 BASE_ENCODE = {'/2': '01',
@@ -430,17 +441,188 @@ def flatten(myString,repchar='_'):
 def conditionalTemplate(myString,symbolDict=None):
     def cb(g):
         content = g.group(1)
-        m = re.search("\\$([_a-zA-Z\\@][_a-zA-Z0-9\\.\\@]*)", content)
+        m = CONDITIONAL_FIELD.search(content)
         if m and (m.group(1) in symbolDict) and (symbolDict[m.group(1)] not in (None,'')): 
             return content
         return ''
     return re.sub(CONDITIONAL_PATTERN, cb,myString)
 
+class CompiledTemplate(object):
+    """A template parsed once and rendered with many symbol dicts (see :func:`templateReplace`).
+    
+    The template is split in its conditional blocks (``${...}``) and every combination
+    of the blocks is parsed in a list of texts and placeholders the first time it is needed.
+    The formats, masks and dtypes of the placeholders are looked up once.
+    
+    :param template: template string or bag (with the ``main`` template and the subtemplates)
+    :param safeMode: if ``True`` the missing symbols are left in the result
+    :param conditionalMode: if ``True`` a ``${...}`` block is removed when its first symbol is empty
+    :param formats: a dict with the format of the symbols
+    :param dtypes: a dict with the dtype of the symbols
+    :param masks: a dict with the mask of the symbols"""
+    def __init__(self, template, safeMode=False, conditionalMode=True, formats=None, dtypes=None, masks=None):
+        self.templates = None
+        if hasattr(template, '_htraverse'):
+            self.templates = template.deepcopy()
+            template = self.templates.pop('main')
+        self.template = template or ''
+        self.safeMode = safeMode
+        self.formats = dict(formats) if isinstance(formats, dict) else formats
+        self.dtypes = dict(dtypes) if isinstance(dtypes, dict) else dtypes
+        self.masks = dict(masks) if isinstance(masks, dict) else masks
+        self.parts = None
+        if conditionalMode and '${' in self.template:
+            self.parts = []
+            pos = 0
+            for m in CONDITIONAL_PATTERN.finditer(self.template):
+                self.parts.append(self.template[pos:m.start()])
+                field = CONDITIONAL_FIELD.search(m.group(1))
+                self.parts.append((m.group(1), field.group(1) if field else None))
+                pos = m.end()
+            self.parts.append(self.template[pos:])
+        self.fields = dict()
+        self._segments = dict()
+        
+    def _included(self, symbolDict):
+        return tuple([part[1] is not None and (part[1] in symbolDict) and (symbolDict[part[1]] not in (None, ''))
+                      for part in self.parts if not isinstance(part, basestring)])
+        
+    def _parse(self, Tpl, text):
+        segments = []
+        pos = 0
+        for mo in Tpl.pattern.finditer(text):
+            segments.append(text[pos:mo.start()])
+            named = mo.group('named') or mo.group('braced')
+            if named is not None:
+                segments.append((named, mo.group()))
+            elif mo.group('escaped') is not None:
+                segments.append(Tpl.delimiter)
+            elif self.safeMode:
+                segments.append(mo.group())
+            else:
+                try:
+                    Tpl(text)._invalid(mo)
+                except ValueError, e:
+                    segments.append((None, str(e)))
+            pos = mo.end()
+        segments.append(text[pos:])
+        return [segment for segment in segments if segment]
+        
+    def segments(self, symbolDict):
+        """Return the texts and the ``(symbol, placeholder)`` tuples of the template for ``symbolDict``"""
+        isBag = hasattr(symbolDict, '_htraverse')
+        included = self._included(symbolDict) if self.parts else None
+        key = (isBag, included)
+        segments = self._segments.get(key)
+        if segments is None:
+            text = self.template
+            if included is not None:
+                included = iter(included)
+                text = ''.join([part if isinstance(part, basestring) else (part[0] if included.next() else '')
+                                for part in self.parts])
+            segments = self._parse(BagTemplate if isBag else Template, text)
+            self._segments[key] = segments
+        return segments
+        
+    def _wrapper(self, symbolDict, noneIsBlank=True, **kwargs):
+        return LocalizedWrapper(symbolDict, templates=self.templates, noneIsBlank=noneIsBlank,
+                                formats=self.formats, dtypes=self.dtypes, masks=self.masks,
+                                fields=self.fields, **kwargs)
+        
+    def _render(self, symbolDict, wrapper):
+        result = []
+        for segment in self.segments(symbolDict):
+            if isinstance(segment, tuple):
+                if segment[0] is None:
+                    raise ValueError(segment[1])
+                try:
+                    segment = '%s' % (wrapper[segment[0]],)
+                except KeyError:
+                    if not self.safeMode:
+                        raise
+                    segment = segment[1]
+            result.append(segment)
+        return ''.join(result)
+        
+    def render(self, symbolDict, noneIsBlank=True, locale=None, editcols=None, df_templates=None,
+               localizer=None, urlformatter=None, emptyMode=None):
+        """Return the template filled with the values of ``symbolDict`` (a dict or a bag).
+        The other parameters are the ones of :func:`templateReplace`"""
+        if not '$' in self.template or not symbolDict:
+            return self.template
+        return self._render(symbolDict, self._wrapper(symbolDict, noneIsBlank=noneIsBlank, locale=locale,
+                                                      editcols=editcols, df_templates=df_templates,
+                                                      localizer=localizer, urlformatter=urlformatter,
+                                                      emptyMode=emptyMode))
+        
+    def renderMany(self, rows, **kwargs):
+        """Return the list of the template filled with every row of ``rows``. The rows share
+        the parsed template and the formatters. The other parameters are the ones of :meth:`render`"""
+        if not '$' in self.template:
+            return [self.template for row in rows]
+        result = []
+        wrapper = None
+        for row in rows:
+            if not row:
+                result.append(self.template)
+                continue
+            if wrapper is None:
+                wrapper = self._wrapper(row, **kwargs)
+            else:
+                wrapper.data = row
+                wrapper.isBag = hasattr(row, '_htraverse')
+            result.append(self._render(row, wrapper))
+        return result
+        
+_templateCache = OrderedDict()
+_templateCacheLock = threading.Lock()
+
+def _templateCacheKey(template, options):
+    if hasattr(template, '_htraverse'):
+        nodes = []
+        for node in template:
+            if node.value is not None and not isinstance(node.value, basestring):
+                return
+            nodes.append((node.label, node.value, node.getAttr('joiner')))
+        template = tuple(nodes)
+    key = [template]
+    for option in options:
+        if hasattr(option, '_htraverse'):
+            option = option.asDict()
+        if isinstance(option, dict):
+            option = tuple(sorted(option.items()))
+        key.append(option)
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return
+    return key
+    
+def compiledTemplate(template, safeMode=False, conditionalMode=True, formats=None, dtypes=None, masks=None):
+    """Return the :class:`CompiledTemplate` of ``template`` and of the options that change its parsing
+    and its formatters. The last ``TEMPLATE_CACHE_SIZE`` compiled templates are kept in a cache"""
+    key = _templateCacheKey(template, (safeMode, conditionalMode, formats, dtypes, masks))
+    if key is not None:
+        with _templateCacheLock:
+            compiled = _templateCache.pop(key, None)
+            if compiled is not None:
+                _templateCache[key] = compiled
+                return compiled
+    compiled = CompiledTemplate(template, safeMode=safeMode, conditionalMode=conditionalMode,
+                                formats=formats, dtypes=dtypes, masks=masks)
+    if key is not None:
+        with _templateCacheLock:
+            _templateCache[key] = compiled
+            while len(_templateCache) > TEMPLATE_CACHE_SIZE:
+                _templateCache.popitem(last=False)
+    return compiled
     
 def templateReplace(myString, symbolDict=None, safeMode=False,noneIsBlank=True,locale=None, 
                     formats=None,dtypes=None,masks=None,editcols=None,df_templates=None,localizer=None,
                     urlformatter=None,emptyMode=None,conditionalMode=True):
-    """Allow to replace string's chunks.
+    """Allow to replace string's chunks. The template is parsed once and kept in the cache
+    of :func:`compiledTemplate`
     
     :param myString: template string or bag
     :param symbolDict: dictionary that links symbol and values. .
@@ -451,32 +633,13 @@ def templateReplace(myString, symbolDict=None, safeMode=False,noneIsBlank=True,l
     >>> templateReplace('$foo loves $bar but she loves $aux and not $foo', {'foo':'John','bar':'Sandra','aux':'Steve'})
     'John loves Sandra but she loves Steve and not John'"""
     myString = myString or ''
-    templateBag=None
-    if hasattr(myString, '_htraverse'):
-        templateBag = myString.deepcopy()
-        myString = templateBag.pop('main')
-    if not '$' in myString or not symbolDict: return myString
-
-    if hasattr(symbolDict, '_htraverse'):
-        Tpl = BagTemplate
-        #if templateBag:
-        #    symbolDict = SubtemplateMapWrapper(symbolDict,templateBag, locale=locale)
-        #elif noneIsBlank:
-        #    symbolDict=NoneIsBlankMapWrapper(symbolDict)
-        #  above is replaced by LocalizedWrapper
-    else:
-        Tpl = Template
-    if conditionalMode and '${' in myString:
-        myString = conditionalTemplate(myString,symbolDict=symbolDict)
-    symbolDict = LocalizedWrapper(symbolDict, locale=locale, templates=templateBag, noneIsBlank=noneIsBlank, formats=formats,dtypes=dtypes,
-                                    masks=masks,editcols=editcols,
-                                    df_templates=df_templates,localizer=localizer,
-                                    urlformatter=urlformatter,emptyMode=emptyMode)
-
-    if safeMode:
-        return Tpl(myString).safe_substitute(symbolDict)
-    else:
-        return Tpl(myString).substitute(symbolDict)
+    if not hasattr(myString, '_htraverse') and (not '$' in myString or not symbolDict):
+        return myString
+    return compiledTemplate(myString, safeMode=safeMode, conditionalMode=conditionalMode, formats=formats,
+                            dtypes=dtypes, masks=masks).render(symbolDict, noneIsBlank=noneIsBlank, locale=locale,
+                                                               editcols=editcols, df_templates=df_templates,
+                                                               localizer=localizer, urlformatter=urlformatter,
+                                                               emptyMode=emptyMode)
         
 def asDict(myString, itemSep=',', argSep='=', symbols=None):
     """Return a dict from a key-value like string (or an empty dict, if there is no string)
@@ -802,6 +965,33 @@ def toText(obj, locale=None, format=None, mask=None, encoding=None, currency=Non
     if mask:
         result = mask % result
     return result
+    
+def toTextColumn(values, locale=None, format=None, mask=None, encoding=None, currency=None):
+    """Return the list of the :func:`toText` results of a sequence of values sharing the
+    same parameters. The localized values are formatted with a single :func:`formatColumn()
+    <gnr.core.gnrlocale.formatColumn>` call
+    
+    :param values: the objects to be transformed in strings
+    :param locale: the current locale (e.g: en, en_us, it)
+    :param format: TODO
+    :param mask: TODO
+    :param encoding: The multibyte character encoding you choose
+    :param currency: TODO"""
+    if not (locale or format):
+        return [toText(v, mask=mask) for v in values]
+    result = []
+    localized = []
+    for v in values:
+        if (hasattr(v, '_htraverse') and format) or isinstance(v, list) or isinstance(v, tuple) or v in (None, ''):
+            result.append(toText(v, locale=locale, format=format, mask=mask, currency=currency))
+        else:
+            localized.append((len(result), v))
+            result.append(None)
+    if localized:
+        texts = formatColumn([v for i, v in localized], format=format, currency=currency, locale=locale)
+        for (i, v), text in zip(localized, texts):
+            result[i] = mask % text if mask else text
+    return result
         
 def guessLen(dtype, locale=None, format=None, mask=None, encoding=None):
     """TODO
@@ -1,6 +1,7 @@
 import xlwt
 import os
-from gnr.core.gnrstring import toText
+import itertools
+from gnr.core.gnrstring import toTextColumn, TEXT_CHUNK_SIZE
 
 class XlsWriter(object):
     """TODO"""
@@ -64,9 +65,12 @@ class XlsWriter(object):
         
     def __call__(self, data=None, sheet_name=None):
         self.writeHeaders(sheet_name=sheet_name)
-        for item in data:
-            row = self.rowGetter(item)
-            self.writeRow(row,sheet_name=sheet_name)
+        data = iter(data)
+        while True:
+            rows = [self.rowGetter(item) for item in itertools.islice(data, TEXT_CHUNK_SIZE)]
+            if not rows:
+                break
+            self.writeRows(rows,sheet_name=sheet_name)
         self.workbookSave()
         
     def rowGetter(self, item):
@@ -94,27 +98,41 @@ class XlsWriter(object):
         """TODO
         
         :param row: TODO"""
+        self.writeRows([row], sheet_name=sheet_name)
+        
+    def writeRows(self, rows, sheet_name=None):
+        """Write a block of rows: the text columns are localized a column at a time
+        
+        :param rows: a list of rows"""
         sheet_name = sheet_name or self.sheet_base_name
-        current_row = self.sheets[sheet_name]['current_row'] + 1
-        self.sheets[sheet_name]['current_row'] = current_row
+        first_row = self.sheets[sheet_name]['current_row'] + 1
+        self.sheets[sheet_name]['current_row'] += len(rows)
         sheet = self.sheets[sheet_name]['sheet']
         columns = self.sheets[sheet_name]['columns']
         coltypes = self.sheets[sheet_name]['coltypes']
         colsizes = self.sheets[sheet_name]['colsizes']
 
         for c, col in enumerate(columns):
-            value = row.get(col)
-            if isinstance(value, list):
-                value = ','.join([str(x != None and x or '') for x in value])
+            values = []
+            for row in rows:
+                value = row.get(col)
+                if isinstance(value, list):
+                    value = ','.join([str(x != None and x or '') for x in value])
+                values.append(value)
             coltype = coltypes.get(col)
+            style = None
             if coltype in ('R', 'F', 'N'):
-                sheet.write(current_row, c, value, self.float_style)
+                style = self.float_style
             elif coltype in ('L', 'I'):
-                sheet.write(current_row, c, value, self.int_style)
+                style = self.int_style
             else:
-                value = toText(value, self.locale)
-                sheet.write(current_row, c, value)
-            colsizes[c] = max(colsizes.get(c, 0), self.fitwidth(value))
+                values = toTextColumn(values, self.locale)
+            for r, value in enumerate(values):
+                if style:
+                    sheet.write(first_row + r, c, value, style)
+                else:
+                    sheet.write(first_row + r, c, value)
+                colsizes[c] = max(colsizes.get(c, 0), self.fitwidth(value))
             
     def fitwidth(self, data, bold=False):
         """Try to autofit Arial 10
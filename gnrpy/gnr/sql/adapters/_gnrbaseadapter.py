@@ -61,8 +61,21 @@ class SqlDbAdapter(object):
     #         # your code here
     #         pass
     support_multiple_connections = True
+    # True if connections can be shared among threads through a
+    # gnr.sql.gnrsqlpool.DbConnectionPool
+    support_pooling = True
+    # True if listen/notify deliver messages to the other processes
+    # (used by gnr.sql.gnrsqlcache to invalidate the table cache)
+    support_notify = False
+    # True if NULL values follow the others in an ascending ORDER BY
+    sortNullsLast = False
+    # True if a query with for_update='skip_locked' skips the rows locked by other
+    # transactions (SELECT ... FOR UPDATE SKIP LOCKED)
+    support_skip_locked = False
     paramstyle = 'named'
     allowAlterColumn=True
+    # maximum number of parameters of a multi-row INSERT written by bulkInsert
+    bulkInsertMaxParams = 999
 
     def __init__(self, dbroot, **kwargs):
         self.dbroot = dbroot
@@ -75,6 +88,24 @@ class SqlDbAdapter(object):
         @return: a new connection object"""
         raise NotImplementedException()
 
+    def checkConnection(self, connection):
+        """Health check run on a pooled connection before handing it out.
+        Raise an exception if the connection is not usable
+
+        :param connection: a connection built by :meth:`connect()`"""
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1;')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def resetPooledConnection(self, connection):
+        """Bring back a pooled connection to a clean state before reusing it
+
+        :param connection: a connection built by :meth:`connect()`"""
+        connection.rollback()
+
     def cursor(self, connection, cursorname=None):
         if isinstance(connection, list):
             if cursorname:
@@ -86,6 +117,26 @@ class SqlDbAdapter(object):
         else:
             return connection.cursor()
 
+    def estimateCount(self, sql, sqlargs=None, storename=None):
+        """Return the number of rows of a query estimated by the planner,
+        or None if the adapter cannot estimate it
+        @param sql: the sql text of the query
+        @param sqlargs: the query parameters
+        @param storename: the dbstore of the query"""
+        return None
+
+    def trySessionLock(self, name):
+        """Take the lock ``name`` for the current connection until it is released or
+        closed. Return False if another connection holds it, or None if the adapter
+        has no such locks
+        @param name: the name of the lock"""
+        return None
+
+    def releaseSessionLock(self, name):
+        """Release a lock taken by trySessionLock
+        @param name: the name of the lock"""
+        pass
+
     def listen(self, msg, timeout=None, onNotify=None, onTimeout=None):
         """-- IMPLEMENT THIS --
         Listen for interprocess message 'msg' 
@@ -98,11 +149,12 @@ class SqlDbAdapter(object):
         """
         raise NotImplementedException()
 
-    def notify(self, msg, autocommit=False):
+    def notify(self, msg, autocommit=False, payload=None):
         """-- IMPLEMENT THIS --
         Notify a message to listener processes.
         @param msg: name of the message to notify
-        @param autocommit: dafault False, if specific implementation of notify uses transactions, commit the current transaction"""
+        @param autocommit: dafault False, if specific implementation of notify uses transactions, commit the current transaction
+        @param payload: optional string delivered with the message"""
         raise NotImplementedException()
 
     def createdb(self, name, encoding=None):
@@ -209,6 +261,30 @@ class SqlDbAdapter(object):
         Other info may be present with an adapter-specific prefix."""
         raise NotImplementedException()
 
+    def getCatalog(self, schemata):
+        """Get a snapshot of the catalog of the given schemata, used by the
+        :class:`SqlModelChecker <gnr.sql.gnrsqlutils.SqlModelChecker>`. Return a dict with:
+        
+        * ``tables``, ``views``: the list of names for every schema
+        * ``columns``, ``indexes``: the :meth:`getColInfo` and :meth:`getIndexesForTable`
+          results for every ``(schema, table)``
+        * ``relations``, ``constraints``: the :meth:`relations` and :meth:`getTableContraints` results
+        
+        This implementation queries every table: adapters can override it to load
+        the catalog with a few set-based queries
+        
+        :param schemata: the list of the schema names"""
+        catalog = dict(tables=dict(), views=dict(), columns=dict(), indexes=dict())
+        for schema in schemata:
+            tables = catalog['tables'][schema] = self.listElements('tables', schema=schema)
+            catalog['views'][schema] = self.listElements('views', schema=schema)
+            for table in tables:
+                catalog['columns'][(schema, table)] = self.getColInfo(schema=schema, table=table)
+                catalog['indexes'][(schema, table)] = self.getIndexesForTable(schema=schema, table=table)
+        catalog['relations'] = self.relations()
+        catalog['constraints'] = self.getTableContraints()
+        return catalog
+
     def prepareSqlText(self, sql, kwargs):
         """Subclass in adapter if you want to change some sql syntax or params types.
         Example: for a search condition using regex, sqlite wants 'REGEXP', while postgres wants '~*'
@@ -297,10 +373,12 @@ class SqlDbAdapter(object):
         _smartappend(result, 'LIMIT', limit)
         _smartappend(result, 'OFFSET', offset)
         if for_update:
-            result.append(self._selectForUpdate(maintable_as=maintable_as))
+            result.append(self._selectForUpdate(maintable_as=maintable_as, skip_locked=for_update == 'skip_locked'))
         return '\n'.join(result)
 
-    def _selectForUpdate(self,maintable_as=None):
+    def _selectForUpdate(self,maintable_as=None,skip_locked=False):
+        if skip_locked and self.support_skip_locked:
+            return 'FOR UPDATE OF %s SKIP LOCKED' %maintable_as
         return 'FOR UPDATE OF %s' %maintable_as
 
     def prepareRecordData(self, record_data, tblobj=None,blackListAttributes=None, **kwargs):
@@ -376,6 +454,51 @@ class SqlDbAdapter(object):
         result = cursor.executemany(sql,records)
         return result
 
+    def bulkInsert(self, dbtable, records, **kwargs):
+        """Insert a list of records with multi-row ``INSERT ... VALUES`` statements, each one
+        with at most ``bulkInsertMaxParams`` parameters. Consecutive records with the same
+        columns are written together. Return the number of inserted records
+
+        :param dbtable: specify the :ref:`database table <table>`. More information in the
+                        :ref:`dbtable` section (:ref:`dbselect_examples_simple`)
+        :param records: a list of dict compatible objects"""
+        tblobj = dbtable.model
+        for columns, chunk in self._bulkChunks(tblobj, records, maxParams=self.bulkInsertMaxParams, **kwargs):
+            sql_flds = [tblobj.sqlnamemapper[k] for k in columns]
+            sql_values = [tblobj.column(k).attributes.get('sql_value') for k in columns]
+            sqlargs = {}
+            rows = []
+            for i, record_data in enumerate(chunk):
+                row = []
+                for j, k in enumerate(columns):
+                    if sql_values[j]:
+                        row.append(sql_values[j])
+                    else:
+                        row.append(':b%i_%i' % (i, j))
+                        sqlargs['b%i_%i' % (i, j)] = record_data[k]
+                rows.append('(%s)' % ','.join(row))
+            sql = 'INSERT INTO %s(%s) VALUES %s;' % (tblobj.sqlfullname, ','.join(sql_flds), ','.join(rows))
+            self.dbroot.execute(sql, sqlargs, dbtable=dbtable.fullname)
+        return len(records)
+
+    def _bulkChunks(self, tblobj, records, maxParams=None, **kwargs):
+        """Prepare the records and yield the tuple (columns, records) for every run of
+        consecutive records with the same columns, split to keep at most *maxParams*
+        values in a chunk"""
+        sqlnamemapper = tblobj.sqlnamemapper
+        chunk = []
+        columns = None
+        for record in records:
+            record_data = self.prepareRecordData(record, tblobj=tblobj, **kwargs)
+            record_columns = tuple(sorted([k for k in record_data.keys() if k in sqlnamemapper]))
+            if chunk and (record_columns != columns or (maxParams and (len(chunk) + 1) * len(columns) > maxParams)):
+                yield columns, chunk
+                chunk = []
+            columns = record_columns
+            chunk.append(record_data)
+        if chunk:
+            yield columns, chunk
+
 
     def update(self, dbtable, record_data, pkey=None,**kwargs):
         """Update a record in the db. 
@@ -382,7 +382,7 @@ class SqlDbAdapter(SqlDbBaseAdapter):
         _smartappend(result, 'ORDER BY', order_by)
         _smartappend(result, 'OFFSET', offset)
         if for_update:
-            result.append(self._selectForUpdate(maintable_as=maintable_as))
+            result.append(self._selectForUpdate(maintable_as=maintable_as, skip_locked=for_update == 'skip_locked'))
         return '\n'.join(result)
         
 
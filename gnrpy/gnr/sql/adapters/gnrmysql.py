@@ -57,6 +57,8 @@ class SqlDbAdapter(SqlDbBaseAdapter):
                     'I': 'int', 'L': 'bigint', 'R': 'real','N':'decimal',
                     'serial': 'serial8', 'O': 'bytea'}
 
+    bulkInsertMaxParams = 65535
+
     def defaultMainSchema(self):
         return ''
 
@@ -180,7 +182,7 @@ class SqlDbAdapter(SqlDbBaseAdapter):
         #if autocommit:
         #self.dbroot.commit()
 
-    def _selectForUpdate(self,maintable_as=None):
+    def _selectForUpdate(self,maintable_as=None,skip_locked=False):
         return 'FOR UPDATE'
 
     def listElements(self, elType, **kwargs):
@@ -23,6 +23,8 @@
 import sys
 
 import re
+import time
+import cStringIO
 import select
 try:
     import psycopg2
@@ -76,6 +78,9 @@ class SqlDbAdapter(SqlDbBaseAdapter):
 
     _lock = threading.Lock()
     paramstyle = 'pyformat'
+    support_notify = True
+    sortNullsLast = True
+    support_skip_locked = True
 
     def __init__(self, *args, **kwargs):
         #self._lock = threading.Lock()
@@ -104,6 +109,11 @@ class SqlDbAdapter(SqlDbBaseAdapter):
             self._lock.release()
         return conn
         
+    def resetPooledConnection(self, connection):
+        connection.rollback()
+        if connection.isolation_level == ISOLATION_LEVEL_AUTOCOMMIT:
+            connection.set_isolation_level(ISOLATION_LEVEL_READ_COMMITTED)
+
     def adaptTupleListSet(self,sql,sqlargs):
         for k,v in sqlargs.items():
             if isinstance(v, list) or isinstance(v, set) or isinstance(v,tuple):
@@ -162,6 +172,46 @@ class SqlDbAdapter(SqlDbBaseAdapter):
         sql = "LOCK %s IN %s MODE %s;" % (dbtable.model.sqlfullname, mode, nowait)
         self.dbroot.execute(sql)
 
+    def bulkInsert(self, dbtable, records, **kwargs):
+        """Insert a list of records with ``COPY ... FROM STDIN``. Tables with ``sql_value``
+        or binary columns are written with multi-row ``INSERT`` statements. The records are
+        written on the store of the table, as :meth:`GnrSqlDb.execute` does
+        
+        :param dbtable: the :ref:`database table <table>`
+        :param records: a list of dict compatible objects"""
+        tblobj = dbtable.model
+        for col in tblobj.columns.values():
+            if col.attributes.get('sql_value') or col.dtype == 'O':
+                return super(SqlDbAdapter, self).bulkInsert(dbtable, records, **kwargs)
+        with self.dbroot.tempEnv(storename=self.dbroot.tableStorename(dbtable)):
+            cursor = self.cursor(self.dbroot.connection)
+            for columns, chunk in self._bulkChunks(tblobj, records, **kwargs):
+                data = cStringIO.StringIO()
+                for record_data in chunk:
+                    data.write('\t'.join([self._copyValue(record_data[k]) for k in columns]))
+                    data.write('\n')
+                data.seek(0)
+                sql = 'COPY %s(%s) FROM STDIN' % (tblobj.sqlfullname, ','.join([tblobj.sqlnamemapper[k] for k in columns]))
+                t_0 = time.time()
+                cursor.copy_expert(sql, data)
+                self.dbroot.onSqlExecuted(sql, delta_time=time.time() - t_0, dbtable=dbtable.fullname)
+        return len(records)
+
+    def _copyValue(self, value):
+        if value is None:
+            return '\\N'
+        if value is True or value is False:
+            return 't' if value else 'f'
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, float):
+            value = repr(value)
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        else:
+            value = str(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
     def createDbSql(self, dbname, encoding):
         return "CREATE DATABASE %s ENCODING '%s';" % (dbname, encoding)
 
@@ -218,6 +268,33 @@ class SqlDbAdapter(SqlDbBaseAdapter):
             self.dbroot.execute('VACUUM ANALYZE %s;' % table)
         self.dbroot.connection.set_isolation_level(ISOLATION_LEVEL_READ_COMMITTED)
         
+    def estimateCount(self, sql, sqlargs=None, storename=None):
+        """Return the number of rows of a query estimated by ``EXPLAIN``
+        
+        :param sql: the sql text of the query
+        :param sqlargs: the query parameters
+        :param storename: the dbstore of the query"""
+        cursor = self.dbroot.execute('EXPLAIN %s' % sql, sqlargs, storename=storename)
+        plan = cursor.fetchone()
+        cursor.close()
+        m = re.search(r' rows=(\d+)', plan[0]) if plan else None
+        return int(m.group(1)) if m else None
+
+    def trySessionLock(self, name):
+        """Take the session advisory lock ``name``: return False if another connection holds it
+        
+        :param name: the name of the lock"""
+        cursor = self.dbroot.execute('SELECT pg_try_advisory_lock(hashtext(:name));', dict(name=name))
+        locked = cursor.fetchone()[0]
+        cursor.close()
+        return locked
+
+    def releaseSessionLock(self, name):
+        """Release the session advisory lock ``name``
+        
+        :param name: the name of the lock"""
+        self.dbroot.execute('SELECT pg_advisory_unlock(hashtext(:name));', dict(name=name)).close()
+        
     def listen(self, msg, timeout=10, onNotify=None, onTimeout=None):
         """Listen for message 'msg' on the current connection using the Postgres LISTEN - NOTIFY method.
         onTimeout callbacks are executed on every timeout, onNotify on messages.
@@ -252,12 +329,16 @@ class SqlDbAdapter(SqlDbBaseAdapter):
                         listening = onNotify(conn.notifies.pop())
         self.dbroot.connection.set_isolation_level(ISOLATION_LEVEL_READ_COMMITTED)
         
-    def notify(self, msg, autocommit=False):
+    def notify(self, msg, autocommit=False, payload=None):
         """Notify a message to listener processes using the Postgres LISTEN - NOTIFY method.
         
         :param msg: name of the message to notify
-        :param autocommit: if False (default) you have to commit transaction, and the message is actually sent on commit"""
-        self.dbroot.execute('NOTIFY %s;' % msg)
+        :param autocommit: if False (default) you have to commit transaction, and the message is actually sent on commit
+        :param payload: optional string received by the listeners as the ``payload`` of the notification"""
+        if payload is None:
+            self.dbroot.execute('NOTIFY %s;' % msg)
+        else:
+            self.dbroot.execute('SELECT pg_notify(:channel, :payload);', dict(channel=msg, payload=payload))
         if autocommit:
             self.dbroot.commit()
             
@@ -453,29 +534,75 @@ class SqlDbAdapter(SqlDbBaseAdapter):
                                       dict(schema=schema,
                                            table=table,
                                            column=column)).fetchall()
-        result = []
-        for col in columns:
-            col = dict(col)
-            col = self._filterColInfo(col, '_pg_')
-            dtype = col['dtype'] = self.typesDict.get(col['dtype'], 'T') #for unrecognized types default dtype is T
-            col['notnull'] = (col['notnull'] == 'NO')
-            if dtype == 'N':
-                precision, scale = col.get('_pg_numeric_precision'), col.get('_pg_numeric_scale')
-                if precision:
-                    col['size'] = '%i,%i' % (precision, scale)
-            elif dtype == 'A':
-                size = col.get('length')
-                if size:
-                    col['size'] = '0:%i' % size
-                else:
-                    dtype = col['dtype'] = 'T'
-            elif dtype == 'C':
-                col['size'] = str(col.get('length'))
-            result.append(col)
+        result = [self._colInfo(col) for col in columns]
         if column:
             result = result[0]
         return result
 
+    def _colInfo(self, col):
+        col = dict(col)
+        col = self._filterColInfo(col, '_pg_')
+        dtype = col['dtype'] = self.typesDict.get(col['dtype'], 'T') #for unrecognized types default dtype is T
+        col['notnull'] = (col['notnull'] == 'NO')
+        if dtype == 'N':
+            precision, scale = col.get('_pg_numeric_precision'), col.get('_pg_numeric_scale')
+            if precision:
+                col['size'] = '%i,%i' % (precision, scale)
+        elif dtype == 'A':
+            size = col.get('length')
+            if size:
+                col['size'] = '0:%i' % size
+            else:
+                dtype = col['dtype'] = 'T'
+        elif dtype == 'C':
+            col['size'] = str(col.get('length'))
+        return col
+
+    def getCatalog(self, schemata):
+        """Get a snapshot of the catalog of the given schemata with a query for the tables,
+        one for the columns and one for the indexes of all the schemata, plus the
+        :meth:`relations` and :meth:`getTableContraints` ones"""
+        catalog = dict(tables=dict(), views=dict(), columns=dict(), indexes=dict())
+        schemata = tuple(schemata)
+        for schema in schemata:
+            catalog['tables'][schema] = []
+            catalog['views'][schema] = []
+        if schemata:
+            sqlargs = dict(schemata=schemata)
+            sql = """SELECT table_schema, table_name, table_type FROM information_schema.tables
+                     WHERE table_schema IN :schemata"""
+            for table_schema, table_name, table_type in self.dbroot.execute(sql, sqlargs).fetchall():
+                catalog['tables'][table_schema].append(table_name)
+                if table_type == 'VIEW':
+                    catalog['views'][table_schema].append(table_name)
+            sql = """SELECT c1.column_name as name,
+                            c1.ordinal_position as position, 
+                            c1.column_default as default, 
+                            c1.is_nullable as notnull, 
+                            c1.data_type as dtype, 
+                            c1.character_maximum_length as length,
+                            *
+                          FROM information_schema.columns AS c1
+                          WHERE c1.table_schema IN :schemata
+                          ORDER BY c1.table_schema, c1.table_name, position"""
+            for col in self.dbroot.execute(sql, sqlargs).fetchall():
+                col = self._colInfo(col)
+                catalog['columns'].setdefault((col['_pg_table_schema'], col['_pg_table_name']), []).append(col)
+            sql = """SELECT indcls.relname AS name, indisunique AS unique, indisprimary AS primary, indkey AS columns,
+                            nspname AS _schema, tblcls.relname AS _table
+                        FROM pg_index
+                   LEFT JOIN pg_class AS indcls ON indexrelid=indcls.oid 
+                   LEFT JOIN pg_class AS tblcls ON indrelid=tblcls.oid 
+                   LEFT JOIN pg_namespace ON pg_namespace.oid=tblcls.relnamespace 
+                       WHERE nspname IN :schemata;"""
+            for index in self.dbroot.execute(sql, sqlargs).fetchall():
+                index = dict(index)
+                key = (index.pop('_schema'), index.pop('_table'))
+                catalog['indexes'].setdefault(key, []).append(index)
+        catalog['relations'] = self.relations()
+        catalog['constraints'] = self.getTableContraints()
+        return catalog
+
     def getWhereTranslator(self):
         return GnrWhereTranslatorPG(self.dbroot)
 
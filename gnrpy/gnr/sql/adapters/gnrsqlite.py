@@ -54,6 +54,7 @@ class SqlDbAdapter(SqlDbBaseAdapter):
                     'serial': 'serial8'}
 
     support_multiple_connections = False
+    support_pooling = False
     paramstyle = 'named'
     allowAlterColumn=False
 
@@ -116,7 +117,7 @@ class SqlDbAdapter(SqlDbBaseAdapter):
     def adaptSqlName(self,name):
         return '"%s"' %name
 
-    def _selectForUpdate(self,maintable_as=None):
+    def _selectForUpdate(self,maintable_as=None,skip_locked=False):
         return ''
 
     def listElements(self, elType, **kwargs):
@@ -235,7 +236,7 @@ class SqlDbAdapter(SqlDbBaseAdapter):
             if onTimeout != None:
                 listening = onTimeout()
 
-    def notify(self, msg, autocommit=False):
+    def notify(self, msg, autocommit=False, payload=None):
         """Actually sqlite has no message comunications: so simply pass"""
         pass
 
@@ -250,10 +251,13 @@ class SqlDbAdapter(SqlDbBaseAdapter):
         conn.close()
 
     def dropDb(self, name):
-        """Drop an existing database file (actually delete the file) 
+        """Drop an existing database file (actually delete the file and its table cache log) 
         @param name: db name
         """
         os.remove(name)
+        tablecache_log = '%s.tablecache' % name
+        if os.path.exists(tablecache_log):
+            os.remove(tablecache_log)
 
     def getIndexesForTable(self, table, schema):
         """Get a (list of) dict containing details about all the indexes of a table.
@@ -338,7 +342,7 @@ class GnrSqliteCursor(pysqlite.Cursor):
                         params[k] = unicode(v)
             args = (params, ) + args
 
-        if not sql.startswith('ATTACH'):
+        if not sql.startswith('ATTACH') and logger.isEnabledFor(logging.DEBUG):
             logger.debug(u"gnrsqlite.execute()\n" + sql)
             if params:
                 logger.debug(u"Parameters:\n" + pprint.pformat(params)+"\n")
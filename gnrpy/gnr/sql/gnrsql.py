@@ -25,6 +25,7 @@ from __future__ import with_statement
 
 import logging
 import cPickle
+import itertools
 import os
 import shutil
 from time import time
@@ -42,11 +43,14 @@ from gnr.core.gnrclasses import GnrClassCatalog
 from datetime import datetime
 import re
 import thread
+import threading
 import locale
 
 __version__ = '1.0b'
 gnrlogger = logging.getLogger(__name__)
 
+BULKINSERT_CHUNKSIZE = 1000
+
 def in_triggerstack(func):
     """TODO"""
     funcname = func.__name__
@@ -63,6 +67,27 @@ def in_triggerstack(func):
         
     return decore
 
+class TriggerStackItemContext(object):
+    """Push an item for ``record`` in the trigger stack of the db while the
+    triggers of a single record run (e.g. the records of :meth:`GnrSqlDb.bulkInsert`)"""
+    def __init__(self, db, event, tblobj, record=None):
+        self.db = db
+        self.event = event
+        self.tblobj = tblobj
+        self.record = record
+
+    def __enter__(self):
+        currentEnv = self.db.currentEnv
+        trigger_stack = currentEnv.get('_trigger_stack')
+        if not trigger_stack:
+            trigger_stack = TriggerStack()
+            currentEnv['_trigger_stack'] = trigger_stack
+        trigger_stack.push(self.event, self.tblobj, record=self.record)
+        self.trigger_stack = trigger_stack
+
+    def __exit__(self, type, value, traceback):
+        self.trigger_stack.pop()
+
 class GnrSqlException(GnrException):
     """Standard Gnr Sql Base Exception
     
@@ -106,6 +131,18 @@ class GnrSqlDb(GnrObject):
         :param main_schema: the database main schema
         :param debugger: TODO
         :param application: TODO
+        
+        Connections are shared among threads through a bounded pool if ``pool_max_size``
+        is given (see :mod:`gnr.sql.gnrsqlpool`). The pool accepts also ``pool_min_size``,
+        ``pool_timeout``, ``pool_max_idle`` and ``pool_maxusage``: in an instance they
+        are the attributes of the ``db`` tag of ``instanceconfig.xml``
+        
+        Compiled queries are kept in a LRU cache of ``compiled_query_cache_size`` items
+        (default 500, ``0`` disables the cache)
+        
+        The data of :meth:`SqlTable.tableCachedData` are kept in a process-wide cache of
+        ``table_cache_size`` items (default 200, ``0`` disables it), see :mod:`gnr.sql.gnrsqlcache`.
+        It accepts also ``table_cache_max_items``, ``table_cache_poll`` and ``table_cache_log``
         """
         
         self.implementation = implementation
@@ -118,19 +155,110 @@ class GnrSqlDb(GnrObject):
         self.typeConverter = GnrClassCatalog()
         self.debugger = debugger
         self.application = application
+        self.compiledQueryCache = self.createCompiledQueryCache(**kwargs)
         self.model = self.createModel()
         self.adapter = importModule('gnr.sql.adapters.gnr%s' % implementation).SqlDbAdapter(self)
         self.whereTranslator = self.adapter.getWhereTranslator()
+        self.tableCache = self.createTableCache(**kwargs)
         if main_schema is None:
             main_schema = self.adapter.defaultMainSchema()
         self.main_schema = main_schema
         self._connections = {}
+        self.connectionPool = self.createConnectionPool(**kwargs)
         self.started = False
         self._currentEnv = {}
+        self._sqlProfiles = {}
         self.stores_handler = DbStoresHandler(self)
 
     #-----------------------Configure and Startup-----------------------------
 
+    def createConnectionPool(self, pool_max_size=None, pool_min_size=None, pool_timeout=None,
+                             pool_max_idle=None, pool_maxusage=None, **kwargs):
+        """Return a :class:`~gnr.sql.gnrsqlpool.DbConnectionPool` or ``None`` if
+        pooling is not configured or not supported by the adapter"""
+        if not pool_max_size or not self.adapter.support_pooling:
+            return
+        from gnr.sql.gnrsqlpool import DbConnectionPool, POOL_MIN_SIZE, POOL_TIMEOUT, POOL_MAX_IDLE
+        return DbConnectionPool(self, max_size=int(pool_max_size),
+                                min_size=int(pool_min_size or POOL_MIN_SIZE),
+                                timeout=float(pool_timeout or POOL_TIMEOUT),
+                                max_idle=float(pool_max_idle if pool_max_idle is not None else POOL_MAX_IDLE),
+                                maxusage=int(pool_maxusage or 0))
+
+    def createCompiledQueryCache(self, compiled_query_cache_size=None, **kwargs):
+        """Return the :class:`~gnr.sql.gnrsqldata.SqlCompiledQueryCache` used by :meth:`SqlQuery.compileQuery`"""
+        if compiled_query_cache_size is None:
+            compiled_query_cache_size = 500
+        compiled_query_cache_size = int(compiled_query_cache_size)
+        if compiled_query_cache_size:
+            from gnr.sql.gnrsqldata import SqlCompiledQueryCache
+            return SqlCompiledQueryCache(size=compiled_query_cache_size)
+
+    def createTableCache(self, table_cache_size=None, table_cache_max_items=None,
+                         table_cache_poll=None, table_cache_log=None, **kwargs):
+        """Return the :class:`~gnr.sql.gnrsqlcache.TableCache` used by :meth:`SqlTable.tableCachedData`.
+        The other processes are notified with ``NOTIFY`` if the adapter supports it, otherwise
+        through the ``table_cache_log`` file (by default next to the sqlite db file)"""
+        from gnr.sql import gnrsqlcache
+        if table_cache_size is None:
+            table_cache_size = gnrsqlcache.TABLECACHE_SIZE
+        table_cache_size = int(table_cache_size)
+        if not table_cache_size:
+            return
+        poll = float(table_cache_poll or gnrsqlcache.TABLECACHE_POLL)
+        if self.adapter.support_notify:
+            transport = gnrsqlcache.TableCacheNotifier(timeout=poll)
+        else:
+            if not table_cache_log and self.implementation == 'sqlite' and self.dbname != ':memory:':
+                table_cache_log = '%s.tablecache' % self.dbname
+            transport = gnrsqlcache.TableCachePoller(table_cache_log, interval=poll) if table_cache_log else None
+        return gnrsqlcache.TableCache(self, size=table_cache_size,
+                                      max_items=int(table_cache_max_items or gnrsqlcache.TABLECACHE_MAX_ITEMS),
+                                      transport=transport)
+
+    def tableChanged(self, tblobj):
+        """Record that a table is written in the current transaction: its cached data
+        are invalidated in every process when the transaction is committed
+        
+        :param tblobj: the table object"""
+        if self.tableCache:
+            changes = self.currentEnv.setdefault('_tablecache_changes', {})
+            changes.setdefault(self.tableStorename(tblobj), set()).add(tblobj.fullname)
+
+    def tableStorename(self, tblobj):
+        """Return the store where a table is read and written in the current env: the rootstore
+        if the table doesn't use the dbstores (as :meth:`execute` does), else the current store
+        
+        :param tblobj: the table object"""
+        envargs = dict([('env_%s' % k, v) for k, v in self.currentEnv.items()])
+        if tblobj.use_dbstores(**envargs) is False:
+            return self.rootstore
+        return self.currentEnv.get('storename') or self.rootstore
+
+    def startSqlProfile(self, name=None, **kwargs):
+        """Start collecting the statistics of the statements executed by the current thread
+        and return the :class:`~gnr.sql.gnrsqlprofile.SqlRequestProfile`
+        
+        :param name: the name of the profiled request"""
+        from gnr.sql.gnrsqlprofile import SqlRequestProfile
+        profile = SqlRequestProfile(name=name, **kwargs)
+        self._sqlProfiles[thread.get_ident()] = profile
+        return profile
+
+    def stopSqlProfile(self):
+        """Stop the sql profile of the current thread and return it"""
+        return self._sqlProfiles.pop(thread.get_ident(), None)
+
+    @property
+    def sqlProfile(self):
+        """The sql profile of the current thread or ``None``"""
+        return self._sqlProfiles.get(thread.get_ident())
+
+    def connectionPoolStats(self):
+        """Return a Bag with the statistics of the connection pool, one node for each dbstore"""
+        if self.connectionPool:
+            return self.connectionPool.stats()
+
     def dbpar(self,parvalue):
         if parvalue and parvalue.startswith("$"):
             return os.environ.get(parvalue[1:])
@@ -241,9 +369,12 @@ class GnrSqlDb(GnrObject):
         :param applyChanges: boolean. If ``True``, all the changes are executed and committed"""
         return self.model.check(applyChanges=applyChanges)
         
-    def closeConnection(self):
-        """Close a connection"""
-        thread_ident = thread.get_ident()
+    def closeConnection(self, thread_ident=None):
+        """Close the connections of the current thread.
+        Pooled connections are given back to the pool
+        
+        :param thread_ident: close the connections of another thread"""
+        thread_ident = thread_ident or thread.get_ident()
         connections_dict = self._connections.get(thread_ident)
         if connections_dict:
             for conn_name in connections_dict.keys():
@@ -252,6 +383,14 @@ class GnrSqlDb(GnrObject):
                     conn.close()
                 except Exception:
                     conn = None
+        self._connections.pop(thread_ident, None)
+
+    def releaseDeadThreadConnections(self):
+        """Close the connections still held by threads that are no longer alive"""
+        alive = set([t.ident for t in threading.enumerate()])
+        for thread_ident in self._connections.keys():
+            if thread_ident not in alive:
+                self.closeConnection(thread_ident=thread_ident)
                     
     def tempEnv(self, **kwargs):
         """Return a TempEnv class"""
@@ -332,7 +471,10 @@ class GnrSqlDb(GnrObject):
         connectionKey = self.connectionKey(storename=storename)
         connection = thread_connections.get(connectionKey)
         if not connection:
-            connection = self.adapter.connect(storename)
+            if self.connectionPool:
+                connection = self.connectionPool.checkout(storename or self.rootstore)
+            else:
+                connection = self.adapter.connect(storename)
             thread_connections[connectionKey] = connection
         return connection
     
@@ -406,8 +548,7 @@ class GnrSqlDb(GnrObject):
                     #if sql.startswith('INSERT') or sql.startswith('UPDATE') or sql.startswith('DELETE'):
                     #    print sql.split(' ',1)[0],storename,self.currentEnv.get('connectionName'),'dbtable',dbtable
                     cursor.execute(sql, sqlargs)
-                if self.debugger:
-                    self.debugger(sql=sql, sqlargs=sqlargs, dbtable=dbtable,delta_time=time()-t_0)
+                self.onSqlExecuted(sql, sqlargs, delta_time=time()-t_0, dbtable=dbtable)
             
             except Exception, e:
                 #print sql
@@ -422,6 +563,20 @@ class GnrSqlDb(GnrObject):
                 self.commit()
         return cursor
 
+    def onSqlExecuted(self, sql, sqlargs=None, delta_time=0., dbtable=None):
+        """Record an executed statement in the sql profile of the thread and in the debugger.
+        The adapters call it for the statements not executed by :meth:`execute` (e.g. ``COPY``)
+        
+        :param sql: the sql statement
+        :param sqlargs: the sql arguments
+        :param delta_time: the execution time in seconds
+        :param dbtable: the fullname of the table"""
+        profile = self._sqlProfiles.get(thread.get_ident())
+        if profile:
+            profile.onExecute(sql, sqlargs, delta_time=delta_time, dbtable=dbtable)
+        if self.debugger:
+            self.debugger(sql=sql, sqlargs=sqlargs, dbtable=dbtable,delta_time=delta_time)
+
     def notifyDbEvent(self,tblobj,**kwargs):
         pass
         
@@ -431,6 +586,12 @@ class GnrSqlDb(GnrObject):
         
         :param tblobj: the table object
         :param record: an object implementing dict interface as colname, colvalue"""
+        self._onInserting(tblobj, record, **kwargs)
+        self.adapter.insert(tblobj, record,**kwargs)
+        self.tableChanged(tblobj)
+        self._onInserted(tblobj, record)
+
+    def _onInserting(self, tblobj, record, **kwargs):
         tblobj.checkPkey(record)
         tblobj.protect_validate(record)
         tblobj._doFieldTriggers('onInserting', record)
@@ -442,23 +603,72 @@ class GnrSqlDb(GnrObject):
         if tblobj.draftField:
             if hasattr(tblobj,'protect_draft'):
                 record[tblobj.draftField] = tblobj.protect_draft(record)
-        self.adapter.insert(tblobj, record,**kwargs)
+
+    def _onInserted(self, tblobj, record):
         tblobj._doFieldTriggers('onInserted', record)
         tblobj.trigger_onInserted(record)
         tblobj._doExternalPkgTriggers('onInserted', record)
-
         
     def insertMany(self, tblobj, records, **kwargs):
         self.adapter.insertMany(tblobj, records,**kwargs)
+        self.tableChanged(tblobj)
+
+    def bulkInsert(self, tblobj, records, triggers='batch', chunk_size=None, **kwargs):
+        """Insert many records in chunks, writing every chunk with a single bulk
+        statement of the adapter (``COPY`` on postgres, multi-row ``INSERT`` elsewhere).
+        Return a dict with the number of inserted ``records``, the ``seconds`` spent and the ``rate``
+        (records per second)
+        
+        :param tblobj: the table object
+        :param records: an iterable of records (objects implementing dict interface)
+        :param triggers: ``batch`` runs the insert triggers of every record of a chunk before
+                         writing it and the inserted triggers after; ``none`` writes the records
+                         as they are, only assigning the missing primary keys
+        :param chunk_size: the number of records written at once. Default: BULKINSERT_CHUNKSIZE"""
+        chunk_size = chunk_size or BULKINSERT_CHUNKSIZE
+        pkeyColumn = tblobj.pkey
+        records = iter(records)
+        count = 0
+        t_0 = time()
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            if triggers == 'batch':
+                for record in chunk:
+                    with TriggerStackItemContext(self, 'insert', tblobj, record):
+                        self._onInserting(tblobj, record, **kwargs)
+            else:
+                for record in chunk:
+                    if record.get(pkeyColumn) in (None, ''):
+                        record[pkeyColumn] = tblobj.newPkeyValue(record)
+            self.adapter.bulkInsert(tblobj, chunk, **kwargs)
+            self.tableChanged(tblobj)
+            if triggers == 'batch':
+                for record in chunk:
+                    with TriggerStackItemContext(self, 'insert', tblobj, record):
+                        self._onInserted(tblobj, record)
+            self._onBulkInserted(tblobj, chunk, triggers=triggers)
+            count += len(chunk)
+        seconds = time() - t_0
+        result = dict(records=count, seconds=seconds, rate=count / seconds if seconds else None)
+        gnrlogger.info('bulkInsert %s: %i records in %.2f s', tblobj.fullname, count, seconds)
+        return result
+
+    def _onBulkInserted(self, tblobj, records, triggers=None):
+        pass
 
     def raw_insert(self, tblobj, record, **kwargs):
         self.adapter.insert(tblobj, record,**kwargs)
+        self.tableChanged(tblobj)
 
     def raw_update(self, tblobj, record,old_record=None, **kwargs):
         self.adapter.update(tblobj, record,**kwargs)
+        self.tableChanged(tblobj)
 
     def raw_delete(self, tblobj, record, **kwargs):
         self.adapter.delete(tblobj, record,**kwargs)
+        self.tableChanged(tblobj)
 
     @in_triggerstack
     def update(self, tblobj, record, old_record=None, pkey=None, **kwargs):
@@ -477,6 +687,7 @@ class GnrSqlDb(GnrObject):
             tblobj.dbo_onUpdating(record,old_record=old_record,pkey=pkey,**kwargs)
         tblobj.trigger_assignCounters(record=record,old_record=old_record)
         self.adapter.update(tblobj, record, pkey=pkey,**kwargs)
+        self.tableChanged(tblobj)
         tblobj.updateRelated(record,old_record=old_record)
         tblobj._doFieldTriggers('onUpdated', record, old_record=old_record)
         tblobj.trigger_onUpdated(record, old_record=old_record)
@@ -499,6 +710,7 @@ class GnrSqlDb(GnrObject):
         tblobj._doExternalPkgTriggers('onDeleting', record)
         tblobj.deleteRelated(record)
         self.adapter.delete(tblobj, record,**kwargs)
+        self.tableChanged(tblobj)
         tblobj._doFieldTriggers('onDeleted', record)
         tblobj.trigger_onDeleted(record)
         tblobj._doExternalPkgTriggers('onDeleted', record)
@@ -507,8 +719,13 @@ class GnrSqlDb(GnrObject):
     def commit(self):
         """Commit a transaction"""
         self.onCommitting()
+        tablecache_changes = self.currentEnv.pop('_tablecache_changes', None)
+        if tablecache_changes:
+            self.tableCache.onCommitting(tablecache_changes)
         for conn in self._connections.get(thread.get_ident(), {}).values():
             conn.commit()
+        if tablecache_changes:
+            self.tableCache.onCommitted(tablecache_changes)
         self.onDbCommitted()
 
     def onCommitting(self):
@@ -550,6 +767,13 @@ class GnrSqlDb(GnrObject):
     def rollback(self):
         """Rollback a transaction"""
         self.connection.rollback()
+        tablecache_changes = self.currentEnv.get('_tablecache_changes')
+        if tablecache_changes:
+            #the rolled back rows may have been cached during the transaction
+            storename = self.currentEnv.get('storename') or self.rootstore
+            tables = tablecache_changes.pop(storename, None)
+            if tables:
+                self.tableCache.invalidate(tables, storename=storename)
         
     def listen(self, *args, **kwargs):
         """Listen for a database event (postgres)"""
@@ -721,7 +945,12 @@ class GnrSqlDb(GnrObject):
               relationDict=None, sqlparams=None, excludeLogicalDeleted=True,
               excludeDraft=True,
               addPkeyColumn=True,ignorePartition=False, locale=None,
-              mode=None,_storename=None,aliasPrefix=None,ignoreTableOrderBy=None, **kwargs):
+              mode=None,_storename=None,aliasPrefix=None,ignoreTableOrderBy=None,_compiled=False, **kwargs):
+        """Return the sql text of a query. The extra keyword arguments are set in the
+        currentEnv and used as parameters of the query
+        
+        :param _compiled: boolean. If ``True``, return also the :class:`SqlCompiledQuery`
+                          (e.g. to know if it can be cached)"""
         q = self.table(table).query(columns=columns, where=where, order_by=order_by,
                          distinct=distinct, limit=limit, offset=offset,
                          group_by=group_by, having=having, for_update=for_update,
@@ -738,6 +967,8 @@ class GnrSqlDb(GnrObject):
                 newk = '%s_%s' %(prefix,k)
                 currentEnv[newk] = v
                 result = re.sub("(:)(%s)(\\W|$)" %k,lambda m: '%senv_%s%s'%(m.group(1),newk,m.group(3)), result)
+        if _compiled:
+            return result,q.compiled
         return result
 
         
@@ -765,6 +996,16 @@ class GnrSqlDb(GnrObject):
 
     def localVirtualColumns(self,table):
         return None
+
+    def customVirtualColumns(self,table):
+        return None
+
+    def clearVirtualColumns(self,table=None):
+        """Invalidate the cached virtual columns of a table (or of all the tables):
+        they are computed again when a query is compiled
+        
+        :param table: the table fullname"""
+        self.model.virtualColumnRegistry.invalidate(table)
                                                   
     def createDb(self, name, encoding='unicode'):
         """Create a database with a given name and an encoding
@@ -986,6 +1227,8 @@ class DbStoresHandler(object):
         config = self.drop_dbstore_config(storename)
         if not config:
             return
+        if self.db.connectionPool:
+            self.db.connectionPool.dropStorePool(storename)
         try:
             self.db.dropDb(config['db?dbname'])
         except Exception:
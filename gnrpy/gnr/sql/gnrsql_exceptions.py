@@ -75,6 +75,10 @@ class NotMatchingModelError(GnrSqlException):
 class SelectionExecutionError(GnrException):
     pass
         
+class SelectionStreamingError(SelectionExecutionError):
+    """Raised when a streaming selection is asked for an operation that needs all its rows"""
+    pass
+        
 class RecordDuplicateError(GnrException):
     pass
         
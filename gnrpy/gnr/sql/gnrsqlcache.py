@@ -0,0 +1,304 @@
+#-*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy sql - see LICENSE for details
+# module gnrsqlcache : Genro sql process-wide table cache.
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Process-wide cache of the data built by :meth:`SqlTable.tableCachedData`
+(e.g. :meth:`SqlTable.cachedRecord`).
+
+The cache is owned by the db (``db.tableCache``) and it is shared by all the
+threads of a process. The written tables are collected during a transaction
+and their cached data are invalidated when it is committed. The other
+processes are told through a :class:`TableCacheNotifier`, that uses
+``LISTEN``/``NOTIFY`` on postgres, or through a :class:`TableCachePoller`,
+that shares an append-only log file (the default on sqlite)."""
+
+import os
+import threading
+import logging
+import time
+from collections import OrderedDict
+
+from gnr.core.gnrbag import Bag
+from gnr.core.gnrlang import getUuid
+
+gnrlogger = logging.getLogger(__name__)
+
+TABLECACHE_SIZE = 200
+TABLECACHE_MAX_ITEMS = 1000
+TABLECACHE_POLL = 2
+TABLECACHE_CHANNEL = 'gnr_tablecache'
+TABLECACHE_LOG_MAXSIZE = 1024 * 1024
+NOTIFY_MAX_PAYLOAD = 7900
+
+def encodeChanges(origin, storename, tables):
+    """Return the message that publishes the ``tables`` written in ``storename``.
+    A message too long for a postgres ``NOTIFY`` invalidates all the tables of the store"""
+    message = '%s|%s|%s' % (origin, storename, ','.join(sorted(tables)))
+    if len(message) > NOTIFY_MAX_PAYLOAD:
+        message = '%s|%s|*' % (origin, storename)
+    return message
+
+def decodeChanges(message):
+    """Return ``(origin, storename, tables)`` from a message built by :func:`encodeChanges`.
+    ``tables`` is ``None`` when all the tables must be invalidated"""
+    try:
+        origin, storename, tables = message.split('|', 2)
+    except (ValueError, AttributeError):
+        return None, None, None
+    return origin, storename, None if tables == '*' else tables.split(',')
+
+class TableCache(object):
+    """A thread safe LRU cache of Bags, one for each ``(storename, table, topic)``.
+
+    Every Bag keeps at most ``max_items`` nodes: the oldest ones are dropped first.
+    The cached data are shared by all the pages of the process, so they must not
+    depend on the user. The callback that reads and fills a Bag holds its lock.
+
+    :param db: the :class:`GnrSqlDb`
+    :param size: the maximum number of cached Bags
+    :param max_items: the maximum number of nodes of every Bag
+    :param transport: the object that publishes the changes to the other processes
+                      and listens to theirs (``None`` invalidates only this process)"""
+    def __init__(self, db, size=TABLECACHE_SIZE, max_items=TABLECACHE_MAX_ITEMS, transport=None):
+        self.db = db
+        self.size = size
+        self.max_items = max_items
+        self.transport = transport
+        self.origin = getUuid()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._keylocks = dict()
+        self._local = threading.local()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def cachedData(self, table, topic, cb, storename=None, **kwargs):
+        """Call ``cb(cache=bag, **kwargs)`` with the cached Bag of ``table`` and ``topic``
+        and return its data. ``cb`` returns ``(data, in_cache)``"""
+        self.start()
+        key = (storename, table, topic)
+        with self._lock:
+            cache = self._cache.pop(key, None)
+            if cache is None:
+                cache = Bag()
+            self._cache[key] = cache
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+            keylock = self._keylocks.get(key)
+            if keylock is None:
+                keylock = self._keylocks[key] = threading.RLock()
+        nested = getattr(self._local, 'nested', 0)
+        if not keylock.acquire(not nested):
+            #the thread already fills another Bag: waiting could deadlock,
+            #so the data are read without caching them
+            self.misses += 1
+            return cb(cache=Bag(), **kwargs)[0]
+        self._local.nested = nested + 1
+        try:
+            data, in_cache = cb(cache=cache, **kwargs)
+            if in_cache:
+                self.hits += 1
+            else:
+                self.misses += 1
+                while len(cache) > self.max_items:
+                    cache.popNode('#0')
+        finally:
+            self._local.nested = nested
+            keylock.release()
+        return data
+
+    def invalidate(self, tables=None, storename=None):
+        """Drop the cached data of ``tables`` (all the tables if ``None``)
+        in ``storename`` (all the stores if ``None``)"""
+        with self._lock:
+            if tables is None and storename is None:
+                self._cache.clear()
+            else:
+                tables = set(tables) if tables is not None else None
+                for key in self._cache.keys():
+                    if (storename is None or key[0] == storename) and (tables is None or key[1] in tables):
+                        self._cache.pop(key)
+            self.invalidations += 1
+
+    def onCommitting(self, changes):
+        """Publish ``changes`` (a dict ``storename: set of tables``) inside the transaction
+        that is going to be committed"""
+        if self.transport:
+            self.transport.onCommitting(self, changes)
+
+    def onCommitted(self, changes):
+        """Invalidate the cached data of ``changes`` after the commit"""
+        for storename, tables in changes.items():
+            self.invalidate(tables, storename=storename)
+        if self.transport:
+            self.transport.onCommitted(self, changes)
+
+    def onMessage(self, message):
+        """Invalidate the tables of a message published by another process"""
+        origin, storename, tables = decodeChanges(message)
+        if origin == self.origin:
+            return
+        if origin is None:
+            self.invalidate()
+        else:
+            self.invalidate(tables, storename=storename)
+
+    def start(self):
+        """Start listening to the changes of the other processes (once)"""
+        if self._thread or not self.transport:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self.transport.listen, args=(self,),
+                                            name='gnr_tablecache')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop listening to the other processes"""
+        if self.transport:
+            self.transport.stop()
+        self._thread = None
+
+    def stats(self):
+        """Return a dict with hits, misses, invalidations and the cache size"""
+        return dict(hits=self.hits, misses=self.misses, invalidations=self.invalidations,
+                    size=len(self._cache), max_size=self.size)
+
+class TableCacheNotifier(object):
+    """Publish the changes with a postgres ``NOTIFY`` sent in the committing transaction
+    and listen to them on a connection of the root store held by the listening thread.
+
+    :param channel: the notification channel
+    :param timeout: seconds between two checks of the stop flag"""
+    def __init__(self, channel=TABLECACHE_CHANNEL, timeout=TABLECACHE_POLL):
+        self.channel = channel
+        self.timeout = timeout
+        self.running = False
+        self.listening = False
+
+    def onCommitting(self, tablecache, changes):
+        db = tablecache.db
+        with db.tempEnv(storename=db.rootstore):
+            for storename, tables in changes.items():
+                db.notify(self.channel, payload=encodeChanges(tablecache.origin, storename, tables))
+
+    def onCommitted(self, tablecache, changes):
+        pass
+
+    def listen(self, tablecache):
+        db = tablecache.db
+        self.running = True
+        while self.running:
+            try:
+                db.listen(self.channel, timeout=self.timeout,
+                          onNotify=lambda notify: self._onNotify(tablecache, notify),
+                          onTimeout=lambda: self._onTimeout(tablecache))
+            except Exception, e:
+                gnrlogger.warning('tablecache listener error: %s', e)
+                db.closeConnection()
+                if self.running:
+                    time.sleep(self.timeout)
+            self.listening = False
+
+    def _checkListening(self, tablecache):
+        if not self.listening:
+            #data cached before LISTEN was active may be stale
+            self.listening = True
+            tablecache.invalidate()
+
+    def _onNotify(self, tablecache, notify):
+        self._checkListening(tablecache)
+        tablecache.onMessage(getattr(notify, 'payload', None))
+        return self.running
+
+    def _onTimeout(self, tablecache):
+        self._checkListening(tablecache)
+        return self.running
+
+    def stop(self):
+        self.running = False
+
+class TableCachePoller(object):
+    """Publish the changes appending a line to a log file after the commit and poll it
+    every ``interval`` seconds. The log is rotated when it exceeds ``maxsize`` bytes:
+    a rotation invalidates all the cached data.
+
+    :param path: the log file, shared by all the processes
+    :param interval: seconds between two polls"""
+    def __init__(self, path, interval=TABLECACHE_POLL, maxsize=TABLECACHE_LOG_MAXSIZE):
+        self.path = path
+        self.interval = interval
+        self.maxsize = maxsize
+        self.running = False
+        self.inode, self.offset = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def onCommitting(self, tablecache, changes):
+        pass
+
+    def onCommitted(self, tablecache, changes):
+        lines = ''.join(['%s\n' % encodeChanges(tablecache.origin, storename, tables)
+                         for storename, tables in changes.items()])
+        try:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+                size = f.tell()
+            if size > self.maxsize:
+                os.rename(self.path, '%s.old' % self.path)
+        except (IOError, OSError), e:
+            gnrlogger.warning('tablecache log %s not written: %s', self.path, e)
+
+    def listen(self, tablecache):
+        self.running = True
+        while self.running:
+            time.sleep(self.interval)
+            self.poll(tablecache)
+
+    def poll(self, tablecache):
+        """Read the lines appended to the log since the last poll"""
+        inode, size = self._stat()
+        if inode != self.inode or size < self.offset:
+            if self.inode is not None:
+                #the log was rotated: its last lines may have been lost
+                tablecache.invalidate()
+            self.inode, self.offset = inode, 0
+        if size == self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read(size - self.offset)
+        complete = chunk.rfind('\n') + 1
+        self.offset += complete
+        for message in chunk[:complete].splitlines():
+            tablecache.onMessage(message)
+
+    def stop(self):
+        self.running = False
@@ -27,10 +27,13 @@ import re
 import cPickle
 import itertools
 import hashlib
+import threading
+from collections import OrderedDict
 from xml.sax import saxutils
 from gnr.core.gnrdict import GnrDict,dictExtract
 from gnr.core.gnrlang import deprecated, uniquify
 import tempfile
+from time import time
 from gnr.core.gnrdate import decodeDatePeriod
 from gnr.core.gnrlist import GnrNamedList
 from gnr.core import gnrclasses
@@ -39,18 +42,30 @@ from gnr.core import gnrlist
 from gnr.core.gnrclasses import GnrClassCatalog
 from gnr.core.gnrbag import Bag, BagResolver, BagAsXml
 from gnr.core.gnranalyzingbag import AnalyzingBag
-from gnr.sql.gnrsql_exceptions import GnrSqlException,SelectionExecutionError, RecordDuplicateError,\
+from gnr.core.gnrbagbinary import PackedBag
+from gnr.sql.gnrsqlfrozen import SelectionColumnStore
+from gnr.sql import gnrsqlvector
+from gnr.sql.gnrsql_exceptions import GnrSqlException,SelectionExecutionError, SelectionStreamingError, RecordDuplicateError,\
     RecordNotExistingError, RecordSelectionError,\
     GnrSqlMissingField, GnrSqlMissingColumn
 
 COLFINDER = re.compile(r"(\W|^)\$(\w+)")
 RELFINDER = re.compile(r"(\W|^)(\@([\w.@:]+))")
+STREAMING_ARRAYSIZE = 1000
 PERIODFINDER = re.compile(r"#PERIOD\s*\(\s*((?:\$|@)?[\w\.\@]+)\s*,\s*:?(\w+)\)")
 
+KEYSETFINDER = re.compile(r"^(\$\w+|@[\w.@]+|\w+)(?:\s+(asc|desc))?$", re.I)
+ESTIMATED_COUNT_THRESHOLD = 100000
+
 ENVFINDER = re.compile(r"#ENV\(([^,)]+)(,[^),]+)?\)")
 PREFFINDER = re.compile(r"#PREF\(([^,)]+)(,[^),]+)?\)")
 THISFINDER = re.compile(r'#THIS\.([\w\.@]+)')
 
+QUERYCOMPILE_PARAMETERS = set(['columns', 'where', 'order_by', 'distinct', 'limit', 'offset', 'group_by',
+                               'having', 'for_update', 'relationDict', 'sqlparams', 'excludeLogicalDeleted',
+                               'excludeDraft', 'addPkeyColumn', 'ignorePartition', 'locale', 'mode',
+                               '_storename', 'aliasPrefix', 'ignoreTableOrderBy'])
+
 class SqlCompiledQuery(object):
     """SqlCompiledQuery is a private class used by the :class:`SqlQueryCompiler` class.
        It is used to store all parameters needed to compile a query string."""
@@ -79,6 +94,9 @@ class SqlCompiledQuery(object):
         self.explodingColumns = []
         self.aggregateDict = {}
         self.pyColumns = []
+        self.usedJoinConditions = []
+        self.envDependencies = []
+        self.cacheable = True
         self.maintable_as = maintable_as
  
     def get_sqltext(self, db):
@@ -95,6 +113,122 @@ class SqlCompiledQuery(object):
 
         
         
+def keysetOrderBy(order_by, pkey):
+    """Return the keyset of an ``order_by`` made only of columns (``$name``, ``@rel.name``):
+    a list of ``(column, descending)`` ending with the pkey. Return ``None`` if the
+    ``order_by`` contains expressions
+    
+    :param order_by: the sql "ORDER BY" clause
+    :param pkey: the pkey of the table"""
+    keyset = []
+    for item in gnrstring.splitAndStrip(order_by or '', ','):
+        if not item:
+            continue
+        m = KEYSETFINDER.match(item)
+        if not m:
+            return
+        column = m.group(1)
+        if column[0] not in '$@':
+            column = '$%s' % column
+        keyset.append((column, (m.group(2) or '').lower() == 'desc'))
+    pkeyColumn = '$%s' % pkey
+    if pkeyColumn not in [column for column, descending in keyset]:
+        keyset.append((pkeyColumn, False))
+    return keyset
+
+def keysetWhere(keyset, values, sortNullsLast=False, prefix='_keyset'):
+    """Return the where condition and its parameters that select the rows following the
+    row whose keyset values are ``values``
+    
+    :param keyset: a keyset returned by :func:`keysetOrderBy`
+    :param values: the values of the keyset columns in the last row of the previous page
+    :param sortNullsLast: ``True`` if NULL values follow the others in an ascending sort"""
+    conditions = []
+    equalities = []
+    params = {}
+    for i, (column, descending) in enumerate(keyset):
+        parname = '%s_%i' % (prefix, i)
+        value = values[i]
+        nullsAfter = sortNullsLast != descending
+        if value is None:
+            following = None if nullsAfter else '%s IS NOT NULL' % column
+            equality = '%s IS NULL' % column
+        else:
+            params[parname] = value
+            following = '%s %s :%s' % (column, '<' if descending else '>', parname)
+            if nullsAfter:
+                following = '(%s OR %s IS NULL)' % (following, column)
+            equality = '%s = :%s' % (column, parname)
+        if following:
+            conditions.append('( %s )' % ' AND '.join(equalities + [following]))
+        equalities.append(equality)
+    return ' OR '.join(conditions) or '1=0', params
+
+def tableEnvState(db, tablename, ignorePartition=False):
+    """Return the part of the environment compiled in the sql of a query of a table:
+    its ``env_<table>_condition_*`` items and its partition condition
+    
+    :param db: the database
+    :param tablename: the table fullname
+    :param ignorePartition: boolean. The ``ignorePartition`` of the query"""
+    env_conditions = dictExtract(db.currentEnv, 'env_%s_condition_' % tablename.replace('.', '_'))
+    return (tablename, ignorePartition, tuple(sorted(env_conditions.items())),
+            db.table(tablename).getPartitionCondition(ignorePartition=ignorePartition))
+
+class SqlCompiledQueryCache(object):
+    """A thread safe LRU cache of the :class:`SqlCompiledQuery` objects built by :meth:`SqlQuery.compileQuery()`.
+    
+    The cache is owned by the db (``db.compiledQueryCache``) and it is cleared when the model is built again.
+    Queries whose compilation depends on the environment (``#ENV``, ``#PREF``, ``#PERIOD``, python formulas)
+    are never cached. A compiled query keeps the :func:`tableEnvState` of the tables of its subqueries
+    (the ``select_`` formula columns): it is served only if they have not changed.
+    
+    :param size: the maximum number of compiled queries kept in the cache"""
+    def __init__(self, size=500):
+        self.size = size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        
+    def get(self, key, db=None):
+        """Return the compiled query cached with a key, or ``None``
+        
+        :param key: the key
+        :param db: the database used to check the subquery tables of the compiled query"""
+        with self._lock:
+            compiled = self._cache.pop(key, None)
+            if compiled is not None:
+                self._cache[key] = compiled
+        if compiled is not None and db is not None:
+            for dependency in compiled.envDependencies:
+                if tableEnvState(db, dependency[0], dependency[1]) != dependency:
+                    compiled = None
+                    break
+        with self._lock:
+            if compiled is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return compiled
+            
+    def set(self, key, compiled):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = compiled
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+                
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            
+    def stats(self):
+        """Return a dict with hits, misses, uncacheable compilations and the cache size"""
+        return dict(hits=self.hits, misses=self.misses, uncacheable=self.uncacheable,
+                    size=len(self._cache), max_size=self.size)
+        
 class SqlQueryCompiler(object):
     """SqlQueryCompiler is a private class used by SqlQuery and SqlRecord to build an SqlCompiledQuery instance.
     
@@ -124,6 +258,7 @@ class SqlQueryCompiler(object):
         self._currColKey = None
         self.aliasPrefix = aliasPrefix or 't'
         self.locale = locale
+        self.cacheable = True
         
     def aliasCode(self,n):
         return '%s%i' %(self.aliasPrefix,n)
@@ -163,11 +298,13 @@ class SqlQueryCompiler(object):
 
         def expandPref(m):
             """#PREF(myprefpath,default)"""
+            self.cacheable = False
             prefpath = m.group(1)
             dflt=m.group(2)[1:] if m.group(2) else None
             return str(curr_tblobj.pkg.getPreference(prefpath,dflt))
         
         def expandEnv(m):
+            self.cacheable = False
             what = m.group(1)
             par2 = None
             if m.group(2):
@@ -210,6 +347,7 @@ class SqlQueryCompiler(object):
                 sql_formula = fldalias.sql_formula
                 attr = dict(fldalias.attributes)
                 if sql_formula is True:
+                    self.cacheable = False
                     sql_formula = getattr(curr_tblobj,'sql_formula_%s' %fld)(attr)
                 select_dict = dictExtract(attr,'select_')
                 if not sql_formula:
@@ -227,9 +365,18 @@ class SqlQueryCompiler(object):
                         sq_pars.setdefault('ignorePartition',True)
                         sq_pars.setdefault('excludeDraft',False)
                         sq_pars.setdefault('excludeLogicalDeleted',False)
+                        if set(sq_pars.keys()) - QUERYCOMPILE_PARAMETERS:
+                            self.cacheable = False # extra parameters are stored in currentEnv by queryCompile
                         aliasPrefix = '%s_t' %alias
                         sq_where = THISFINDER.sub(expandThis,sq_where)
-                        sql_text = self.db.queryCompile(table=sq_table,where=sq_where,aliasPrefix=aliasPrefix,addPkeyColumn=False,ignoreTableOrderBy=True,**sq_pars)
+                        sq_ignorePartition = sq_pars['ignorePartition']
+                        sql_text,sq_compiled = self.db.queryCompile(table=sq_table,where=sq_where,aliasPrefix=aliasPrefix,
+                                                                   addPkeyColumn=False,ignoreTableOrderBy=True,
+                                                                   _compiled=True,**sq_pars)
+                        if not sq_compiled.cacheable:
+                            self.cacheable = False
+                        self.cpl.envDependencies.append(tableEnvState(self.db,sq_table,sq_ignorePartition))
+                        self.cpl.envDependencies.extend(sq_compiled.envDependencies)
                         sql_formula = re.sub('#%s\\b' %susbselect, tpl %sql_text,sql_formula)
                 subreldict = {}
                 sql_formula = self.updateFieldDict(sql_formula, reldict=subreldict)
@@ -238,6 +385,7 @@ class SqlQueryCompiler(object):
                 sql_formula = THISFINDER.sub(expandThis,sql_formula)
                 sql_formula_var = dictExtract(attr,'var_')
                 if sql_formula_var:
+                    self.cacheable = False
                     prefix = str(id(sql_formula_var))
                     currentEnv = self.db.currentEnv
                     for k,v in sql_formula_var.items():
@@ -374,6 +522,7 @@ class SqlQueryCompiler(object):
         one_one = None
         joinExtra = self.joinConditions.get('%s_%s' % (target_fld.replace('.', '_'), from_fld.replace('.', '_')))
         if joinExtra:
+            self.cpl.usedJoinConditions.append('%s_%s' % (target_fld.replace('.', '_'), from_fld.replace('.', '_')))
             extracnd = joinExtra['condition'].replace('$tbl', alias)
             params = joinExtra.get('params')
             self.sqlparams.update(params)
@@ -470,7 +619,9 @@ class SqlQueryCompiler(object):
         :param offset: the same of the sql "OFFSET"
         :param group_by: the sql "GROUP BY" clause. For more information check the :ref:`sql_group_by` section
         :param having: the sql "HAVING" clause. For more information check the :ref:`sql_having`
-        :param for_update: boolean. If ``True``, lock the selected records of the main table (SELECT ... FOR UPDATE OF ...)
+        :param for_update: boolean. If ``True``, lock the selected records of the main table (SELECT ... FOR UPDATE OF ...).
+                           With ``'skip_locked'`` the records locked by other transactions are skipped
+                           (if the adapter has ``support_skip_locked``)
         :param relationDict: a dict to assign a symbolic name to a :ref:`relation`. For more information
                              check the :ref:`relationdict` documentation section
         :param bagFields: boolean. If ``True``, include fields of Bag type (``X``) when the ``columns``
@@ -724,6 +875,7 @@ class SqlQueryCompiler(object):
         """TODO
         
         :param m: TODO"""
+        self.cacheable = False
         fld = m.group(1)
         period_param = m.group(2)
         date_from, date_to = decodeDatePeriod(self.sqlparams[period_param],
@@ -870,7 +1022,7 @@ class SqlQuery(object):
     :param offset: the same of the sql "OFFSET"
     :param group_by: the sql "GROUP BY" clause. For more information check the :ref:`sql_group_by` section
     :param having: the sql "HAVING" clause. For more information check the :ref:`sql_having`
-    :param for_update: boolean. TODO
+    :param for_update: boolean or ``'skip_locked'``. TODO
     :param relationDict: a dict to assign a symbolic name to a :ref:`relation`. For more information
                          check the :ref:`relationdict` documentation section
     :param sqlparams: a dictionary which associates sqlparams to their values
@@ -962,22 +1114,60 @@ class SqlQuery(object):
         
     def compileQuery(self, count=False):
         """Return the :meth:`compiledQuery() <SqlQueryCompiler.compiledQuery()>` method.
+        The result is taken from the db :class:`SqlCompiledQueryCache` when possible.
         
         :param count: boolean. If ``True``, optimize the sql query to get the number of resulting rows (like count(*))"""
-        return SqlQueryCompiler(self.dbtable.model,
+        cache = self.db.compiledQueryCache
+        cacheKey = self._compiledQueryKey(count) if cache is not None else None
+        if cacheKey is not None:
+            compiled = cache.get(cacheKey, db=self.db)
+            if compiled is not None:
+                for k in compiled.usedJoinConditions:
+                    self.sqlparams.update(self.joinConditions[k].get('params') or {})
+                return compiled
+        compiler = SqlQueryCompiler(self.dbtable.model,
                                 joinConditions=self.joinConditions,
                                 sqlContextName=self.sqlContextName,
                                 sqlparams=self.sqlparams,
                                 aliasPrefix=self.aliasPrefix,
-                                locale=self.locale).compiledQuery(relationDict=self.relationDict,
-                                                                  count=count,
-                                                                  bagFields=self.bagFields,
-                                                                  excludeLogicalDeleted=self.excludeLogicalDeleted,
-                                                                  excludeDraft=self.excludeDraft,
-                                                                  addPkeyColumn=self.addPkeyColumn,
-                                                                  ignorePartition=self.ignorePartition,
-                                                                  ignoreTableOrderBy=self.ignoreTableOrderBy,
-                                                                  **self.querypars)
+                                locale=self.locale)
+        compiled = compiler.compiledQuery(relationDict=self.relationDict,
+                                          count=count,
+                                          bagFields=self.bagFields,
+                                          excludeLogicalDeleted=self.excludeLogicalDeleted,
+                                          excludeDraft=self.excludeDraft,
+                                          addPkeyColumn=self.addPkeyColumn,
+                                          ignorePartition=self.ignorePartition,
+                                          ignoreTableOrderBy=self.ignoreTableOrderBy,
+                                          **self.querypars)
+        compiled.cacheable = compiler.cacheable
+        if cacheKey is not None:
+            if compiler.cacheable:
+                compiled.relationDict = dict(compiled.relationDict)
+                cache.set(cacheKey, compiled)
+            else:
+                cache.uncacheable += 1
+        return compiled
+        
+    def _compiledQueryKey(self, count):
+        tblobj = self.dbtable.model
+        tablename = tblobj.fullname
+        env_conditions = dictExtract(self.db.currentEnv, 'env_%s_condition_' % tablename.replace('.', '_'))
+        joinConditions = [(k, v.get('condition'), v.get('one_one')) for k, v in self.joinConditions.items()]
+        key = (tablename, self.aliasPrefix, self.locale, count, self.bagFields,
+               self.excludeLogicalDeleted, self.excludeDraft, self.addPkeyColumn,
+               self.ignorePartition, self.ignoreTableOrderBy,
+               tuple(sorted(self.querypars.items())),
+               tuple(sorted(self.relationDict.items())),
+               tuple(sorted(joinConditions)),
+               tuple(sorted(env_conditions.items())),
+               tblobj.dbtable.getPartitionCondition(ignorePartition=self.ignorePartition),
+               tblobj.virtualColumnsVersion, getattr(tblobj, '_last_virtual_columns_ts', None))
+        try:
+            hash(key)
+        except TypeError:
+            return
+        return key
                                                                   
     def cursor(self):
         """Get a cursor of the current selection."""
@@ -999,8 +1189,14 @@ class SqlQuery(object):
         return result
 
     def handlePyColumns(self,data):
+        """Compute the python columns of the fetched rows. The rows and the time spent
+        are counted in the sql profile of the thread (see :meth:`GnrSqlDb.startSqlProfile`)"""
+        profile = self.db.sqlProfile
+        if profile:
+            profile.onFetch(len(data))
         if not self.compiled.pyColumns:
             return
+        t_0 = time()
         pcdict = dict(self.compiled.pyColumns)
         for field in  self.dbtable.model.virtual_columns.keys():
             if not field in pcdict:
@@ -1011,6 +1207,8 @@ class SqlQuery(object):
                     #d[field] = handler(d,field=field)
                     result = handler(d,field=field)
                     d[field] = result
+        if profile:
+            profile.onPyColumns(time()-t_0)
 
     def fetchPkeys(self):
         fetch = self.fetch()
@@ -1088,13 +1286,20 @@ class SqlQuery(object):
 
         return index, data
 
-    def selection(self, pyWhere=None, key=None, sortedBy=None, _aggregateRows=False):
+    def selection(self, pyWhere=None, key=None, sortedBy=None, _aggregateRows=False,
+                  streaming=False, arraysize=STREAMING_ARRAYSIZE):
         """Execute the query and return a SqlSelection
         
         :param pyWhere: a callback that can be used to reduce the selection during the fetch
         :param key: TODO
         :param sortedBy: TODO
-        :param _aggregateRows: boolean. TODO"""
+        :param _aggregateRows: boolean. TODO
+        :param streaming: boolean. If ``True``, return a :class:`SqlStreamingSelection` that reads
+                          the rows from a server cursor instead of fetching them all
+        :param arraysize: the number of rows fetched at a time by a streaming selection"""
+        if streaming:
+            return self.streamingSelection(pyWhere=pyWhere, key=key, sortedBy=sortedBy,
+                                           _aggregateRows=_aggregateRows, arraysize=arraysize)
         index, data = self._dofetch(pyWhere=pyWhere)
         return SqlSelection(self.dbtable, data,
                             index=index,
@@ -1109,6 +1314,38 @@ class SqlQuery(object):
                             _aggregateDict = self.compiled.aggregateDict
                             )
                             
+    def streamingSelection(self, pyWhere=None, key=None, sortedBy=None, _aggregateRows=False,
+                           arraysize=STREAMING_ARRAYSIZE):
+        """Execute the query on a server cursor and return a :class:`SqlStreamingSelection`.
+        Only ``arraysize`` rows at a time are kept in memory
+        
+        :param pyWhere: a callback that can be used to reduce the selection during the fetch
+        :param key: TODO
+        :param sortedBy: not allowed: a streaming selection cannot be sorted
+        :param _aggregateRows: boolean. Not allowed if the query has exploding columns
+        :param arraysize: the number of rows fetched at a time"""
+        cursor, rowset = self.serverfetch(arraysize=arraysize)
+        index = cursor.index
+        return SqlStreamingSelection(self.dbtable, self._streamingRows(rowset, pyWhere=pyWhere),
+                                     index=index,
+                                     cursor=cursor,
+                                     colAttrs=self._prepColAttrs(index),
+                                     joinConditions=self.joinConditions,
+                                     sqlContextName=self.sqlContextName,
+                                     key=key,
+                                     sortedBy=sortedBy,
+                                     explodingColumns=self.compiled.explodingColumns,
+                                     checkPermissions=self.checkPermissions,
+                                     _aggregateRows=_aggregateRows,
+                                     _aggregateDict=self.compiled.aggregateDict)
+        
+    def _streamingRows(self, rowset, pyWhere=None):
+        for rows in rowset:
+            if pyWhere:
+                rows = [r for r in rows if pyWhere(r)]
+            self.handlePyColumns(rows)
+            yield rows
+                            
     def _prepColAttrs(self, index):
         colAttrs = {}
         for k in index.keys():
@@ -1160,6 +1397,50 @@ class SqlQuery(object):
             yield rows
         cursor.close()
         
+    def keyset(self):
+        """Return the keyset of the query (see :func:`keysetOrderBy`) or ``None`` if the query
+        cannot be paginated with a keyset"""
+        querypars = self.querypars
+        if querypars['distinct'] or querypars['group_by'] or querypars['having']:
+            return
+        order_by = querypars['order_by']
+        if not order_by and not self.ignoreTableOrderBy:
+            order_by = self.dbtable.attributes.get('order_by')
+        return keysetOrderBy(order_by, self.dbtable.pkey)
+        
+    def setKeyset(self, keyset, after=None, limit=None, offset=None):
+        """Prepare the query to fetch ``limit`` rows ordered by ``keyset``, starting after
+        the row whose keyset values are ``after`` and skipping ``offset`` rows.
+        The keyset values of the fetched rows are read in the ``_keyset_<i>`` columns
+        
+        :param keyset: a keyset returned by :meth:`keyset`
+        :param after: the keyset values of the last row of the previous page
+        :param limit: the number of rows of the page
+        :param offset: the rows to skip after ``after``"""
+        querypars = self.querypars
+        querypars['order_by'] = ','.join(['%s %s' % (column, 'DESC' if descending else 'ASC')
+                                          for column, descending in keyset])
+        querypars['columns'] = '%s,%s' % (querypars['columns'],
+                                          ','.join(['%s AS _keyset_%i' % (column, i)
+                                                    for i, (column, descending) in enumerate(keyset)]))
+        if after is not None:
+            where, params = keysetWhere(keyset, after, sortNullsLast=self.db.adapter.sortNullsLast)
+            querypars['where'] = '( %s ) AND ( %s )' % (querypars['where'], where) if querypars['where'] else where
+            self.sqlparams.update(params)
+        querypars['limit'] = limit
+        querypars['offset'] = offset or None
+        self._compiled = None
+        
+    def estimatedCount(self, threshold=ESTIMATED_COUNT_THRESHOLD):
+        """Return the number of rows estimated by the query planner if it is at least ``threshold``,
+        otherwise (or if the adapter cannot estimate it) the exact :meth:`count`
+        
+        :param threshold: the estimate under which the rows are counted"""
+        estimate = self.db.adapter.estimateCount(self.sqltext, self.sqlparams, storename=self.storename)
+        if estimate is not None and estimate >= threshold:
+            return estimate
+        return self.count()
+        
     def count(self):
         """Return rowcount. It does not save a selection"""
         compiledQuery = self.compileQuery(count=True)
@@ -1185,7 +1466,15 @@ class SqlSelection(object):
     """It is the resulting data from the execution of an istance of the :class:`SqlQuery`. Through the
     SqlSelection you can get data into differents modes: you can use the :meth:`output()` method or you
     can :meth:`freeze()` it into a file. You can also use the :meth:`sort()` and the :meth:`filter()` methods
-    on a SqlSelection."""
+    on a SqlSelection.
+    
+    A frozen selection keeps its rows in a :class:`~gnr.sql.gnrsqlfrozen.SelectionColumnStore`:
+    until the rows are needed as a whole, paging, sorting and summing read only the involved
+    rows and columns."""
+    _frz_store = None
+    _frz_rowids = None
+    _frz_rewrite = False
+    
     def __init__(self, dbtable, data, index=None, colAttrs=None, key=None, sortedBy=None,
                  joinConditions=None, sqlContextName=None, explodingColumns=None, checkPermissions=None,_aggregateRows=False,_aggregateDict=None):
         self._frz_data = None
@@ -1344,8 +1633,30 @@ class SqlSelection(object):
             raise SelectionExecutionError('Not existing mode: %s' % outmethod)
             
     def __len__(self):
+        if self._frz_unloaded:
+            return self._frz_store.rowsCount(filtered=self._frz_filtered_data is not None)
         return len(self.data)
         
+    @property
+    def _frz_unloaded(self):
+        return self._frz_store is not None and self._frz_data == 'frozen' and self._frz_filtered_data in (None, 'frozen')
+        
+    @property
+    def _frz_positionalKey(self):
+        if self.key == 'rowidx':
+            return self.key
+        
+    def _frozenRows(self, rows, rowids):
+        if self._frz_rowids is None:
+            self._frz_rowids = {}
+        for rid, r in zip(rowids, rows):
+            self._frz_rowids[id(r)] = (rid, r)
+        return rows
+        
+    def _rowsByRowid(self, rows):
+        rowids = self._frz_rowids or {}
+        return dict([(rowids[id(r)][0], r) for r in rows if id(r) in rowids])
+        
     def _get_data(self):
         if self._filtered_data is not None:
             return self._filtered_data
@@ -1375,18 +1686,49 @@ class SqlSelection(object):
     _data = property(_get_full_data, _set_full_data)
         
     def _freezeme(self):
-        if self.analyzeBag != None:
-            self.analyzeBag.makePicklable()
-        saved = self.dbtable, self._data, self._filtered_data
-        self.dbtable, self._data, self._filtered_data = None, 'frozen', 'frozen' * bool(self._filtered_data) or None
+        saved = self.dbtable, self._frz_data, self._frz_filtered_data, self._frz_rowids, self.analyzeBag
+        self.dbtable, self._frz_data, self._frz_rowids = None, 'frozen', None
+        if self.analyzeBag is not None:
+            self.analyzeBag = PackedBag(self.analyzeBag)
+        self._frz_filtered_data = 'frozen' if self._frz_filtered_data is not None else None
         selection_path = '%s.pik' % self.freezepath
         dumpfile_handle, dumpfile_path = tempfile.mkstemp(prefix='gnrselection',suffix='.pik')
         with os.fdopen(dumpfile_handle, "w") as f:
             cPickle.dump(self, f)
         shutil.move(dumpfile_path, selection_path)
-        self.dbtable, self._data, self._filtered_data = saved
+        self.dbtable, self._frz_data, self._frz_filtered_data, self._frz_rowids, self.analyzeBag = saved
         
     def _freeze_data(self, readwrite):
+        store = self._frz_store
+        if store is None:
+            return self._freeze_pickled_data(readwrite)
+        if readwrite == 'r':
+            rowids = store.loadRowids()
+            self._frz_data = self._frozenRows(store.rows(rowids, self._index, firstPosition=0), rowids)
+            if self._frz_filtered_data not in (None, 'frozen'):
+                byrid = self._rowsByRowid(self._frz_data)
+                self._frz_filtered_data = [byrid.get(self._frz_rowids[id(r)][0], r) for r in self._frz_filtered_data]
+            return
+        if self._frz_data == 'frozen':
+            store.saveOrder()
+            return
+        data = self._frz_data
+        rowids = self._frz_rowids
+        if rowids is not None and not self._frz_rewrite:
+            newrows = [r for r in data if id(r) not in rowids]
+            appended = store.append(newrows, self._index)
+            if appended is not None:
+                self._frozenRows(newrows, appended)
+                store.setOrder([rowids[id(r)][0] for r in data])
+                return
+        filtered = self._filtered_data
+        self._frz_rowids = None
+        self._frz_rewrite = False
+        self._frozenRows(data, store.write(data, self._index, positionalKey=self._frz_positionalKey))
+        if filtered is not None:
+            self._freeze_filtered('w')
+        
+    def _freeze_pickled_data(self, readwrite):
         pik_path = '%s_data.pik' % self.freezepath
         if readwrite == 'w':
             dumpfile_handle, dumpfile_path = tempfile.mkstemp(prefix='gnrselection_data',suffix='.pik')
@@ -1409,6 +1751,35 @@ class SqlSelection(object):
                 return cPickle.load(f)
         
     def _freeze_filtered(self, readwrite):
+        store = self._frz_store
+        if store is None:
+            return self._freeze_pickled_filtered(readwrite)
+        filtered = self._frz_filtered_data
+        if readwrite == 'w':
+            if filtered == 'frozen':
+                store.saveFiltered()
+            elif filtered is None:
+                store.setFiltered(None)
+            else:
+                rowids = self._frz_rowids or {}
+                if [r for r in filtered if id(r) not in rowids]:
+                    self._freeze_data('w')
+                    rowids = self._frz_rowids
+                store.setFiltered([rowids[id(r)][0] for r in filtered])
+            return
+        rowids = store.loadRowids(filtered=True)
+        if rowids is None:
+            self._frz_filtered_data = None
+        elif self._frz_data == 'frozen':
+            self._frz_filtered_data = self._frozenRows(store.rows(rowids, self._index), rowids)
+        else:
+            byrid = self._rowsByRowid(self._frz_data)
+            missing = [rid for rid in rowids if rid not in byrid]
+            if missing:
+                byrid.update(zip(missing, self._frozenRows(store.rows(missing, self._index), missing)))
+            self._frz_filtered_data = [byrid[rid] for rid in rowids]
+        
+    def _freeze_pickled_filtered(self, readwrite):
         fpath = '%s_filtered.pik' % self.freezepath
         if readwrite == 'w' and self._filtered_data is None:
             if os.path.isfile(fpath):
@@ -1428,7 +1799,10 @@ class SqlSelection(object):
         
         :param fpath: the freeze path
         :param autocreate: boolean. if ``True``, TODO"""
+        self._data, self._filtered_data #load the rows of a previous freeze
         self.freezepath = fpath
+        self._frz_store = SelectionColumnStore(fpath)
+        self._frz_rowids = None
         self.isChangedSelection = False
         self.isChangedData = False
         self.isChangedFiltered = False
@@ -1438,7 +1812,6 @@ class SqlSelection(object):
                 os.makedirs(dirname)
         self._freezeme()
         self._freeze_data('w')
-        self._freeze_filtered('w')
         if freezePkeys:
             self._freeze_pkeys('w')
 
@@ -1474,11 +1847,19 @@ class SqlSelection(object):
                     if arg.split(':')[0] in self.explodingColumns:
                         args[k] = arg.replace('*', '')
             self.sortedBy = args
-            gnrlist.sortByItem(self.data, *args)
-            if self.key == 'rowidx':
-                self.setKey('rowidx')
+            if self._frz_unloaded and self._frz_store.meta['positionalKey'] == self._frz_positionalKey:
+                self._frz_store.sort(args, filtered=self._frz_filtered_data is not None)
+            else:
+                data = self.data
+                perm = gnrsqlvector.sortPermutation(data, args) if self._vectorRows() else None
+                if perm is None:
+                    gnrlist.sortByItem(data, *args)
+                else:
+                    data[:] = [data[i] for i in perm]
+                if self.key == 'rowidx':
+                    self.setKey('rowidx')
             self.isChangedSelection = True #prova
-            if not self._filtered_data:
+            if not self._frz_filtered_data:
                 self.isChangedData = True
             else:
                 self.isChangedFiltered = True
@@ -1494,6 +1875,7 @@ class SqlSelection(object):
         else:
             self._filtered_data = None
         self.isChangedFiltered = True
+        self.isChangedSelection = True
         
     def extend(self, selection, merge=True):
         """TODO
@@ -1522,6 +1904,7 @@ class SqlSelection(object):
                 r.update(result)
             else:
                 rowsToChange.append((i, result))
+        self._frz_rewrite = True
                 
         if rowsToChange:
             rowsToChange.reverse()
@@ -1593,8 +1976,12 @@ class SqlSelection(object):
                 keep = [x.replace('@', '_').replace('.', '_').replace('$', '') if isinstance(x, basestring) else x for x
                         in keep]
             self.analyzeKey = key
-            self.analyzeBag.analyze(self, group_by=group_by, sum=sum, collect=collect,
-                                    distinct=distinct, keep=keep, key=key, captionCb=captionCb, **kwargs)
+            rows = self._vectorRows()
+            if rows is None or gnrsqlvector.analyze(self.analyzeBag, rows, group_by=group_by, sum=sum,
+                                                    collect=collect, distinct=distinct, keep=keep, key=key,
+                                                    captionCb=captionCb, **kwargs) is None:
+                self.analyzeBag.analyze(self, group_by=group_by, sum=sum, collect=collect,
+                                        distinct=distinct, keep=keep, key=key, captionCb=captionCb, **kwargs)
         return self.analyzeBag
         
     @deprecated
@@ -1647,31 +2034,57 @@ class SqlSelection(object):
         if isinstance(columns,basestring):
             columns = columns.split(',')
         result  = list()
-        if not columns or not self.data:
+        if not columns:
+            return result
+        if self._frz_unloaded:
+            store = self._frz_store
+            rowids = store.rowids(filtered=self._frz_filtered_data is not None)
+            if not rowids:
+                return result
+            data = [store.column(c, rowids) for c in columns]
+        elif not self.data:
             return result
-        data = zip(*[[r[c] for c in columns] for r in self.data])
+        else:
+            data = zip(*[[r[c] for c in columns] for r in self.data])
         for k,c in enumerate(columns):
             result.append(sum(filter(lambda r: r is not None, data[k])))
         return result
+        
+    def _vectorRows(self):
+        """Return the rows of the selection if they are enough to use the
+        :mod:`~gnr.sql.gnrsqlvector` implementation of the operations"""
+        data = self.data
+        if gnrsqlvector.useVector(data):
+            return data
 
 
     def _out(self, columns=None, offset=0, limit=None, filterCb=None):
-        if filterCb:
-            source = itertools.ifilter(filterCb, self.data)
-        else:
-            source = self.data
         if limit:
             stop = offset + limit
         else:
             stop = None
         columns = filter(lambda cname: not self.colAttrs.get(cname,{}).get('user_forbidden'),columns)
+        if filterCb:
+            source = itertools.islice(itertools.ifilter(filterCb, self), offset, stop)
+        elif self._frz_unloaded:
+            source = self._frozenWindow(offset, stop, columns)
+        else:
+            source = itertools.islice(self, offset, stop)
         if columns != ['**rawdata**']:
-            for r in itertools.islice(source, offset, stop):
+            for r in source:
                 yield r.extractItems(columns)
         else:
-            for r in itertools.islice(source, offset, stop):
+            for r in source:
                 yield r
                 
+    def _frozenWindow(self, offset, stop, columns):
+        filtered = self._frz_filtered_data is not None
+        store = self._frz_store
+        rowids = store.rowids(offset, stop, filtered=filtered)
+        if columns == ['**rawdata**']:
+            columns = None
+        return store.rows(rowids, self._index, columns=columns, firstPosition=None if filtered else offset)
+                
     def toTextGen(self, outgen, formats, locale, dfltFormats):
         """TODO
         
@@ -1679,13 +2092,22 @@ class SqlSelection(object):
         :param formats: TODO
         :param locale: the current locale (e.g: en, en_us, it)
         :param dfltFormats: TODO"""
-        def _toText(cell):
-            k, v = cell
-            v = gnrstring.toText(v, format=formats.get(k) or dfltFormats.get(type(v)), locale=locale)
-            return (k, v)
-            
-        for r in outgen:
-            yield map(_toText, r)
+        outgen = iter(outgen)
+        while True:
+            rows = list(itertools.islice(outgen, gnrstring.TEXT_CHUNK_SIZE))
+            if not rows:
+                return
+            cells = dict()
+            for i, r in enumerate(rows):
+                for j, (k, v) in enumerate(r):
+                    cells.setdefault((k, formats.get(k) or dfltFormats.get(type(v))), []).append((i, j))
+            result = [list(r) for r in rows]
+            for (k, format), positions in cells.items():
+                texts = gnrstring.toTextColumn([rows[i][j][1] for i, j in positions], format=format, locale=locale)
+                for (i, j), text in zip(positions, texts):
+                    result[i][j] = (k, text)
+            for r in result:
+                yield r
             
     def __iter__(self):
         return self.data.__iter__()
@@ -1750,10 +2172,21 @@ class SqlSelection(object):
         return [dict(r) for r in outsource]
         
     def out_json(self, outsource):
-        """TODO
+        """Return the outsource as a json list, encoded a row at a time (see :meth:`iter_json`)
         
         :param outsource: TODO"""
-        return gnrstring.toJson(self.out_dictlist(outsource))
+        return ''.join(self.iter_json(outsource))
+        
+    def iter_json(self, outsource):
+        """A generator function that returns the outsource as a json list, a row at a time.
+        
+        :param outsource: TODO"""
+        yield '['
+        separator = ''
+        for r in outsource:
+            yield '%s%s' % (separator, gnrstring.toJson(dict(r)))
+            separator = ', '
+        yield ']'
         
     def out_list(self, outsource):
         """TODO
@@ -1775,10 +2208,8 @@ class SqlSelection(object):
             yield r[0][1]
 
     def out_template(self,outsource,rowtemplate=None,joiner=''):
-        result = []
-        for r in outsource:
-            result.append(gnrstring.templateReplace(rowtemplate,dict(r),safeMode=True))
-        return joiner.join(result)
+        compiled = gnrstring.compiledTemplate(rowtemplate,safeMode=True)
+        return joiner.join(compiled.renderMany([dict(r) for r in outsource]))
 
     def out_records(self, outsource,virtual_columns=None):
         """TODO
@@ -2011,15 +2442,17 @@ class SqlSelection(object):
         """TODO
         
         :param outsource: TODO"""
+        return '\n'.join(self.iter_tabtext(outsource))
+        
+    def iter_tabtext(self, outsource):
+        """A generator function that returns the headers line and then a line for each row
         
-        headers = self.colHeaders()
+        :param outsource: TODO"""
         columns = [c for c in self.columns if not c in ('pkey', 'rowidx')]
-        result = ['\t'.join(headers)]
+        yield '\t'.join(self.colHeaders)
         for row in outsource:
             r = dict(row)
-            result.append(
-                    '\t'.join([r[col].replace('\n', ' ').replace('\r', ' ').replace('\t', ' ') for col in columns]))
-        return '\n'.join(result)
+            yield '\t'.join([r[col].replace('\n', ' ').replace('\r', ' ').replace('\t', ' ') for col in columns])
         
     def out_xls(self, outsource, filepath=None):
         """TODO
@@ -2035,6 +2468,135 @@ class SqlSelection(object):
                            format_float='#,##0.00', format_int='#,##0')
         writer(data=outsource)
         
+class SqlStreamingSelection(SqlSelection):
+    """A :class:`SqlSelection` reading its rows from a server cursor, a chunk at a time.
+    
+    The rows are never collected in a list, so :meth:`output()` (e.g. the ``generator``,
+    ``tabtext``, ``json`` and ``xls`` modes) and :meth:`totalize()` work with bounded memory.
+    The rows can be read only once and the operations that need all of them at the same
+    time (sort, filter, random access, freeze...) raise a :class:`SelectionStreamingError`"""
+    def __init__(self, dbtable, rowsource, cursor=None, **kwargs):
+        self._rowsource = rowsource
+        self._cursor = cursor
+        self._consumed = False
+        super(SqlStreamingSelection, self).__init__(dbtable, None, **kwargs)
+        
+    def _notStreamable(self, operation):
+        raise SelectionStreamingError('%s is not allowed on a streaming selection of %s: use a standard selection'
+                                      % (operation, self.tablename))
+        
+    def _aggregateRows(self, data, index, explodingColumns, aggregateDict=None):
+        if explodingColumns:
+            self._notStreamable('Aggregating exploding columns')
+        return data
+        
+    def setKey(self, key):
+        """Set the key of the selection. The rows get the key value while they are read
+        
+        :param key: the key."""
+        self.key = key
+        
+    def __iter__(self):
+        if self._consumed:
+            raise SelectionStreamingError('The rows of a streaming selection of %s can be read only once'
+                                          % self.tablename)
+        self._consumed = True
+        return self._iterRows()
+        
+    def _iterRows(self):
+        key = self.key
+        if key in self._index:
+            key = None
+        i = 0
+        for rows in self._rowsource:
+            for r in rows:
+                if key:
+                    r[key] = i
+                i += 1
+                yield r
+        self._cursor = None
+        
+    def close(self):
+        """Close the server cursor of a selection that will not be read until its end"""
+        self._consumed = True
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        
+    @property
+    def data(self):
+        self._notStreamable('Random access')
+        
+    @property
+    def keyDict(self):
+        self._notStreamable('Access by key')
+        
+    def __len__(self):
+        self._notStreamable('len()')
+        
+    def sort(self, *args):
+        """Not allowed: raise a :class:`SelectionStreamingError`"""
+        self._notStreamable('Sort')
+        
+    def filter(self, filterCb=None):
+        """Not allowed: use the ``filterCb`` parameter of :meth:`output()`"""
+        self._notStreamable('Filter')
+        
+    def freeze(self, fpath, autocreate=False, freezePkeys=False):
+        """Not allowed: raise a :class:`SelectionStreamingError`"""
+        self._notStreamable('Freeze')
+        
+    def freezeUpdate(self):
+        """Not allowed: raise a :class:`SelectionStreamingError`"""
+        self._notStreamable('Freeze')
+        
+    def extend(self, selection, merge=True):
+        """Not allowed: raise a :class:`SelectionStreamingError`"""
+        self._notStreamable('Extend')
+        
+    def apply(self, cb):
+        """Not allowed: raise a :class:`SelectionStreamingError`"""
+        self._notStreamable('Apply')
+        
+    def insert(self, i, values):
+        """Not allowed: raise a :class:`SelectionStreamingError`"""
+        self._notStreamable('Insert')
+        
+    def append(self, values):
+        """Not allowed: raise a :class:`SelectionStreamingError`"""
+        self._notStreamable('Append')
+        
+    def remove(self, cb):
+        """Not allowed: raise a :class:`SelectionStreamingError`"""
+        self._notStreamable('Remove')
+        
+    def totalize(self, group_by=None, sum=None, collect=None, distinct=None,
+                 keep=None, key=None, captionCb=None, **kwargs):
+        """Like :meth:`SqlSelection.totalize`, reading the rows. The indexes of the rows
+        of every group are not collected unless ``collectIdx`` is ``True``"""
+        kwargs.setdefault('collectIdx', False)
+        return super(SqlStreamingSelection, self).totalize(group_by=group_by, sum=sum, collect=collect,
+                                                           distinct=distinct, keep=keep, key=key,
+                                                           captionCb=captionCb, **kwargs)
+        
+    def _vectorRows(self):
+        return
+        
+    def sum(self, columns=None):
+        """Return the sums of the given columns, reading the rows"""
+        if isinstance(columns, basestring):
+            columns = columns.split(',')
+        if not columns:
+            return list()
+        result = None
+        for r in self:
+            if result is None:
+                result = [0] * len(columns)
+            for k, c in enumerate(columns):
+                if r[c] is not None:
+                    result[k] += r[c]
+        return result or list()
+        
 class SqlRelatedSelectionResolver(BagResolver):
     """TODO"""
     classKwargs = {'cacheTime': 0, 'readOnly': True, 'db': None,
@@ -2157,6 +2719,9 @@ class SqlRecord(object):
             data = cursor.fetchall()
             index = cursor.index
             cursor.close()
+            profile = self.db.sqlProfile
+            if profile:
+                profile.onFetch(len(data))
             if self.compiled.explodingColumns and len(data)>1:
                 data = self.aggregateRecords(data,index)
             if len(data) == 1:
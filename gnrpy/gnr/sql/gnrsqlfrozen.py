@@ -0,0 +1,457 @@
+#-*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy sql - see LICENSE for details
+# module gnrsqlfrozen : columnar storage of frozen selections.
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Columnar storage of the rows of a frozen :class:`~gnr.sql.gnrsqldata.SqlSelection`.
+
+The rows live in the folder ``<freezepath>_columns``:
+
+* ``meta.pik``: the number of stored rows and the kind of every column
+* ``c<n>.col``: the values of the n-th column as a typed array. Integers and floats are
+  stored as they are. A column with few distinct values is dictionary encoded: the array
+  holds the codes and ``c<n>.dict`` holds the distinct values. The values of the other
+  columns (e.g. the pkeys, the timestamps) are pickled one by one in ``c<n>.blob`` and
+  the array holds the offset and the length of every value
+* ``order.col``: the ids of the rows in the order of the selection
+* ``positions.col``: the position of every row in the order of the selection
+* ``filtered.col``: the ids of the filtered rows, if the selection is filtered
+
+Arrays are memory-mapped on read, so paging a selection reads only the rows of the
+window and the requested columns. New rows are appended to the column files."""
+
+import os
+import mmap
+import shutil
+import struct
+import tempfile
+import cPickle
+from array import array
+
+from gnr.core import gnrlist
+from gnr.core.gnrlist import GnrNamedList
+
+ROWID_TYPECODE = 'l'
+KIND_INT = 'l'
+KIND_FLOAT = 'd'
+KIND_DICT = 'c'
+KIND_BLOB = 'b'
+KIND_POSITION = 'k'
+
+DICT_MAX_SIZE = 1024
+DICT_MIN_REPEAT = 4
+
+def columnKind(values):
+    """Return the storage kind of a column with the given values
+
+    :param values: the values of the column"""
+    types = set([type(v) for v in values])
+    if not types or types == set([int]):
+        return KIND_INT
+    if types == set([float]):
+        return KIND_FLOAT
+    return KIND_DICT if lowCardinality(values) else KIND_BLOB
+
+def lowCardinality(values):
+    """Return ``True`` if the values are hashable and every distinct value is repeated
+    on average at least DICT_MIN_REPEAT times, with at most DICT_MAX_SIZE distinct values
+
+    :param values: the values of the column"""
+    limit = min(DICT_MAX_SIZE, len(values) / DICT_MIN_REPEAT)
+    distinct = set()
+    try:
+        for v in values:
+            distinct.add(_dictKey(v))
+            if len(distinct) > limit:
+                return False
+    except TypeError:
+        return False
+    return True
+
+def _dictKey(v):
+    return (type(v), v)
+
+BLOB_ENTRY = struct.Struct('2%s' % ROWID_TYPECODE)
+
+class SelectionColumnStore(object):
+    """The columnar storage of a frozen selection
+
+    :param fpath: the freeze path of the selection"""
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.folder = '%s_columns' % fpath
+        self._reset()
+
+    def _reset(self):
+        self._meta = None
+        self._maps = {}
+        self._dictionaries = {}
+        self.order = None
+        self.filtered = None
+        self._filtered_loaded = False
+
+    def __getstate__(self):
+        return dict(fpath=self.fpath, folder=self.folder)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _dump(self, name, writer):
+        dumpfile_handle, dumpfile_path = tempfile.mkstemp(prefix='gnrselection_col', dir=self.folder)
+        with os.fdopen(dumpfile_handle, 'wb') as f:
+            writer(f)
+        shutil.move(dumpfile_path, self._path(name))
+        self._maps.pop(name, None)
+
+    def _dumpArray(self, name, values, typecode):
+        self._dump(name, lambda f: array(typecode, values).tofile(f))
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with open(self._path('meta.pik'), 'rb') as f:
+                self._meta = cPickle.load(f)
+        return self._meta
+
+    def _saveMeta(self):
+        self._dump('meta.pik', lambda f: cPickle.dump(self._meta, f, cPickle.HIGHEST_PROTOCOL))
+
+    @property
+    def nrows(self):
+        return self.meta['nrows']
+
+    @property
+    def columns(self):
+        return [c for c, kind in self.meta['columns']]
+
+    def exists(self):
+        """Return ``True`` if the rows were stored"""
+        return os.path.exists(self._path('meta.pik'))
+
+    # writing
+
+    def write(self, rows, index, positionalKey=None):
+        """Store the given rows replacing the current content. The order of the rows
+        becomes the stored order. Return the ids of the rows
+
+        :param rows: a list of rows
+        :param index: the dict mapping the column names to their positions in the rows
+        :param positionalKey: the name of a column whose value is the position of the row
+                              (e.g. ``rowidx``): it is not stored"""
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+        os.makedirs(self.folder)
+        self._reset()
+        columns = []
+        for k, (colname, pos) in enumerate(sorted(index.items(), key=lambda item: item[1])):
+            if colname == positionalKey:
+                kind = KIND_POSITION
+            else:
+                values = [r[pos] if pos < len(r) else None for r in rows]
+                kind = columnKind(values)
+                self._writeColumn(k, kind, values)
+            columns.append((colname, kind))
+        self._meta = dict(nrows=len(rows), columns=columns, positionalKey=positionalKey)
+        self._saveMeta()
+        rowids = range(len(rows))
+        self.setOrder(rowids)
+        self.setFiltered(None)
+        return rowids
+
+    def _writeColumn(self, k, kind, values, dictionary=None):
+        colfile = 'c%i.col' % k
+        if kind == KIND_BLOB:
+            entries = array(ROWID_TYPECODE)
+            self._dump('c%i.blob' % k, lambda f: entries.extend(self._writeBlob(f, values, 0)))
+            self._dumpArray(colfile, entries, ROWID_TYPECODE)
+            return
+        if kind != KIND_DICT:
+            self._dumpArray(colfile, values, kind)
+            return
+        codes, newvalues = self._encode(values, dictionary or {})
+        self._dumpArray(colfile, codes, ROWID_TYPECODE)
+        self._dump('c%i.dict' % k, lambda f: cPickle.dump(newvalues, f, cPickle.HIGHEST_PROTOCOL))
+
+    def _writeBlob(self, f, values, offset):
+        entries = array(ROWID_TYPECODE)
+        for v in values:
+            pickled = cPickle.dumps(v, cPickle.HIGHEST_PROTOCOL)
+            f.write(pickled)
+            entries.append(offset)
+            entries.append(len(pickled))
+            offset += len(pickled)
+        return entries
+
+    def _encode(self, values, dictionary):
+        codes = []
+        newvalues = []
+        for v in values:
+            key = _dictKey(v)
+            code = dictionary.get(key)
+            if code is None:
+                code = dictionary[key] = len(dictionary)
+                newvalues.append(v)
+            codes.append(code)
+        return codes, newvalues
+
+    def append(self, rows, index):
+        """Append the given rows to the stored ones and return their ids. Return ``None``
+        if the rows cannot be appended (e.g. a column changed its kind): in this case the
+        store must be rewritten
+
+        :param rows: a list of rows
+        :param index: the dict mapping the column names to their positions in the rows"""
+        meta = self.meta
+        if not rows:
+            return []
+        if sorted(index.keys()) != sorted(self.columns):
+            return
+        columns = []
+        for k, (colname, kind) in enumerate(meta['columns']):
+            if kind == KIND_POSITION:
+                continue
+            pos = index[colname]
+            values = [r[pos] if pos < len(r) else None for r in rows]
+            if kind == KIND_DICT:
+                dictionary = dict([(_dictKey(v), code) for code, v in enumerate(self._dictionary(k))])
+                try:
+                    values = self._encode(values, dictionary)
+                except TypeError:
+                    return
+                if len(dictionary) > DICT_MAX_SIZE:
+                    return
+            elif kind != KIND_BLOB and columnKind(values) != kind:
+                return
+            columns.append((k, kind, values))
+        for k, kind, values in columns:
+            if kind == KIND_DICT:
+                codes, newvalues = values
+                self._appendFile('c%i.col' % k, lambda f: array(ROWID_TYPECODE, codes).tofile(f))
+                if newvalues:
+                    self._appendFile('c%i.dict' % k,
+                                     lambda f: cPickle.dump(newvalues, f, cPickle.HIGHEST_PROTOCOL))
+                    self._dictionaries[k].extend(newvalues)
+            elif kind == KIND_BLOB:
+                blobfile = 'c%i.blob' % k
+                entries = array(ROWID_TYPECODE)
+                offset = os.path.getsize(self._path(blobfile))
+                self._appendFile(blobfile, lambda f: entries.extend(self._writeBlob(f, values, offset)))
+                self._appendFile('c%i.col' % k, lambda f: entries.tofile(f))
+            else:
+                self._appendFile('c%i.col' % k, lambda f: array(kind, values).tofile(f))
+        first = meta['nrows']
+        meta['nrows'] += len(rows)
+        self._saveMeta()
+        return range(first, meta['nrows'])
+
+    def _appendFile(self, name, writer):
+        self._maps.pop(name, None)
+        with open(self._path(name), 'ab') as f:
+            writer(f)
+
+    def setOrder(self, rowids):
+        """Set and store the ids of the rows in the order of the selection
+
+        :param rowids: a list of row ids"""
+        self.order = array(ROWID_TYPECODE, rowids)
+        self.saveOrder()
+
+    def saveOrder(self):
+        """Store the order of the rows and their positions if it was loaded"""
+        if self.order is not None:
+            self._dumpArray('order.col', self.order, ROWID_TYPECODE)
+            positions = array(ROWID_TYPECODE, [-1]) * self.nrows
+            for pos, rid in enumerate(self.order):
+                positions[rid] = pos
+            self._dumpArray('positions.col', positions, ROWID_TYPECODE)
+
+    def setFiltered(self, rowids):
+        """Set and store the ids of the filtered rows
+
+        :param rowids: a list of row ids or ``None`` if the selection is not filtered"""
+        self.filtered = array(ROWID_TYPECODE, rowids) if rowids is not None else None
+        self._filtered_loaded = True
+        self.saveFiltered()
+
+    def saveFiltered(self):
+        """Store the filtered rows if they were loaded"""
+        if not self._filtered_loaded:
+            return
+        if self.filtered is None:
+            if os.path.exists(self._path('filtered.col')):
+                os.remove(self._path('filtered.col'))
+        else:
+            self._dumpArray('filtered.col', self.filtered, ROWID_TYPECODE)
+
+    # reading
+
+    def _map(self, name):
+        m = self._maps.get(name)
+        if m is None:
+            with open(self._path(name), 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    m = ''
+            self._maps[name] = m
+        return m
+
+    def _readArray(self, name, typecode, start=0, stop=None):
+        m = self._map(name)
+        itemsize = array(typecode).itemsize
+        stop = len(m) if stop is None else min(stop * itemsize, len(m))
+        result = array(typecode)
+        if start * itemsize < stop:
+            result.fromstring(m[start * itemsize:stop])
+        return result
+
+    def _take(self, name, typecode, rowids):
+        if len(rowids) > self.nrows / 8:
+            values = self._readArray(name, typecode)
+            return [values[rid] for rid in rowids]
+        m = self._map(name)
+        itemsize = array(typecode).itemsize
+        unpack = struct.Struct(typecode).unpack_from
+        return [unpack(m, rid * itemsize)[0] for rid in rowids]
+
+    def _dictionary(self, k):
+        dictionary = self._dictionaries.get(k)
+        if dictionary is None:
+            dictionary = []
+            with open(self._path('c%i.dict' % k), 'rb') as f:
+                while True:
+                    try:
+                        dictionary.extend(cPickle.load(f))
+                    except EOFError:
+                        break
+            self._dictionaries[k] = dictionary
+        return dictionary
+
+    def rowsCount(self, filtered=False):
+        """Return the number of rows of the selection
+
+        :param filtered: boolean. If ``True``, count the filtered rows"""
+        name = 'filtered.col' if filtered else 'order.col'
+        rowids = self.filtered if filtered else self.order
+        if rowids is not None:
+            return len(rowids)
+        return len(self._map(name)) / array(ROWID_TYPECODE).itemsize
+
+    def rowids(self, start=0, stop=None, filtered=False):
+        """Return the ids of the rows of the selection in the given window
+
+        :param start: the first position
+        :param stop: the last position (excluded)
+        :param filtered: boolean. If ``True``, read the filtered rows"""
+        rowids = self.filtered if filtered else self.order
+        if rowids is not None:
+            return rowids[start:stop]
+        return self._readArray('filtered.col' if filtered else 'order.col', ROWID_TYPECODE, start, stop)
+
+    def loadRowids(self, filtered=False):
+        """Load in memory the ids of the rows of the selection and return them
+
+        :param filtered: boolean. If ``True``, load the filtered rows"""
+        if filtered:
+            if not self._filtered_loaded:
+                self.filtered = self.rowids(filtered=True) if os.path.exists(self._path('filtered.col')) else None
+                self._filtered_loaded = True
+            return self.filtered
+        if self.order is None:
+            self.order = self.rowids()
+        return self.order
+
+    def positions(self, rowids):
+        """Return the positions of the given rows in the order of the selection
+
+        :param rowids: a list of row ids"""
+        if self.order is not None:
+            positions = dict([(rid, pos) for pos, rid in enumerate(self.order)])
+            return [positions.get(rid) for rid in rowids]
+        return [pos if pos >= 0 else None for pos in self._take('positions.col', ROWID_TYPECODE, rowids)]
+
+    def column(self, colname, rowids, firstPosition=None):
+        """Return the values of a column for the given rows
+
+        :param colname: the column name
+        :param rowids: a list of row ids
+        :param firstPosition: the position of the first row in the selection order, if the rows
+                              are contiguous. It is used for positional columns"""
+        for k, (name, kind) in enumerate(self.meta['columns']):
+            if name == colname:
+                break
+        else:
+            return [None] * len(rowids)
+        if kind == KIND_POSITION:
+            if firstPosition is not None:
+                return range(firstPosition, firstPosition + len(rowids))
+            return self.positions(rowids)
+        colfile = 'c%i.col' % k
+        if kind == KIND_BLOB:
+            entries = self._map(colfile)
+            blob = self._map('c%i.blob' % k)
+            result = []
+            for rid in rowids:
+                offset, size = BLOB_ENTRY.unpack_from(entries, rid * BLOB_ENTRY.size)
+                result.append(cPickle.loads(blob[offset:offset + size]))
+            return result
+        if kind == KIND_DICT:
+            dictionary = self._dictionary(k)
+            return [dictionary[code] for code in self._take(colfile, ROWID_TYPECODE, rowids)]
+        return self._take(colfile, kind, rowids)
+
+    def rows(self, rowids, index, columns=None, firstPosition=None):
+        """Return the given rows as a list of :class:`~gnr.core.gnrlist.GnrNamedList`
+
+        :param rowids: a list of row ids
+        :param index: the index of the rows to build
+        :param columns: the columns to read. If ``None``, read all the columns
+        :param firstPosition: see :meth:`column`"""
+        columns = columns or self.columns
+        rows = [[None] * len(index) for rid in rowids]
+        for colname in columns:
+            pos = index.get(colname)
+            if pos is None:
+                continue
+            for row, v in zip(rows, self.column(colname, rowids, firstPosition=firstPosition)):
+                row[pos] = v
+        return [GnrNamedList(index, values=row) for row in rows]
+
+    def sort(self, args, filtered=False):
+        """Sort the rows of the selection reading only the sort columns.
+
+        :param args: the sort criteria, as in :func:`~gnr.core.gnrlist.sortByItem`
+        :param filtered: boolean. If ``True``, sort the filtered rows"""
+        rowids = self.loadRowids(filtered=filtered)
+        columns = set([arg.split(':')[0] for arg in args])
+        sortrows = [dict(_rowid=rid) for rid in rowids]
+        for colname in columns:
+            for r, v in zip(sortrows, self.column(colname, rowids)):
+                r[colname] = v
+        gnrlist.sortByItem(sortrows, *args)
+        rowids = array(ROWID_TYPECODE, [r['_rowid'] for r in sortrows])
+        if filtered:
+            self.filtered = rowids
+        else:
+            self.order = rowids
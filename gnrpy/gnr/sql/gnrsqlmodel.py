@@ -33,6 +33,7 @@ from gnr.sql.gnrsqltable import SqlTable
 from gnr.sql.gnrsql_exceptions import GnrSqlMissingField, GnrSqlMissingTable,\
     GnrSqlMissingColumn, GnrSqlRelationError
 import threading
+import weakref
 
 logger = logging.getLogger(__name__)
 VIRTUAL_COLUMNS_CACHETIME = timedelta(0,300)
@@ -48,6 +49,90 @@ def bagItemFormula(bagcolumn=None,itempath=None,dtype=None):
 class NotExistingTableError(Exception):
     pass
     
+class VirtualColumnRegistry(object):
+    """The virtual columns of the tables computed by code or read from the db: the
+    columns of the formula column methods of the tables and of the pages and the
+    formula columns of the user objects.
+    
+    Every table has a version, incremented by :meth:`invalidate`: the columns cached
+    for an older version are computed again. The cached columns expire anyway after
+    VIRTUAL_COLUMNS_CACHETIME, as the formula column methods may read the db. The
+    columns read from the db are cached for every store, as every store has its own db"""
+    def __init__(self):
+        self.versions = {}
+        self._cache = {}
+        self._methodNames = weakref.WeakKeyDictionary()
+        self._lock = threading.RLock()
+        
+    def version(self, table):
+        """Return the version of the virtual columns of a table
+        
+        :param table: the table fullname"""
+        return self.versions.get(table, 0)
+        
+    def get(self, table, kind, builder, storename=None):
+        """Return the columns of a kind cached for the current version of the table,
+        calling *builder* if they are missing or expired
+        
+        :param table: the table fullname
+        :param kind: the kind of columns (e.g. ``custom``)
+        :param builder: a callable returning the columns
+        :param storename: the store the columns are read from"""
+        version = self.version(table)
+        key = (table, kind, storename)
+        cached = self._cache.get(key)
+        if cached and cached[0] == version and datetime.now() - cached[1] < VIRTUAL_COLUMNS_CACHETIME:
+            return cached[2]
+        result = builder()
+        with self._lock:
+            if self.version(table) == version:
+                self._cache[key] = (version, datetime.now(), result)
+        return result
+        
+    def invalidate(self, table=None):
+        """Increment the version of a table, or of all tables if *table* is ``None``
+        
+        :param table: the table fullname"""
+        with self._lock:
+            if table:
+                tables = [table]
+            else:
+                tables = set(self.versions.keys() + [k[0] for k in self._cache.keys()])
+            for t in tables:
+                self.versions[t] = self.version(t) + 1
+                for k in [k for k in self._cache.keys() if k[0] == t]:
+                    self._cache.pop(k, None)
+                    
+    def clear(self):
+        """Invalidate all tables and forget the method names (the model is built again)"""
+        self.invalidate()
+        self._methodNames.clear()
+        
+    def methodNames(self, obj, prefix):
+        """Return the sorted names of the attributes of *obj* starting with *prefix*
+        (e.g. ``formulaColumn_``). The names defined by every class are looked up
+        only once, the instance attributes (mixed in at runtime) every time
+        
+        :param obj: an instance
+        :param prefix: the prefix of the names"""
+        names = self._classMethodNames(obj.__class__, prefix)
+        instance_names = [k for k in getattr(obj, '__dict__', {}) if k.startswith(prefix) and k not in names]
+        if instance_names:
+            names = sorted(names + instance_names)
+        return names
+        
+    def _classMethodNames(self, cls, prefix):
+        classnames = self._methodNames.get(cls)
+        if classnames is None:
+            classnames = self._methodNames.setdefault(cls, {})
+        names = classnames.get(prefix)
+        if names is None:
+            names = set([k for k in cls.__dict__ if k.startswith(prefix)])
+            for base in cls.__bases__:
+                names.update(self._classMethodNames(base, prefix))
+            names = classnames[prefix] = sorted(names)
+        return names
+        
 class DbModel(object):
     """TODO"""
     def __init__(self, db):
@@ -58,6 +143,7 @@ class DbModel(object):
         self.relations = Bag()
         self._columnsWithRelations = {}
         self.mixins = Bag()
+        self.virtualColumnRegistry = VirtualColumnRegistry()
         
     @property
     def debug(self):
@@ -109,6 +195,9 @@ class DbModel(object):
             oneCol = relation.pop('related_column')
             self.addRelation(many_relation_tuple, oneCol, **relation)
         self._columnsWithRelations.clear()
+        self.virtualColumnRegistry.clear()
+        if self.db.compiledQueryCache is not None:
+            self.db.compiledQueryCache.clear()
             
     def resolveAlias(self, name):
         """TODO
@@ -872,10 +961,17 @@ class DbTableObj(DbModelObj):
                 r.append((reltbl,deferred or onDelete=='setnull'))
         return r
 
+    @property
+    def virtualColumnsVersion(self):
+        """The version of the virtual columns of the table in the
+        :class:`VirtualColumnRegistry` of the model"""
+        return self.db.model.virtualColumnRegistry.version(self.fullname)
+
     @property  
     def virtual_columns(self):
         """Returns a DbColAliasListObj"""
-        if hasattr(self,'_virtual_columns'):
+        version = self.virtualColumnsVersion
+        if getattr(self, '_virtual_columns_version', None) == version:
             if datetime.now()-self._last_virtual_columns_ts<VIRTUAL_COLUMNS_CACHETIME:
                 return self._virtual_columns 
         virtual_columns = self['virtual_columns']
@@ -889,6 +985,7 @@ class DbTableObj(DbModelObj):
             obj = DbVirtualColumnObj(structnode=node,parent=virtual_columns)
             virtual_columns.children[obj.name.lower()] = obj
         self._virtual_columns = virtual_columns
+        self._virtual_columns_version = version
         self._last_virtual_columns_ts = datetime.now()
         return virtual_columns
 
@@ -896,7 +993,8 @@ class DbTableObj(DbModelObj):
     def dynamic_columns(self):
         result = Bag()
         dbtable = self.dbtable
-        fmethods = [v for v in [getattr(dbtable,k) for k in dir(dbtable) if k.startswith('formulaColumn_')]]
+        registry = self.db.model.virtualColumnRegistry
+        fmethods = [getattr(dbtable,k) for k in registry.methodNames(dbtable, 'formulaColumn_')]
         for f in fmethods:
             r = f()
             if not isinstance(r,list):
@@ -912,7 +1010,10 @@ class DbTableObj(DbModelObj):
     def full_virtual_columns(self):
         """Returns a DbColAliasListObj"""
         virtual_columns = self.virtual_columns
-        custom_virtual_columns = self.db.customVirtualColumns(self.fullname)
+        storename = self.db.currentEnv.get('storename') or self.db.rootstore
+        custom_virtual_columns = self.db.model.virtualColumnRegistry.get(self.fullname, 'custom',
+                                                lambda: self.db.customVirtualColumns(self.fullname),
+                                                storename=storename)
         if custom_virtual_columns:
             for node in custom_virtual_columns:
                 obj = DbVirtualColumnObj(structnode=node,parent=virtual_columns)
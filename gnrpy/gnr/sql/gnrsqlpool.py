@@ -0,0 +1,289 @@
+#-*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy sql - see LICENSE for details
+# module gnrsqlpool : Genro sql connection pool.
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Bounded connection pool shared by all the threads of a process.
+
+Every dbstore gets its own sub-pool (:class:`DbStorePool`). Connections are
+built by the adapter ``connect()`` method and wrapped by a
+:class:`~gnr.sql.SteadyDB.SteadyDBConnection`, so a connection dropped by the
+server is transparently reopened. A checked out connection is returned to its
+sub-pool when it is closed: :meth:`GnrSqlDb.closeConnection` does it at the end
+of every request."""
+
+import threading
+import logging
+from collections import deque
+from functools import partial
+from time import time
+
+from gnr.core.gnrbag import Bag
+from gnr.sql import SteadyDB
+from gnr.sql.gnrsql_exceptions import GnrSqlException
+
+gnrlogger = logging.getLogger(__name__)
+
+POOL_MAX_SIZE = 20
+POOL_MIN_SIZE = 0
+POOL_TIMEOUT = 30
+POOL_MAX_IDLE = 300
+
+class GnrSqlPoolTimeout(GnrSqlException):
+    """Raised when no connection could be checked out within the pool timeout"""
+    pass
+
+class PooledConnection(object):
+    """A connection checked out from a :class:`DbStorePool`.
+
+    Cursors are obtained through the steady connection, so a dead connection is
+    reopened on the fly. :meth:`close` gives the connection back to the pool."""
+
+    def __init__(self, pool, steady):
+        self._pool = pool
+        self._steady = steady
+        self._checkout_ts = None
+        self.last_used = time()
+
+    def cursor(self, *args, **kwargs):
+        return self._steady._cursor(*args, **kwargs)
+
+    def commit(self):
+        self._steady.commit()
+
+    def rollback(self):
+        self._steady.rollback()
+
+    def close(self):
+        self._pool.checkin(self)
+
+    @property
+    def storename(self):
+        return self._pool.storename
+
+    def __getattr__(self, name):
+        return getattr(self._steady._con, name)
+
+class DbStorePool(object):
+    """The sub-pool of connections to a single dbstore
+
+    :param adapter: the db adapter that builds the connections
+    :param storename: the dbstore name
+    :param min_size: connections kept open even when idle
+    :param max_size: maximum number of connections open at the same time
+    :param timeout: seconds to wait for a free connection before raising :class:`GnrSqlPoolTimeout`
+    :param max_idle: seconds after which an idle connection exceeding ``min_size`` is closed
+    :param maxusage: number of checkouts after which a connection is reopened (``0`` means unlimited)
+    :param onExhausted: callback invoked when the pool is full, before waiting"""
+
+    def __init__(self, adapter, storename, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_TIMEOUT, max_idle=POOL_MAX_IDLE, maxusage=None, onExhausted=None):
+        self.adapter = adapter
+        self.storename = storename
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.maxusage = maxusage or 0
+        self.onExhausted = onExhausted
+        self._idle = deque()
+        self._in_use = set()
+        self._pending = 0
+        self._cond = threading.Condition(threading.Lock())
+        self.counters = dict(created=0, discarded=0, checkouts=0, waits=0, wait_time=0.,
+                             timeouts=0, failed_checks=0, max_in_use=0)
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use) + self._pending
+
+    def _create(self):
+        steady = SteadyDB.connect(partial(self.adapter.connect, self.storename),
+                                  maxusage=self.maxusage, closeable=True)
+        self.counters['created'] += 1
+        return PooledConnection(self, steady)
+
+    def _discard(self, connection):
+        self.counters['discarded'] += 1
+        try:
+            connection._steady._close()
+        except Exception:
+            pass
+
+    def _healthy(self, connection):
+        steady = connection._steady
+        if steady._maxusage and steady._usage >= steady._maxusage:
+            return False
+        try:
+            self.adapter.checkConnection(connection)
+            return True
+        except Exception:
+            self.counters['failed_checks'] += 1
+            return False
+
+    def checkout(self):
+        """Return a connection, reusing an idle one when available"""
+        t_start = time()
+        waited = False
+        with self._cond:
+            while True:
+                self._evict()
+                if self._idle:
+                    connection = self._idle.pop()
+                    self._in_use.add(connection)
+                    break
+                if self.size < self.max_size:
+                    connection = None
+                    self._pending += 1
+                    break
+                if not waited:
+                    waited = True
+                    self.counters['waits'] += 1
+                    if self.onExhausted:
+                        self._cond.release()
+                        try:
+                            self.onExhausted(self)
+                        finally:
+                            self._cond.acquire()
+                        continue
+                remaining = self.timeout - (time() - t_start)
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise GnrSqlPoolTimeout('GNRSQL-POOL',
+                                            'No connection available for store %s after %i seconds (max_size=%i)'
+                                            % (self.storename, self.timeout, self.max_size))
+                self._cond.wait(remaining)
+            if waited:
+                self.counters['wait_time'] += time() - t_start
+        if connection is not None and not self._healthy(connection):
+            with self._cond:
+                self._in_use.discard(connection)
+                self._pending += 1
+            self._discard(connection)
+            connection = None
+        if connection is None:
+            try:
+                connection = self._create()
+            except Exception:
+                with self._cond:
+                    self._pending -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._pending -= 1
+                self._in_use.add(connection)
+        with self._cond:
+            self.counters['checkouts'] += 1
+            self.counters['max_in_use'] = max(self.counters['max_in_use'], len(self._in_use))
+        connection._steady._usage += 1
+        connection._checkout_ts = time()
+        return connection
+
+    def checkin(self, connection):
+        """Give back a connection to the pool. The pending transaction is rolled back"""
+        try:
+            self.adapter.resetPooledConnection(connection)
+            reusable = True
+        except Exception:
+            reusable = False
+        with self._cond:
+            if connection not in self._in_use:
+                return
+            self._in_use.discard(connection)
+            if reusable:
+                connection.last_used = time()
+                self._idle.append(connection)
+            else:
+                self._discard(connection)
+            self._cond.notify()
+
+    def _evict(self):
+        if not self.max_idle:
+            return
+        limit = time() - self.max_idle
+        while self._idle and self.size > self.min_size and self._idle[0].last_used < limit:
+            self._discard(self._idle.popleft())
+
+    def evictIdle(self):
+        """Close the connections idle for more than ``max_idle`` seconds"""
+        with self._cond:
+            self._evict()
+
+    def closeAll(self):
+        """Close all the idle connections"""
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.popleft())
+
+    def stats(self):
+        with self._cond:
+            result = dict(self.counters)
+            result.update(size=self.size, in_use=len(self._in_use), idle=len(self._idle),
+                          min_size=self.min_size, max_size=self.max_size)
+        return result
+
+class DbConnectionPool(object):
+    """Process wide connection pool with a sub-pool for each dbstore
+
+    :param db: the :class:`~gnr.sql.gnrsql.GnrSqlDb` instance
+    :param \*\*pool_kwargs: the :class:`DbStorePool` parameters"""
+
+    def __init__(self, db, **pool_kwargs):
+        self.db = db
+        self.pool_kwargs = pool_kwargs
+        self.pools = {}
+        self._lock = threading.Lock()
+
+    def storePool(self, storename):
+        pool = self.pools.get(storename)
+        if pool is None:
+            with self._lock:
+                pool = self.pools.get(storename)
+                if pool is None:
+                    pool = DbStorePool(self.db.adapter, storename,
+                                       onExhausted=self.onExhausted, **self.pool_kwargs)
+                    self.pools[storename] = pool
+        return pool
+
+    def checkout(self, storename):
+        return self.storePool(storename).checkout()
+
+    def onExhausted(self, pool):
+        self.db.releaseDeadThreadConnections()
+
+    def evictIdle(self):
+        for pool in self.pools.values():
+            pool.evictIdle()
+
+    def closeAll(self):
+        for pool in self.pools.values():
+            pool.closeAll()
+
+    def dropStorePool(self, storename):
+        pool = self.pools.pop(storename, None)
+        if pool:
+            pool.closeAll()
+
+    def stats(self):
+        """Return a Bag with the statistics of every sub-pool"""
+        result = Bag()
+        for storename in sorted(self.pools.keys()):
+            result.setItem(storename, None, **self.pools[storename].stats())
+        return result
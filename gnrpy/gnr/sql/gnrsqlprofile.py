@@ -0,0 +1,154 @@
+#-*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy sql - see LICENSE for details
+# module gnrsqlprofile : Genro sql per-request instrumentation.
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Per-request sql instrumentation.
+
+A :class:`SqlRequestProfile` is started by :meth:`GnrSqlDb.startSqlProfile` and
+collects the statements executed by its thread: their number and time, the
+fetched rows and the time spent computing the python columns. The same statement
+executed many times with different parameters is reported as a N+1 pattern
+(typically a resolver or ``getRelatedRecord`` called in a loop).
+
+A :class:`SqlProfileSummary` aggregates the last profiles of a process."""
+
+import threading
+from collections import deque
+from time import time
+
+from gnr.core.gnrstring import boolean
+
+NPLUSONE_THRESHOLD = 10
+SUMMARY_SIZE = 500
+SQLTEXT_MAXLEN = 300
+
+def profilingEnabled(option):
+    """Return ``True`` unless the profile option (e.g. ``wsgi?sql_profile`` of a site)
+    is set to a false value: the requests are profiled by default
+    
+    :param option: the value of the option, ``None`` if it is missing"""
+    return option is None or boolean(option)
+
+def paramsKey(sqlargs):
+    """Return a hashable key of the query parameters (the ``env_`` ones excluded)"""
+    if not sqlargs:
+        return None
+    return hash(tuple(sorted([(k, repr(v)) for k, v in sqlargs.items() if not k.startswith('env_')])))
+
+class SqlRequestProfile(object):
+    """The sql statistics of a single request
+
+    :param name: the name of the request (e.g. the page path and the rpc method)
+    :param nplusone_threshold: executions of the same statement with different parameters
+                               that are reported as a N+1 pattern"""
+    def __init__(self, name=None, nplusone_threshold=NPLUSONE_THRESHOLD):
+        self.name = name
+        self.nplusone_threshold = nplusone_threshold
+        self.start_ts = time()
+        self.queries = 0
+        self.db_time = 0.
+        self.rows = 0
+        self.pycolumns_time = 0.
+        self.statements = dict()
+
+    def onExecute(self, sql, sqlargs=None, delta_time=0., dbtable=None):
+        self.queries += 1
+        self.db_time += delta_time
+        statement = self.statements.get(sql)
+        if statement is None:
+            statement = self.statements[sql] = dict(count=0, time=0., table=dbtable, params=set())
+        statement['count'] += 1
+        statement['time'] += delta_time
+        statement['params'].add(paramsKey(sqlargs))
+
+    def onFetch(self, rows):
+        self.rows += rows
+
+    def onPyColumns(self, delta_time):
+        self.pycolumns_time += delta_time
+
+    def repeatedStatements(self):
+        """Return the statements executed at least ``nplusone_threshold`` times with
+        different parameters, the slowest first"""
+        result = []
+        for sql, statement in self.statements.items():
+            if statement['count'] >= self.nplusone_threshold and len(statement['params']) > 1:
+                result.append(dict(table=statement['table'], count=statement['count'],
+                                   distinct=len(statement['params']),
+                                   time=round(statement['time'], 4), sql=sql[:SQLTEXT_MAXLEN]))
+        return sorted(result, key=lambda r: r['time'], reverse=True)
+
+    def result(self):
+        """Return a dict with the aggregates of the request"""
+        return dict(name=self.name, total_time=round(time() - self.start_ts, 4),
+                    queries=self.queries, statements=len(self.statements),
+                    db_time=round(self.db_time, 4), rows=self.rows,
+                    pycolumns_time=round(self.pycolumns_time, 4),
+                    n_plus_one=self.repeatedStatements())
+
+class SqlProfileSummary(object):
+    """A thread safe rolling summary of the last ``size`` request profiles of a process
+
+    :param size: the number of profiles kept"""
+    def __init__(self, size=SUMMARY_SIZE):
+        self.profiles = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        """Add the :meth:`SqlRequestProfile.result` of a request"""
+        with self._lock:
+            self.profiles.append(result)
+
+    def summary(self):
+        """Return a dict with an item for every request name: the number of requests,
+        the average and maximum of queries and db time, the fetched rows, the python
+        columns time and the N+1 statements found, the worst first"""
+        with self._lock:
+            profiles = list(self.profiles)
+        result = dict()
+        for profile in profiles:
+            item = result.get(profile['name'])
+            if item is None:
+                item = result[profile['name']] = dict(requests=0, queries=0, max_queries=0, db_time=0.,
+                                                      max_db_time=0., total_time=0., rows=0,
+                                                      pycolumns_time=0., n_plus_one=dict())
+            item['requests'] += 1
+            item['queries'] += profile['queries']
+            item['max_queries'] = max(item['max_queries'], profile['queries'])
+            item['db_time'] += profile['db_time']
+            item['max_db_time'] = max(item['max_db_time'], profile['db_time'])
+            item['total_time'] += profile['total_time']
+            item['rows'] += profile['rows']
+            item['pycolumns_time'] += profile['pycolumns_time']
+            for statement in profile['n_plus_one']:
+                repeated = item['n_plus_one'].setdefault(statement['sql'], dict(table=statement['table'],
+                                                                                requests=0, count=0))
+                repeated['requests'] += 1
+                repeated['count'] += statement['count']
+        for item in result.values():
+            requests = item.pop('requests')
+            item.update(requests=requests, avg_queries=round(float(item.pop('queries')) / requests, 1),
+                        avg_db_time=round(item.pop('db_time') / requests, 4),
+                        avg_total_time=round(item.pop('total_time') / requests, 4),
+                        max_db_time=round(item['max_db_time'], 4),
+                        pycolumns_time=round(item['pycolumns_time'], 4),
+                        n_plus_one=[dict(sql=sql, **v) for sql, v in item['n_plus_one'].items()])
+        return result
@@ -24,11 +24,13 @@
 #import weakref
 import os
 import re
+import hashlib
 
 from gnr.core import gnrstring
 from gnr.core.gnrlang import GnrObject,getUuid,uniquify
 from gnr.core.gnrdecorator import deprecated
 from gnr.core.gnrbag import Bag, BagCbResolver
+from gnr.core.gnrbagxml import BagFromXml, XmlOutputBag
 from gnr.core.gnrdict import dictExtract
 #from gnr.sql.gnrsql_exceptions import GnrSqlException,GnrSqlSaveException, GnrSqlApplicationException
 from gnr.sql.gnrsqldata import SqlRecord, SqlQuery
@@ -41,6 +43,9 @@ import threading
 __version__ = '1.0b'
 gnrlogger = logging.getLogger(__name__)
 
+XMLDUMP_ARRAYSIZE = 1000
+ENVPARAM_FINDER = re.compile(r"#ENV\(([^,)]+)(?:,([^),]+))?\)|:env_(\w+)")
+
 
 
 class RecordUpdater(object):
@@ -551,9 +556,34 @@ class SqlTable(GnrObject):
                 cache.setItem(pkey,result,virtual_columns_set=virtual_columns_set)
             return result,in_cache
         virtual_columns_set = set(virtual_columns.split(',')) if virtual_columns else set()
-        return self.tableCachedData('cachedRecord',recordFromCache,pkey=pkey,
+        topic = 'cachedRecord'
+        if self._sharedTableCache():
+            envKey = self._virtualColumnsEnvKey(virtual_columns_set)
+            if envKey is None:
+                return recordFromCache(cache=Bag(),pkey=pkey,virtual_columns_set=virtual_columns_set)[0]
+            if envKey:
+                topic = 'cachedRecord_%s' %hashlib.md5(repr(envKey)).hexdigest()
+        return self.tableCachedData(topic,recordFromCache,pkey=pkey,
                                 virtual_columns_set=virtual_columns_set)
 
+    def _virtualColumnsEnvKey(self,virtual_columns):
+        """Return the environment values used by ``virtual_columns`` as a sorted tuple
+        of ``(name,value)``. Return ``None`` if a column is computed by python code
+        (``py_method`` or ``sql_formula=True``), that could depend on the user"""
+        result = dict()
+        for name in virtual_columns:
+            column = self.model.virtual_columns[name]
+            if column is None:
+                continue
+            if column.py_method or column.sql_formula is True:
+                return
+            for m in ENVPARAM_FINDER.finditer(repr(column.attributes)):
+                for envname in m.groups():
+                    if envname:
+                        value = self.db.workdate if envname=='workdate' else self.db.currentEnv.get(envname)
+                        result[envname] = repr(value)
+        return tuple(sorted(result.items()))
+
     def findDuplicates(self,allrecords=True):
         duplicated = [r[0] for r in self.query(columns='$_duplicate_finder,count(*)',having='count(*)>1',group_by='$_duplicate_finder').fetch()]
         if not duplicated:
@@ -571,8 +601,20 @@ class SqlTable(GnrObject):
         return translator.prepareCondition(column, op, value, dtype, sqlArgs,tblobj=self)
 
     def tableCachedData(self,topic,cb,**kwargs):
-        currentPage = self.db.currentPage
+        """Return the data built by ``cb(cache=bag,**kwargs)``, that returns ``(data,in_cache)``.
+        The bag is kept in the process-wide ``db.tableCache`` and it is emptied when the table
+        is written by any process. Without the table cache, or if the page mirrors the data
+        on the client (``clientCachedRecord`` page option), it is kept in the page store
+        
+        :param topic: the name of the cached data (e.g. ``cachedRecord``)
+        :param cb: the callback that reads and fills the cache"""
+        currentPage = getattr(self.db,'currentPage',None)
         cacheKey = '%s.%s' %(topic,self.fullname)
+        tableCache = self.db.tableCache
+        if self._sharedTableCache():
+            return tableCache.cachedData(self.fullname,topic,cb,
+                                         storename=self.db.tableStorename(self),
+                                         **kwargs)
         if currentPage:
             with currentPage.pageStore() as store:
                 if store:
@@ -587,6 +629,14 @@ class SqlTable(GnrObject):
         return data
 
 
+    def _sharedTableCache(self):
+        currentPage = getattr(self.db,'currentPage',None)
+        return self.db.tableCache and not (currentPage and self._clientCachedTable(currentPage))
+
+    def _clientCachedTable(self,page):
+        pageOptions = getattr(page,'pageOptions',None) or dict()
+        return self.fullname in (pageOptions.get('clientCachedRecord') or '').split(',')
+
     def record(self, pkey=None, where=None,
                lazy=None, eager=None, mode=None, relationDict=None, ignoreMissing=False, virtual_columns=None,
                ignoreDuplicate=False, bagFields=True, joinConditions=None, sqlContextName=None,
@@ -1058,6 +1108,7 @@ class SqlTable(GnrObject):
     def empty(self):
         """TODO"""
         self.db.adapter.emptyTable(self)
+        self.db.tableChanged(self)
         
     def sql_deleteSelection(self, where=None,_pkeys=None, **kwargs):
         """Delete a selection from the table. It works only in SQL so no python trigger is executed
@@ -1069,6 +1120,7 @@ class SqlTable(GnrObject):
             _pkeys = [x[0] for x in todelete] if todelete else None
         if _pkeys:
             self.db.adapter.sql_deleteSelection(self, pkeyList=_pkeys)
+            self.db.tableChanged(self)
             
     #Jeff added the support to deleteSelection for passing no condition so that all records would be deleted
     def deleteSelection(self, condition_field=None, condition_value=None, excludeLogicalDeleted=False, excludeDraft=False,condition_op='=',
@@ -1217,6 +1269,17 @@ class SqlTable(GnrObject):
     def insertMany(self, records, **kwargs):
         self.db.insertMany(self, records, **kwargs)
 
+    def bulkInsert(self, records, triggers='batch', chunk_size=None, **kwargs):
+        """Insert many records in chunks, writing every chunk with a single statement
+        (``COPY`` on postgres). Return a dict with the number of inserted ``records``,
+        the ``seconds`` spent and the ``rate`` (records per second)
+        
+        :param records: an iterable of records
+        :param triggers: ``batch`` runs the insert triggers of every record of a chunk,
+                         ``none`` writes the records as they are
+        :param chunk_size: the number of records written at once"""
+        return self.db.bulkInsert(self, records, triggers=triggers, chunk_size=chunk_size, **kwargs)
+
     def raw_update(self,record=None,old_record=None,pkey=None,**kwargs):
         self.db.raw_update(self, record,old_record=old_record,pkey=pkey,**kwargs)
 
@@ -1717,22 +1780,30 @@ class SqlTable(GnrObject):
         return result
         
     
-    @deprecated
+    @deprecated()
     def xmlDump(self, path):
         """TODO
         
         :param path: TODO"""
         filepath = os.path.join(path, '%s_dump.xml' % self.name)
-        records = self.query(excludeLogicalDeleted=False,excludeDraft=False).fetch()
-        result = Bag()
-        
-        for r in records:
-            r = dict(r)
-            pkey = r.pop('pkey')
-            result['records.%s' % pkey.replace('.', '_')] = Bag(r)
-        result.toXml(filepath, autocreate=True)
+        if path and not os.path.exists(path):
+            os.makedirs(path)
+        query = self.query(excludeLogicalDeleted=False,excludeDraft=False)
+        cursor, rowsets = query.serverfetch(arraysize=XMLDUMP_ARRAYSIZE)
+        with XmlOutputBag(filepath, typeattrs=True, typevalue=True) as dump:
+            dumped = False
+            for rows in rowsets:
+                query.handlePyColumns(rows)
+                for r in rows:
+                    r = dict(r)
+                    pkey = r.pop('pkey')
+                    dump.output.write('\n' if dumped else '<records>')
+                    dump.addItemBag(('%s' % pkey).replace('.', '_'), Bag(r))
+                    dumped = True
+            if dumped:
+                dump.output.write('</records>')
     
-    @deprecated
+    @deprecated()
     def importFromXmlDump(self, path):
         """TODO
         
@@ -1741,11 +1812,12 @@ class SqlTable(GnrObject):
             filepath = path
         else:
             filepath = os.path.join(path, '%s_dump.xml' % self.name)
-        data = Bag(filepath)
-        if data:
-            for record in data['records'].values():
+        def records():
+            for node in BagFromXml().iterNodes(filepath, True, path='records'):
+                record = node.value
                 record.pop('_isdeleted')
-                self.insert(record)
+                yield record
+        self.bulkInsert(records())
 
     def dependenciesTree(self,records=None,history=None,ascmode=False):
         print 'dependencies from',self.fullname
@@ -1808,17 +1880,17 @@ class SqlTable(GnrObject):
             dest_tbl.empty()
         elif raw_insert and dest_tbl.countRecords()==0:
             insertOnly = True
-        for record in source_records:
-            record = dict(record)
-            if _converters:
-                for c in _converters:
-                    record = getattr(self,c)(record)
-            if insertOnly:
-                if raw_insert:
-                    dest_tbl.raw_insert(record)
-                else:
-                    dest_tbl.insert(record)
-            else:
+        def records():
+            for record in source_records:
+                record = dict(record)
+                if _converters:
+                    for c in _converters:
+                        record = getattr(self,c)(record)
+                yield record
+        if insertOnly:
+            dest_tbl.bulkInsert(records(), triggers='none' if raw_insert else 'batch')
+        else:
+            for record in records():
                 dest_tbl.insertOrUpdate(record)
     
     def copyToDbstore(self,pkey=None,dbstore=None,bagFields=True,empty_before=False,**kwargs):
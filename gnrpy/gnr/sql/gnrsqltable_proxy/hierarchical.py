@@ -20,11 +20,20 @@
 #License along with this library; if not, write to the Free Software
 #Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+from collections import defaultdict
 from gnr.core.gnrstring import encode36
 from gnr.core.gnrbag import Bag,BagResolver
 from gnr.core.gnrdict import dictExtract
 from gnr.core.gnrdecorator import extract_kwargs
 
+PRELOAD_CHUNKSIZE = 500
+
+def chunks(values, size=None):
+    size = size or PRELOAD_CHUNKSIZE
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
 class TableHandlerTreeResolver(BagResolver):
     classKwargs = {'cacheTime': 300,
                    'table':None,
@@ -40,6 +49,7 @@ class TableHandlerTreeResolver(BagResolver):
                    'related_kwargs':None,
                    '_isleaf':None,
                    'readOnly':False,
+                   'preload':None,
                    '_page':None}
     classArgs = ['table','parent_id']
 
@@ -56,20 +66,28 @@ class TableHandlerTreeResolver(BagResolver):
     def load(self):
         result = Bag()
         if self.related_kwargs:
-            for related_row in self.getRelatedChildren(self.parent_id):
-                r = dict(related_row)
-                pkey = r.pop('pkey',None)
-                result.setItem(pkey, None,
-                                child_count=0,
-                                 caption=r[self.relatedCaptionField],
-                                 pkey=pkey, treeIdentifier='%s_%s'%(self.parent_id, pkey),
-                                 node_class='tree_related',**r)
+            self.setRelatedChildren(result,self.parent_id,self.getRelatedChildren(self.parent_id))
         if not self._isleaf:
-            children = self.getChildren(self.parent_id)
-            if len(children):
-                self.setChildren(result,children)
+            if self.preload:
+                self.setSubtree(result)
+            else:
+                children = self.getChildren(self.parent_id)
+                if len(children):
+                    self.setChildren(result,children)
         return result
 
+    def setRelatedChildren(self,result,parent_id,related_rows):
+        for related_row in related_rows:
+            r = dict(related_row)
+            pkey = r.pop('pkey',None)
+            r.pop('_h_fkey',None)
+            r.pop('_h_alias_fkey',None)
+            result.setItem(pkey, None,
+                            child_count=0,
+                             caption=r[self.relatedCaptionField],
+                             pkey=pkey, treeIdentifier='%s_%s'%(parent_id, pkey),
+                             node_class='tree_related',**r)
+
     def getRelatedChildren(self,parent_id=None):
         related_tblobj = self.db.table(self.related_kwargs['table'])
         result = []
@@ -97,6 +115,47 @@ class TableHandlerTreeResolver(BagResolver):
                                             pkey=parent_id,**condition_kwargs).fetch()
         return result
 
+    def getRelatedChildrenByParent(self,parent_ids):
+        """Return the rows of the related table of many nodes grouped by node pkey,
+        reading them with one query every PRELOAD_CHUNKSIZE nodes
+        
+        :param parent_ids: the pkeys of the nodes"""
+        related_tblobj = self.db.table(self.related_kwargs['table'])
+        result = defaultdict(list)
+        related_kwargs = dict(self.related_kwargs)
+        includeAlias = related_kwargs.pop('includeAlias', None)
+        caption_field = self.relatedCaptionField
+        relation_path = self.related_kwargs['path']
+        if not relation_path.startswith('$') and not relation_path.startswith('@'):
+            relation_path = '$%s' %relation_path
+        columns = '%s,%s AS _h_fkey' %(self.related_kwargs.get('columns') or '*,$%s' %caption_field,relation_path)
+        condition = self.related_kwargs.get('condition')
+        condition_kwargs = dictExtract(related_kwargs,'condition_')
+        where = ' (%s IN :pkeys) ' % relation_path
+        if includeAlias:
+            tblobj = self.db.table(self.table)
+            aliasTableName = '%s_alias' %tblobj.fullname
+            aliasJoiner = related_tblobj.model.getJoiner(aliasTableName)
+            aliasRelationName = aliasJoiner['relation_name']
+            mainJoiner = tblobj.model.getJoiner(aliasTableName)
+            aliasFkey = mainJoiner.get('many_relation','').split('.')[-1]
+            where = "(%s) OR @%s.%s IN :pkeys"%(where, aliasRelationName, aliasFkey)
+            columns = '%s,@%s.%s AS _h_alias_fkey' %(columns,aliasRelationName, aliasFkey)
+        if condition:
+            where = '(%s) AND %s'%(where,condition)
+        for pkeys in chunks(parent_ids):
+            f = related_tblobj.query(where=where,columns=columns, _storename=self.dbstore,
+                                     pkeys=pkeys,**condition_kwargs).fetch()
+            pkeys = set(pkeys)
+            for r in f:
+                fkey = r['_h_fkey']
+                if fkey in pkeys:
+                    result[fkey].append(r)
+                alias_fkey = r['_h_alias_fkey'] if includeAlias else None
+                if alias_fkey in pkeys and alias_fkey != fkey:
+                    result[alias_fkey].append(r)
+        return result
+
     def getChildren(self,parent_id):
         tblobj = self.db.table(self.table)
         where = '$parent_id IS NULL'
@@ -104,8 +163,23 @@ class TableHandlerTreeResolver(BagResolver):
             where = '$id=:r_id'
         elif parent_id:
             where='$parent_id=:p_id'
+        caption_field = self.getCaptionField()
+        condition_kwargs = self.getConditionKwargs()
+        condition_pkeys = None
+        if self.condition:
+            condition_pkeys = self.getConditionPkeys()
+            where = ' ( %s ) AND ( $id IN :condition_pkeys ) ' %where
+        order_by = tblobj.attributes.get('order_by') or '$%s' %caption_field
+        columns = self.columns or '*'
+        q = tblobj.query(where=where,p_id=parent_id,r_id=self.root_id,columns='%s,$child_count,$%s' %(columns,caption_field),
+                         condition_pkeys=condition_pkeys,
+                         order_by=order_by,_storename=self.dbstore,**condition_kwargs)
+        return q.fetch()
+
+    def getCaptionField(self):
         caption_field = self.caption_field
         if not caption_field:
+            tblobj = self.db.table(self.table)
             if tblobj.attributes.get('hierarchical_caption_field'):
                 caption_field = tblobj.attributes['hierarchical_caption_field']
             elif tblobj.attributes['hierarchical'] != 'pkey':
@@ -113,20 +187,112 @@ class TableHandlerTreeResolver(BagResolver):
             else:
                 caption_field = tblobj.attributes.get('caption_field')
             self.caption_field = caption_field
+        return caption_field
+
+    def getConditionKwargs(self):
         condition_kwargs = self.condition_kwargs or dict()
         for k,v in condition_kwargs.items():
             condition_kwargs.pop(k)
             condition_kwargs[str(k)] = v
-        condition_pkeys = None
-        if self.condition:
-            condition_pkeys = self.getConditionPkeys()
-            where = ' ( %s ) AND ( $id IN :condition_pkeys ) ' %where
+        return condition_kwargs
+
+    def getSubtreeRows(self):
+        """Return the rows below the node of the resolver (or below the root), reading them
+        with a single query on the ``hierarchical_pkey``. If ``preload`` is a number only
+        that many levels are returned, plus one to know which nodes have children.
+        Return also the level of the first rows"""
+        tblobj = self.db.table(self.table)
+        caption_field = self.getCaptionField()
+        condition_kwargs = self.getConditionKwargs()
+        where = []
+        hpkey = None
+        base_level = 0
+        if self.root_id:
+            hpkey = tblobj.readColumns(columns='$hierarchical_pkey',pkey=self.root_id,_storename=self.dbstore)
+            base_level = hpkey.count('/') if hpkey else 0
+            where.append('($id=:r_id OR $hierarchical_pkey LIKE :h_prefix)')
+        elif self.parent_id:
+            hpkey = tblobj.readColumns(columns='$hierarchical_pkey',pkey=self.parent_id,_storename=self.dbstore)
+            base_level = hpkey.count('/')+1 if hpkey else 0
+            where.append('$hierarchical_pkey LIKE :h_prefix')
+        if self.preload is not True:
+            where.append('$hlevel<=:h_maxlevel')
         order_by = tblobj.attributes.get('order_by') or '$%s' %caption_field
         columns = self.columns or '*'
-        q = tblobj.query(where=where,p_id=parent_id,r_id=self.root_id,columns='%s,$child_count,$%s' %(columns,caption_field),
-                         condition_pkeys=condition_pkeys,
-                         order_by=order_by,_storename=self.dbstore,**condition_kwargs)
-        return q.fetch()
+        f = tblobj.query(where=' AND '.join(where) or None,r_id=self.root_id,h_prefix='%s/%%' %hpkey,
+                         h_maxlevel=base_level+int(self.preload)+1,
+                         columns='%s,$parent_id,$hierarchical_pkey,$%s' %(columns,caption_field),
+                         order_by=order_by,_storename=self.dbstore,**condition_kwargs).fetch()
+        if hpkey:
+            # LIKE treats the underscores of the pkeys as wildcards
+            prefix = '%s/' %hpkey
+            f = [r for r in f if r['hierarchical_pkey'].startswith(prefix) or r['pkey']==self.root_id]
+        if self.condition:
+            condition_pkeys = set(self.getConditionPkeys())
+            f = [r for r in f if r['pkey'] in condition_pkeys]
+        return f,base_level+1
+
+    def setSubtree(self,result):
+        """Build in memory the nodes below the node of the resolver from the rows of
+        :meth:`getSubtreeRows`. The nodes of the last preloaded level having children get
+        a lazy resolver, the rows of the related table are read with one query per level"""
+        rows,first_level = self.getSubtreeRows()
+        pkeyfield = self.db.table(self.table).pkey
+        children = defaultdict(list)
+        for r in rows:
+            children[r['parent_id']].append(r)
+        if self.root_id:
+            level_rows = [r for r in rows if r[pkeyfield]==self.root_id]
+        else:
+            level_rows = children[self.parent_id]
+        level = first_level
+        parents = [(result,self.parent_id,level_rows)]
+        while parents:
+            last_level = self.preload is not True and level>=first_level+int(self.preload)-1
+            related_children = {}
+            if self.related_kwargs:
+                related_children = self.getRelatedChildrenByParent([r[pkeyfield] for parent_bag,parent_id,level_rows in parents
+                                                                        for r in level_rows
+                                                                        if not (children.get(r[pkeyfield]) and last_level)])
+            next_parents = []
+            for parent_bag,parent_id,level_rows in parents:
+                for r in level_rows:
+                    record = dict(r)
+                    pkey = record[pkeyfield]
+                    node_children = children.get(pkey)
+                    child_count = len(node_children) if node_children else 0
+                    record['child_count'] = child_count
+                    value = None
+                    if node_children and last_level:
+                        value = TableHandlerTreeResolver(_page=self._page,table=self.table,
+                                                    parent_id=pkey,caption_field=self.caption_field,
+                                                    alt_pkey_field=self.alt_pkey_field,
+                                                    dbstore=self.dbstore,
+                                                    condition=self.condition,
+                                                    related_kwargs=self.related_kwargs,
+                                                    _condition_id=self._condition_id,columns=self.columns,
+                                                    preload=self.preload)
+                    elif node_children:
+                        value = Bag()
+                        self.setRelatedChildren(value,pkey,related_children.get(pkey,[]))
+                        next_parents.append((value,pkey,node_children))
+                    elif self.related_kwargs:
+                        related_rows = related_children.get(pkey)
+                        if related_rows:
+                            value = Bag()
+                            self.setRelatedChildren(value,pkey,related_rows)
+                            child_count = len(related_rows)
+                        elif not self.related_kwargs.get('_allowEmptyFolders'):
+                            continue
+                    parent_bag.setItem(pkey,value,
+                                    **self.applyOnTreeNodeAttr(caption=r[self.caption_field],
+                                            child_count=child_count,pkey=record.get(self.alt_pkey_field) if self.alt_pkey_field else (pkey or '_all_'),
+                                            parent_id=parent_id,
+                                            hierarchical_pkey=record['hierarchical_pkey'],
+                                            treeIdentifier=pkey,_record=record))
+            parents = next_parents
+            level += 1
+        return result
 
     def setChildren(self,result,children):
         pkeyfield = self.db.table(self.table).pkey
@@ -274,14 +440,20 @@ class HierarchicalHandler(object):
     def getHierarchicalData(self,caption_field=None,condition=None,
                             condition_kwargs=None,caption=None,
                             dbstore=None,columns=None,related_kwargs=None,
-                            resolved=False,parent_id=None,root_id=None,alt_pkey_field=None,**kwargs):
+                            resolved=False,parent_id=None,root_id=None,alt_pkey_field=None,preload=None,**kwargs):
+        """Return a Bag with the tree of the table. With ``preload`` the nodes are loaded with
+        one query per tree instead of one per node: ``True`` loads the whole tree, a number
+        that many levels at every expansion. A ``resolved`` tree is always preloaded"""
         b = Bag()
+        if resolved and preload is None:
+            preload = True
         caption = caption or self.tblobj.name_plural
         condition_kwargs = condition_kwargs or dict()
         condition_kwargs.update(dictExtract(kwargs,'condition_'))
         related_kwargs = related_kwargs or {}
         v = TableHandlerTreeResolver(_page=self,table=self.tblobj.fullname,caption_field=caption_field,condition=condition,dbstore=dbstore,columns=columns,related_kwargs=related_kwargs,
-                                                condition_kwargs=condition_kwargs,root_id=root_id,parent_id=parent_id,alt_pkey_field=alt_pkey_field)
+                                                condition_kwargs=condition_kwargs,root_id=root_id,parent_id=parent_id,alt_pkey_field=alt_pkey_field,
+                                                preload=preload)
         b.setItem('root',v,caption=caption,child_count=1,pkey='',treeIdentifier='_root_',table=self.tblobj.fullname,
                     search_method=self.tblobj.hierarchicalSearch,search_related_table=related_kwargs.get('table'),
                     search_related_path=related_kwargs.get('path'),search_related_caption_field=related_kwargs.get('caption_field'))
@@ -301,14 +473,18 @@ class HierarchicalHandler(object):
             return 
         pkeys = pkeys.split(',')
         pkey_field = alt_pkey_field or self.tblobj.pkey
+        f = []
         if not related_kwargs:
-            f = self.tblobj.query(where='$%s IN :pk' %pkey_field,pk=pkeys,columns='$hierarchical_pkey AS _hpath',_storename=dbstore).fetch()
+            for chunk in chunks(pkeys):
+                f.extend(self.tblobj.query(where='$%s IN :pk' %pkey_field,pk=chunk,columns='$hierarchical_pkey AS _hpath',
+                                           _storename=dbstore).fetch())
         else:
             related_table = self.db.table(related_kwargs['table'])
             relpkey =related_table.pkey
-            f = related_table.query(where='$%s IN :pk' %pkey_field,pk=pkeys,addPkeyColumn=True,
-                    columns='@%s.hierarchical_pkey AS _hpath,$%s' %(related_kwargs['path'],relpkey) ,
-                    _storename=dbstore).fetch()
+            for chunk in chunks(pkeys):
+                f.extend(related_table.query(where='$%s IN :pk' %pkey_field,pk=chunk,addPkeyColumn=True,
+                        columns='@%s.hierarchical_pkey AS _hpath,$%s' %(related_kwargs['path'],relpkey) ,
+                        _storename=dbstore).fetch())
             f = [dict(_hpath='%s/%s' %(r['_hpath'],r[relpkey]) ) for r in f]
         if parent_id:
             return ','.join([r['_hpath'].split(parent_id,1)[1][1:].replace('/','.') for r in f if r['_hpath']])
@@ -317,13 +493,18 @@ class HierarchicalHandler(object):
 
 
     def getAncestors(self,pkey=None,hierarchical_pkey=None,meToo=True,columns=None,order_by=None,**kwargs):
+        """Return the ancestors of a record. The pkeys of the ancestors are the steps of its
+        ``hierarchical_pkey``: they are read by pkey with a single query"""
         if not hierarchical_pkey:
             hierarchical_pkey = self.tblobj.readColumns(columns='$hierarchical_pkey' ,pkey=pkey)
-        p = hierarchical_pkey
-        where = ['( :p ILIKE $hierarchical_pkey || :suffix)']
-        if meToo:
-            where.append('( :p = $hierarchical_pkey )')
-        where =  ' OR '.join(where)
+        if not hierarchical_pkey:
+            return []
+        ancestors = hierarchical_pkey.split('/')
+        if not meToo:
+            ancestors = ancestors[:-1]
+            if not ancestors:
+                return []
         order_by= order_by or '$hlevel'
-        return self.tblobj.query(where=where,p=p,suffix='/%%',order_by=order_by,columns=columns,**kwargs).fetch()
+        return self.tblobj.query(where='$%s IN :ancestors' %self.tblobj.pkey,ancestors=ancestors,
+                                 order_by=order_by,columns=columns,**kwargs).fetch()
 
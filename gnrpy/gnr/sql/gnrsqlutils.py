@@ -131,6 +131,7 @@ class SqlModelChecker(object):
             self.actual_schemata = self.db.adapter.listElements('schemata')
         except GnrNonExistingDbException, exc:
             self.actual_schemata = []
+            self.catalog = None
             self.actual_tables = {}
             self.actual_views = {}
             self.actual_relations = {}
@@ -138,15 +139,13 @@ class SqlModelChecker(object):
             self.changes.append(self.db.adapter.createDbSql(exc.dbname, 'UNICODE'))
             create_db = True
         if not create_db:
-            self.actual_tables = dict(
-                    [(k, self.db.adapter.listElements('tables', schema=k)) for k in self.actual_schemata])
-            self.actual_views = dict(
-                    [(k, self.db.adapter.listElements('views', schema=k)) for k in self.actual_schemata])
-            actual_relations = self.db.adapter.relations()
+            self.catalog = self.db.adapter.getCatalog(self.actual_schemata)
+            self.actual_tables = self.catalog['tables']
+            self.actual_views = self.catalog['views']
             self.actual_relations = {}
-            for r in actual_relations:
+            for r in self.catalog['relations']:
                 self.actual_relations.setdefault('%s.%s' % (r[1], r[2]), []).append(r)
-            self.unique_constraints = self.db.adapter.getTableContraints()
+            self.unique_constraints = self.catalog['constraints']
         for pkg in self.db.packages.values():
             #print '----------checking %s----------'%pkg.name
             self._checkPackage(pkg)
@@ -217,13 +216,13 @@ class SqlModelChecker(object):
         
         :param tbl: the :ref:`table` object"""
         tablechanges = []
-        tableindexes = self.db.adapter.getIndexesForTable(schema=tbl.sqlschema, table=tbl.sqlname)
+        tableindexes = self.catalog['indexes'].get((tbl.sqlschema, tbl.sqlname), [])
         dbindexes = dict([(c['name'], c) for c in tableindexes])
         columnsindexes = dict([(c['columns'], c) for c in tableindexes])
         tblattr = tbl.attributes
         if tbl.columns:
             dbcolumns = dict(
-                    [(c['name'], c) for c in self.db.adapter.getColInfo(schema=tbl.sqlschema, table=tbl.sqlname)])
+                    [(c['name'], c) for c in self.catalog['columns'].get((tbl.sqlschema, tbl.sqlname), [])])
             for col in tbl.columns.values():
                 if col.sqlname in dbcolumns:
                     #it there's the column it should check if has been edited.
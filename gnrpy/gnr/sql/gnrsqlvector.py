@@ -0,0 +1,295 @@
+#-*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy sql - see LICENSE for details
+# module gnrsqlvector : NumPy execution of the SqlSelection operations.
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Array based execution of :meth:`SqlSelection.sort() <gnr.sql.gnrsqldata.SqlSelection.sort>`
+and :meth:`~gnr.sql.gnrsqldata.SqlSelection.totalize`.
+
+NumPy is optional: :func:`useVector` is ``False`` when it is not installed or when the
+selection has less than :data:`VECTOR_THRESHOLD` rows. Every function returns ``None``
+when the data cannot be handled (e.g. unhashable values) and the caller falls back
+to the row by row implementation. The results are identical to the ones of
+:func:`gnr.core.gnrlist.sortByItem` and :meth:`gnr.core.gnranalyzingbag.AnalyzingBag.analyze`."""
+
+try:
+    import numpy
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+from gnr.core.gnrbag import Bag
+
+VECTOR_THRESHOLD = 20000
+_INT64_LIMIT = 2 ** 62
+_EXACT_FLOAT_LIMIT = 2 ** 53
+
+def useVector(rows):
+    """Return ``True`` if the vectorized implementation should be used for the given rows
+
+    :param rows: the rows of the selection"""
+    return HAS_NUMPY and len(rows) >= VECTOR_THRESHOLD
+
+def safeCmp(a, b):
+    """The comparison of :func:`~gnr.core.gnrlist.sortByItem`: ``None`` is lower than any value"""
+    if a is None:
+        if b is None:
+            return 0
+        return -1
+    elif b is None:
+        return 1
+    return cmp(a, b)
+
+def sortCriteria(args):
+    """Decode the sort arguments as :func:`~gnr.core.gnrlist.sortByItem` does and return a list
+    of ``(column, reverse, caseInsensitive)`` in the order they must be applied
+
+    :param args: the sort arguments (e.g. ``'name'``, ``'date:d'``, ``'name:a*'``)"""
+    criteria = []
+    rev = False
+    for crit in list(args):
+        caseInsensitive = False
+        if ':' in crit:
+            crit, direction = crit.split(':', 1)
+            if direction.endswith('*'):
+                direction = direction[0:-1]
+                caseInsensitive = True
+            if direction.lower() in['d', 'desc', 'descending']:
+                rev = not rev
+        criteria = [(crit, rev, caseInsensitive)] + criteria
+    return criteria
+
+def rankCodes(values):
+    """Return an array with the rank of every value in the :func:`safeCmp` order. Equal
+    values get the same rank. Return ``None`` if the values are not hashable
+
+    :param values: a list of values"""
+    try:
+        distinct = set(values)
+    except TypeError:
+        return
+    ranks = {}
+    rank = -1
+    prev = None
+    for k, v in enumerate(sorted(distinct, cmp=safeCmp)):
+        if k == 0 or safeCmp(prev, v):
+            rank += 1
+        ranks[v] = rank
+        prev = v
+    return numpy.fromiter((ranks[v] for v in values), dtype=numpy.int64, count=len(values))
+
+def sortPermutation(rows, args):
+    """Return the list of the row indexes in the order given by ``args``
+
+    :param rows: the rows to sort
+    :param args: the sort arguments of :func:`~gnr.core.gnrlist.sortByItem`"""
+    perm = numpy.arange(len(rows))
+    for crit, rev, caseInsensitive in sortCriteria(args):
+        if caseInsensitive:
+            values = [(r.get(crit, None) or '').lower() for r in rows]
+        else:
+            values = [r.get(crit, None) for r in rows]
+        codes = rankCodes(values)
+        if codes is None:
+            return
+        perm = perm[numpy.argsort(codes[perm], kind='mergesort')]
+        if rev:
+            perm = perm[::-1]
+    return perm.tolist()
+
+def _numericKind(values):
+    kind = int
+    for v in values:
+        t = type(v)
+        if t is float:
+            kind = float
+        elif t is not int and t is not bool:
+            return
+    return kind
+
+def _groupLabel(value):
+    if value is None:
+        return ''
+    if not isinstance(value, basestring):
+        value = str(value)
+    return value
+
+class _Level(object):
+    def __init__(self, groups, first, parents, labels):
+        self.groups = groups
+        self.first = first
+        self.parents = parents
+        self.labels = labels
+
+def _groupLevels(rows, group_by):
+    n = len(rows)
+    parent = numpy.zeros(n, dtype=numpy.int64)
+    levels = []
+    for gr in group_by:
+        if gr.startswith('*'):
+            labels = [gr[1:].replace('.', '_') or '_']
+            labelcodes = numpy.zeros(n, dtype=numpy.int64)
+        else:
+            labels = []
+            labelindex = {}
+            rawcodes = {}
+            codes = []
+            try:
+                for r in rows:
+                    v = r[gr]
+                    rawkey = (type(v), v)
+                    code = rawcodes.get(rawkey)
+                    if code is None:
+                        label = _groupLabel(v).replace('.', '_') or '_'
+                        code = labelindex.get(label)
+                        if code is None:
+                            code = labelindex[label] = len(labels)
+                            labels.append(label)
+                        rawcodes[rawkey] = code
+                    codes.append(code)
+            except TypeError:
+                return
+            labelcodes = numpy.array(codes, dtype=numpy.int64)
+        nlabels = len(labels)
+        combined = parent * nlabels + labelcodes
+        uniq, first, inverse = numpy.unique(combined, return_index=True, return_inverse=True)
+        levels.append(_Level(inverse, first, (uniq // nlabels).tolist(),
+                             [labels[c] for c in (uniq % nlabels).tolist()]))
+        parent = inverse
+    return levels
+
+def _groupSums(values, groups, ngroups, members):
+    kind = _numericKind(values)
+    if kind is not None:
+        arr = numpy.array(values, dtype=numpy.float64 if kind is float else numpy.int64)
+        if kind is int and (not len(arr) or numpy.abs(arr).max() * len(arr) < _INT64_LIMIT):
+            sums = numpy.zeros(ngroups, dtype=numpy.int64)
+            numpy.add.at(sums, groups, arr)
+            return [int(s) for s in sums]
+        if kind is float:
+            isfloat = numpy.array([type(v) is float for v in values], dtype=numpy.bool_)
+            if numpy.abs(arr[~isfloat]).sum() < _EXACT_FLOAT_LIMIT:
+                sums = numpy.bincount(groups, weights=arr, minlength=ngroups)
+                hasfloat = numpy.bincount(groups, weights=isfloat, minlength=ngroups) > 0
+                return [float(s) if f else int(s) for s, f in zip(sums, hasfloat)]
+    result = []
+    for rowlist in members:
+        tt = 0
+        for j in rowlist:
+            tt = tt + values[j]
+        result.append(tt)
+    return result
+
+def analyze(bag, rows, group_by=None, sum=None, collect=None, keep=None, distinct=None,
+            key=None, captionCb=None, collectIdx=True):
+    """Fill the empty :class:`~gnr.core.gnranalyzingbag.AnalyzingBag` ``bag`` as its ``analyze``
+    method does. Return ``None`` if the vectorized implementation cannot be used
+
+    :param bag: the AnalyzingBag
+    :param rows: the rows of the selection
+    :param group_by: the group columns
+    :param sum: the columns to total
+    :param collect: the columns whose values are collected
+    :param keep: the columns whose first value is kept
+    :param distinct: the columns whose distinct values are collected
+    :param key: the column that identifies a row. If ``None``, the row index is used
+    :param captionCb: a callback for the captions: it is not supported
+    :param collectIdx: boolean. If ``True``, collect the keys of the rows of every group"""
+    if captionCb or len(bag) or not group_by:
+        return
+    if not all([isinstance(gr, basestring) for gr in group_by]):
+        return
+    levels = _groupLevels(rows, group_by)
+    if levels is None:
+        return
+    if key is None:
+        keys = range(len(rows))
+    else:
+        keys = [r[key] for r in rows]
+    columns = dict()
+    for fld in set((sum or []) + (collect or []) + (keep or []) + (distinct or [])):
+        columns[fld] = [r[fld] for r in rows]
+    if sum:
+        for fld in sum:
+            columns['sum_%s' % fld] = [r.get(fld, 0) or 0 for r in rows]
+    levelattrs = []
+    for level in levels:
+        ngroups = len(level.labels)
+        order = numpy.argsort(level.groups, kind='mergesort')
+        bounds = numpy.cumsum(numpy.bincount(level.groups, minlength=ngroups)).tolist()
+        order = order.tolist()
+        members = [order[start:stop] for start, stop in zip([0] + bounds[:-1], bounds)]
+        #attributes are listed in the order analyze sets them
+        attrs = [list() for g in range(ngroups)]
+        if collectIdx:
+            counts = []
+            for attr, rowlist in zip(attrs, members):
+                idx = set([keys[j] for j in rowlist])
+                counts.append(len(idx))
+                attr.extend([('idx', idx), ('count', len(idx))])
+        else:
+            counts = [len(m) for m in members]
+            for attr, count in zip(attrs, counts):
+                attr.append(('count', count))
+        if sum is not None:
+            for fld in sum:
+                sums = _groupSums(columns['sum_%s' % fld], level.groups, ngroups, members)
+                for attr, tt, count in zip(attrs, sums, counts):
+                    attr.extend([('sum_%s' % fld, tt), ('avg_%s' % fld, float(tt / count))])
+        if collect is not None:
+            for fld in collect:
+                values = columns[fld]
+                for attr, rowlist in zip(attrs, members):
+                    attr.append(('collect_%s' % fld, [values[j] for j in rowlist]))
+        if distinct is not None:
+            for fld in distinct:
+                values = columns[fld]
+                for attr, rowlist in zip(attrs, members):
+                    fldset = set([values[j] for j in rowlist])
+                    attr.extend([('dist_%s' % fld, fldset), ('count_%s' % fld, len(fldset))])
+        if keep is not None:
+            for fld in keep:
+                values = columns[fld]
+                for attr, rowlist in zip(attrs, members):
+                    value = None
+                    for j in rowlist:
+                        value = values[j]
+                        if value:
+                            break
+                    attr.append(('k_%s' % fld, value))
+        levelattrs.append(attrs)
+    events = []
+    for k, level in enumerate(levels):
+        events.extend([(first, k, g) for g, first in enumerate(level.first.tolist())])
+    events.sort()
+    nodes = [dict() for level in levels]
+    for first, k, g in events:
+        level = levels[k]
+        currbag = nodes[k - 1][level.parents[g]].value if k else bag
+        label = level.labels[g]
+        bagnode = currbag.getNode(label, autocreate=True)
+        bagnode.setAttr(_pkey=bag.nodeCounter)
+        bagnode.value = Bag()
+        attr = bagnode.getAttr()
+        for attrname, value in levelattrs[k][g]:
+            attr[attrname] = value
+        bagnode.setAttr(caption=label)
+        nodes[k][g] = bagnode
+    return bag
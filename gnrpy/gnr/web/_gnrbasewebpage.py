@@ -204,6 +204,7 @@ class GnrBaseWebPage(GnrObject):
         :param name: TODO"""
         path = self.pageLocalDocument(name)
         selection.freeze(path, autocreate=True,**kwargs)
+        self.app.dropPagedSelection(name)
         return path
 
     def freezeSelectionUpdate(self,selection):
@@ -220,6 +221,8 @@ class GnrBaseWebPage(GnrObject):
         if isinstance(dbtable, basestring):
             dbtable = self.db.table(dbtable)
         selection = self.db.unfreezeSelection(self.pageLocalDocument(name,page_id=page_id))
+        if selection is None:
+            selection = self.app.freezePagedSelection(name, page_id=page_id)
         if dbtable and selection is not None:
             assert dbtable == selection.dbtable, 'unfrozen selection does not belong to the given table'
         return selection
@@ -228,7 +231,10 @@ class GnrBaseWebPage(GnrObject):
         assert name, 'name is mandatory'
         if isinstance(dbtable, basestring):
             dbtable = self.db.table(dbtable)
-        return self.db.freezedPkeys(self.pageLocalDocument(name,page_id=page_id))
+        fpath = self.pageLocalDocument(name,page_id=page_id)
+        if not os.path.exists('%s_pkeys.pik' % fpath):
+            self.app.freezePagedSelection(name, page_id=page_id)
+        return self.db.freezedPkeys(fpath)
 
     @public_method
     def getUserSelection(self, selectionName=None, selectedRowidx=None, filterCb=None, columns=None,
@@ -6,9 +6,11 @@
 #Created by Francesco Porcari on 2010-10-16.
 #Copyright (c) 2011 Softwell. All rights reserved.
 
+import itertools
+
 from gnr.web.batch.btcbase import BaseResourceBatch
 from gnr.core.gnrxls import XlsWriter
-from gnr.core.gnrstring import toText
+from gnr.core.gnrstring import toTextColumn, TEXT_CHUNK_SIZE
 
 class CsvWriter(object):
     """docstring for CsVWriter"""
@@ -34,7 +36,13 @@ class CsvWriter(object):
         return txt
 
     def writeRow(self, row, separator='\t'):
-        self.result.append(separator.join([self.cleanCol(toText(row.get(col),locale=self.locale), self.coltypes[col]) for col in self.columns]))
+        self.writeRows([row], separator=separator)
+
+    def writeRows(self, rows, separator='\t'):
+        columns = [[self.cleanCol(txt, self.coltypes[col]) for txt in toTextColumn([row.get(col) for row in rows], locale=self.locale)]
+                   for col in self.columns]
+        lines = zip(*columns) if columns else [()] * len(rows)
+        self.result.extend([separator.join(line) for line in lines])
 
     def workbookSave(self):
         f = open(self.filepath, 'w')
@@ -114,8 +122,12 @@ class BaseResourceExport(BaseResourceBatch):
 
     def do(self):
         self.writer.writeHeaders()
-        for row in self.data:
-            self.writer.writeRow(row)
+        data = iter(self.data)
+        while True:
+            rows = list(itertools.islice(data, TEXT_CHUNK_SIZE))
+            if not rows:
+                break
+            self.writer.writeRows(rows)
         self.post_process()
 
     def post_process(self):
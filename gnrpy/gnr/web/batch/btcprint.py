@@ -8,6 +8,7 @@
 
 from gnr.web.batch.btcbase import BaseResourceBatch
 from gnr.core.gnrstring import slugify
+from gnr.core.gnrprinthandler import PdfRenderPool
 import os
 
 
@@ -23,6 +24,7 @@ class BaseResourcePrint(BaseResourceBatch):
     templates = '' #CONTROLLARE
     batch_print_modes = ['pdf','server_print','mail_pdf','mail_deliver']
     batch_mail_modes = ['mail_pdf','mail_deliver']
+    pdf_pool_size = None # converters running at the same time: None for the number of cpus, 0 to convert serially
     def __init__(self, *args, **kwargs):
         super(BaseResourcePrint, self).__init__(**kwargs)
         batch_print_modes = self.db.application.getPreference('.print.modes',pkg='sys')
@@ -60,14 +62,35 @@ class BaseResourcePrint(BaseResourceBatch):
         pkeyfield = self.tblobj.pkey
         if not self.get_selection():
             return
-        for k,record in self.btc.thermo_wrapper(records, maximum=len(self.get_selection()),enum=True ,**thermo_s):
-            self.print_record(record=record, thermo=thermo_r, storagekey=record[pkeyfield],idx=k)
+        pool = None
+        if self.htmlMaker and self.pdf_make and self.pdf_pool_size != 0:
+            pool = self.htmlMaker.pdf_pool = PdfRenderPool(size=self.pdf_pool_size)
+        try:
+            for k,record in self.btc.thermo_wrapper(records, maximum=len(self.get_selection()),enum=True ,**thermo_s):
+                self.print_record(record=record, thermo=thermo_r, storagekey=record[pkeyfield],idx=k)
+            if pool:
+                pool.join()
+        except:
+            if pool:
+                pool.terminate()
+            raise
+        finally:
+            if pool:
+                self.htmlMaker.pdf_pool = None
 
     def print_record(self, record=None, thermo=None, storagekey=None,idx=None):
         result = self.do_print_record(record=record)
-        self.onRecordExit(record)
-        if result:
-            self.storeResult(storagekey, result, record, filepath=getattr(self.htmlMaker,'filepath',result))
+        filepath = getattr(self.htmlMaker,'filepath',result)
+        def onRecordDone():
+            self.onRecordExit(record)
+            if result:
+                self.storeResult(storagekey, result, record, filepath=filepath)
+        pool = getattr(self.htmlMaker, 'pdf_pool', None)
+        if pool and result:
+            #the pdf may be still converted by the pool
+            pool.whenDone(result, onRecordDone)
+        else:
+            onRecordDone()
 
     def do_print_record(self,record=None,idx=None,thermo=None):
         result = None
@@ -75,6 +98,9 @@ class BaseResourcePrint(BaseResourceBatch):
             self.htmlMaker.record = record
             result = self.htmlMaker.getPdfPath()
             self.htmlMaker.filepath = result
+            pool = getattr(self.htmlMaker, 'pdf_pool', None)
+            if pool:
+                pool.waitFor(result)
             if not os.path.isfile(result):
                 result = None
         if not result:
@@ -32,6 +32,7 @@ from tornado import gen,locks
 import tornado.websocket as websocket
 import tornado.ioloop
 import signal
+import threading
 from tornado.netutil import bind_unix_socket
 from tornado.tcpserver import TCPServer
 from tornado.httpserver import HTTPServer
@@ -40,7 +41,7 @@ from gnr.app.gnrconfig import gnrConfigPath
 from gnr.core.gnrbag import Bag,TraceBackResolver
 from gnr.web.gnrwsgisite_proxy.gnrwebsockethandler import AsyncWebSocketHandler
 from gnr.web.gnrwsgisite import GnrWsgiSite
-from gnr.core.gnrstring import fromJson
+from gnr.core.gnrstring import fromJson,toJson
 from tornado import version_info
 
 if version_info[0]>=4 and version_info[1]>=2:
@@ -50,6 +51,20 @@ else:
 
 MAX_WAIT_SECONDS_BEFORE_SHUTDOWN = 3
     
+def typedJson(catalog,value):
+    """Return ``value`` ready for a json websocket frame: the dicts are kept (the client
+    reads their ``<key>_attr`` items as the attributes of ``key``), a Bag is sent as xml
+    and the other values as typed text"""
+    if value is None:
+        return None
+    if isinstance(value,dict):
+        return dict([(k,typedJson(catalog,v)) for k,v in value.items()])
+    if isinstance(value,Bag):
+        return '%s::X' %value.toXml(unresolved=True)
+    if isinstance(value,basestring):
+        return '%s::T' %value if '::' in value or not value else value
+    return catalog.asTypedText(value)
+
 def threadpool(func):
     func._executor='threadpool'
     return func
@@ -264,7 +279,7 @@ class GnrWebSocketHandler(websocket.WebSocketHandler,GnrBaseHandler):
                     #result.add_done_callback(lambda f: self.tornado_future_result(f,result_token=result_token))
                     #yield None
             if result_token:
-                result = Bag(dict(token=result_token,envelope=result)).toXml(unresolved=True)
+                result = toJson(dict(token=result_token,envelope=typedJson(self.server.gnrapp.catalog,result)))
             if result is not None:
                 self.write_message(result)
 
@@ -342,11 +357,11 @@ class GnrWebSocketHandler(websocket.WebSocketHandler,GnrBaseHandler):
             except Exception, e:
                 result = TraceBackResolver()()
                 error=str(e)
-        envelope=Bag()
-        
-        envelope.setItem('data',result,_attributes=resultAttrs, _server_time=time.time()-_time_start)
+        data_attr = dict(resultAttrs or {})
+        data_attr['_server_time'] = time.time()-_time_start
+        envelope = dict(data=result,data_attr=data_attr)
         if error:
-            envelope.setItem('error',error)  
+            envelope['error'] = error
         return envelope        
         #result=Bag(dict(token=result_token,envelope=envelope))
         #return result.toXml(unresolved=True)
@@ -401,6 +416,8 @@ class SharedObject(object):
         self.autoLoad=autoLoad
         self.changes=False
         self.dbSaveKw=dbSaveKw
+        self.pending_changes = []
+        self._pending_lock = threading.Lock()
         self.onInit(**kwargs)
 
 
@@ -543,8 +560,7 @@ class SharedObject(object):
     @lockedCoroutine
     def datachange(self,page_id=None,path=None,value=None,attr=None,evt=None,fired=None,**kwargs):
         if fired:
-            data = Bag(dict(value=value,attr=attr,path=path,shared_id=self.shared_id,evt=evt,fired=fired))
-            self.broadcast(command='som.sharedObjectChange',data=data,from_page_id=page_id)
+            self.queueChange(path=path,value=value,attr=attr,evt=evt,fired=fired,from_page_id=page_id)
         else:
             path = 'root' if not path else 'root.%s' %path
             if evt=='del':
@@ -560,9 +576,45 @@ class SharedObject(object):
         if evt=='ins' or evt=='del':
             plist = plist+[node.label]
         path = '.'.join(plist)
-        data = Bag(dict(value=node.value,attr=node.attr,path=path,shared_id=self.shared_id,evt=evt))
-        from_page_id = reason
-        self.broadcast(command='som.sharedObjectChange',data=data,from_page_id=from_page_id)
+        self.queueChange(path=path,value=node.value,attr=node.attr,evt=evt,from_page_id=reason)
+
+    def queueChange(self,path=None,value=None,attr=None,evt=None,fired=None,from_page_id=None):
+        """Add a change to the ones sent to the subscribers at the next tick of the loop.
+        The value is serialized now, so later changes of the same Bag do not alter it:
+        an update replaces the previous one only if it is the last queued change"""
+        catalog = self.server.gnrapp.catalog
+        change = dict(path=path,evt=evt,value=typedJson(catalog,value),
+                      attr=typedJson(catalog,dict(attr)) if attr else None,
+                      from_page_id=from_page_id)
+        if fired:
+            change['fired'] = True
+        with self._pending_lock:
+            pending = self.pending_changes
+            if pending and evt=='upd' and not fired:
+                last = pending[-1]
+                if last['evt']=='upd' and not last.get('fired') and last['path']==path \
+                        and last['from_page_id']==from_page_id:
+                    pending[-1] = change
+                    return
+            pending.append(change)
+            if len(pending)==1:
+                self.server.io_loop.add_callback(self.flushChanges)
+
+    def flushChanges(self):
+        """Send the queued changes as a single frame, serialized once for all the subscribers.
+        The clients skip the changes coming from their own page"""
+        with self._pending_lock:
+            changes,self.pending_changes = self.pending_changes,[]
+        if not changes:
+            return
+        frame = toJson(dict(command='som.sharedObjectChanges',
+                            data=dict(shared_id=self.shared_id,changes=changes)))
+        origins = set([c['from_page_id'] for c in changes])
+        channels = self.server.channels
+        for p in self.subscribed_pages.keys():
+            channel = channels.get(p)
+            if channel and origins!=set([p]):
+                channel.write_message(frame)
 
                 
     def onPathFocus(self, page_id=None,curr_path=None,focused=None):
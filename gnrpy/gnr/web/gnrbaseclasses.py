@@ -175,6 +175,7 @@ class TableScriptToHtml(BagToHtml):
     cached = None
     css_requires = 'print_stylesheet'
     client_locale = False
+    pdf_pool = None
 
 
     def __init__(self, page=None, resource_table=None, **kwargs):
@@ -209,7 +210,7 @@ class TableScriptToHtml(BagToHtml):
         if not pdf:
             return html
         
-        self.writePdf(docname=self.getDocName())
+        self.writePdf(docname=self.getDocName(), pool=None if downloadAs else self.pdf_pool)
         if downloadAs:
             with open(self.pdfpath, 'rb') as f:
                 result = f.read()
@@ -223,12 +224,12 @@ class TableScriptToHtml(BagToHtml):
         return os.path.splitext(os.path.basename(self.filepath))[0]
 
     @extract_kwargs(pdf=True)
-    def writePdf(self,filepath=None, pdfpath=None,docname=None,pdf_kwargs=None,**kwargs):
+    def writePdf(self,filepath=None, pdfpath=None,docname=None,pdf_kwargs=None,pool=None,**kwargs):
         self.pdfpath = pdfpath or self.getPdfPath('%s.pdf' % docname, autocreate=-1)
         pdf_kw = dict([(k[10:],getattr(self,k)) for k in dir(self) if k.startswith('htmltopdf_')])
         pdf_kw.update(pdf_kwargs)
         self.print_handler.htmlToPdf(filepath or self.filepath, self.pdfpath, orientation=self.orientation(), page_height=self.page_height, 
-                                        page_width=self.page_width,pdf_kwargs=pdf_kw)
+                                        page_width=self.page_width,pdf_kwargs=pdf_kw,pool=pool)
 
     def get_css_requires(self):
         """TODO"""
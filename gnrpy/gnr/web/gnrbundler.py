@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy web - see LICENSE for details
+# module gnrbundler : build time bundles of the js and css files of the pages
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Bundles of the js and css files served by the pages, built offline by ``gnrbundle``.
+
+Every bundle is named after the hash of its content, so its url never changes and it can be
+cached forever. A ``.gz`` sibling (and a ``.br`` one, if brotli is installed and requested)
+is written next to it. The manifest maps the list of the source files of a bundle to its
+url: the pages look it up with :meth:`BundleManifest.url` and use the bundle only if the
+source files have not changed since it was built."""
+
+import os
+import re
+import gzip
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from gnr.core.gnrstring import toJson, fromJson
+from gnr.web.jsmin import jsmin
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+logger = logging.getLogger(__name__)
+
+BUNDLES_FOLDER = ('_static', '_bundles')
+MANIFEST_NAME = 'manifest.json'
+PRECOMPRESS_EXTENSIONS = ('js', 'css', 'html', 'svg', 'json', 'xml', 'txt')
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+def bundleKey(files):
+    """Return the key of a list of source files in the manifest
+
+    :param files: the paths of the source files"""
+    return hashlib.md5('\n'.join(files)).hexdigest()
+
+def fileStamp(path):
+    """Return the modification time and the size of a file, or ``None`` if it is missing"""
+    try:
+        stats = os.stat(path)
+    except OSError:
+        return None
+    return [int(stats.st_mtime), stats.st_size]
+
+def writeCompressed(path, brotli_level=None):
+    """Write the ``.gz`` sibling of a file (and the ``.br`` one with *brotli_level*).
+    The gzip header has no timestamp, so the same content gives the same file"""
+    with open(path, 'rb') as f:
+        content = f.read()
+    gzpath = '%s.gz' % path
+    with open(gzpath, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=9, mtime=0) as gz:
+            gz.write(content)
+    shutil.copystat(path, gzpath)
+    if brotli_level and HAS_BROTLI:
+        brpath = '%s.br' % path
+        with open(brpath, 'wb') as br:
+            br.write(brotli.compress(content, quality=brotli_level))
+        shutil.copystat(path, brpath)
+
+
+class BundleManifest(object):
+    """The manifest of the bundles of a site, read at the first lookup and read again
+    when ``gnrbundle`` writes a new one.
+
+    :param site: the site"""
+    def __init__(self, site):
+        self.site = site
+        self.folder = site.getStatic('site').path(*BUNDLES_FOLDER)
+        self.path = os.path.join(self.folder, MANIFEST_NAME)
+        self._bundles = None
+        self._stamp = None
+
+    @property
+    def bundles(self):
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime, stat.st_ino, stat.st_size)
+        except OSError:
+            stamp = None
+        if self._bundles is None or stamp != self._stamp:
+            bundles = {}
+            if stamp:
+                with open(self.path) as f:
+                    bundles = fromJson(f.read()) or {}
+            self._bundles = bundles
+            self._stamp = stamp
+        return self._bundles
+
+    def reload(self):
+        self._bundles = None
+
+    def url(self, files):
+        """Return the url of the bundle of a list of source files, or ``None`` if there is
+        no bundle for them or one of them has changed after the bundle was built
+
+        :param files: the paths of the source files, in the order they are served"""
+        if not files or not self.bundles:
+            return
+        bundle = self.bundles.get(bundleKey(files))
+        if not bundle:
+            return
+        for path, stamp in bundle['files']:
+            if fileStamp(path) != stamp:
+                logger.warning('Bundle %s is stale: %s has changed', bundle['name'], path)
+                return
+        return self.site.getStatic('site').url(*(BUNDLES_FOLDER + (bundle['name'],)))
+
+
+class AssetBundler(object):
+    """Build the bundles of the js and css files of a site and their manifest.
+
+    :param site: the site
+    :param brotli_level: if given (and brotli is installed) write also the ``.br`` files"""
+    def __init__(self, site, brotli_level=None):
+        self.site = site
+        self.brotli_level = brotli_level
+        self.folder = site.getStatic('site').path(*BUNDLES_FOLDER)
+        self.bundles = {}
+        self._static_roots = None
+
+    def build(self, precompress_trees=False):
+        """Build the bundle of the genro js and css and the bundles of the requires of every page,
+        then write the manifest
+
+        :param precompress_trees: write also the ``.gz`` siblings of the files of the gnrjs and dojo trees"""
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.bundleFrontend(self.site.config['dojo?version'] or '11', self.site.config['gnrjs?version'] or '11')
+        for basepath, relpath, pkg in self.sitePages():
+            try:
+                page_class = self.site.resource_loader.get_page_class(basepath=basepath, relpath=relpath, pkg=pkg)
+            except Exception, e:
+                logger.warning('Page %s not bundled: %s', os.path.join(basepath, relpath), e)
+                continue
+            self.bundleFrontend(page_class.dojo_version, page_class.gnrjsversion)
+            self.bundlePage(page_class, os.path.join(basepath, relpath))
+        self.writeManifest()
+        if precompress_trees:
+            for version, path in self.site.gnr_path.items():
+                self.precompressTree(path)
+            for version, path in self.site.dojo_path.items():
+                self.precompressTree(path)
+        return self.bundles
+
+    def sitePages(self):
+        """Yield the basepath, relpath and package of the pages of the site and of its packages"""
+        folders = [(self.site.pages_dir, self.site.mainpackage)]
+        for pkg_id, pkg in self.site.gnrapp.packages.items():
+            folders.append((os.path.join(pkg.packageFolder, 'webpages'), pkg_id))
+        for basepath, pkg in folders:
+            for dirpath, dirnames, filenames in os.walk(basepath):
+                dirnames[:] = [d for d in dirnames if not d.startswith('_') and not d.startswith('.')]
+                for filename in sorted(filenames):
+                    if filename.endswith('.py') and not filename.startswith('_'):
+                        yield basepath, os.path.relpath(os.path.join(dirpath, filename), basepath), pkg
+
+    def bundleFrontend(self, dojo_version, gnrjsversion):
+        """Bundle the genro js and css of a frontend
+
+        :param dojo_version: the dojo version of the frontend
+        :param gnrjsversion: the version of the genro js"""
+        frontend_class = self.frontendClass(dojo_version)
+        gnr_static = self.site.getStatic('gnr')
+        self.bundle([gnr_static.path(gnrjsversion, 'js', '%s.js' % f) for f in frontend_class.gnrjs_imports], 'js',
+                    name='genro')
+        for media, css_list in frontend_class.css_genro_imports.items():
+            self.bundle([gnr_static.path(gnrjsversion, 'css', '%s.css' % f) for f in css_list], 'css',
+                        name='genro_%s' % media)
+
+    def frontendClass(self, dojo_version):
+        from gnr.core.gnrlang import gnrImport
+        return getattr(gnrImport('gnr.web.gnrwebpage_proxy.frontend.dojo_%s' % dojo_version), 'GnrWebFrontend')
+
+    def bundlePage(self, page_class, page_path):
+        """Bundle the :ref:`js_requires` and the :ref:`css_requires` of a page class, resolved
+        as :meth:`GnrWebPage.build_arg_dict() <gnr.web.gnrwebpage.GnrWebPage.build_arg_dict>` does"""
+        resource_loader = self.site.resource_loader
+        name = os.path.splitext(os.path.basename(page_path))[0]
+        js_files = []
+        for js in page_class.js_requires:
+            if not js:
+                continue
+            if js.startswith('/'):
+                static = self.site.getStatic(js.split('/')[1][1:])
+                if not static:
+                    continue
+                js = static.path(*js.split('/')[2:])
+            found = resource_loader.getResourceList(page_class.resourceDirs, js, 'js')
+            if found:
+                js_files.append(found[0])
+        self.bundle(js_files, 'js', name=name)
+        requires = [r for r in page_class.css_requires if r]
+        css_theme = getattr(page_class, 'css_theme', None) or self.site.config['gui?css_theme'] or 'ludo'
+        css_icons = getattr(page_class, 'css_icons', None) or self.site.config['gui?css_icons'] or 'retina/gray'
+        requires.append('themes/%s' % css_theme)
+        requires.append('css_icons/%s/icons' % css_icons)
+        css_files = []
+        for css in requires:
+            if ':' not in css:
+                css_files.extend(resource_loader.getResourceList(page_class.resourceDirs, css, 'css'))
+        page_css = '%s.css' % os.path.splitext(page_path)[0]
+        if os.path.isfile(page_css):
+            css_files.append(page_css)
+        self.bundle(css_files, 'css', name=name)
+
+    def bundle(self, files, ext, name=None):
+        """Write the bundle of a list of files and add it to the manifest. Return its name,
+        or ``None`` if the files cannot be bundled
+
+        :param files: the paths of the source files, in the order they are served
+        :param ext: ``js`` or ``css``
+        :param name: a readable prefix of the name of the bundle"""
+        if not files:
+            return
+        key = bundleKey(files)
+        if key in self.bundles:
+            return self.bundles[key]['name']
+        chunks = []
+        stamps = []
+        for path in files:
+            stamp = fileStamp(path)
+            if stamp is None:
+                return
+            with open(path) as f:
+                content = f.read()
+            if ext == 'js':
+                content = jsmin(content)
+            else:
+                content = self.rebaseCss(content, path)
+                if content is None:
+                    return
+            chunks.append(content)
+            stamps.append([path, stamp])
+        content = '\n\n'.join(chunks)
+        bundle_name = '%s-%s.%s' % (name or ext, hashlib.md5(content).hexdigest()[:16], ext)
+        bundle_path = os.path.join(self.folder, bundle_name)
+        if not os.path.isfile(bundle_path):
+            outfile_handle, outfile_path = tempfile.mkstemp(prefix='gnrbundle', suffix='.%s' % ext, dir=self.folder)
+            with os.fdopen(outfile_handle, 'w') as out:
+                out.write(content)
+            os.chmod(outfile_path, 0644)
+            shutil.move(outfile_path, bundle_path)
+            writeCompressed(bundle_path, brotli_level=self.brotli_level)
+        self.bundles[key] = dict(name=bundle_name, files=stamps)
+        return bundle_name
+
+    def rebaseCss(self, content, path):
+        """Make the relative urls of a css file absolute, as the bundle is served from
+        another folder. Return ``None`` if the file is not served by a static handler"""
+        base_url = self.fileUrl(os.path.dirname(path))
+        if base_url is None:
+            return
+        def rebase(m):
+            url = m.group(2).strip()
+            if url.startswith('/') or url.startswith('data:') or url.startswith('#') or '://' in url:
+                return m.group(0)
+            return 'url(%s)' % os.path.normpath('%s/%s' % (base_url, url)).replace(os.path.sep, '/')
+        return CSS_URL.sub(rebase, content)
+
+    def fileUrl(self, path):
+        """Return the url of a file (or folder) served by a static handler of the site"""
+        if self._static_roots is None:
+            roots = []
+            site_static = self.site.getStatic('site')
+            roots.append((self.site.site_static_dir, lambda *args: site_static.url(*args)))
+            for pkg_id, pkg in self.site.gnrapp.packages.items():
+                roots.append((pkg.packageFolder, lambda *args, **kw: self.site.getStatic('pkg').url(kw['pkg'], *args),
+                              dict(pkg=pkg_id)))
+            for rsrc, rsrc_path in self.site.resources.items():
+                roots.append((rsrc_path, lambda *args, **kw: self.site.getStatic('rsrc').url(kw['rsrc'], *args),
+                              dict(rsrc=rsrc)))
+            for version, gnr_path in self.site.gnr_path.items():
+                roots.append((gnr_path, lambda *args, **kw: self.site.getStatic('gnr').url(kw['version'], *args),
+                              dict(version=version)))
+            roots = [r if len(r) == 3 else r + (dict(),) for r in roots]
+            roots.sort(key=lambda r: len(r[0]), reverse=True)
+            self._static_roots = roots
+        path = os.path.abspath(path)
+        for root, url, kw in self._static_roots:
+            root = os.path.abspath(root)
+            if path == root or path.startswith(root + os.path.sep):
+                return url(*[p for p in path[len(root):].split(os.path.sep) if p], **kw)
+
+    def writeManifest(self):
+        """Write the manifest of the bundles"""
+        outfile_handle, outfile_path = tempfile.mkstemp(prefix='gnrbundle', suffix='.json', dir=self.folder)
+        with os.fdopen(outfile_handle, 'w') as out:
+            out.write(toJson(self.bundles))
+        os.chmod(outfile_path, 0644)
+        shutil.move(outfile_path, os.path.join(self.folder, MANIFEST_NAME))
+
+    def precompressTree(self, path):
+        """Write the ``.gz`` siblings of the static files of a tree that are missing or
+        older than their file"""
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                if filename.rsplit('.', 1)[-1] not in PRECOMPRESS_EXTENSIONS:
+                    continue
+                filepath = os.path.join(dirpath, filename)
+                gzpath = '%s.gz' % filepath
+                if os.path.exists(gzpath) and os.path.getmtime(gzpath) >= os.path.getmtime(filepath):
+                    continue
+                writeCompressed(filepath, brotli_level=self.brotli_level)
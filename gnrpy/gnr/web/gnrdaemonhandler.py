@@ -3,7 +3,7 @@
 # 
 from datetime import datetime
 from multiprocessing import Process
-from gnr.web.gnrwsgisite_proxy.gnrsiteregister import GnrSiteRegisterServer
+from gnr.web.gnrwsgisite_proxy.gnrsiteregister import GnrSiteRegisterServer, shardStoragePath
 from gnr.core.gnrlang import gnrImport
 from gnr.core.gnrbag import Bag
 from gnr.core.gnrsys import expandpath
@@ -24,9 +24,9 @@ PYRO_HOST = 'localhost'
 PYRO_PORT = 40004
 PYRO_HMAC_KEY = 'supersecretkey'
 
-def createSiteRegister(sitename=None,daemon_uri=None,host=None, socket=None, hmac_key=None,storage_path=None,debug=None,autorestore=False):
+def createSiteRegister(sitename=None,daemon_uri=None,host=None, socket=None, hmac_key=None,storage_path=None,debug=None,autorestore=False,shard=None):
     print 'creating'
-    server = GnrSiteRegisterServer(sitename=sitename,daemon_uri=daemon_uri,storage_path=storage_path,debug=debug)
+    server = GnrSiteRegisterServer(sitename=sitename,daemon_uri=daemon_uri,storage_path=storage_path,debug=debug,shard=shard)
     print 'starting'
     server.start(host=host,socket=socket,hmac_key=hmac_key,port='*',autorestore=autorestore)
 
@@ -152,9 +152,12 @@ class GnrDaemon(object):
         if size_limit:
             Pyro4.config.SIZE_LIMIT = size_limit
     
-    def onRegisterStart(self,sitename,server_uri=None,register_uri=None):
-        self.siteregisters[sitename]['server_uri'] = server_uri
-        self.siteregisters[sitename]['register_uri'] = register_uri
+    def onRegisterStart(self,sitename,server_uri=None,register_uri=None,shard=0):
+        siteregister = self.siteregisters[sitename]
+        siteregister['shards'][shard].update(server_uri=server_uri,register_uri=register_uri)
+        if shard==0:
+            siteregister['server_uri'] = server_uri
+            siteregister['register_uri'] = register_uri
 
         print 'registered ',sitename,server_uri
 
@@ -169,11 +172,13 @@ class GnrDaemon(object):
         return 'ping'
     
     def getSite(self,sitename=None,create=False,storage_path=None,autorestore=None,heartbeat_options=None,**kwargs):
-        if sitename in self.siteregisters and self.siteregisters[sitename]['server_uri']:
-            return self.siteregisters[sitename]
+        if sitename in self.siteregisters:
+            if all([shard['server_uri'] for shard in self.siteRegisterShards(sitename)]):
+                return self.siteregisters[sitename]
+            return dict()
         elif create:
             self.addSiteRegister(sitename,storage_path=storage_path,autorestore=autorestore,
-                                    heartbeat_options=heartbeat_options)
+                                    heartbeat_options=heartbeat_options,shards=kwargs.get('shards'))
             return dict()
         
     def stop(self,saveStatus=False,**kwargs):
@@ -225,20 +230,28 @@ class GnrDaemon(object):
         return proc
         
     
-    def addSiteRegister(self,sitename,storage_path=None,autorestore=False,heartbeat_options=None):
+    def addSiteRegister(self,sitename,storage_path=None,autorestore=False,heartbeat_options=None,shards=None):
         if not sitename in self.siteregisters:
-            socket = os.path.join(self.sockets,'%s_daemon.sock' %sitename) if self.sockets else None
-            process_kwargs = dict(sitename=sitename,daemon_uri=self.main_uri,host=self.host,socket=socket
-                                   ,hmac_key=self.hmac_key, storage_path=storage_path,autorestore=autorestore)
-            childprocess = Process(name='sr_%s' %sitename, target=createSiteRegister,kwargs=process_kwargs)
-            self.siteregisters[sitename] = dict(sitename=sitename,server_uri=False,register_uri=False,start_ts=datetime.now())
-            childprocess.daemon = True
-            childprocess.start()
+            shards = int(shards or 1)
+            self.siteregisters[sitename] = dict(sitename=sitename,server_uri=False,register_uri=False,start_ts=datetime.now(),
+                                                shards=[dict(server_uri=False,register_uri=False) for shard in range(shards)])
+            registers = []
+            for shard in range(shards):
+                sockname = '%s_daemon.sock' %sitename if shards==1 else '%s_daemon_%i.sock' %(sitename,shard)
+                socket = os.path.join(self.sockets,sockname) if self.sockets else None
+                process_kwargs = dict(sitename=sitename,daemon_uri=self.main_uri,host=self.host,socket=socket
+                                       ,hmac_key=self.hmac_key, storage_path=shardStoragePath(storage_path,shard,shards),
+                                       autorestore=autorestore,shard=shard)
+                childprocess = Process(name='sr_%s' %sitename if shards==1 else 'sr_%s_%i' %(sitename,shard),
+                                        target=createSiteRegister,kwargs=process_kwargs)
+                childprocess.daemon = True
+                childprocess.start()
+                registers.append(childprocess)
             hbprocess = None
             if heartbeat_options:
                 hbprocess = Process(name='hb_%s' %sitename, target=createHeartBeat,kwargs=heartbeat_options)
                 hbprocess.start()
-            sitedict = dict(register = childprocess,heartbeat=hbprocess)
+            sitedict = dict(register = registers[0],registers=registers,heartbeat=hbprocess)
             self.startServiceProcesses(sitename,sitedict=sitedict)
             self.siteregisters_process[sitename] = sitedict
             
@@ -259,16 +272,20 @@ class GnrDaemon(object):
     def siteRegisterProxy(self,sitename):
         return self.pyroProxy(self.siteregisters[sitename]['register_uri'])
 
+    def siteRegisterShards(self,sitename):
+        siteregister = self.siteregisters[sitename]
+        return siteregister.get('shards') or [siteregister]
+
     def siteregister_dump(self,sitename=None,**kwargs):
-        uri = self.siteregisters[sitename]['register_uri']
-        with self.pyroProxy(uri) as proxy:
-            return proxy.dump()
+        for shard in self.siteRegisterShards(sitename):
+            with self.pyroProxy(shard['register_uri']) as proxy:
+                proxy.dump()
 
 
     def setSiteInMaintenance(self,sitename,status=None,allowed_users=None):
-        uri = self.siteregisters[sitename]['register_uri']
-        with self.pyroProxy(uri) as proxy:
-            return proxy.setMaintenance(status,allowed_users=allowed_users)
+        for shard in self.siteRegisterShards(sitename):
+            with self.pyroProxy(shard['register_uri']) as proxy:
+                proxy.setMaintenance(status,allowed_users=allowed_users)
 
     def siteregister_stop(self,sitename=None,saveStatus=False,**kwargs):
         result = None
@@ -276,9 +293,9 @@ class GnrDaemon(object):
             for k in self.siteregisters:
                 self.siteregister_stop(k,saveStatus=saveStatus)
             return
-        uri = self.siteregisters[sitename]['server_uri']
-        with self.pyroProxy(uri) as proxy:
-            result = proxy.stop(saveStatus=saveStatus)
+        for shard in self.siteRegisterShards(sitename):
+            with self.pyroProxy(shard['server_uri']) as proxy:
+                result = proxy.stop(saveStatus=saveStatus)
         self.onRegisterStop(sitename)
         return result
 
@@ -29,6 +29,7 @@ import shutil
 import urllib
 import thread
 import copy
+import bisect
 
 from time import time
 from datetime import timedelta
@@ -1077,12 +1078,17 @@ class GnrWebPage(GnrBaseWebPage):
             arg_dict['genroJsImport'] = [self.jstools.closurecompile(jsfiles)]
         else:
             jsfiles = [gnr_static_handler.path(self.gnrjsversion, 'js', '%s.js' % f) for f in gnrimports]
-            if not self.site.compressedJsPath or self.site.debug:
-                self.site.compressedJsPath = self.jstools.compress(jsfiles)
-            arg_dict['genroJsImport'] = [self.site.compressedJsPath]
+            bundle_url = None
+            if not self.isDeveloper():
+                bundle_url = self.site.bundle_manifest.url(jsfiles)
+            if bundle_url:
+                arg_dict['genroJsImport'] = [bundle_url]
+            else:
+                if not self.site.compressedJsPath or self.site.debug:
+                    self.site.compressedJsPath = self.jstools.compress(jsfiles)
+                arg_dict['genroJsImport'] = [self.site.compressedJsPath]
         arg_dict['css_genro'] = self.get_css_genro()
-        arg_dict['js_requires'] = [x for x in [self.getResourceUri(r, 'js', add_mtime=True) for r in self.js_requires]
-                                   if x]
+        arg_dict['js_requires'] = self.get_js_requires()
         if self.isMobile:
             arg_dict['js_requires'].append(self.site.getStaticUrl('rsrc:js_libs','hammer.min.js'))
         css_path, css_media_path = self.get_css_path()
@@ -1153,9 +1159,36 @@ class GnrWebPage(GnrBaseWebPage):
     def get_css_genro(self):
         """TODO"""
         css_genro = self.frontend.css_genro_frontend()
+        gnr_static_handler = self.site.getStatic('gnr')
         for media in css_genro.keys():
-            css_genro[media] = [self.mtimeurl(self.gnrjsversion, 'css', '%s.css' % f) for f in css_genro[media]]
+            bundle_url = None
+            if not self.isDeveloper():
+                bundle_url = self.site.bundle_manifest.url([gnr_static_handler.path(self.gnrjsversion, 'css', '%s.css' % f)
+                                                            for f in css_genro[media]])
+            if bundle_url:
+                css_genro[media] = [bundle_url]
+            else:
+                css_genro[media] = [self.mtimeurl(self.gnrjsversion, 'css', '%s.css' % f) for f in css_genro[media]]
         return css_genro
+
+    def get_js_requires(self):
+        """Get the uris of the :ref:`js_requires`: the uri of their bundle, if it has been built
+        by ``gnrbundle`` and it is not stale, or the uri of every file"""
+        js_requires = [x for x in [self.getResourceUri(r, 'js', add_mtime=True) for r in self.js_requires] if x]
+        if js_requires and not self.isDeveloper():
+            bundle_url = self.site.bundle_manifest.url([x for x in [self.getResource(r, ext='js')
+                                                                    for r in self._static_js_requires()] if x])
+            if bundle_url:
+                return [bundle_url]
+        return js_requires
+
+    def _static_js_requires(self):
+        for r in self.js_requires:
+            if r and r.startswith('/'):
+                lpath = r.split('/')[1:]
+                if self.site.getStatic(lpath[0][1:]):
+                    r = self.site.getStatic(lpath[0][1:]).path(*lpath[1:])
+            yield r
         
     def _get_domSrcFactory(self):
         return self.frontend.domSrcFactory
@@ -1362,6 +1395,7 @@ class GnrWebPage(GnrBaseWebPage):
         #requires.reverse()
         filepath = os.path.splitext(self.filepath)[0]
         css_requires = []
+        css_files = []
         css_media_requires = {}
         for css in requires:
             if ':' in css:
@@ -1376,8 +1410,14 @@ class GnrWebPage(GnrBaseWebPage):
                     css_media_requires.setdefault(media, []).extend(css_uri_list)
                 else:
                     css_requires.extend(css_uri_list)
+                    css_files.extend(csslist)
         if os.path.isfile('%s.css' % filepath):
             css_requires.append(self.getResourceUri('%s.css' % filepath, add_mtime=True))
+            css_files.append('%s.css' % filepath)
+        if css_files and not self.isDeveloper():
+            bundle_url = self.site.bundle_manifest.url(css_files)
+            if bundle_url:
+                css_requires = [bundle_url]
         if os.path.isfile(self.resolvePath('%s.css' % self.pagename)):
             css_requires.append('%s.css' % self.pagename)
         return css_requires, css_media_requires
@@ -2568,3 +2608,102 @@ class ClientDataChange(object):
     def __repr__(self):
         return "Datachange path:%s, reason:%s, value:%s, attributes:%s" % (
         self.path, self.reason, self.value, self.attributes)
+
+class DataChangeLog(object):
+    """The log of the :class:`ClientDataChange` of a register item
+    
+    Every change gets a sequence number (its ``change_idx``) that always grows, even after
+    a :meth:`clear`, so a client can ask only for the changes newer than the last one it received.
+    A change appended with ``replace=True`` takes the place of the previous equal change
+    (same path, reason and fired): the old one is removed and the log is compacted
+    when the removed changes are more than the live ones
+    
+    :param changes: an iterable of :class:`ClientDataChange` to start with"""
+    compactThreshold = 64
+    
+    def __init__(self, changes=None):
+        self.seq = 0
+        self.clear()
+        for change in changes or []:
+            self.append(change)
+            
+    def clear(self):
+        """Remove all the changes. The sequence number is kept"""
+        self.changes = []
+        self.seqs = []
+        self.lastchange = {}
+        self.removed = 0
+        
+    def _key(self, change):
+        return (change.path, change.reason, change.fired)
+        
+    def append(self, change, replace=False):
+        """Add a change, giving it the next sequence number, and return it
+        
+        :param change: the :class:`ClientDataChange`
+        :param replace: boolean. If ``True``, the previous equal change is removed"""
+        key = self._key(change)
+        if replace:
+            self._remove(self.lastchange.get(key))
+        self.seq += 1
+        change.change_idx = self.seq
+        self.changes.append(change)
+        self.seqs.append(self.seq)
+        self.lastchange[key] = change
+        return change
+        
+    def _remove(self, change):
+        if change is None:
+            return
+        pos = bisect.bisect_left(self.seqs, change.change_idx)
+        if pos < len(self.seqs) and self.changes[pos] is change:
+            self.changes[pos] = None
+            self.removed += 1
+            key = self._key(change)
+            if self.lastchange.get(key) is change:
+                self.lastchange.pop(key)
+            if self.removed > self.compactThreshold and self.removed * 2 > len(self.changes):
+                self.compact()
+                
+    def compact(self):
+        """Drop the removed changes"""
+        self.changes = [change for change in self.changes if change is not None]
+        self.seqs = [change.change_idx for change in self.changes]
+        self.removed = 0
+        
+    def drop(self, path):
+        """Remove all the changes of a path and of its descendants
+        
+        :param path: the path"""
+        for change in self:
+            if change.path.startswith(path):
+                self._remove(change)
+                
+    def since(self, seq):
+        """Return the list of the changes with a sequence number greater than ``seq``
+        
+        :param seq: the last sequence number received"""
+        pos = bisect.bisect_right(self.seqs, seq or 0)
+        return [change for change in self.changes[pos:] if change is not None]
+        
+    def __iter__(self):
+        return (change for change in self.changes if change is not None)
+        
+    def __len__(self):
+        return len(self.changes) - self.removed
+        
+class PathPrefixIndex(object):
+    """Find which of a set of paths are a prefix of a given path, looking up its
+    prefixes of the right lengths instead of comparing it with every path
+    
+    :param paths: the paths to index"""
+    def __init__(self, paths):
+        self.paths = set(paths)
+        self.lengths = sorted(set([len(p) for p in self.paths]))
+        
+    def match(self, path):
+        """Return the indexed paths that are a prefix of ``path``
+        
+        :param path: the path"""
+        size = len(path)
+        return [path[:l] for l in self.lengths if l <= size and path[:l] in self.paths]
@@ -28,6 +28,7 @@
 import os
 import re
 import time
+import cPickle
 from datetime import datetime
 
 from gnr.core.gnrlang import gnrImport
@@ -43,6 +44,7 @@ from gnr.web.gnrwebpage_proxy.gnrbaseproxy import GnrBaseProxy
 from gnr.web.gnrwebstruct import cellFromField
 from gnr.sql.gnrsql_exceptions import GnrSqlDeleteException
 from gnr.sql.gnrsql import GnrSqlException
+from gnr.sql.gnrsqldata import ESTIMATED_COUNT_THRESHOLD
 
 
 gnrlogger = logging.getLogger(__name__)
@@ -602,13 +604,15 @@ class GnrWebAppHandler(GnrBaseProxy):
         for change in changelist:
             eventdict.setdefault(change['dbevent'],[]).append(change['pkey'])
         deleted = eventdict.get('D',[])
+        updated = eventdict.get('U',[])
+        if deleted or updated:
+            selectionPkeys = set(selection.output('pkeylist'))
         if deleted:
-            if bool(filter(lambda r: r['pkey'] in deleted,selection.data)):
+            if selectionPkeys.intersection(deleted):
                 return True #update required delete in selection
 
-        updated = eventdict.get('U',[])
         if updated:
-            if bool(filter(lambda r: r['pkey'] in updated,selection.data)):
+            if selectionPkeys.intersection(updated):
                 return True #update required update in selection
 
         inserted = eventdict.get('I',[])
@@ -688,7 +692,7 @@ class GnrWebAppHandler(GnrBaseProxy):
                          selectmethod=None, expressions=None, sum_columns=None,
                          sortedBy=None, excludeLogicalDeleted=True,excludeDraft=True,hardQueryLimit=None,
                          savedQuery=None,savedView=None, externalChanges=None,prevSelectedDict=None,
-                         checkPermissions=None,queryBySample=False,**kwargs):
+                         checkPermissions=None,queryBySample=False,pagingMode=None,estimatedCount=False,**kwargs):
         """TODO
         
         ``getSelection()`` method is decorated with the :meth:`public_method
@@ -731,7 +735,14 @@ class GnrWebAppHandler(GnrBaseProxy):
         :param excludeDraft: TODO
         :param savedQuery: TODO
         :param savedView: TODO
-        :param externalChanges: TODO"""
+        :param externalChanges: TODO
+        :param pagingMode: ``keyset`` to read every page of the grid with a keyset query instead
+                           of freezing the whole selection. The selection is frozen only when
+                           all its rows are needed (e.g. select all, export). The following
+                           requests of the same selection are paged as long as its state exists,
+                           so the client does not need to send ``pagingMode`` again
+        :param estimatedCount: with ``pagingMode='keyset'``, ``True`` to use the row count estimated
+                               by the database for large selections"""
         t = time.time()
         tblobj = self.db.table(table)
         row_start = int(row_start)
@@ -747,19 +758,27 @@ class GnrWebAppHandler(GnrBaseProxy):
         for k in kwargs.keys():
             if k.startswith('format_'):
                 formats[7:] = kwargs.pop(k)
+        pagedSelection = None
         if selectionName.startswith('*'):
             if selectionName == '*':
                 selectionName = self.page.page_id
             else:
                 selectionName = selectionName[1:]
         elif selectionName:
-            selection = self.page.unfreezeSelection(tblobj, selectionName)
-            if selection is not None:
-                if sortedBy and  ','.join(selection.sortedBy or []) != sortedBy:
-                    selection.sort(sortedBy)
-                    self.page.freezeSelectionUpdate(selection)
-                debug = 'fromPickle'
+            pagedSelection = self._loadPagedSelection(selectionName)
+            if pagedSelection and not self._sortPagedSelection(tblobj, pagedSelection, sortedBy):
+                pagedSelection = None
+            if pagedSelection:
+                debug = 'keyset'
                 newSelection = False
+            else:
+                selection = self.page.unfreezeSelection(tblobj, selectionName)
+                if selection is not None:
+                    if sortedBy and  ','.join(selection.sortedBy or []) != sortedBy:
+                        selection.sort(sortedBy)
+                        self.page.freezeSelectionUpdate(selection)
+                    debug = 'fromPickle'
+                    newSelection = False
         if newSelection:
             debug = 'fromDb'
             if savedQuery:            
@@ -774,29 +793,51 @@ class GnrWebAppHandler(GnrBaseProxy):
             if fromSelection:
                 fromSelection = self.page.unfreezeSelection(tblobj, fromSelection)
                 pkeys = fromSelection.output('pkeylist')
-            selection = selecthandler(tblobj=tblobj, table=table, distinct=distinct, columns=columns, where=where,
-                                      condition=condition,queryMode=queryMode,
-                                      order_by=order_by, limit=limit, offset=offset, group_by=group_by, having=having,
-                                      relationDict=relationDict, sqlparams=sqlparams,
-                                      recordResolver=recordResolver, selectionName=selectionName, 
-                                      pkeys=pkeys, sortedBy=sortedBy, excludeLogicalDeleted=excludeLogicalDeleted,
-                                      excludeDraft=excludeDraft,checkPermissions=checkPermissions ,**kwargs)
-            if external_queries:
-                self._externalQueries(selection=selection,external_queries=external_queries)
-            if applymethod:
-                applyPars = self._getApplyMethodPars(kwargs)
-                applyresult = self.page.getPublicMethod('rpc', applymethod)(selection, **applyPars)
-                if applyresult:
-                    resultAttributes.update(applyresult)
-
             if selectionName:
-                selection.setKey('rowidx')
-                selectionPath = self.page.freezeSelection(selection, selectionName,freezePkeys=True)
-                self.page.userStore().setItem('current.table.%s.last_selection_path' % table.replace('.', '_'), selectionPath)
-            resultAttributes.update(table=table, method='app.getSelection', selectionName=selectionName,
-                                    row_count=row_count,
-                                    totalrows=len(selection))
-        generator = selection.output(mode='generator', offset=row_start, limit=row_count, formats=formats)
+                self.dropPagedSelection(selectionName)
+            selectionKwargs = dict(table=table, distinct=distinct, columns=columns, where=where,
+                                   condition=condition,queryMode=queryMode,
+                                   order_by=order_by, limit=limit, offset=offset, group_by=group_by, having=having,
+                                   relationDict=relationDict, sqlparams=sqlparams,
+                                   recordResolver=recordResolver, selectionName=selectionName, 
+                                   pkeys=pkeys, excludeLogicalDeleted=excludeLogicalDeleted,
+                                   excludeDraft=excludeDraft,checkPermissions=checkPermissions ,**kwargs)
+            if pagingMode == 'keyset' and selectionName and row_count and not (selectmethod or applymethod or pkeys
+                    or queryMode or external_queries or structure or sum_columns or prevSelectedDict
+                    or hardQueryLimit or limit or offset):
+                pagedSelection = self._newPagedSelection(tblobj, selectionName, selectionKwargs, sortedBy=sortedBy,
+                                                         estimatedCount=estimatedCount)
+            if pagedSelection:
+                debug = 'keyset'
+                self.page.userStore().setItem('current.table.%s.last_selection_path' % table.replace('.', '_'),
+                                              self.page.pageLocalDocument(selectionName))
+                resultAttributes.update(table=table, method='app.getSelection', selectionName=selectionName,
+                                        row_count=row_count, totalrows=pagedSelection['totalrows'],
+                                        pagingMode='keyset', estimatedCount=pagedSelection['estimated'])
+            else:
+                selection = selecthandler(tblobj=tblobj, sortedBy=sortedBy, **selectionKwargs)
+                if external_queries:
+                    self._externalQueries(selection=selection,external_queries=external_queries)
+                if applymethod:
+                    applyPars = self._getApplyMethodPars(kwargs)
+                    applyresult = self.page.getPublicMethod('rpc', applymethod)(selection, **applyPars)
+                    if applyresult:
+                        resultAttributes.update(applyresult)
+
+                if selectionName:
+                    selection.setKey('rowidx')
+                    selectionPath = self.page.freezeSelection(selection, selectionName,freezePkeys=True)
+                    self.page.userStore().setItem('current.table.%s.last_selection_path' % table.replace('.', '_'), selectionPath)
+                resultAttributes.update(table=table, method='app.getSelection', selectionName=selectionName,
+                                        row_count=row_count,
+                                        totalrows=len(selection))
+        if pagedSelection:
+            selection = self._pagedSelectionRows(tblobj, selectionName, pagedSelection, row_start, row_count)
+            generator = selection.output(mode='generator', formats=formats,
+                                         columns=[c for c in selection.allColumns if not c.startswith('_keyset_')
+                                                  and c not in (selection.aggregateDict or {})])
+        else:
+            generator = selection.output(mode='generator', offset=row_start, limit=row_count, formats=formats)
         _addClassesDict = dict([(k, v['_addClass']) for k, v in selection.colAttrs.items() if '_addClass' in v])
         data = self.gridSelectionData(selection, generator, logicalDeletionField=tblobj.logicalDeletionField,
                                       recordResolver=recordResolver, numberedRows=numberedRows,
@@ -845,6 +886,114 @@ class GnrWebAppHandler(GnrBaseProxy):
                         slaveSelections.popNode(page_id)
         return (result, resultAttributes)
 
+    def _pagedSelectionPath(self, selectionName, page_id=None):
+        return '%s_paged.pik' % self.page.pageLocalDocument(selectionName, page_id=page_id)
+
+    def _loadPagedSelection(self, selectionName, page_id=None):
+        path = self._pagedSelectionPath(selectionName, page_id=page_id)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            return cPickle.load(f)
+
+    def _savePagedSelection(self, selectionName, pagedSelection, page_id=None):
+        with open(self._pagedSelectionPath(selectionName, page_id=page_id), 'wb') as f:
+            cPickle.dump(pagedSelection, f, cPickle.HIGHEST_PROTOCOL)
+
+    def dropPagedSelection(self, selectionName, page_id=None):
+        """Remove the keyset paging state of a selection, if any"""
+        path = self._pagedSelectionPath(selectionName, page_id=page_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _pagedOrderBy(self, tblobj, sortedBy):
+        """Return the order_by of a grid ``sortedBy`` (e.g. ``name:a,date:d``) or ``None``
+        if it cannot be sorted by the keyset query"""
+        order_by = []
+        for item in splitAndStrip(sortedBy, ','):
+            field, direction = (item.split(':', 1) + ['a'])[:2]
+            if direction.endswith('*') or field not in tblobj.columns:
+                return
+            order_by.append('$%s%s' % (field, ' desc' if direction.lower().startswith('d') else ''))
+        return ','.join(order_by)
+
+    def _newPagedSelection(self, tblobj, selectionName, selectionKwargs, sortedBy=None, estimatedCount=False):
+        """Prepare the keyset paging of a new selection: return its state or ``None``
+        if the query must be frozen as a whole"""
+        selectionKwargs = dict(selectionKwargs)
+        if sortedBy:
+            selectionKwargs['order_by'] = self._pagedOrderBy(tblobj, sortedBy)
+            if not selectionKwargs['order_by']:
+                return
+        query = self._default_getSelectionQuery(tblobj=tblobj, **selectionKwargs)
+        keyset = query.keyset()
+        if not keyset or query.compiled.explodingColumns or query.compiled.aggregateDict:
+            return
+        fpath = self.page.pageLocalDocument(selectionName)
+        for suffix in ('', '_data', '_pkeys', '_filtered'):
+            if os.path.exists('%s%s.pik' % (fpath, suffix)):
+                os.remove('%s%s.pik' % (fpath, suffix))
+        selectionKwargs.pop('selectionName', None)
+        pagedSelection = dict(table=tblobj.fullname, query=selectionKwargs, keyset=keyset,
+                              sortedBy=sortedBy, bookmarks={0: None}, estimated=False)
+        if estimatedCount:
+            pagedSelection['totalrows'] = query.estimatedCount()
+            pagedSelection['estimated'] = pagedSelection['totalrows'] >= ESTIMATED_COUNT_THRESHOLD
+        else:
+            pagedSelection['totalrows'] = query.count()
+        self._savePagedSelection(selectionName, pagedSelection)
+        return pagedSelection
+
+    def _sortPagedSelection(self, tblobj, pagedSelection, sortedBy):
+        """Apply a new ``sortedBy`` to a paged selection. Return ``False`` if it
+        must be frozen and sorted in memory"""
+        if not sortedBy or sortedBy == pagedSelection['sortedBy']:
+            return True
+        order_by = self._pagedOrderBy(tblobj, sortedBy)
+        if not order_by:
+            return False
+        query = tblobj.query(order_by=order_by)
+        pagedSelection.update(keyset=query.keyset(), sortedBy=sortedBy, bookmarks={0: None})
+        pagedSelection['query']['order_by'] = order_by
+        return True
+
+    def _pagedSelectionRows(self, tblobj, selectionName, pagedSelection, row_start, row_count):
+        """Return the selection of ``row_count`` rows from ``row_start``: the query starts
+        from the nearest page already read, so it does not skip the previous rows"""
+        keyset = pagedSelection['keyset']
+        bookmarks = pagedSelection['bookmarks']
+        start = max([idx for idx in bookmarks if idx <= row_start])
+        query = self._default_getSelectionQuery(tblobj=tblobj, selectionName=selectionName,
+                                                **pagedSelection['query'])
+        query.setKeyset(keyset, after=bookmarks[start], limit=row_count, offset=row_start - start)
+        selection = query.selection(_aggregateRows=True)
+        selection.setKey('rowidx')
+        for r in selection.data:
+            r['rowidx'] += row_start
+        if len(selection) == row_count and (row_start + row_count) not in bookmarks:
+            last = selection.data[-1]
+            bookmarks[row_start + row_count] = [last['_keyset_%i' % i] for i in range(len(keyset))]
+            self._savePagedSelection(selectionName, pagedSelection)
+        return selection
+
+    def freezePagedSelection(self, selectionName, page_id=None):
+        """Freeze all the rows of a keyset paged selection, in the order of its pages, and
+        return it. The following requests of the grid read the frozen selection"""
+        pagedSelection = self._loadPagedSelection(selectionName, page_id=page_id)
+        if not pagedSelection:
+            return
+        tblobj = self.db.table(pagedSelection['table'])
+        selectionKwargs = dict(pagedSelection['query'])
+        selectionKwargs['order_by'] = ','.join(['%s%s' % (column, ' desc' if descending else '')
+                                                for column, descending in pagedSelection['keyset']])
+        query = self._default_getSelectionQuery(tblobj=tblobj, selectionName=selectionName, **selectionKwargs)
+        selection = query.selection(_aggregateRows=True)
+        selection.setKey('rowidx')
+        selection.freeze(self.page.pageLocalDocument(selectionName, page_id=page_id), autocreate=True,
+                         freezePkeys=True)
+        self.dropPagedSelection(selectionName, page_id=page_id)
+        return selection
+
     def _getSelection_columns(self, tblobj, columns, expressions=None):
         external_queries = {}
         if isinstance(columns, Bag):
@@ -945,6 +1094,30 @@ class GnrWebAppHandler(GnrBaseProxy):
                                pkeys=None, queryMode=None,
                               sortedBy=None, sqlContextName=None,
                               excludeLogicalDeleted=True,excludeDraft=True,**kwargs):
+        query = self._default_getSelectionQuery(tblobj=tblobj, table=table, distinct=distinct, columns=columns,
+                                                where=where, condition=condition, order_by=order_by, limit=limit,
+                                                offset=offset, group_by=group_by, having=having,
+                                                relationDict=relationDict, sqlparams=sqlparams,
+                                                recordResolver=recordResolver, selectionName=selectionName,
+                                                pkeys=pkeys, queryMode=queryMode, sqlContextName=sqlContextName,
+                                                excludeLogicalDeleted=excludeLogicalDeleted,
+                                                excludeDraft=excludeDraft, **kwargs)
+        selection = query.selection(sortedBy=sortedBy, _aggregateRows=True)
+        #if sqlContextBag:
+        #    THIS BLOCK SHOULD ALLOW US TO HAVE AN APPLYMETHOD INSIDE SQLCONTEXT.
+        #    IT DOES NOT WORK BUT WE THINK IT'S USELESS
+        #    joinBag = sqlContextBag['%s_%s' % (target_fld.replace('.','_'), from_fld.replace('.','_'))]
+        #    if joinBag and joinBag.get('applymethod'):
+        #        applyPars = self._getApplyMethodPars(kwargs)
+        #        self.page.getPublicMethod('rpc', joinBag['applymethod'])(selection,**applyPars)
+        #
+        return selection
+
+    def _default_getSelectionQuery(self, tblobj=None, table=None, distinct=None, columns=None, where=None,
+                                   condition=None, order_by=None, limit=None, offset=None, group_by=None,
+                                   having=None, relationDict=None, sqlparams=None, recordResolver=None,
+                                   selectionName=None, pkeys=None, queryMode=None, sqlContextName=None,
+                                   excludeLogicalDeleted=True, excludeDraft=True, **kwargs):
         sqlContextBag = None
         if sqlContextName:
             sqlContextBag = self._getSqlContextConditions(sqlContextName)
@@ -985,16 +1158,7 @@ class GnrWebAppHandler(GnrBaseProxy):
                              excludeLogicalDeleted=excludeLogicalDeleted,excludeDraft=excludeDraft, **kwargs)
         if sqlContextName:
             self._joinConditionsFromContext(query, sqlContextName)
-        selection = query.selection(sortedBy=sortedBy, _aggregateRows=True)
-        #if sqlContextBag:
-        #    THIS BLOCK SHOULD ALLOW US TO HAVE AN APPLYMETHOD INSIDE SQLCONTEXT.
-        #    IT DOES NOT WORK BUT WE THINK IT'S USELESS
-        #    joinBag = sqlContextBag['%s_%s' % (target_fld.replace('.','_'), from_fld.replace('.','_'))]
-        #    if joinBag and joinBag.get('applymethod'):
-        #        applyPars = self._getApplyMethodPars(kwargs)
-        #        self.page.getPublicMethod('rpc', joinBag['applymethod'])(selection,**applyPars)
-        #
-        return selection
+        return query
 
  
     def _decodeWhereBag(self, tblobj, where, kwargs):
@@ -13,6 +13,11 @@ from gnr.web.gnrwebstruct import  GnrDomSrc_dojo_11
 class GnrWebFrontend(GnrBaseDojoFrontend):
     version = 'd11'
     domSrcFactory = GnrDomSrc_dojo_11
+    gnrjs_imports = ['gnrbag','gnrdomsource','gnrlang', 'gnrstores',
+                     'genro','genro_patch','genro_rpc','genro_wdg', 'genro_src',
+                     'genro_widgets','genro_tree','genro_grid','genro_components','genro_frm',
+                     'genro_dev','genro_dlg', 'genro_dom','genro_extra','genro_mobile','gnrwebsocket','gnrsharedobjects']
+    css_genro_imports = {'all': ['gnrbase'], 'print': ['gnrprint']}
 
     def css_frontend(self, theme=None):
         theme = theme or self.theme
@@ -25,13 +30,10 @@ class GnrWebFrontend(GnrBaseDojoFrontend):
         ]
 
     def gnrjs_frontend(self):
-        return ['gnrbag','gnrdomsource','gnrlang', 'gnrstores', 
-                'genro','genro_patch','genro_rpc','genro_wdg', 'genro_src',
-                'genro_widgets','genro_tree','genro_grid','genro_components','genro_frm',
-                'genro_dev','genro_dlg', 'genro_dom','genro_extra','genro_mobile','gnrwebsocket','gnrsharedobjects']
+        return list(self.gnrjs_imports)
 
     def css_genro_frontend(self):
-        return {'all': ['gnrbase'], 'print': ['gnrprint']}
+        return dict([(media, list(css_list)) for media, css_list in self.css_genro_imports.items()])
 
     def dojo_release_imports(self):
         return ['dojo_release.js']
@@ -13,6 +13,10 @@ from gnr.web.gnrwebstruct import  GnrDomSrc_dojo_14
 class GnrWebFrontend(GnrBaseDojoFrontend):
     version = 'd14'
     domSrcFactory = GnrDomSrc_dojo_14
+    gnrjs_imports = ['gnrbag', 'genro', 'genro_widgets', 'genro_rpc', 'genro_patch',
+                     'genro_dev', 'genro_dlg', 'genro_frm', 'genro_dom', 'gnrdomsource',
+                     'genro_wdg', 'genro_src', 'gnrlang', 'gnrstores']
+    css_genro_imports = {'all': ['gnrbase'], 'print': ['gnrprint']}
 
     def css_frontend(self, theme=None):
         theme = theme or self.theme
@@ -24,11 +28,9 @@ class GnrWebFrontend(GnrBaseDojoFrontend):
         ]
 
     def gnrjs_frontend(self):
-        return ['gnrbag', 'genro', 'genro_widgets', 'genro_rpc', 'genro_patch',
-                'genro_dev', 'genro_dlg', 'genro_frm', 'genro_dom', 'gnrdomsource',
-                'genro_wdg', 'genro_src', 'gnrlang', 'gnrstores']
+        return list(self.gnrjs_imports)
 
     def css_genro_frontend(self):
-        return {'all': ['gnrbase'], 'print': ['gnrprint']}
+        return dict([(media, list(css_list)) for media, css_list in self.css_genro_imports.items()])
 
 
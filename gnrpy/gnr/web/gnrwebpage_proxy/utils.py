@@ -16,6 +16,7 @@ from gnr.core.gnrdecorator import public_method
 from gnr.core.gnrbag import Bag, DirectoryResolver
 from gnr.core.gnrlist import XlsReader,CsvReader
 from gnr.core.gnrstring import slugify
+from gnr.core.gnrprinthandler import PdfRenderPool
 
 EXPORT_PDF_TEMPLATE = """
 <html lang="en">
@@ -317,13 +318,15 @@ class GnrWebUtils(GnrBaseProxy):
         pl.append('pdf')
         pl.append('%s.pdf' %name)
         outputFilePath = self.page.site.getStaticPath('page:exportPdfFromNodes',*pl,autocreate=-1)
-        for i,p in enumerate(pages):
-            hp = [name]
-            hp.append('html')
-            hp.append('page_%s.pdf' %i)
-            page_path = self.page.site.getStaticPath('page:exportPdfFromNodes',*hp,autocreate=-1)
-            print_handler.htmlToPdf(EXPORT_PDF_TEMPLATE %dict(title='%s %i' %(name,i) ,style=style, body=p),page_path, orientation=orientation)
-            pdf_list.append(page_path)
+        with PdfRenderPool() as pool:
+            for i,p in enumerate(pages):
+                hp = [name]
+                hp.append('html')
+                hp.append('page_%s.pdf' %i)
+                page_path = self.page.site.getStaticPath('page:exportPdfFromNodes',*hp,autocreate=-1)
+                print_handler.htmlToPdf(EXPORT_PDF_TEMPLATE %dict(title='%s %i' %(name,i) ,style=style, body=p),page_path,
+                                        orientation=orientation,pool=pool)
+                pdf_list.append(page_path)
         print_handler.getPrinterConnection('PDF').printPdf(pdf_list, 'export_%s' %name,
                                        outputFilePath=os.path.splitext(outputFilePath)[0])
         self.page.setInClientData(path='gnr.clientprint',
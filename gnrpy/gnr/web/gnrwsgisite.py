@@ -9,6 +9,7 @@ from gnr.web.gnrwebpage import GnrUnsupportedBrowserException, GnrMaintenanceExc
 import os
 import glob
 import re
+import json
 import logging
 import subprocess
 import urllib
@@ -39,6 +40,8 @@ from gnr.web.services.gnrmail import WebMailHandler
 from gnr.web.gnrwsgisite_proxy.gnrresourceloader import ResourceLoader
 from gnr.web.gnrwsgisite_proxy.gnrstatichandler import StaticHandlerManager
 from gnr.web.gnrwsgisite_proxy.gnrcommandhandler import CommandHandler
+from gnr.web.gnrbundler import BundleManifest
+from gnr.sql.gnrsqlprofile import SqlProfileSummary, NPLUSONE_THRESHOLD, profilingEnabled
 
 from gnr.web.gnrwsgisite_proxy.gnrsiteregister import SiteRegisterClient
 from gnr.web.gnrwsgisite_proxy.gnrwebsockethandler import WsgiWebSocketHandler
@@ -58,6 +61,7 @@ OP_TO_LOG = {'x': 'y'}
 IS_MOBILE = re.compile(r'iPhone|iPad|Android')
 
 log = logging.getLogger(__name__)
+sqlprofile_log = logging.getLogger('gnr.sql.profile')
 warnings.simplefilter("default")
 global GNRSITE
 
@@ -246,6 +250,7 @@ class GnrWsgiSite(object):
         self.site_static_dir = self.config['resources?site'] or '.'
         if self.site_static_dir and not os.path.isabs(self.site_static_dir):
             self.site_static_dir = os.path.normpath(os.path.join(self.site_path, self.site_static_dir))
+        self.bundle_manifest = BundleManifest(self)
         self.find_gnrjs_and_dojo()
         self.gnrapp = self.build_gnrapp(options=options)
         default_locale = locale.getdefaultlocale()[0]
@@ -273,6 +278,11 @@ class GnrWsgiSite(object):
             self.db.commit()
             print 'End of import'
 
+        self.process_stats_interval = int(self.config['wsgi?process_stats_interval'] or 30)
+        self._process_stats_ts = 0
+        self.sql_profile = profilingEnabled(self.config['wsgi?sql_profile'])
+        self.sql_profile_nplusone = int(self.config['wsgi?sql_profile_nplusone'] or NPLUSONE_THRESHOLD)
+        self.sqlProfileSummary = SqlProfileSummary()
         cleanup = self.custom_config.getAttr('cleanup') or dict()
         self.cleanup_interval = int(cleanup.get('interval') or 120)
         self.page_max_age = int(cleanup.get('page_max_age') or 120)
@@ -684,6 +694,7 @@ class GnrWsgiSite(object):
         # Url parsing start
         path_list = self.get_path_list(request.path_info)
         self.process_cmd.getPending()
+        self.publishProcessStats()
         expiredConnections = self.register.cleanup()
         if expiredConnections:
             self.connectionLog('close',expiredConnections)
@@ -734,6 +745,9 @@ class GnrWsgiSite(object):
                 return self.not_found_exception(environ,start_response)
         else:
             self.log_print('%s : kwargs: %s' % (path_list, str(request_kwargs)), code='RESOURCE')
+            if self.sql_profile:
+                self.db.startSqlProfile(nplusone_threshold=self.sql_profile_nplusone)
+            page = None
             try:
                 page = self.resource_loader(path_list, request, response, environ=environ,request_kwargs=request_kwargs)
                 if page:
@@ -744,6 +758,10 @@ class GnrWsgiSite(object):
                 log.exception("wsgisite.dispatcher: self.resource_loader failed with non-HTTP exception.")
                 log.exception(str(exc))
                 raise
+            finally:
+                if not (page and page._call_handler):
+                    #the page is not served: onSqlProfiled will not stop the profile
+                    self.db.stopSqlProfile()
             if not (page and page._call_handler):
                 return self.not_found_exception(environ, start_response)
             self.currentPage = page
@@ -765,6 +783,7 @@ class GnrWsgiSite(object):
                 return self.serve_htmlPage('html_pages/maintenance.html', environ, start_response)
             finally:
                 self.onServedPage(page)
+                self.onSqlProfiled(page,method=request_kwargs.get('method'))
                 self.cleanup()
             response = self.setResultInResponse(result, response, info_GnrTime=time() - t,info_GnrSqlTime=page.sql_time,info_GnrSqlCount=page.sql_count,
                                                                 info_GnrXMLTime=getattr(page,'xml_deltatime',None),info_GnrXMLSize=getattr(page,'xml_size',None),
@@ -842,6 +861,37 @@ class GnrWsgiSite(object):
         :param page: TODO"""
         pass
         
+    def onSqlProfiled(self, page, method=None):
+        """Stop the sql profile of the request. The aggregates are added to the summary of
+        the process and logged as json on the ``gnr.sql.profile`` logger: at ``INFO`` level,
+        or at ``WARNING`` level if N+1 statements are found
+        
+        :param page: the served page
+        :param method: the rpc method"""
+        profile = self.db.stopSqlProfile()
+        if not profile:
+            return
+        profile.name = '%s:%s' %(page.pagepath,method) if method else page.pagepath
+        page.sql_count = profile.queries
+        page.sql_time = profile.db_time
+        result = profile.result()
+        self.sqlProfileSummary.add(result)
+        level = logging.WARNING if result['n_plus_one'] else logging.INFO
+        if sqlprofile_log.isEnabledFor(level):
+            sqlprofile_log.log(level,json.dumps(result))
+
+    def publishProcessStats(self):
+        """Publish in the register the statistics of this process (see
+        :meth:`SiteRegister.processStats`), at most once every ``process_stats_interval`` seconds"""
+        if time() - self._process_stats_ts < self.process_stats_interval:
+            return
+        self._process_stats_ts = time()
+        dbpool_stats = self.db.connectionPoolStats()
+        if dbpool_stats:
+            self.register.setProcessStats(os.getpid(),'dbpool',dbpool_stats)
+        if self.sql_profile:
+            self.register.setProcessStats(os.getpid(),'sqlprofile',self.sqlProfileSummary.summary())
+
     def cleanup(self):
         """clean up"""
         debugger = getattr(self.currentPage,'debugger',None)
@@ -25,6 +25,9 @@ class CommandHandler(object):
     def clearTableUserConfig(self,**kwargs):
         self.send(command='clearTableUserConfig',pars=kwargs)
 
+    def clearVirtualColumns(self,table=None):
+        self.send(command='clearVirtualColumns',pars=dict(table=table))
+
     def clearApplicationCache(self,key=None):
         self.send(command='clearApplicationCache',pars=dict(key=key))
 
@@ -36,6 +39,9 @@ class CommandHandler(object):
         else:
             self.db.table(table).clearUserConfiguration()
 
+    def command_clearVirtualColumns(self,table=None):
+        self.db.clearVirtualColumns(table=table)
+
     def command_clearApplicationCache(self,key=None):
         self.site.gnrapp.cache.pop(key,None)
 
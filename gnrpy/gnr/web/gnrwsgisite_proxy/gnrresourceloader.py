@@ -8,6 +8,7 @@
 
 from gnr.core.gnrbag import Bag, DirectoryResolver
 import os
+import sys
 import re
 import inspect
 import glob
@@ -26,6 +27,8 @@ from gnr.core.gnrlang import uniquify
 
 log = logging.getLogger(__name__)
 
+GNR_FOLDER = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 
 
 
@@ -110,7 +113,10 @@ class ResourceLoader(object):
 
 
     def get_page_class(self, basepath=None,relpath=None, pkg=None, plugin=None,avoid_module_cache=None,request_args=None,request_kwargs=None, page_factory=None):
-        """TODO
+        """Return the class of a webpage. The assembled class is cached by module path,
+        main package, page factory and plugin classes and is reused by the following
+        requests: in debug mode it is assembled again, reloading the changed modules,
+        when one of the files its methods come from is modified
         
         :param path: TODO
         :param pkg: the :ref:`package <packages>` object"""
@@ -122,12 +128,73 @@ class ResourceLoader(object):
         mainPkg = pkg
         if hasattr(custom_class,'getMainPackage'):
             kw = dict()
-            if 'page_id' in request_kwargs:
+            if 'page_id' in (request_kwargs or {}):
                 kw = self.site.register.pageStore(request_kwargs['page_id']).getItem('pageArgs') or dict()
                 kw.update(request_kwargs)
             mainPkg = custom_class.getMainPackage(request_args=request_args,request_kwargs=kw)
-        py_requires = splitAndStrip(getattr(custom_class, 'py_requires', ''), ',')
         plugin_webpage_classes = self.plugin_webpage_classes(relpath, pkg=mainPkg)
+        cache_key = (module_path, mainPkg, page_factory, tuple(plugin_webpage_classes))
+        page_class = self.page_factories.get(cache_key)
+        if page_class and not avoid_module_cache:
+            if not self.debug:
+                return self._page_class_copy(page_class)
+            changed = [f for f, mtime in page_class._resource_mtimes.items() if self._file_mtime(f) != mtime]
+            if not changed:
+                return self._page_class_copy(page_class)
+            self._unload_modules(changed)
+            page_module = gnrImport(module_path, avoidDup=True,silent=False)
+            custom_class = getattr(page_module, 'GnrCustomWebPage')
+            plugin_webpage_classes = self.plugin_webpage_classes(relpath, pkg=mainPkg)
+        page_class = self.build_page_class(module_path=module_path, page_module=page_module, page_factory=page_factory,
+                                           custom_class=custom_class, mainPkg=mainPkg, relpath=relpath,
+                                           plugin_webpage_classes=plugin_webpage_classes)
+        page_class._resource_mtimes = self._page_class_mtimes(page_class)
+        self.page_factories[cache_key] = page_class
+        return self._page_class_copy(page_class)
+
+    def _page_class_copy(self, page_class):
+        """A subclass of the cached page class with its own copy of the lists that the
+        components mixed in at runtime extend"""
+        attributes = dict(__module__=page_class.__module__,
+                          css_requires=list(page_class.css_requires), js_requires=list(page_class.js_requires))
+        if hasattr(page_class, 'struct_namespaces'):
+            attributes['struct_namespaces'] = set(page_class.struct_namespaces)
+        return type(page_class.__name__, (page_class,), attributes)
+
+    def _file_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _page_class_mtimes(self, page_class):
+        """The modification time of the python files of the methods of the page class,
+        the framework modules excluded"""
+        result = {}
+        for k in dir(page_class):
+            func = getattr(getattr(page_class, k, None), 'im_func', None)
+            code = getattr(func, 'func_code', None)
+            if code is None or code.co_filename in result:
+                continue
+            if not os.path.abspath(code.co_filename).startswith(GNR_FOLDER):
+                result[code.co_filename] = self._file_mtime(code.co_filename)
+        return result
+
+    def _unload_modules(self, paths):
+        """Remove from ``sys.modules`` the modules loaded by :func:`gnrImport` from *paths*,
+        so that they are loaded again"""
+        paths = set([os.path.splitext(os.path.abspath(p))[0] for p in paths])
+        for name, module in sys.modules.items():
+            module_file = getattr(module, '__file__', None)
+            if module_file and os.path.splitext(os.path.abspath(module_file))[0] in paths:
+                sys.modules.pop(name, None)
+
+    def build_page_class(self, module_path=None, page_module=None, page_factory=None, custom_class=None,
+                         mainPkg=None, relpath=None, plugin_webpage_classes=None):
+        """Assemble the class of a webpage mixing the page factory with the package and
+        application customizations, the :ref:`py_requires <webpages_py_requires>`,
+        the page class, the plugins and the instance custom page"""
+        py_requires = splitAndStrip(getattr(custom_class, 'py_requires', ''), ',')
         for plugin_webpage_class in plugin_webpage_classes:
             plugin_py_requires = splitAndStrip(getattr(plugin_webpage_class, 'py_requires', ''), ',')
             py_requires.extend(plugin_py_requires)
@@ -170,7 +237,6 @@ class ResourceLoader(object):
         page_class._packageId = mainPkg
         self.page_class_plugin_mixin(page_class, plugin_webpage_classes)
         self.page_class_custom_mixin(page_class, relpath, pkg=mainPkg)
-        self.page_factories[module_path] = page_class
         return page_class
         
     def page_class_base_mixin(self, page_class, pkg=None):
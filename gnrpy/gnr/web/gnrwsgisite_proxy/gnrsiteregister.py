@@ -25,10 +25,12 @@ import thread
 import Pyro4
 import os
 import re
+import zlib
 from datetime import datetime
 from collections import defaultdict
 from gnr.core.gnrbag import Bag,BagResolver
-from gnr.web.gnrwebpage import ClientDataChange
+from gnr.core.gnrbagbinary import PackedBag, packBag
+from gnr.web.gnrwebpage import ClientDataChange, DataChangeLog, PathPrefixIndex
 from gnr.core.gnrclasses import GnrClassCatalog
 from gnr.app.gnrconfig import gnrConfigPath
 
@@ -70,9 +72,38 @@ def remotebag_wrapper(func):
             kwargs['_pyrosubbag'] = self.rootpath
         kwargs['_siteregister_register_name'] = self.register_name
         kwargs['_siteregister_register_item_id'] = self.register_item_id
-        return func(self,*args,**kwargs)
+        return func(self,*packArgs(args),**packKwargs(kwargs))
     return decore
 
+def shardIndex(key, shards):
+    """Return the shard of the register owning the item with the given key
+    (a page_id, a connection_id or a user)"""
+    if shards < 2 or key is None:
+        return 0
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return (zlib.crc32(str(key)) & 0xffffffff) % shards
+
+def shardStoragePath(storage_path, shard, shards):
+    if not storage_path or shards < 2:
+        return storage_path
+    return storage_path.replace('.pik', '_%i.pik' % shard)
+
+def datachangesBag(datachanges):
+    result = Bag()
+    if datachanges:
+        for j, change in enumerate(datachanges):
+            result.setItem('sc_%i' % j, change.value, change_path=change.path, change_reason=change.reason,
+                       change_fired=change.fired, change_attr=change.attributes,
+                       change_ts=change.change_ts, change_delete=change.delete)
+    return result
+
+def packArgs(args):
+    return [packBag(v) for v in args]
+
+def packKwargs(kwargs):
+    return dict([(k,packBag(v)) for k,v in kwargs.items()])
+
 class BaseRemoteObject(object):
     def onSizeExceeded(self, msg_size, method, vargs, kwargs):
         print '[%i-%i-%i %i:%i:%i]-----%s-----'%((time.localtime()[:6])+(self.__class__.__name__.upper(),))
@@ -101,7 +132,7 @@ class RemoteStoreBagHandler(BaseRemoteObject):
             if not h:
                 raise AttributeError("PyroSubBag at %s has no attribute '%s'" % (_pyrosubbag,name))
             else:
-                return h(*args,**kwargs)
+                return packBag(h(*args,**kwargs))
 
         return decore
 
@@ -155,7 +186,7 @@ class RemoteStoreBag(object):
             kwargs['_pyrosubbag'] = self.rootpath
             kwargs['_siteregister_register_name'] = self.register_name
             kwargs['_siteregister_register_item_id'] = self.register_item_id
-            return h(*args,**kwargs)
+            return h(*packArgs(args),**packKwargs(kwargs))
         return decore
 
 #------------------------------- END REMOTEBAG  ---------------------------
@@ -203,13 +234,15 @@ class BaseRegister(BaseRemoteObject):
     def addRegisterItem(self,register_item,data=None):
         register_item_id = register_item['register_item_id']
         self.registerItems[register_item_id] = register_item
-        register_item['datachanges'] = list()
-        register_item['datachanges_idx'] = 0
+        register_item['datachanges'] = DataChangeLog()
         register_item['subscribed_paths'] = set()
         data = Bag(data)
-        data.subscribe('datachanges', any=lambda **kwargs:  self._on_data_trigger(register_item=register_item,**kwargs))
+        self._subscribeItemData(register_item,data)
         self.itemsData[register_item_id] = data
 
+    def _subscribeItemData(self,register_item,data):
+        data.subscribe('datachanges', any=lambda **kwargs:  self._on_data_trigger(register_item=register_item,**kwargs))
+
     def _on_data_trigger(self, node=None, ind=None, evt=None, pathlist=None,register_item=None, **kwargs):
         if evt == 'ins':
             pathlist.append(node.label)
@@ -295,38 +328,35 @@ class BaseRegister(BaseRemoteObject):
         register_item.update(upddict)
         return register_item
 
-    def get_datachanges(self,register_item_id,reset=False):
+    def get_datachanges(self,register_item_id,reset=False,since=None):
         register_item = self.get_item(register_item_id)
         if not register_item:
             return
         datachanges = register_item['datachanges']
+        if since is not None:
+            return datachanges.since(since)
+        result = list(datachanges)
         if reset:
-            register_item['datachanges'] = []
-            register_item['datachanges_idx'] = 0
-        return datachanges
+            datachanges.clear()
+        return result
 
     def reset_datachanges(self,register_item_id):
-        return self.update_item(register_item_id,dict(datachanges=list(),datachanges_idx=0))
+        register_item = self.get_item(register_item_id)
+        register_item['datachanges'].clear()
+        return register_item
 
 
     def set_datachange(self,register_item_id, path, value=None, attributes=None, fired=False, reason=None, replace=False, delete=False):
         register_item = self.get_item(register_item_id)
         if not register_item:
             return
-        datachanges = register_item['datachanges']
-        register_item['datachanges_idx'] = register_item.get('datachanges_idx', 0)
-        register_item['datachanges_idx'] += 1
         datachange = ClientDataChange(path, value, attributes=attributes, fired=fired,
-                                      reason=reason, change_idx=register_item['datachanges_idx'],
-                                      delete=delete)
-        if replace and datachange in datachanges:
-            datachanges.pop(datachanges.index(datachange))
-        datachanges.append(datachange)
+                                      reason=reason, delete=delete)
+        register_item['datachanges'].append(datachange,replace=replace)
 
     def drop_datachanges(self,register_item_id, path):
         register_item = self.get_item(register_item_id)
-        datachanges = register_item['datachanges']
-        datachanges[:] = [dc for dc in datachanges if not dc.path.startswith(path)]
+        register_item['datachanges'].drop(path)
 
     def subscribe_path(self, register_item_id,path):
         register_item = self.get_item(register_item_id)
@@ -347,7 +377,7 @@ class BaseRegister(BaseRemoteObject):
     def dump(self,storagefile):
 
         pickle.dump(self.registerItems, storagefile)
-        pickle.dump(self.itemsData, storagefile)
+        pickle.dump(dict([(k,PackedBag(v)) for k,v in self.itemsData.items()]), storagefile)
         pickle.dump(self.itemsTS, storagefile)
         pickle.dump(self.locked_items, storagefile)
 
@@ -356,6 +386,14 @@ class BaseRegister(BaseRemoteObject):
         self.itemsData = pickle.load(storagefile)
         self.itemsTS = pickle.load(storagefile)
         self.locked_items = pickle.load(storagefile)
+        for register_item in self.registerItems.values():
+            if not isinstance(register_item.get('datachanges'),DataChangeLog):
+                register_item['datachanges'] = DataChangeLog(register_item.get('datachanges'))
+                register_item.pop('datachanges_idx',None)
+        for register_item_id,data in self.itemsData.items():
+            register_item = self.registerItems.get(register_item_id)
+            if register_item is not None:
+                self._subscribeItemData(register_item,data)
 
 
 
@@ -442,7 +480,6 @@ class PageRegister(BaseRegister):
                 user_ip=user_ip,
                 user_agent=user_agent,
                 relative_url=relative_url,
-                datachanges=list(),
                 subscribed_paths=set(),
                 register_name='page')
         self.addRegisterItem(register_item,data=data)
@@ -592,6 +629,7 @@ class SiteRegister(BaseRemoteObject):
         self.maintenance = False
         self.allowed_users = None
         self.interproces_commands = dict()
+        self.process_stats = dict()
 
 
     def checkCachedTables(self,table):
@@ -707,41 +745,60 @@ class SiteRegister(BaseRemoteObject):
         connection_item['user_name'] = user_name
         connection_item['user_id'] = user_id
         connection_item['avatar_extra'] = avatar_extra
-        for p in self.pages(connection_id=connection_id):
-            p['user'] = user
+        self.set_connection_pages_user(connection_id,user)
         if not self.connection_register.connections(olduser):
             self.drop_user(olduser)
 
+    def set_connection_pages_user(self,connection_id,user):
+        for p in self.pages(connection_id=connection_id):
+            p['user'] = user
+
     def refresh(self, page_id, last_user_ts=None,last_rpc_ts=None,pageProfilers=None):
         refresh_ts = datetime.now()
-        page = self.page_register.refresh(page_id,last_user_ts=last_user_ts,last_rpc_ts=last_rpc_ts,refresh_ts=refresh_ts)
+        page = self.refresh_item('page',page_id,last_user_ts=last_user_ts,last_rpc_ts=last_rpc_ts,
+                                refresh_ts=refresh_ts,pageProfilers=pageProfilers)
         if not page:
             return
-        self.page_register.updatePageProfilers(page_id,pageProfilers)
-        connection = self.connection_register.refresh(page['connection_id'],last_user_ts=last_user_ts,last_rpc_ts=last_rpc_ts,refresh_ts=refresh_ts)
+        connection = self.refresh_item('connection',page['connection_id'],last_user_ts=last_user_ts,last_rpc_ts=last_rpc_ts,refresh_ts=refresh_ts)
         if not connection:
             return
-        return self.user_register.refresh(connection['user'],last_user_ts=last_user_ts,last_rpc_ts=last_rpc_ts,refresh_ts=refresh_ts)
+        return self.refresh_item('user',connection['user'],last_user_ts=last_user_ts,last_rpc_ts=last_rpc_ts,refresh_ts=refresh_ts)
 
+    def refresh_item(self,register_name,register_item_id,last_user_ts=None,last_rpc_ts=None,refresh_ts=None,pageProfilers=None):
+        register = self.get_register(register_name)
+        item = register.refresh(register_item_id,last_user_ts=last_user_ts,last_rpc_ts=last_rpc_ts,refresh_ts=refresh_ts)
+        if item and register_name=='page':
+            register.updatePageProfilers(register_item_id,pageProfilers)
+        return item
 
     def cleanup(self):
         if time.time()-self.last_cleanup < self.cleanup_interval:
             return
+        self.cleanup_pages()
+        dropped_connections = []
+        for connection_id in self.expired_connections():
+            dropped_connections.append(connection_id)
+            self.drop_connection(connection_id,cascade=True)
+        self.last_cleanup = time.time()
+        return dropped_connections
+
+    def cleanup_pages(self):
         now = datetime.now()
         for page in self.pages():
             page_max_age = self.page_max_age if not page['user'].startswith('guest_') else self.guest_connection_max_age
             last_refresh_ts = page.get('last_refresh_ts') or page.get('start_ts')
             if ((now - last_refresh_ts).seconds > page_max_age):
                 self.drop_page(page['register_item_id'])
-        dropped_connections = []
+
+    def expired_connections(self):
+        now = datetime.now()
+        result = []
         for connection in self.connections():
             last_refresh_ts = connection.get('last_refresh_ts') or  connection.get('start_ts')
             connection_max_age = self.connection_max_age if not connection['user'].startswith('guest_') else  self.guest_connection_max_age
             if (now - last_refresh_ts).seconds > connection_max_age:
-                dropped_connections.append(connection['register_item_id'])
-                self.drop_connection(connection['register_item_id'],cascade=True)
-        self.last_cleanup = time.time()
-        return dropped_connections
+                result.append(connection['register_item_id'])
+        return result
 
 
     def get_register(self,register_name):
@@ -754,36 +811,58 @@ class SiteRegister(BaseRemoteObject):
         self.page_register.subscribeTable(page_id,table=table,subscribe=subscribe,subscribeMode=subscribeMode)
 
     def subscription_storechanges(self, user, page_id):
-        external_datachanges = self.page_register.get_datachanges(register_item_id=page_id,reset=True)
+        external_datachanges,active_subscriptions = self.page_subscriptions(page_id)
+        if not active_subscriptions:
+            return external_datachanges
+        store_datachanges,offsets = self.user_subscription_changes(user,active_subscriptions)
+        return external_datachanges+store_datachanges
+
+    def page_subscriptions(self, page_id):
+        """Return the pending datachanges of a page and its active subscriptions to the user store"""
+        external_datachanges = self.page_register.get_datachanges(register_item_id=page_id,reset=True) or []
         page_item_data = self.page_register.get_item_data(page_id)
         if not page_item_data:
-            return external_datachanges
+            return external_datachanges,None
         user_subscriptions = page_item_data.getItem('_subscriptions.user')
         if not user_subscriptions:
-            return external_datachanges
+            return external_datachanges,None
+        return external_datachanges,dict([(subpath, subdict) for subpath, subdict in user_subscriptions.items() if subdict['on']])
+
+    def update_subscription_offsets(self, page_id, offsets):
+        page_item_data = self.page_register.get_item_data(page_id)
+        user_subscriptions = page_item_data.getItem('_subscriptions.user') if page_item_data else None
+        if not user_subscriptions:
+            return
+        for subpath,offset in offsets.items():
+            if subpath in user_subscriptions:
+                user_subscriptions[subpath]['offset'] = offset
+
+    def user_subscription_changes(self, user, active_subscriptions):
+        """Return the datachanges of the user store matching the active subscriptions of a page
+        and the new offsets of the subscriptions"""
         store_datachanges = []
-        datachanges = self.user_register.get_datachanges(user)
+        offset = min([subdict.get('offset', 0) for subdict in active_subscriptions.values()])
+        datachanges = self.user_register.get_datachanges(user,since=offset) or []
         user_item_data = self.user_register.get_item_data(user)
-        storesubscriptions_items = user_subscriptions.items()
         global_offsets = user_item_data.getItem('_subscriptions.offsets')
         if global_offsets is None:
             global_offsets = {}
             user_item_data.setItem('_subscriptions.offsets', global_offsets)
-        for j, change in enumerate(datachanges):
-            changepath = change.path
+        pathindex = PathPrefixIndex(active_subscriptions.keys())
+        for change in datachanges:
             change_idx = change.change_idx
-            for subpath, subdict in storesubscriptions_items:
-                if subdict['on'] and changepath.startswith(subpath):
-                    if change_idx > subdict.get('offset', 0):
-                        subdict['offset'] = change_idx
-                        change.attributes = change.attributes or {}
-                        if change_idx > global_offsets.get(subpath, 0):
-                            global_offsets[subpath] = change_idx
-                            change.attributes['_new_datachange'] = True
-                        else:
-                            change.attributes.pop('_new_datachange', None)
-                        store_datachanges.append(change)
-        return external_datachanges+store_datachanges
+            for subpath in pathindex.match(change.path):
+                subdict = active_subscriptions[subpath]
+                if change_idx > subdict.get('offset', 0):
+                    subdict['offset'] = change_idx
+                    change.attributes = change.attributes or {}
+                    if change_idx > global_offsets.get(subpath, 0):
+                        global_offsets[subpath] = change_idx
+                        change.attributes['_new_datachange'] = True
+                    else:
+                        change.attributes.pop('_new_datachange', None)
+                    store_datachanges.append(change)
+        return store_datachanges,dict([(subpath,subdict.get('offset', 0)) for subpath,subdict in active_subscriptions.items()])
 
     def handle_ping(self, page_id=None, reason=None, _serverstore_changes=None,**kwargs):
         _children_pages_info= kwargs.get('_children_pages_info')
@@ -818,24 +897,21 @@ class SiteRegister(BaseRemoteObject):
                 datachanges = self.handle_ping_get_datachanges(k, user=user)
                 if datachanges:
                     envelope.setItem('childDataChanges.%s' %k, datachanges)
+        if self.user_running_batch(user):
+            envelope.setItem('runningBatch',True)
+        return envelope
+
+    def user_running_batch(self, user):
         user_register_data = self.user_register.get_item_data(user)
         lastBatchUpdate = user_register_data.getItem('lastBatchUpdate')
         if lastBatchUpdate:
             if (datetime.now()-lastBatchUpdate).seconds<5:
-                envelope.setItem('runningBatch',True)
-            else:
-                user_register_data.setItem('lastBatchUpdate',None)
-        return envelope
+                return True
+            user_register_data.setItem('lastBatchUpdate',None)
+        return False
 
     def handle_ping_get_datachanges(self, page_id, user=None):
-        result = Bag()
-        store_datachanges = self.subscription_storechanges(user,page_id)
-        if store_datachanges:
-            for j, change in enumerate(store_datachanges):
-                result.setItem('sc_%i' % j, change.value, change_path=change.path, change_reason=change.reason,
-                           change_fired=change.fired, change_attr=change.attributes,
-                           change_ts=change.change_ts, change_delete=change.delete)
-        return result
+        return datachangesBag(self.subscription_storechanges(user,page_id))
         
     def set_serverstore_changes(self, page_id=None, datachanges=None):
         page_item_data = self.page_register.get_item_data(page_id)
@@ -904,6 +980,27 @@ class SiteRegister(BaseRemoteObject):
                     pidhandler['commands'].append(command)
 
 
+    def setProcessStats(self,pid,name,stats):
+        """Store the statistics published by a site process (e.g. the db connection pool)"""
+        self.process_stats.setdefault(pid,dict())[name] = dict(stats=stats,ts=datetime.now())
+
+    def processStats(self,name=None):
+        """Return a Bag with the statistics published by the living site processes.
+        If ``name`` is given only that kind of statistics is returned"""
+        now = datetime.now()
+        result = Bag()
+        for pid,pidstats in self.process_stats.items():
+            for statname,item in pidstats.items():
+                if (now - item['ts']).total_seconds() > PROCESS_SELFDESTROY_TIMEOUT:
+                    pidstats.pop(statname)
+                    continue
+                if name and statname!=name:
+                    continue
+                result.setItem('%s.%s' %(statname,pid),item['stats'],pid=pid,ts=item['ts'])
+            if not pidstats:
+                self.process_stats.pop(pid)
+        return result
+
     def setMaintenance(self,status,allowed_users=None):
         if status is False:
             self.allowed_users = None
@@ -937,6 +1034,247 @@ class SiteRegister(BaseRemoteObject):
         
 ################################### CLIENT ##########################################
 
+class ShardedSiteRegister(object):
+    """Client side facade of a site register split in many processes (the shards).
+    Pages, connections and users live in the shard chosen by :func:`shardIndex` on their
+    page_id, connection_id and user: the calls about an item go to its shard, the queries
+    on many items are sent to every shard and the operations involving items of different
+    kinds (e.g. refresh or drop with cascade) are composed here, so the shards never call
+    each other. Process commands and statistics are kept by the first shard.
+
+    :param proxies: the Pyro proxies of the shards, in shard order"""
+    item_keys = ('register_item_id', 'page_id', 'connection_id', 'user')
+
+    def __init__(self, proxies):
+        self.shards = proxies
+        self.catalog = GnrClassCatalog()
+        self.last_cleanup = time.time()
+        self.cleanup_interval = 120
+
+    def shard(self, key):
+        return self.shards[shardIndex(key, len(self.shards))]
+
+    def fanout(self, fname, *args, **kwargs):
+        return [getattr(shard, fname)(*args, **kwargs) for shard in self.shards]
+
+    def fanout_list(self, fname, *args, **kwargs):
+        result = []
+        for r in self.fanout(fname, *args, **kwargs):
+            result.extend(r or [])
+        return result
+
+    def setConfiguration(self, cleanup=None):
+        self.cleanup_interval = int((cleanup or dict()).get('interval') or 120)
+        self.fanout('setConfiguration', cleanup=cleanup)
+
+    def new_connection(self, connection_id, connection_name=None, user=None, user_id=None,
+                            user_name=None, user_tags=None, user_ip=None, user_agent=None, browser_name=None, avatar_extra=None):
+        connection_shard = self.shard(connection_id)
+        if connection_shard is self.shard(user):
+            return connection_shard.new_connection(connection_id, connection_name=connection_name, user=user, user_id=user_id,
+                            user_name=user_name, user_tags=user_tags, user_ip=user_ip, user_agent=user_agent,
+                            browser_name=browser_name, avatar_extra=avatar_extra)
+        if not self.shard(user).exists(user, register_name='user'):
+            self.new_user(user, user_id=user_id, user_name=user_name, user_tags=user_tags, avatar_extra=avatar_extra)
+        return connection_shard.create(connection_id, connection_name=connection_name, user=user, user_id=user_id,
+                            user_name=user_name, user_tags=user_tags, user_ip=user_ip, user_agent=user_agent,
+                            browser_name=browser_name, register_name='connection')
+
+    def new_user(self, user=None, **kwargs):
+        return self.shard(user).new_user(user=user, **kwargs)
+
+    def drop_pages(self, connection_id):
+        self.fanout('drop_pages', connection_id)
+
+    def drop_page(self, page_id, cascade=None):
+        page_shard = self.shard(page_id)
+        page = page_shard.get_item(page_id, register_name='page') if cascade else None
+        page_shard.drop_page(page_id)
+        if page and not self.connection_page_keys(page['connection_id']):
+            self.drop_connection(page['connection_id'])
+
+    def drop_connections(self, user):
+        for connection_id in self.user_connection_keys(user):
+            self.drop_connection(connection_id)
+
+    def drop_connection(self, connection_id, cascade=None):
+        self.drop_pages(connection_id)
+        connection = self.shard(connection_id).drop_item(connection_id, register_name='connection')
+        if connection and cascade and not self.user_connection_keys(connection['user']):
+            self.drop_user(connection['user'])
+
+    def drop_user(self, user):
+        self.drop_connections(user)
+        self.shard(user).drop_item(user, register_name='user')
+
+    def user_connection_keys(self, user):
+        return self.fanout_list('user_connection_keys', user)
+
+    def user_connection_items(self, user):
+        return self.fanout_list('user_connection_items', user)
+
+    def user_connections(self, user):
+        return self.fanout_list('user_connections', user)
+
+    def connection_page_keys(self, connection_id):
+        return self.fanout_list('connection_page_keys', connection_id)
+
+    def connection_page_items(self, connection_id):
+        return self.fanout_list('connection_page_items', connection_id)
+
+    def connection_pages(self, connection_id):
+        return self.fanout_list('connection_pages', connection_id)
+
+    def subscribed_table_pages(self, table=None):
+        return self.fanout_list('subscribed_table_pages', table)
+
+    def filter_subscribed_tables(self, table_list, register_name=None):
+        result = set()
+        for tables in self.fanout('filter_subscribed_tables', table_list, register_name='page'):
+            result.update(tables)
+        return list(result)
+
+    def pages(self, connection_id=None, user=None, index_name=None, filters=None, include_data=None):
+        return self.fanout_list('pages', connection_id=connection_id, user=user, index_name=index_name,
+                                filters=filters, include_data=include_data)
+
+    def connections(self, user=None, include_data=None):
+        return self.fanout_list('connections', user=user, include_data=include_data)
+
+    def users(self, include_data=None):
+        return self.fanout_list('users', include_data=include_data)
+
+    def page(self, page_id):
+        return self.shard(page_id).page(page_id)
+
+    def connection(self, connection_id):
+        return self.shard(connection_id).connection(connection_id)
+
+    def user(self, user):
+        return self.shard(user).user(user)
+
+    def change_connection_user(self, connection_id, user=None, user_tags=None, user_id=None, user_name=None,
+                               avatar_extra=None):
+        connection_shard = self.shard(connection_id)
+        olduser = connection_shard.connection(connection_id)['user']
+        if not self.shard(user).exists(user, register_name='user'):
+            self.new_user(user=user, user_tags=user_tags, user_id=user_id, user_name=user_name, avatar_extra=avatar_extra)
+        connection_shard.update_item(connection_id, dict(user=user, user_tags=user_tags, user_name=user_name,
+                                                         user_id=user_id, avatar_extra=avatar_extra),
+                                     register_name='connection')
+        self.fanout('set_connection_pages_user', connection_id, user)
+        if not self.connections(olduser):
+            self.drop_user(olduser)
+
+    def refresh(self, page_id, last_user_ts=None, last_rpc_ts=None, pageProfilers=None):
+        refresh_ts = datetime.now()
+        page = self.shard(page_id).refresh_item('page', page_id, last_user_ts=last_user_ts, last_rpc_ts=last_rpc_ts,
+                                                refresh_ts=refresh_ts, pageProfilers=pageProfilers)
+        if not page:
+            return
+        connection_id = page['connection_id']
+        connection = self.shard(connection_id).refresh_item('connection', connection_id, last_user_ts=last_user_ts,
+                                                            last_rpc_ts=last_rpc_ts, refresh_ts=refresh_ts)
+        if not connection:
+            return
+        return self.shard(connection['user']).refresh_item('user', connection['user'], last_user_ts=last_user_ts,
+                                                           last_rpc_ts=last_rpc_ts, refresh_ts=refresh_ts)
+
+    def cleanup(self):
+        if time.time() - self.last_cleanup < self.cleanup_interval:
+            return
+        self.last_cleanup = time.time()
+        self.fanout('cleanup_pages')
+        dropped_connections = self.fanout_list('expired_connections')
+        for connection_id in dropped_connections:
+            self.drop_connection(connection_id, cascade=True)
+        return dropped_connections
+
+    def subscription_storechanges(self, user, page_id):
+        page_shard = self.shard(page_id)
+        external_datachanges, active_subscriptions = page_shard.page_subscriptions(page_id)
+        if not active_subscriptions:
+            return external_datachanges
+        store_datachanges, offsets = self.shard(user).user_subscription_changes(user, active_subscriptions)
+        page_shard.update_subscription_offsets(page_id, offsets)
+        return external_datachanges + store_datachanges
+
+    def handle_ping(self, page_id=None, reason=None, _serverstore_changes=None, **kwargs):
+        _children_pages_info = kwargs.get('_children_pages_info')
+        user_item = self.refresh(page_id, kwargs.get('_lastUserEventTs'), last_rpc_ts=kwargs.get('_lastRpc'),
+                                 pageProfilers=kwargs.get('_pageProfilers'))
+        if not user_item:
+            return False
+        if _serverstore_changes:
+            self.set_serverstore_changes(page_id, _serverstore_changes)
+        if _children_pages_info:
+            for k, v in _children_pages_info.items():
+                child_lastUserEventTs = v.pop('_lastUserEventTs', None)
+                child_lastRpc = v.pop('_lastRpc', None)
+                child_pageProfilers = v.pop('_pageProfilers', None)
+                if v:
+                    self.set_serverstore_changes(k, v)
+                if child_lastUserEventTs:
+                    child_lastUserEventTs = self.catalog.fromTypedText(child_lastUserEventTs)
+                if child_lastRpc:
+                    child_lastRpc = self.catalog.fromTypedText(child_lastRpc)
+                self.refresh(k, child_lastUserEventTs, last_rpc_ts=child_lastRpc, pageProfilers=child_pageProfilers)
+        envelope = Bag(dict(result=None))
+        user = user_item['user']
+        datachanges = self.handle_ping_get_datachanges(page_id, user=user)
+        if datachanges:
+            envelope.setItem('dataChanges', datachanges)
+        if _children_pages_info:
+            for k in _children_pages_info.keys():
+                datachanges = self.handle_ping_get_datachanges(k, user=user)
+                if datachanges:
+                    envelope.setItem('childDataChanges.%s' % k, datachanges)
+        if self.shard(user).user_running_batch(user):
+            envelope.setItem('runningBatch', True)
+        return envelope
+
+    def handle_ping_get_datachanges(self, page_id, user=None):
+        return datachangesBag(self.subscription_storechanges(user, page_id))
+
+    def setInClientData(self, path, value=None, attributes=None, page_id=None, filters=None, **kwargs):
+        kwargs.pop('register_name', None)
+        if filters:
+            return self.fanout('setInClientData', path, value=value, attributes=attributes, filters=filters,
+                               register_name='page', **kwargs)
+        return self.shard(page_id).setInClientData(path, value=value, attributes=attributes, page_id=page_id,
+                                                   register_name='page', **kwargs)
+
+    def notifyDbEvents(self, dbeventsDict=None, **kwargs):
+        self.fanout('notifyDbEvents', dbeventsDict, **kwargs)
+
+    def checkCachedTables(self, table):
+        self.fanout('checkCachedTables', table)
+
+    def invalidateTableCache(self, table, **kwargs):
+        self.fanout('invalidateTableCache', table, **kwargs)
+
+    def setMaintenance(self, status, allowed_users=None):
+        self.fanout('setMaintenance', status, allowed_users=allowed_users)
+
+    def dump(self):
+        self.fanout('dump')
+
+    def load(self):
+        return all(self.fanout('load'))
+
+    def __getattr__(self, fname):
+        if fname in ('pendingProcessCommands', 'sendProcessCommand', 'setProcessStats', 'processStats',
+                     'isInMaintenance', 'allowedUsers'):
+            return getattr(self.shards[0], fname)
+        def decore(*args, **kwargs):
+            if args:
+                key = args[0]
+            else:
+                key = [kwargs[k] for k in self.item_keys if kwargs.get(k) is not None]
+                key = key[0] if key else None
+            return getattr(self.shard(key), fname)(*args, **kwargs)
+        return decore
+
 class SiteRegisterClient(object):
     STORAGE_PATH = 'siteregister_data.pik'
 
@@ -945,6 +1283,8 @@ class SiteRegisterClient(object):
         self.site = site
         self.siteregisterserver_uri = None
         self.siteregister_uri = None
+        self.shards = int(self.site.config['siteregister?shards'] or 1)
+        self.shard_uris = []
         self.storage_path = os.path.join(self.site.site_path, self.STORAGE_PATH)
         self.errors = Pyro4.errors
 
@@ -976,22 +1316,26 @@ class SiteRegisterClient(object):
                 if (time.time()-t_start)>DAEMON_TIMEOUT_START:
                     raise Exception('GnrDaemon timout')
         print 'creating proxy',self.siteregister_uri,self.siteregisterserver_uri
-        self.siteregister = Pyro4.Proxy(self.siteregister_uri)
-        if not OLD_HMAC_MODE:
-            self.siteregister._pyroHmacKey = self.hmac_key
         self.remotebag_uri =self.siteregister_uri.replace(':SiteRegister@',':RemoteData@')
+        if len(self.shard_uris) > 1:
+            self.siteregister = ShardedSiteRegister([self.pyroProxy(uri) for uri in self.shard_uris])
+            self.remotebag_uris = [uri.replace(':SiteRegister@',':RemoteData@') for uri in self.shard_uris]
+        else:
+            self.siteregister = self.pyroProxy(self.siteregister_uri)
+            self.remotebag_uris = [self.remotebag_uri]
         self.siteregister.setConfiguration(cleanup = self.site.custom_config.getAttr('cleanup'))
 
 
     def checkSiteRegisterServerUri(self,daemonProxy):
         if not self.siteregisterserver_uri:
             info = daemonProxy.getSite(self.site.site_name,create=True,storage_path=self.storage_path,autorestore=True,
-                                        heartbeat_options=self.site.heartbeat_options)
+                                        heartbeat_options=self.site.heartbeat_options,shards=self.shards)
             self.siteregisterserver_uri = info.get('server_uri',False)
             if not self.siteregisterserver_uri:
                 time.sleep(1)
             else:
                 self.siteregister_uri = info['register_uri']
+                self.shard_uris = [shard['register_uri'] for shard in info.get('shards') or []] or [self.siteregister_uri]
         return self.siteregisterserver_uri
 
     def runningDaemon(self,daemonProxy):
@@ -1015,7 +1359,7 @@ class SiteRegisterClient(object):
         register_item = self.siteregister.new_page( page_id, pagename = page.pagename,connection_id=page.connection_id,user=page.user,
                                             user_ip=page.user_ip,user_agent=page.user_agent, 
                                             relative_url=page.request.path_info,
-                                            data=data)
+                                            data=packBag(data))
         self.add_data_to_register_item(register_item)
         return register_item
 
@@ -1076,7 +1420,8 @@ class SiteRegisterClient(object):
         return register_item
 
     def add_data_to_register_item(self,register_item):
-        register_item['data'] = RemoteStoreBag(self.remotebag_uri, register_item['register_name'],
+        remotebag_uri = self.remotebag_uris[shardIndex(register_item['register_item_id'],len(self.remotebag_uris))]
+        register_item['data'] = RemoteStoreBag(remotebag_uri, register_item['register_name'],
                                                 register_item['register_item_id'],hmac_key=self.hmac_key)
         return register_item
 
@@ -1117,8 +1462,9 @@ class SiteRegisterClient(object):
 ##############################################################################
 
 class GnrSiteRegisterServer(object):
-    def __init__(self,sitename=None,daemon_uri=None,storage_path=None,debug=None):
+    def __init__(self,sitename=None,daemon_uri=None,storage_path=None,debug=None,shard=None):
         self.sitename = sitename
+        self.shard = shard or 0
         self.gnr_daemon_uri = daemon_uri
         self.debug = debug
         self.storage_path = storage_path
@@ -1175,7 +1521,7 @@ class GnrSiteRegisterServer(object):
             with Pyro4.Proxy(self.gnr_daemon_uri) as proxy:
                 if not OLD_HMAC_MODE:
                     proxy._pyroHmacKey = hmac_key
-                proxy.onRegisterStart(self.sitename,str(self.main_uri),str(self.register_uri))
+                proxy.onRegisterStart(self.sitename,str(self.main_uri),str(self.register_uri),shard=self.shard)
         self.run(autorestore=autorestore)
 
 ########################################### SERVER STORE #######################################
@@ -5,20 +5,159 @@ from gnr.core import gnrstring
 import inspect
 import os
 import sys
+import stat
+import time
+import mimetypes
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from threading import Lock
 from gnr.core.gnrsys import expandpath
 from urllib2 import urlparse
-from paste import fileapp
-from paste.httpheaders import ETAG
 import random
 import tempfile
 
+BLOCK_SIZE = 64 * 1024
+FILE_CACHE_SIZE = 4096
+FILE_CACHE_TTL = 2
+PRECOMPRESSED_VARIANTS = (('br', '.br'), ('gzip', '.gz'))
+
+class StaticFileInfo(object):
+    """The stats of a served file and of its precompressed variants"""
+    __slots__ = ('path', 'mtime', 'size', 'etag', 'variants', 'checked')
+
+    def __init__(self, path, stats, variants, checked):
+        self.path = path
+        self.mtime = stats.st_mtime
+        self.size = stats.st_size
+        self.etag = '%s-%s' % (str(self.mtime), str(self.size))
+        self.variants = variants
+        self.checked = checked
+
+class StaticFileCache(object):
+    """A bounded LRU cache of the :class:`StaticFileInfo` of the served files, so that the hot
+    assets are not stat-ed at every request. An entry is checked again after *ttl* seconds.
+
+    :param maxsize: the maximum number of files in the cache
+    :param ttl: the seconds an entry is trusted without checking the file again"""
+    def __init__(self, maxsize=FILE_CACHE_SIZE, ttl=FILE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, path, fresh=False):
+        """Return the :class:`StaticFileInfo` of a regular file, or ``None`` if it is missing
+
+        :param path: the path of the file
+        :param fresh: if ``True`` check the file even if its entry is still valid"""
+        now = time.time()
+        with self.lock:
+            info = self._items.pop(path, None)
+            if info is not None and not fresh and now - info.checked < self.ttl:
+                self._items[path] = info
+                return info
+        info = self.stat(path, now)
+        if info is not None:
+            with self.lock:
+                self._items[path] = info
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return info
+
+    def stat(self, path, now=None):
+        try:
+            stats = os.stat(path)
+        except OSError:
+            return
+        if not stat.S_ISREG(stats.st_mode):
+            return
+        variants = {}
+        for encoding, ext in PRECOMPRESSED_VARIANTS:
+            try:
+                variant_stats = os.stat(path + ext)
+            except OSError:
+                continue
+            if variant_stats.st_mtime >= stats.st_mtime:
+                variants[encoding] = path + ext
+        return StaticFileInfo(path, stats, variants, now or time.time())
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self._items.clear()
+            else:
+                self._items.pop(path, None)
+
+    def __len__(self):
+        return len(self._items)
+
+class FileRangeIter(object):
+    """Iterate over *length* bytes of an open file, from its current position"""
+    def __init__(self, f, length, block_size=BLOCK_SIZE):
+        self.file = f
+        self.length = length
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.length <= 0:
+            raise StopIteration
+        chunk = self.file.read(min(self.block_size, self.length))
+        if not chunk:
+            raise StopIteration
+        self.length -= len(chunk)
+        return chunk
+
+    def close(self):
+        self.file.close()
+
+def accepted_encodings(accept_encoding):
+    """Return the set of the content codings accepted by the client (``q=0`` excludes a coding)"""
+    result = set()
+    for item in (accept_encoding or '').split(','):
+        parts = [p.strip() for p in item.split(';')]
+        if not parts[0]:
+            continue
+        q = [p[2:] for p in parts[1:] if p.startswith('q=')]
+        try:
+            if q and float(q[0]) == 0:
+                continue
+        except ValueError:
+            continue
+        result.add(parts[0].lower())
+    return result
+
+def parse_range(range_header, size):
+    """Return the ``(first, last)`` bytes of a single byte range, ``None`` if the header is not
+    a single byte range (the whole file is served) or ``False`` if it cannot be satisfied"""
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return
+    first, sep, last = range_header[6:].strip().partition('-')
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return
+    if first >= size or first > last:
+        return False
+    return first, last
+
 class StaticHandlerManager(object):
     """ This class handles the StaticHandlers"""
 
     def __init__(self, site):
         self.site = site
         self.statics = Bag()
-        
+        self.file_cache = StaticFileCache(maxsize=int(site.config['wsgi?static_cache_size'] or FILE_CACHE_SIZE),
+                                          ttl=float(site.config['wsgi?static_cache_ttl'] or FILE_CACHE_TTL))
+
 
     def addAllStatics(self, module=None):
         """inspect self (or other modules) for StaticHandler subclasses and 
@@ -87,7 +226,7 @@ class StaticHandler(object):
             result = m(pkey)
             return result is not False
 
-    def serve(self, f, environ, start_response, download=False, download_name=None, **kwargs):
+    def serve(self, f, environ, start_response, download=False, download_name=None, nocache=None, **kwargs):
         if isinstance(f,list):
             fullpath = self.path(*f[1:])
         elif isinstance(f,file):
@@ -97,36 +236,120 @@ class StaticHandler(object):
         if not fullpath:
             return self.site.not_found_exception(environ, start_response)
         if not os.path.isabs(fullpath):
-            fullpath = os.path.normpath(os.path.join(self.site_path, fullpath))
-        existing_doc = os.path.exists(fullpath)
-        if not existing_doc and '_lazydoc' in kwargs:
-            existing_doc = self.build_lazydoc(kwargs['_lazydoc'],ext=os.path.splitext(fullpath)[-1])
-        if not existing_doc:
+            fullpath = os.path.normpath(os.path.join(self.site.site_path, fullpath))
+        file_cache = self.site.statics.file_cache
+        info = file_cache.get(fullpath, fresh=nocache)
+        if info is None and '_lazydoc' in kwargs:
+            if self.build_lazydoc(kwargs['_lazydoc'],ext=os.path.splitext(fullpath)[-1]):
+                info = file_cache.get(fullpath, fresh=True)
+        if info is None:
             if kwargs.get('_lazydoc'):
                 headers = []
                 start_response('200 OK', headers)
                 return ['']
             return self.site.not_found_exception(environ, start_response)
-        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
-        if if_none_match:
-            if_none_match = if_none_match.replace('"','')
-            stats = os.stat(fullpath)
-            mytime = stats.st_mtime
-            size = stats.st_size
-            my_none_match = "%s-%s"%(str(mytime),str(size))
-            if my_none_match == if_none_match:
-                headers = []
-                ETAG.update(headers, my_none_match)
-                start_response('304 Not Modified', headers)
-                return [''] # empty body
-        file_args = dict()
         if download or download_name:
             download_name = download_name or os.path.basename(fullpath)
-            file_args['content_disposition'] = "attachment; filename=%s" % download_name
-        file_responder = fileapp.FileApp(fullpath, **file_args)
+        return self.serve_file(info, environ, start_response, download_name=download_name)
+
+    def serve_file(self, info, environ, start_response, download_name=None):
+        """Send a file through ``wsgi.file_wrapper`` (the server can use ``sendfile``), answering
+        the conditional requests, the single byte ranges and sending its precompressed
+        ``.br`` or ``.gz`` variant to the clients that accept it
+
+        :param info: the :class:`StaticFileInfo` of the file
+        :param download_name: if given, the file is sent as an attachment with this name"""
+        headers = [('ETag', '"%s"' % info.etag),
+                   ('Last-Modified', formatdate(info.mtime, usegmt=True)),
+                   ('Accept-Ranges', 'bytes')]
         if self.site.cache_max_age:
-            file_responder.cache_control(max_age=self.site.cache_max_age)
-        return file_responder(environ, start_response)
+            headers.append(('Cache-Control', 'max-age=%i' % self.site.cache_max_age))
+        if download_name:
+            headers.append(('Content-Disposition', 'attachment; filename=%s' % download_name))
+        if self.not_modified(info, environ):
+            start_response('304 Not Modified', headers)
+            return ['']
+        content_type, content_encoding = mimetypes.guess_type(info.path)
+        headers.append(('Content-Type', content_type or 'application/octet-stream'))
+        byte_range = None
+        if environ.get('HTTP_RANGE') and self.if_range(info, environ):
+            byte_range = parse_range(environ['HTTP_RANGE'], info.size)
+            if byte_range is False:
+                start_response('416 Requested Range Not Satisfiable',
+                               headers + [('Content-Range', 'bytes */%i' % info.size), ('Content-Length', '0')])
+                return ['']
+        path = info.path
+        if info.variants and not content_encoding and not download_name:
+            headers.append(('Vary', 'Accept-Encoding'))
+            if not byte_range:
+                accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING'))
+                for encoding, ext in PRECOMPRESSED_VARIANTS:
+                    if encoding in accepted and encoding in info.variants:
+                        path = info.variants[encoding]
+                        content_encoding = encoding
+                        headers[0] = ('ETag', '"%s-%s"' % (info.etag, encoding))
+                        break
+        if content_encoding:
+            headers.append(('Content-Encoding', content_encoding))
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            self.site.statics.file_cache.invalidate(info.path)
+            return self.site.not_found_exception(environ, start_response)
+        size = os.fstat(f.fileno()).st_size
+        if path == info.path and size != info.size:
+            info = self.site.statics.file_cache.get(info.path, fresh=True) or info
+            headers[0] = ('ETag', '"%s"' % info.etag)
+            byte_range = parse_range(environ['HTTP_RANGE'], size) if byte_range else None
+            if byte_range is False:
+                f.close()
+                start_response('416 Requested Range Not Satisfiable',
+                               headers + [('Content-Range', 'bytes */%i' % size), ('Content-Length', '0')])
+                return ['']
+        if byte_range:
+            first, last = byte_range
+            headers.append(('Content-Range', 'bytes %i-%i/%i' % (first, last, size)))
+            headers.append(('Content-Length', str(last - first + 1)))
+            start_response('206 Partial Content', headers)
+        else:
+            headers.append(('Content-Length', str(size)))
+            start_response('200 OK', headers)
+        if environ.get('REQUEST_METHOD', 'GET').upper() == 'HEAD':
+            f.close()
+            return ['']
+        if byte_range:
+            f.seek(first)
+            return FileRangeIter(f, last - first + 1)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper:
+            return file_wrapper(f, BLOCK_SIZE)
+        return FileRangeIter(f, size)
+
+    def not_modified(self, info, environ):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            for etag in if_none_match.split(','):
+                etag = etag.strip().replace('W/', '').strip('"')
+                for encoding, ext in PRECOMPRESSED_VARIANTS:
+                    if etag.endswith('-%s' % encoding):
+                        etag = etag[:-len(encoding) - 1]
+                if etag == '*' or etag == info.etag:
+                    return True
+            return False
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            parsed = parsedate_tz(if_modified_since)
+            return parsed is not None and int(info.mtime) <= mktime_tz(parsed)
+        return False
+
+    def if_range(self, info, environ):
+        if_range = environ.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range.strip('"') == info.etag
+        parsed = parsedate_tz(if_range)
+        return parsed is not None and int(info.mtime) <= mktime_tz(parsed)
 
     def kwargs_url(self, *args, **kwargs):
         url = self.url(*args)
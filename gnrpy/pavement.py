@@ -29,7 +29,7 @@ setup(
         scripts=['../scripts/gnrdbsetup', '../scripts/gnrmkinstance', '../scripts/gnrmkthresource','../scripts/gnrmksite','../scripts/gnrxml2py', '../scripts/gnrheartbeat', '../scripts/gnrmkpackage',
                  '../scripts/gnrwsgiserve','../scripts/gnruwsgiserve', '../scripts/gnrmkapachesite','../scripts/gnrdaemon', '../scripts/gnrsql2py',
                  '../scripts/gnrsendmail', '../scripts/gnrsitelocalize', '../scripts/gnrdbsetupparallel', '../scripts/gnrtrdaemon', '../scripts/gnrsync4d', '../scripts/gnrmkproject', '../scripts/gnrdbstruct', '../scripts/gnrdbgraph',
-                 '../scripts/gnrwsgi', '../scripts/gnruwsgi', '../scripts/gnrasync','../scripts/gnrlocalizer', '../scripts/gnrvassal', '../scripts/gnrsite','../scripts/gnrupdate'],
+                 '../scripts/gnrwsgi', '../scripts/gnruwsgi', '../scripts/gnrasync','../scripts/gnrlocalizer', '../scripts/gnrvassal', '../scripts/gnrsite','../scripts/gnrupdate','../scripts/gnrbundle'],
         packages=['gnr', 'gnr.core', 'gnr.app', 'gnr.web', 'gnr.sql'],
         data_files=data_files,
         install_requires=['pip'], # NOTE: real requirements are now handled by pip and are in requirements.txt
@@ -1,6 +1,13 @@
 from gnr.core.gnrbag import Bag, BagNode, BagResolver
+from gnr.core.gnrbagxml import BagFromXml
+from gnr.core.gnrbagbinary import PackedBag
+from gnr.core.gnranalyzingbag import AnalyzingBag
+from decimal import Decimal
 import datetime
 import socket, os
+import cPickle as pickle
+import StringIO
+import py
 
 
 def setup_module(module):
@@ -286,3 +293,52 @@ def testToTree():
     assert str(treeBag) == expectedStr
     treeBag2 = b.toTree(group_by='number,text', caption='alfa', attributes=('date', 'text'))
     assert treeBag == treeBag2
+
+def testLabelIndex():
+    b = Bag()
+    b['a'] = 1
+    b.addItem('a', 2)
+    b.setItem('b', 3, _position='<')
+    assert b.keys() == ['b', 'a', 'a'] and b['a'] == 1
+    b.getNode('#1').setLabel('c')
+    assert b['c'] == 1 and b['a'] == 2
+    b.sort('#k:d')
+    assert b.keys() == ['c', 'b', 'a'] and b['b'] == 3
+    b.pop('c')
+    assert b['a'] == 2 and b['#0'] == 3
+    b.clear()
+    assert b['a'] is None
+    b['x.y'] = 4
+    assert pickle.loads(pickle.dumps(b, 1))['x.y'] == 4
+    b.fillFrom('<GenRoBag><y>3</y><x>5</x></GenRoBag>')
+    assert b._nodes._labels == {'y': 0, 'x': 1}
+    assert b['x'] == '5' and b['y'] == '3'
+
+def testXmlStreaming():
+    b = Bag(BAG_DATA)
+    b.setItem('records.r1', Bag(dict(amount=3, day=datetime.date(2010, 5, 10))), code='a&b')
+    b['records.r2.note'] = u'caff\xe8 & <tag>'
+    output = StringIO.StringIO()
+    b.toXml(output=output)
+    xml = b.toXml()
+    assert output.getvalue() == xml
+    py.test.raises(ValueError, b.toXml, filename='streamed.xml', output=output)
+    nodes = list(BagFromXml().iterNodes(xml, False, chunksize=16))
+    assert [(n.label, n.attr, n.value) for n in nodes] == [(n.label, n.attr, n.value) for n in Bag(xml).nodes]
+    records = list(BagFromXml().iterNodes(xml, False, path='records', chunksize=16))
+    assert [(n.label, n.attr, n.value) for n in records] == [(n.label, n.attr, n.value) for n in b['records'].nodes]
+
+def testBinary():
+    b = Bag(BAG_DATA)
+    b.setItem('values.a', [1, 2 ** 70, 3.5, (u'caff\xe8', 'x')], code=Decimal('1.20'), empty=None)
+    b.addItem('values.a', dict(day=datetime.date(2010, 5, 10), ts=datetime.datetime(2010, 5, 10, 8, 30, 1, 5)))
+    b['values.b'] = set([True, False])
+    for compress in (False, True):
+        c = Bag()
+        c.fromBinary(b.toBinary(compress=compress))
+        assert c == b
+        assert c.toXml() == b.toXml()
+    ab = AnalyzingBag()
+    ab.setItem('x.y', 4, sum_amount=10.5)
+    restored = pickle.loads(pickle.dumps(PackedBag(ab), 2))
+    assert isinstance(restored, AnalyzingBag) and restored == ab
@@ -0,0 +1,39 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+
+from gnr.core.gnrprinthandler import PdfRenderPool, PrintHandler
+
+def test_renderPool():
+    folder = tempfile.mkdtemp()
+    src = os.path.join(folder, 'doc.html')
+    with PdfRenderPool(size=3) as pool:
+        for i in range(6):
+            with open(src, 'w') as f:
+                f.write('doc %i' % i)
+            pool.submit(['sh', '-c', 'sleep 0.1; cp "$0" "$1"', src, 'out'], src, os.path.join(folder, '%i.pdf' % (i % 4)))
+    assert sorted(os.listdir(folder)) == ['0.pdf', '1.pdf', '2.pdf', '3.pdf', 'doc.html']
+    assert [open(os.path.join(folder, '%i.pdf' % i)).read() for i in range(4)] == ['doc 4', 'doc 5', 'doc 2', 'doc 3']
+
+def test_htmlToPdfArgs():
+    args, destPath = PrintHandler().htmlToPdfArgs('/tmp/doc.html', '/tmp', pdf_kwargs=dict(margin_top='1mm'))
+    assert destPath == '/tmp/doc.pdf'
+    assert args[0] == 'wkhtmltopdf' and args[-2:] == ['/tmp/doc.html', '/tmp/doc.pdf']
+    assert args[args.index('--orientation') + 1] == 'Portrait'
+    assert args[args.index('--margin-top') + 1] == '1mm' and '--quiet' in args
+
+def test_whenDone():
+    folder = tempfile.mkdtemp()
+    src = os.path.join(folder, 'doc.html')
+    done = []
+    with PdfRenderPool(size=3) as pool:
+        for i in range(5):
+            with open(src, 'w') as f:
+                f.write('doc %i' % i)
+            destPath = os.path.join(folder, '%i.pdf' % i)
+            pool.submit(['sh', '-c', 'sleep 0.%i; cp "$0" "$1"' % (5 - i), src, 'out'], src, destPath)
+            pool.whenDone(destPath, lambda destPath=destPath: done.append(open(destPath).read()))
+        pool.whenDone(src, lambda: done.append('cached'))
+        pool.waitFor(os.path.join(folder, '0.pdf'))
+        assert open(os.path.join(folder, '0.pdf')).read() == 'doc 0'
+    assert done == ['doc 0', 'doc 1', 'doc 2', 'doc 3', 'doc 4', 'cached']
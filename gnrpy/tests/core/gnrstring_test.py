@@ -67,6 +67,19 @@ def test_templateReplace():
                                      {'foo': 'John', 'bar': 'Sandra',
                                       'aux': 'Steve'}) == 'John loves Sandra but she loves Steve and not John'
 
+def test_compiledTemplate():
+    """docstring for test_compiledTemplate"""
+    compiled = gnrstring.compiledTemplate('$name${ ($city)} $$ $missing', safeMode=True)
+    assert gnrstring.compiledTemplate('$name${ ($city)} $$ $missing', safeMode=True) is compiled
+    assert compiled.renderMany([{'name': 'John', 'city': 'Rome'}, {'name': 'Sandra', 'city': None}, {}]) == \
+           ['John (Rome) $ $missing', 'Sandra $ $missing', '$name${ ($city)} $$ $missing']
+    assert len(compiled._segments) == 2
+    try:
+        gnrstring.templateReplace('$name $missing', {'name': 'John'})
+        assert False
+    except KeyError:
+        pass
+
 def test_asDict():
     """docstring for asDict"""
     d = gnrstring.asDict('height=22, weight=73')
@@ -25,7 +25,7 @@
 
 import datetime
 import pytz
-from gnr.core.gnrlocale import localize, parselocal
+from gnr.core.gnrlocale import localize, parselocal, formatColumn, getFormatter
 from decimal import Decimal
 
 class TestLocalize:
@@ -180,6 +180,13 @@ class TestLocalize:
         assert localize(None, locale='de') == ''
         assert localize(None, locale='it') == ''
 
+    def test_formatColumn(self):
+        values = [0, 1256789, None, self.date, True, Decimal('12.5')]
+        assert formatColumn(values, '#,##0;(#);-', locale='it') == [localize(v, '#,##0;(#);-', locale='it')
+                                                                   for v in values]
+        assert getFormatter(datetime.date, locale='it-IT') is getFormatter(datetime.date, locale='it_IT')
+        assert getFormatter(datetime.date, locale='it_IT')(self.date) == '10/12/07'
+
     def test_parse_number(self):
         assert parselocal('2', int, locale='it') == 2
         assert parselocal('1,990', int) == 1990
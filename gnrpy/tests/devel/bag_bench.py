@@ -0,0 +1,74 @@
+# -*- encoding: utf-8 -*-
+"""Benchmark of the Bag label lookup.
+
+Usage: python bag_bench.py [nodes ...]   (default: 10000 100000)
+
+Every operation is run on a Bag and on a LinearBag, that looks the labels up scanning
+the nodes as Bag did before the label index, and the results are checked to be identical.
+The linear scan is quadratic: above LINEAR_LIMIT nodes only the Bag is timed."""
+
+import sys
+import time
+
+from gnr.core.gnrbag import Bag
+
+LINEAR_LIMIT = 20000
+
+class LinearBag(Bag):
+    def _index(self, label):
+        if label.startswith('#'):
+            return Bag._index(self, label)
+        for idx, el in enumerate(self._nodes):
+            if el._label == label:
+                return idx
+        return -1
+
+def build(bagcls, n):
+    bag = bagcls()
+    for i in xrange(n):
+        bag.setItem('node_%i' % i, i, code=i % 7)
+    return bag
+
+def buildDeep(bagcls, n):
+    bag = bagcls()
+    for i in xrange(n):
+        bag.setItem('rec_%i.name' % (i % 1000), 'name %i' % i)
+        bag.setItem('rec_%i.value_%i' % (i % 1000, i), i)
+    return bag
+
+def lookup(bag):
+    n = len(bag)
+    return [bag['node_%i' % i] for i in xrange(n - 1, -1, -(n // 1000 or 1))]
+
+def popHalf(bag):
+    n = len(bag)
+    for i in xrange(n // 2):
+        bag.pop('node_%i' % (n - 1 - i))
+    return bag.keys()
+
+OPERATIONS = [
+    ('build', lambda bagcls, n: build(bagcls, n).digest('#k,#v')),
+    ('build nested', lambda bagcls, n: buildDeep(bagcls, n).getIndexList()),
+    ('lookup', lambda bagcls, n: lookup(build(bagcls, n))),
+    ('pop from the end', lambda bagcls, n: popHalf(build(bagcls, n))),
+]
+
+def timed(operation, bagcls, n):
+    t = time.time()
+    result = operation(bagcls, n)
+    return time.time() - t, result
+
+def bench(n):
+    print '%i nodes' % n
+    for name, operation in OPERATIONS:
+        indextime, result = timed(operation, Bag, n)
+        if n > LINEAR_LIMIT:
+            print '  %-18s index %8.3fs' % (name, indextime)
+            continue
+        lineartime, expected = timed(operation, LinearBag, n)
+        assert result == expected, '%s: different results' % name
+        print '  %-18s linear %8.3fs   index %8.3fs   x%.1f' % (name, lineartime, indextime, lineartime / indextime)
+
+if __name__ == '__main__':
+    for n in [int(a) for a in sys.argv[1:]] or [10000, 100000]:
+        bench(n)
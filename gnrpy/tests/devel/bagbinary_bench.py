@@ -0,0 +1,92 @@
+# -*- encoding: utf-8 -*-
+"""Benchmark of the binary Bag format against pickle and XML.
+
+Usage: python bagbinary_bench.py [pages ...]   (default: 1 10 100)
+
+The payload imitates the data of a page in the register: some page and user
+variables, a few record stores with their fields and a grid store with its rows.
+Pickle and the binary format are checked to restore an identical Bag,
+XML does not keep every type and is not checked."""
+
+import sys
+import time
+import random
+import datetime
+import cPickle as pickle
+from decimal import Decimal
+
+from gnr.core.gnrbag import Bag
+
+ROUNDS = 5
+
+def makeRecord(rnd, i):
+    record = Bag()
+    record.setItem('id', 'REC%08i' % i, dtype='T', _pkey=True)
+    record.setItem('code', 'C%05i' % rnd.randint(0, 5000), dtype='T', size='10')
+    record.setItem('description', u'Articolo n\xb0 %i - %s' % (i, rnd.choice(['rosso', 'verde', 'blu'])), dtype='T')
+    record.setItem('price', Decimal('%i.%02i' % (rnd.randint(0, 999), rnd.randint(0, 99))), dtype='N')
+    record.setItem('qty', rnd.randint(0, 100), dtype='L')
+    record.setItem('date', datetime.date(2015, 1, 1) + datetime.timedelta(days=rnd.randint(0, 1500)), dtype='D')
+    record.setItem('__ins_ts', datetime.datetime(2015, 1, 1, 8, 0) + datetime.timedelta(seconds=rnd.randint(0, 10 ** 8)),
+                   dtype='DH')
+    record.setItem('active', rnd.random() > 0.2, dtype='B')
+    return record
+
+def makePageStore(rnd, rows=200):
+    store = Bag()
+    store.setItem('page.pagename', 'orders')
+    store.setItem('page.workdate', datetime.date(2016, 3, 1))
+    store.setItem('page.user', 'admin', user_id='U0001', tags='admin,user')
+    for k in range(3):
+        record = makeRecord(rnd, k)
+        store.setItem('forms.form_%i.record' % k, record, _pkey=record['id'], _newrecord=False,
+                      _loadedValue=True, table='shop.article')
+        store.setItem('forms.form_%i.controller.changed' % k, False)
+    grid = Bag()
+    for i in range(rows):
+        record = makeRecord(rnd, i)
+        grid.setItem('r_%i' % i, None, _pkey=record['id'], **dict(record.items()))
+    store.setItem('grids.articles.store', grid, totalrows=rows, selectionName='articles_selection')
+    return store
+
+def roundtrip(name, store):
+    if name == 'pickle':
+        data = pickle.dumps(store, pickle.HIGHEST_PROTOCOL)
+        return data, lambda: pickle.loads(data), lambda: pickle.dumps(store, pickle.HIGHEST_PROTOCOL)
+    if name == 'xml':
+        data = store.toXml()
+        return data, lambda: Bag(data), lambda: store.toXml()
+    compress = name == 'binary+zlib'
+    data = store.toBinary(compress=compress)
+    def load():
+        result = Bag()
+        result.fromBinary(data)
+        return result
+    return data, load, lambda: store.toBinary(compress=compress)
+
+def timed(f):
+    t = time.time()
+    for k in range(ROUNDS):
+        result = f()
+    return (time.time() - t) / ROUNDS, result
+
+def bench(pages):
+    rnd = random.Random(42)
+    stores = [makePageStore(rnd) for k in range(pages)]
+    print '%i page stores' % pages
+    for name in ('pickle', 'xml', 'binary', 'binary+zlib'):
+        size = 0
+        dumptime = loadtime = 0
+        for store in stores:
+            data, load, dump = roundtrip(name, store)
+            size += len(data)
+            t, result = timed(dump)
+            dumptime += t
+            t, result = timed(load)
+            loadtime += t
+            assert name == 'xml' or result == store, '%s: different result' % name
+        print '  %-12s size %10i   dump %8.4fs   load %8.4fs' % (name, size, dumptime, loadtime)
+
+if __name__ == '__main__':
+    for n in [int(a) for a in sys.argv[1:]] or [1, 10, 100]:
+        bench(n)
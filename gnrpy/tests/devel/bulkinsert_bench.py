@@ -0,0 +1,60 @@
+# -*- encoding: utf-8 -*-
+"""Benchmark of SqlTable.bulkInsert against the row by row insert.
+
+Usage: python bulkinsert_bench.py [records ...]   (default: 10000 100000)
+
+The records are written in the movie table of the sql tests on a new sqlite db,
+run it from the tests/sql folder."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from gnr.sql.gnrsql import GnrSqlDb
+
+def makeDb(folder, name):
+    db = GnrSqlDb(dbname=os.path.join(folder, '%s.db' % name))
+    db.createDb(db.dbname)
+    db.loadModel('data/dbstructure_base.xml')
+    db.startup()
+    db.checkDb(applyChanges=True)
+    return db
+
+def makeRecords(n):
+    return [{'id': i, 'title': 'Movie %i' % i, 'genre': 'DRAMA', 'year': 1950 + i % 70,
+             'nationality': 'ITA', 'description': 'The description of movie %i' % i} for i in xrange(n)]
+
+def insert(tbl, records):
+    for record in records:
+        tbl.insert(record)
+
+OPERATIONS = [
+    ('insert', insert),
+    ('bulkInsert batch', lambda tbl, records: tbl.bulkInsert(records)),
+    ('bulkInsert none', lambda tbl, records: tbl.bulkInsert(records, triggers='none')),
+]
+
+def bench(n, folder):
+    print '%i records' % n
+    basetime = None
+    for name, operation in OPERATIONS:
+        db = makeDb(folder, '%s_%i' % (name.replace(' ', '_'), n))
+        tbl = db.table('video.movie')
+        t = time.time()
+        operation(tbl, makeRecords(n))
+        db.commit()
+        elapsed = time.time() - t
+        assert tbl.countRecords() == n, '%s: wrong count' % name
+        db.closeConnection()
+        basetime = basetime or elapsed
+        print '  %-18s %8.3fs   %10.0f records/s   x%.1f' % (name, elapsed, n / elapsed, basetime / elapsed)
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp()
+    try:
+        for n in [int(a) for a in sys.argv[1:]] or [10000, 100000]:
+            bench(n, folder)
+    finally:
+        shutil.rmtree(folder)
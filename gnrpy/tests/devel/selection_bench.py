@@ -0,0 +1,73 @@
+# -*- encoding: utf-8 -*-
+"""Benchmark of the SqlSelection operations with and without the NumPy implementation.
+
+Usage: python selection_bench.py [rows ...]   (default: 100000 1000000)
+
+Every operation is run twice, with the row by row implementation and with the
+:mod:`gnr.sql.gnrsqlvector` one, and the results are checked to be identical."""
+
+import sys
+import time
+import random
+import datetime
+
+from gnr.core.gnrlist import GnrNamedList
+from gnr.sql import gnrsqlvector
+from gnr.sql.gnrsqldata import SqlSelection
+
+class BenchTable(object):
+    fullname = 'bench.row'
+
+def makeRows(n):
+    rnd = random.Random(42)
+    index = dict(pkey=0, code=1, city=2, amount=3, qty=4, day=5)
+    cities = ['Milano', 'Roma', 'Torino', 'Napoli', None, 'Genova', 'Bari']
+    start = datetime.date(2010, 1, 1)
+    rows = []
+    for i in xrange(n):
+        rows.append(GnrNamedList(index, [i, 'C%05i' % rnd.randint(0, 5000), rnd.choice(cities),
+                                         round(rnd.uniform(0, 1000), 2), rnd.randint(0, 50),
+                                         start + datetime.timedelta(days=rnd.randint(0, 3000))]))
+    return index, rows
+
+def makeSelection(n):
+    index, rows = makeRows(n)
+    return SqlSelection(BenchTable(), rows, index=index)
+
+def bagSnapshot(bag):
+    result = []
+    for node in bag:
+        result.append((node.label, node.attr.items(), bagSnapshot(node.value) if node.value else None))
+    return result
+
+OPERATIONS = [
+    ('sort city,day:d', lambda sel: (sel.sort('city', 'day:d'), sel.output('pkeylist'))[1]),
+    ('sort code:a*,amount', lambda sel: (sel.sort('code:a*', 'amount'), sel.output('pkeylist'))[1]),
+    ('totalize city/qty', lambda sel: bagSnapshot(sel.totalize(group_by=['city', 'qty'], sum=['amount', 'qty'],
+                                                               keep=['code'], distinct=['day']))),
+]
+
+def timed(operation, sel):
+    t = time.time()
+    result = operation(sel)
+    return time.time() - t, result
+
+def bench(n):
+    print '%i rows' % n
+    for name, operation in OPERATIONS:
+        threshold = gnrsqlvector.VECTOR_THRESHOLD
+        gnrsqlvector.VECTOR_THRESHOLD = sys.maxint
+        try:
+            rowtime, expected = timed(operation, makeSelection(n))
+        finally:
+            gnrsqlvector.VECTOR_THRESHOLD = threshold
+        vectortime, result = timed(operation, makeSelection(n))
+        assert result == expected, '%s: different results' % name
+        print '  %-22s rows %8.3fs   vector %8.3fs   x%.1f' % (name, rowtime, vectortime, rowtime / vectortime)
+
+if __name__ == '__main__':
+    if not gnrsqlvector.HAS_NUMPY:
+        print 'NumPy is not installed'
+        sys.exit(1)
+    for n in [int(a) for a in sys.argv[1:]] or [100000, 1000000]:
+        bench(n)
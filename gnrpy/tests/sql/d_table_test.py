@@ -76,6 +76,18 @@ class BaseSql(object):
         print self.db.model.modelChanges
         assert not check
 
+    def test_catalog(self):
+        adapter = self.db.adapter
+        schemata = adapter.listElements('schemata')
+        catalog = adapter.getCatalog(schemata)
+        for schema in schemata:
+            assert sorted(catalog['tables'][schema]) == sorted(adapter.listElements('tables', schema=schema))
+            for table in catalog['tables'][schema]:
+                assert catalog['columns'][(schema, table)] == adapter.getColInfo(schema=schema, table=table)
+                indexes = adapter.getIndexesForTable(schema=schema, table=table)
+                assert sorted([dict(r) for r in catalog['indexes'].get((schema, table), [])]) == \
+                       sorted([dict(r) for r in indexes])
+
     def test_execute1(self):
         result = self.db.execute('SELECT 1;').fetchall()
         assert result[0][0] == 1
@@ -118,6 +130,29 @@ class BaseSql(object):
         self.db.commit()
         assert result[0][0] == 'Munich'
 
+    def test_bulkInsert(self):
+        tbl = self.db.table('video.movie')
+        records = [{'id': 1000 + i, 'title': 'Movie %i' % i, 'year': 2000 + i % 20, 'genre': 'DRAMA'} for i in range(500)]
+        records.append({'id': 1500, 'title': 'No year'})
+        triggered = []
+        tbl.trigger_onInserting = lambda record: triggered.append(tbl.currentTrigger.record is record)
+        profile = self.db.startSqlProfile(name='bulkInsert')
+        try:
+            result = tbl.bulkInsert(iter(records), chunk_size=150)
+        finally:
+            del tbl.trigger_onInserting
+            self.db.stopSqlProfile()
+        assert result['records'] == 501
+        assert triggered == [True] * 501
+        assert profile.result()['queries'] >= 4
+        self.db.commit()
+        fetched = tbl.query(columns='$id,$title,$year', where='$id >= :min', min=1000, order_by='$id').fetch()
+        assert [(r['id'], r['title'], r['year']) for r in fetched] == [(r['id'], r['title'], r.get('year')) for r in records]
+        tbl.bulkInsert([{'id': 2000, 'title': "Tab\tand 'quote'"}], triggers='none')
+        assert tbl.readColumns(pkey=2000, columns='$title') == "Tab\tand 'quote'"
+        tbl.sql_deleteSelection(where='$id >= :min', min=1000)
+        self.db.commit()
+
     def test_record(self):
         result = self.db.table('video.dvd').record(1, mode='bag')
         assert result['@movie_id.title'] == 'Scoop'
@@ -37,8 +37,10 @@ hdlr = logging.FileHandler('logs.log')
 gnrlogger.addHandler(hdlr)
 
 from gnr.sql.gnrsql import GnrSqlDb
-from gnr.sql.gnrsqldata import SqlQuery, SqlSelection
+from gnr.sql.gnrsqldata import SqlQuery, SqlSelection, SqlStreamingSelection
+from gnr.sql.gnrsql_exceptions import SelectionStreamingError
 from gnr.core.gnrbag import Bag
+from gnr.core.gnrstring import fromJson
 from a_structure_load_test import configurePackage
 
 
@@ -184,6 +186,87 @@ class BaseSql(object):
                                where="$code = :code", code=0).fetch()
         assert result[0]['title'] == "Match point"
 
+    def test_compiledQueryCache(self):
+        cache = self.db.compiledQueryCache
+        hits = cache.hits
+        query_kwargs = dict(columns='@movie_id.title,@movie_id.year', where='$code = :code')
+        first = self.db.query('video.dvd', code=0, **query_kwargs)
+        second = self.db.query('video.dvd', code=1, **query_kwargs)
+        assert first.sqltext == second.sqltext
+        assert cache.hits == hits + 1
+        assert first.fetch()[0]['_movie_id_title'] == 'Match point'
+        assert self.db.query('video.dvd', columns='@movie_id.title', where='$code = :code').sqltext != first.sqltext
+
+    def test_compiledQueryCache_subquery(self):
+        cache = self.db.compiledQueryCache
+        tblobj = self.db.table('video.movie')
+        tblobj.formulaColumn_available_dvds = lambda: dict(name='available_dvds', dtype='L',
+                                                           select=dict(table='video.dvd', columns='COUNT(*)',
+                                                                       where='$movie_id=#THIS.id'))
+        self.db.clearVirtualColumns('video.movie')
+        def availableDvds():
+            return self.db.query('video.movie', columns='$available_dvds', where='$id=:id',
+                                 id=0).fetch()[0]['available_dvds']
+        try:
+            assert availableDvds() == 3
+            self.db.updateEnv(env_video_dvd_condition_x="$available='no'")
+            hits = cache.hits
+            assert availableDvds() == 0
+            assert cache.hits == hits
+            assert availableDvds() == 0
+            assert cache.hits == hits + 1
+            self.db.currentEnv.pop('env_video_dvd_condition_x')
+            assert availableDvds() == 3
+        finally:
+            self.db.currentEnv.pop('env_video_dvd_condition_x', None)
+            del tblobj.formulaColumn_available_dvds
+            self.db.clearVirtualColumns()
+
+    def test_virtualColumnRegistry(self):
+        registry = self.db.model.virtualColumnRegistry
+        tblobj = self.db.table('video.movie')
+        built = []
+        def builder():
+            built.append(True)
+            return Bag()
+        registry.get('video.movie', 'custom', builder)
+        registry.get('video.movie', 'custom', builder)
+        assert len(built) == 1
+        registry.get('video.movie', 'custom', builder, storename='store2')
+        registry.get('video.movie', 'custom', builder, storename='store2')
+        assert len(built) == 2
+        version = tblobj.model.virtualColumnsVersion
+        tblobj.formulaColumn_upper_title = lambda: dict(name='upper_title', sql_formula='UPPER($title)')
+        try:
+            assert 'formulaColumn_upper_title' in registry.methodNames(tblobj, 'formulaColumn_')
+            self.db.clearVirtualColumns('video.movie')
+            assert tblobj.model.virtualColumnsVersion == version + 1
+            registry.get('video.movie', 'custom', builder)
+            registry.get('video.movie', 'custom', builder, storename='store2')
+            assert len(built) == 4
+            result = self.db.query('video.movie', columns='$upper_title', where='$id=:id', id=0).fetch()
+            assert result[0]['upper_title'] == 'MATCH POINT'
+        finally:
+            del tblobj.formulaColumn_upper_title
+            self.db.clearVirtualColumns()
+
+    def test_streamingSelection(self):
+        query = self.db.query('video.movie', columns='$title,$year', order_by='$id')
+        expected = query.selection().output('dictlist')
+        selection = query.selection(streaming=True, arraysize=3)
+        assert isinstance(selection, SqlStreamingSelection)
+        assert [dict(r) for r in selection.output('generator')] == expected
+        py.test.raises(SelectionStreamingError, selection.output, 'list')
+        py.test.raises(SelectionStreamingError, query.selection, streaming=True, sortedBy='year')
+        selection = query.selection(streaming=True, arraysize=3)
+        py.test.raises(SelectionStreamingError, len, selection)
+        totals = selection.totalize(group_by=['year'], sum=['year'])
+        assert totals['2005?count'] == 2
+        assert query.selection(streaming=True).sum('year') == query.selection().sum('year')
+        json = query.selection(streaming=True, arraysize=3).output('json')
+        assert json == query.selection().output('json')
+        assert fromJson(json) == [dict(r) for r in expected]
+
     def teardown_class(cls):
         cls.db.closeConnection()
         cls.db.dropDb(cls.dbname)
@@ -27,12 +27,15 @@ this test module focus on SqlSelection's methods
 """
 
 import os
+import shutil
+import tempfile
 import datetime
 
 import py.test
 
 from gnr.sql.gnrsql import GnrSqlDb
 from gnr.sql.gnrsqldata import SqlQuery
+from gnr.sql.gnrsqlfrozen import KIND_BLOB, KIND_DICT
 from gnr.sql.gnrsqlmodel import DbPackageObj, DbModelObj, DbTableObj, DbColumnObj,\
     DbTableListObj, DbColumnListObj, DbIndexListObj
 from gnr.sql.adapters._gnrbaseadapter import GnrDictRow
@@ -99,6 +102,63 @@ class BaseDb(object):
         sel = self.db.table('video.cast').frozenSelection('data/myselection')
         assert self.mysel.data == sel.data
 
+    def test_frozenColumns(self):
+        folder = tempfile.mkdtemp()
+        try:
+            self._frozenColumns(os.path.join(folder, 'myselection_col'))
+        finally:
+            shutil.rmtree(folder)
+
+    def _frozenColumns(self, fpath):
+        sel = self.myquery.selection(key='rowidx')
+        sel.freeze(fpath)
+        sel.sort('movie', 'person')
+        expected = sel.output('list', columns='rowidx,movie,person')
+        frozen = self.db.unfreezeSelection(fpath)
+        frozen.sort('movie', 'person')
+        assert frozen._frz_unloaded
+        kinds = dict(frozen._frz_store.meta['columns'])
+        assert kinds['movie'] == KIND_BLOB and kinds['role'] == KIND_DICT
+        assert len(frozen) == len(expected)
+        assert frozen.output('list', columns='rowidx,movie,person', offset=2, limit=3) == expected[2:5]
+        assert frozen.sum('id') == sel.sum('id')
+        frozen.freezeUpdate()
+        assert frozen._frz_unloaded
+        frozen = self.db.unfreezeSelection(fpath)
+        assert frozen.output('list', columns='rowidx,movie,person') == expected
+        frozen.append(dict(id=100, person='Nobody', movie='Nothing', role='actor'))
+        frozen.isChangedData = True
+        frozen.freezeUpdate()
+        assert frozen._frz_store.nrows == len(expected) + 1
+        frozen.filter(lambda r: r['person'] in ('Al Pacino', 'Nobody'))
+        frozen.freezeUpdate()
+        frozen = self.db.unfreezeSelection(fpath)
+        pacino = [r for r in expected if r[2] == 'Al Pacino']
+        assert [r[0] for r in frozen.output('list', columns='person')] == ['Al Pacino'] * len(pacino) + ['Nobody']
+        positions = [i for i, r in enumerate(expected) if r[2] == 'Al Pacino'] + [len(expected)]
+        assert [r[0] for r in frozen.output('list', columns='rowidx')] == positions
+        frozen.sort('movie:d')
+        assert frozen._frz_unloaded
+        movies = [r[0] for r in frozen.output('list', columns='movie')]
+        assert movies == sorted(movies, reverse=True) and 'Nothing' in movies
+
+    def test_vectorOperations(self):
+        py.test.importorskip('numpy')
+        from gnr.sql import gnrsqlvector
+        def attributes(bag):
+            return [(n.label, n.attr.items(), attributes(n.value) if n.value else None) for n in bag]
+        def run(threshold):
+            saved = gnrsqlvector.VECTOR_THRESHOLD
+            gnrsqlvector.VECTOR_THRESHOLD = threshold
+            try:
+                sel = self.myquery.selection()
+                sel.sort('movie', 'role:d', 'person:a*')
+                totals = sel.totalize(group_by=['movie', 'role'], sum=['id'], keep=['person'], distinct=['person'])
+                return sel.output('list'), attributes(totals)
+            finally:
+                gnrsqlvector.VECTOR_THRESHOLD = saved
+        assert run(0) == run(len(self.mysel) + 1)
+
     def xtest_formatSelection(self):
         sel = self.db.query('video.dvd', columns='$purchasedate, @movie_id.title AS title').selection()
         assert sel.output('list')[0][1] == 'Match point'
@@ -0,0 +1,89 @@
+# -*- coding: UTF-8 -*-
+"""
+this test module focus on the connection pool
+"""
+
+import sqlite3
+import threading
+
+import py.test
+
+from gnr.sql.gnrsqlpool import DbStorePool, DbConnectionPool, GnrSqlPoolTimeout
+from gnr.sql.adapters._gnrbaseadapter import SqlDbAdapter
+
+class FakeAdapter(SqlDbAdapter):
+    def __init__(self):
+        self.opened = 0
+
+    def connect(self, storename=None):
+        self.opened += 1
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+class FakeDb(object):
+    def __init__(self):
+        self.adapter = FakeAdapter()
+        self.released = 0
+
+    def releaseDeadThreadConnections(self):
+        self.released += 1
+
+def test_reuse():
+    adapter = FakeAdapter()
+    pool = DbStorePool(adapter, 'main', max_size=2)
+    conn = pool.checkout()
+    cursor = conn.cursor()
+    cursor.execute('SELECT 1;')
+    assert cursor.fetchall() == [(1,)]
+    conn.close()
+    assert pool.checkout() is conn
+    assert adapter.opened == 1
+    stats = pool.stats()
+    assert stats['checkouts'] == 2
+    assert stats['in_use'] == 1
+
+def test_timeout():
+    pool = DbStorePool(FakeAdapter(), 'main', max_size=1, timeout=0.1)
+    conn = pool.checkout()
+    py.test.raises(GnrSqlPoolTimeout, pool.checkout)
+    assert pool.stats()['timeouts'] == 1
+    conn.close()
+    assert pool.checkout() is conn
+
+def test_wait_for_checkin():
+    pool = DbStorePool(FakeAdapter(), 'main', max_size=1, timeout=5)
+    conn = pool.checkout()
+    threading.Timer(0.1, conn.close).start()
+    assert pool.checkout() is conn
+    assert pool.stats()['waits'] == 1
+
+def test_health_check():
+    adapter = FakeAdapter()
+    pool = DbStorePool(adapter, 'main', max_size=1)
+    conn = pool.checkout()
+    conn.close()
+    conn._steady._con.close()
+    fresh = pool.checkout()
+    assert fresh is not conn
+    assert adapter.opened == 2
+    assert pool.stats()['failed_checks'] == 1
+
+def test_idle_eviction():
+    pool = DbStorePool(FakeAdapter(), 'main', max_size=2, max_idle=0.01, min_size=0)
+    conn = pool.checkout()
+    conn.last_used = 0
+    pool.checkin(conn)
+    conn.last_used = 0
+    pool.evictIdle()
+    assert pool.stats()['size'] == 0
+
+def test_store_pools():
+    db = FakeDb()
+    pool = DbConnectionPool(db, max_size=1, timeout=0.05)
+    c1 = pool.checkout('store_a')
+    c2 = pool.checkout('store_b')
+    assert c1.storename == 'store_a' and c2.storename == 'store_b'
+    py.test.raises(GnrSqlPoolTimeout, pool.checkout, 'store_a')
+    assert db.released == 1
+    stats = pool.stats()
+    assert stats['store_a?in_use'] == 1
+    assert stats['store_b?size'] == 1
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# -*- coding: UTF-8 -*-
+#--------------------------------------------------------------------------
+# package       : GenroPy core - see LICENSE for details
+# module gnrbag : an advanced data storage system
+# Copyright (c) : 2004 - 2007 Softwell sas - Milano 
+# Written by    : Giovanni Porcari, Michele Bertoldi
+#                 Saverio Porcari, Francesco Porcari , Francesco Cavazzana
+#--------------------------------------------------------------------------
+#This library is free software; you can redistribute it and/or
+#modify it under the terms of the GNU Lesser General Public
+#License as published by the Free Software Foundation; either
+#version 2.1 of the License, or (at your option) any later version.
+
+#This library is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#Lesser General Public License for more details.
+
+#You should have received a copy of the GNU Lesser General Public
+#License along with this library; if not, write to the Free Software
+#Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""
+this test module focus on the loading of hierarchical tables
+"""
+
+import logging
+
+gnrlogger = logging.getLogger('gnr')
+hdlr = logging.FileHandler('logs.log')
+gnrlogger.addHandler(hdlr)
+
+from gnr.sql.gnrsql import GnrSqlDb
+from gnr.core.gnrbag import Bag
+
+
+def setup_module(module):
+    logging.getLogger('gnr.sql.gnrsql').setLevel(logging.INFO)
+    module.CONFIG = Bag('data/configTest.xml')
+
+def configurePackage(pkg):
+    account = pkg.table('account', pkey='id', hierarchical='pkey', caption_field='code')
+    account.column('id', size='22')
+    account.column('code')
+    account.column('parent_id', size='22').relation('account.id', relation_name='_children')
+    account.column('hierarchical_pkey')
+    account.formulaColumn('child_count', select=dict(columns='COUNT(*)', table='acc.account',
+                                                     where='$parent_id=#THIS.id'), dtype='L')
+    account.formulaColumn('hlevel', "length($hierarchical_pkey)-length(replace($hierarchical_pkey,'/',''))+1",
+                          dtype='L')
+    entry = pkg.table('entry', pkey='id', caption_field='description')
+    entry.column('id', size='22')
+    entry.column('description')
+    entry.column('account_id', size='22').relation('account.id')
+
+def treeNodes(bag):
+    result = []
+    def cb(node, _pathlist=None, **kwargs):
+        result.append(('.'.join(_pathlist + [node.label]), sorted(node.attr.items())))
+    bag.walk(cb, _pathlist=[])
+    return result
+
+class BaseSql(object):
+    def setup_class(cls):
+        cls.init()
+        cls.db.createDb(cls.dbname)
+        configurePackage(cls.db.packageSrc('acc'))
+        cls.db.startup()
+        cls.db.checkDb(applyChanges=True)
+        account = cls.db.table('acc.account')
+        entry = cls.db.table('acc.entry')
+        for pkey in ('a', 'a_1', 'a_1_1', 'a_1_1_1', 'a_1_2', 'a_2', 'b', 'b_1'):
+            steps = pkey.split('_')
+            hpkey = '/'.join(['_'.join(steps[:i + 1]) for i in range(len(steps))])
+            account.insert(dict(id=pkey, code='C%s' % pkey, hierarchical_pkey=hpkey,
+                                parent_id='_'.join(steps[:-1]) or None))
+            entry.insert(dict(id='e%s' % pkey, description='E%s' % pkey, account_id=pkey))
+        cls.db.commit()
+        cls.handler = account.hierarchicalHandler
+        account.hierarchicalSearch = cls.handler.hierarchicalSearch
+
+    def countQueries(self, cb):
+        count = []
+        execute = self.db.execute
+        def countingExecute(*args, **kwargs):
+            count.append(True)
+            return execute(*args, **kwargs)
+        self.db.execute = countingExecute
+        try:
+            result = cb()
+        finally:
+            del self.db.execute
+        return result, len(count)
+
+    def test_preloadedTree(self):
+        for related_kwargs in ({}, dict(table='acc.entry', path='account_id')):
+            for kwargs in (dict(), dict(root_id='a_1'), dict(parent_id='a')):
+                lazy, lazy_queries = self.countQueries(lambda: treeNodes(
+                        self.handler.getHierarchicalData(related_kwargs=related_kwargs, resolved=True,
+                                                         preload=False, **kwargs)))
+                preloaded, preloaded_queries = self.countQueries(lambda: treeNodes(
+                        self.handler.getHierarchicalData(related_kwargs=related_kwargs, resolved=True, **kwargs)))
+                assert preloaded == lazy
+                assert preloaded_queries <= lazy_queries
+        tree, queries = self.countQueries(lambda: treeNodes(self.handler.getHierarchicalData(resolved=True)))
+        assert len(tree) == 9
+        assert queries == 1
+
+    def test_preloadLevels(self):
+        tree = self.handler.getHierarchicalData(preload=2)
+        root = tree['root']
+        assert root.getNode('a.a_1').getAttr('child_count') == 2
+        assert root.getNode('a.a_1.a_1_1').getAttr('child_count') == 1
+        assert root.getNode('a.a_1.a_1_1').getValue('static') is not None
+        assert root['a.a_1.a_1_1.a_1_1_1'] is None
+
+    def test_getAncestors(self):
+        assert [r['id'] for r in self.handler.getAncestors(pkey='a_1_1_1')] == ['a', 'a_1', 'a_1_1', 'a_1_1_1']
+        assert [r['id'] for r in self.handler.getAncestors(pkey='a_1_1', meToo=False)] == ['a', 'a_1']
+        assert self.handler.getHierarchicalPathsFromPkeys(pkeys='a_1_1,b_1') == 'a.a_1.a_1_1,b.b_1'
+
+    def teardown_class(cls):
+        cls.db.closeConnection()
+        cls.db.dropDb(cls.dbname)
+
+
+class TestGnrSqlDb_sqlite(BaseSql):
+    def init(cls):
+        cls.name = 'sqlite'
+        cls.dbname = CONFIG['db.sqlite?filename']
+        cls.db = GnrSqlDb(dbname=cls.dbname)
+
+    init = classmethod(init)
+
+class TestGnrSqlDb_postgres(BaseSql):
+    def init(cls):
+        cls.name = 'postgres'
+        cls.dbname = CONFIG['db.postgres?dbname']
+        cls.db = GnrSqlDb(implementation='postgres',
+                          host=CONFIG['db.postgres?host'],
+                          port=CONFIG['db.postgres?port'],
+                          dbname=cls.dbname,
+                          user=CONFIG['db.postgres?user'],
+                          password=CONFIG['db.postgres?password']
+                          )
+
+    init = classmethod(init)
@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+"""
+this test module focus on the process-wide table cache
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from gnr.sql.gnrsql import GnrSqlDb
+from gnr.sql.gnrsqlcache import TableCache, TableCachePoller, encodeChanges, decodeChanges
+
+def fromCache(cache=None, pkey=None):
+    pkey = str(pkey)
+    if pkey in cache:
+        return cache[pkey], True
+    cache[pkey] = 'record %s' % pkey
+    return cache[pkey], False
+
+def fill(tablecache, table='pkg.tbl', storename='_main_db', pkeys=(1,)):
+    return [tablecache.cachedData(table, 'cachedRecord', fromCache, storename=storename, pkey=pkey)
+            for pkey in pkeys]
+
+def setup_module(module):
+    module.folder = tempfile.mkdtemp()
+    module.logpath = os.path.join(folder, 'db.tablecache')
+
+def teardown_module(module):
+    shutil.rmtree(module.folder)
+
+def test_lru():
+    tablecache = TableCache(None, size=2, max_items=3)
+    assert fill(tablecache, pkeys=(1, 1)) == ['record 1', 'record 1']
+    assert tablecache.stats()['hits'] == 1
+    fill(tablecache, pkeys=range(10))
+    assert len(tablecache._cache[('_main_db', 'pkg.tbl', 'cachedRecord')]) == 3
+    fill(tablecache, table='pkg.other')
+    fill(tablecache, table='pkg.third')
+    assert tablecache.stats()['size'] == 2
+    assert ('_main_db', 'pkg.tbl', 'cachedRecord') not in tablecache._cache
+
+def test_invalidate():
+    tablecache = TableCache(None)
+    fill(tablecache)
+    fill(tablecache, storename='store_b')
+    fill(tablecache, table='pkg.other')
+    tablecache.onCommitted({'store_b': set(['pkg.tbl'])})
+    assert sorted(tablecache._cache.keys()) == [('_main_db', 'pkg.other', 'cachedRecord'),
+                                                ('_main_db', 'pkg.tbl', 'cachedRecord')]
+    tablecache.invalidate(['pkg.tbl'])
+    assert tablecache._cache.keys() == [('_main_db', 'pkg.other', 'cachedRecord')]
+
+def test_messages():
+    assert decodeChanges(encodeChanges('a', 'store', set(['pkg.b', 'pkg.a']))) == ('a', 'store', ['pkg.a', 'pkg.b'])
+    assert decodeChanges(encodeChanges('a', 'store', ['pkg.t%05i' % i for i in range(1000)])) == ('a', 'store', None)
+    assert decodeChanges(None) == (None, None, None)
+
+def test_poller():
+    writer = TableCache(None, transport=TableCachePoller(logpath))
+    reader = TableCache(None, transport=TableCachePoller(logpath))
+    fill(writer)
+    fill(reader)
+    fill(reader, table='pkg.other')
+    writer.onCommitted({'_main_db': set(['pkg.tbl'])})
+    assert writer._cache.keys() == []
+    writer.transport.poll(writer)
+    reader.transport.poll(reader)
+    assert reader._cache.keys() == [('_main_db', 'pkg.other', 'cachedRecord')]
+    writer.transport.maxsize = 0
+    writer.onCommitted({'_main_db': set(['pkg.tbl'])})
+    assert not os.path.exists(logpath)
+    reader.transport.poll(reader)
+    assert reader._cache.keys() == []
+    fill(reader)
+    writer.onCommitted({'_main_db': set(['pkg.other'])})
+    reader.transport.poll(reader)
+    assert reader._cache.keys() == [('_main_db', 'pkg.tbl', 'cachedRecord')]
+
+def test_threads():
+    tablecache = TableCache(None)
+    def slowCache(cache=None, pkey=None):
+        if pkey in cache:
+            return cache[pkey], True
+        time.sleep(0.001)
+        cache[pkey] = 'record %s' % pkey
+        return cache[pkey], False
+    def reader():
+        for i in range(20):
+            tablecache.cachedData('pkg.tbl', 'cachedRecord', slowCache, pkey='p%i' % (i % 5))
+    threads = [threading.Thread(target=reader) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(tablecache._cache[(None, 'pkg.tbl', 'cachedRecord')].keys()) == ['p0', 'p1', 'p2', 'p3', 'p4']
+    assert tablecache.stats()['misses'] == 5
+    nested = lambda cache=None: (fill(tablecache, table='pkg.other'), True)
+    assert tablecache.cachedData('pkg.tbl', 'nested', nested) == ['record 1']
+
+def test_db():
+    db = GnrSqlDb(dbname=':memory:')
+    tbl = db.packageSrc('pkg').table('tbl', pkey='id')
+    tbl.column('id', size='4')
+    tbl.column('name')
+    tbl.formulaColumn('owned', sql_formula="$name = :env_user", dtype='B')
+    tbl.pyColumn('upper', py_method='pyColumn_upper')
+    db.startup()
+    db.checkDb(applyChanges=True)
+    tblobj = db.table('pkg.tbl')
+    tblobj.insert(dict(id='0001', name='alfa'))
+    db.commit()
+    db.updateEnv(user='alfa')
+    assert tblobj.cachedRecord('0001', virtual_columns='owned')['owned'] == 1
+    db.updateEnv(user='beta')
+    assert tblobj.cachedRecord('0001', virtual_columns='owned')['owned'] == 0
+    assert tblobj.cachedRecord('0001')['name'] == 'alfa'
+    assert tblobj._virtualColumnsEnvKey(set(['upper'])) is None
+    tblobj.insert(dict(id='0002', name='gamma'))
+    assert tblobj.cachedRecord('0002')['name'] == 'gamma'
+    db.rollback()
+    assert [k for k in db.tableCache._cache if k[1] == 'pkg.tbl'] == []
+    db.closeConnection()
+
+def test_stores():
+    db = GnrSqlDb(dbname=':memory:')
+    db.packageSrc('pkg').table('tbl', pkey='id').column('id', size='4')
+    db.packageSrc('pkg').table('shared', pkey='id').column('id', size='4')
+    db.startup()
+    tblobj = db.table('pkg.tbl')
+    shared = db.table('pkg.shared')
+    shared.use_dbstores = lambda **kwargs: False
+    db.updateEnv(storename='store_x')
+    assert tblobj.tableCachedData('cachedRecord', fromCache, pkey=1) == 'record 1'
+    assert shared.tableCachedData('cachedRecord', fromCache, pkey=1) == 'record 1'
+    assert sorted(db.tableCache._cache.keys()) == [('_main_db', 'pkg.shared', 'cachedRecord'),
+                                                   ('store_x', 'pkg.tbl', 'cachedRecord')]
+    db.updateEnv(storename='store_y')
+    db.tableChanged(shared)
+    db.tableChanged(tblobj)
+    assert db.currentEnv['_tablecache_changes'] == {'_main_db': set(['pkg.shared']), 'store_y': set(['pkg.tbl'])}
+    db.tableCache.onCommitted(db.currentEnv.pop('_tablecache_changes'))
+    assert db.tableCache._cache.keys() == [('store_x', 'pkg.tbl', 'cachedRecord')]
@@ -0,0 +1,40 @@
+# -*- coding: UTF-8 -*-
+"""
+this test module focus on the per-request sql profile
+"""
+
+from gnr.sql.gnrsql import GnrSqlDb
+from gnr.sql.gnrsqlprofile import SqlProfileSummary, profilingEnabled
+
+def test_profile():
+    db = GnrSqlDb(dbname=':memory:')
+    profile = db.startSqlProfile(name='index', nplusone_threshold=3)
+    assert db.sqlProfile is profile
+    for i in range(4):
+        db.execute('SELECT :v AS v', dict(v=i)).fetchall()
+    for i in range(4):
+        db.execute('SELECT :v AS w', dict(v=1)).fetchall()
+    assert db.stopSqlProfile() is profile
+    assert db.sqlProfile is None
+    db.execute('SELECT 1').fetchall()
+    result = profile.result()
+    assert result['queries'] == 8
+    assert result['statements'] == 2
+    assert [(r['sql'], r['count'], r['distinct']) for r in result['n_plus_one']] == [('SELECT :v AS v', 4, 4)]
+
+def test_summary():
+    summary = SqlProfileSummary(size=3)
+    repeated = [dict(sql='SELECT 1', table='pkg.tbl', count=20, distinct=20, time=0.1)]
+    for i in range(4):
+        summary.add(dict(name='index', total_time=1., queries=i + 1, statements=1, db_time=0.5,
+                         rows=10, pycolumns_time=0., n_plus_one=repeated if i else []))
+    item = summary.summary()['index']
+    assert item['requests'] == 3
+    assert item['avg_queries'] == 3.
+    assert item['max_queries'] == 4
+    assert item['n_plus_one'] == [dict(sql='SELECT 1', table='pkg.tbl', requests=3, count=60)]
+
+def test_profilingEnabled():
+    assert profilingEnabled(None)
+    assert profilingEnabled('y') and profilingEnabled(True)
+    assert not profilingEnabled('false') and not profilingEnabled('n') and not profilingEnabled(False)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+this test module focus on the keyset pagination of queries
+"""
+
+from gnr.sql.gnrsql import GnrSqlDb
+from gnr.sql.gnrsqldata import keysetOrderBy
+from gnr.core.gnrbag import Bag
+
+NAMES = ['b', None, 'a', 'c', 'b', None, 'a', 'd', 'b', 'c', None]
+
+def setup_module(module):
+    module.CONFIG = Bag('data/configTest.xml')
+
+def test_keysetOrderBy():
+    assert keysetOrderBy('$name desc, @account_id.code', 'id') == [('$name', True), ('@account_id.code', False),
+                                                                   ('$id', False)]
+    assert keysetOrderBy('name,$id DESC', 'id') == [('$name', False), ('$id', True)]
+    assert keysetOrderBy('lower($name)', 'id') is None
+
+class BaseSql(object):
+    def setup_class(cls):
+        cls.init()
+        cls.db.createDb(cls.dbname)
+        item = cls.db.packageSrc('ks').table('item', pkey='id')
+        item.column('id', size='4')
+        item.column('name')
+        cls.db.startup()
+        cls.db.checkDb(applyChanges=True)
+        tblobj = cls.db.table('ks.item')
+        for i, name in enumerate(NAMES):
+            tblobj.insert(dict(id='%04i' % i, name=name))
+        cls.db.commit()
+
+    def pages(self, order_by, size):
+        tblobj = self.db.table('ks.item')
+        result = []
+        after = None
+        while True:
+            query = tblobj.query(columns='$name', order_by=order_by)
+            query.setKeyset(query.keyset(), after=after, limit=size)
+            rows = query.fetch()
+            result.extend([r['pkey'] for r in rows])
+            if len(rows) < size:
+                return result
+            after = [rows[-1]['_keyset_%i' % i] for i in range(len(query.keyset()) - 1)] + [rows[-1]['pkey']]
+
+    def test_pages(self):
+        tblobj = self.db.table('ks.item')
+        for order_by in ('$name', '$name desc', '$name,$id desc'):
+            query = tblobj.query(columns='$name', order_by=order_by)
+            query.setKeyset(query.keyset())
+            expected = [r['pkey'] for r in query.fetch()]
+            assert len(expected) == len(NAMES)
+            for size in (1, 2, 3, 5):
+                assert self.pages(order_by, size) == expected
+
+    def test_estimatedCount(self):
+        query = self.db.table('ks.item').query(where='$name IS NOT NULL')
+        assert query.estimatedCount() == 8
+
+    def teardown_class(cls):
+        cls.db.closeConnection()
+        cls.db.dropDb(cls.dbname)
+
+class TestGnrSqlDb_sqlite(BaseSql):
+    def init(cls):
+        cls.name = 'sqlite'
+        cls.dbname = CONFIG['db.sqlite?filename']
+        cls.db = GnrSqlDb(dbname=cls.dbname)
+
+    init = classmethod(init)
+
+class TestGnrSqlDb_postgres(BaseSql):
+    def init(cls):
+        cls.name = 'postgres'
+        cls.dbname = CONFIG['db.postgres?dbname']
+        cls.db = GnrSqlDb(implementation='postgres',
+                          host=CONFIG['db.postgres?host'],
+                          port=CONFIG['db.postgres?port'],
+                          dbname=cls.dbname,
+                          user=CONFIG['db.postgres?user'],
+                          password=CONFIG['db.postgres?password']
+                          )
+
+    init = classmethod(init)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+this test module focus on the transactions claimed by the workers of the transaction daemon
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+from gnr.sql.gnrsql import GnrSqlDb
+from gnr.core.gnrbag import Bag
+from gnr.app.gnrtransactionqueue import TransactionQueue
+
+REQUEST = datetime(2020, 1, 1)
+
+def setup_module(module):
+    module.CONFIG = Bag('data/configTest.xml')
+
+class BaseSql(object):
+    def setup_class(cls):
+        cls.init()
+        cls.db.createDb(cls.dbname)
+        tbl = cls.db.packageSrc('gnr').table('transaction', pkey='id')
+        tbl.column('id', size=':22')
+        tbl.column('queue_id', size=':22')
+        tbl.column('request', dtype='DH')
+        tbl.column('execution_start', dtype='DH')
+        tbl.column('execution_end', dtype='DH')
+        tbl.column('error_id', size=':22')
+        tbl.column('data', dtype='X')
+        cls.db.startup()
+        cls.db.checkDb(applyChanges=True)
+        cls.queue = TransactionQueue(cls.db, 'gnr.transaction')
+
+    def fill(self, rows):
+        tblobj = self.db.table('gnr.transaction')
+        tblobj.sql_deleteSelection(where='$id IS NOT NULL')
+        for i, queue_id, minutes in rows:
+            tblobj.insert(dict(id=i, queue_id=queue_id, request=REQUEST + timedelta(minutes=minutes)))
+        self.db.commit()
+
+    def claimAll(self):
+        result = []
+        transaction = self.queue.claim()
+        while transaction:
+            result.append(transaction['id'])
+            transaction = self.queue.claim()
+        return result
+
+    def test_claim(self):
+        self.fill([('1', 'q1', 0), ('2', 'q1', 1), ('3', 'q2', 2), ('4', None, 3), ('5', 'q2', 4), ('6', 'q3', 5)])
+        tblobj = self.db.table('gnr.transaction')
+        tblobj.update(dict(id='6', execution_start=REQUEST, execution_end=REQUEST, error_id='e'))
+        tblobj.insert(dict(id='7', queue_id='q3', request=REQUEST + timedelta(minutes=6)))
+        self.db.commit()
+        assert self.claimAll() == ['1', '3', '4']
+        tblobj.update(dict(id='1', execution_end=datetime.now()))
+        self.db.commit()
+        assert self.claimAll() == ['2']
+        assert self.queue.pending()[0] == 2
+        self.queue.releaseClaims()
+        assert self.queue.pending() == (5, REQUEST + timedelta(minutes=1))
+        assert self.claimAll() == ['2', '3', '4']
+
+    def test_workers(self):
+        if not self.db.adapter.support_skip_locked:
+            return
+        self.fill([('%02i' % i, None, i) for i in range(40)])
+        locked = threading.Event()
+        done = threading.Event()
+        def lockFirst():
+            self.db.table('gnr.transaction').query(where='$id=:id', id='00', for_update=True).fetch()
+            locked.set()
+            done.wait()
+            self.db.rollback()
+            self.db.closeConnection()
+        locker = threading.Thread(target=lockFirst)
+        locker.start()
+        locked.wait()
+        assert self.queue.claim()['id'] == '01'
+        claimed = []
+        def worker():
+            claimed.extend(self.claimAll())
+            self.db.closeConnection()
+        workers = [threading.Thread(target=worker) for i in range(4)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        done.set()
+        locker.join()
+        assert sorted(claimed) == ['%02i' % i for i in range(2, 40)]
+        assert self.claimAll() == ['00']
+
+    def teardown_class(cls):
+        cls.db.closeConnection()
+        cls.db.dropDb(cls.dbname)
+
+class TestGnrSqlDb_sqlite(BaseSql):
+    def init(cls):
+        cls.name = 'sqlite'
+        cls.dbname = CONFIG['db.sqlite?filename']
+        cls.db = GnrSqlDb(dbname=cls.dbname)
+
+    init = classmethod(init)
+
+class TestGnrSqlDb_postgres(BaseSql):
+    def init(cls):
+        cls.name = 'postgres'
+        cls.dbname = CONFIG['db.postgres?dbname']
+        cls.db = GnrSqlDb(implementation='postgres',
+                          host=CONFIG['db.postgres?host'],
+                          port=CONFIG['db.postgres?port'],
+                          dbname=cls.dbname,
+                          user=CONFIG['db.postgres?user'],
+                          password=CONFIG['db.postgres?password']
+                          )
+
+    init = classmethod(init)
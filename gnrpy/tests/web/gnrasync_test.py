@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+import datetime
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip('tornado')
+
+from gnr.core.gnrbag import Bag
+from gnr.core.gnrclasses import GnrClassCatalog
+from gnr.core.gnrstring import fromJson
+from gnr.web.gnrasync import SharedObject, typedJson
+
+class FakeApp(object):
+    catalog = GnrClassCatalog()
+
+class FakeLoop(object):
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback(self, cb):
+        self.callbacks.append(cb)
+
+    def tick(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for cb in callbacks:
+            cb()
+
+class FakeChannel(object):
+    def __init__(self):
+        self.messages = []
+
+    def write_message(self, message):
+        self.messages.append(fromJson(message))
+
+class FakeServer(object):
+    def __init__(self):
+        self.gnrapp = FakeApp()
+        self.io_loop = FakeLoop()
+        self.channels = {}
+
+class FakeManager(object):
+    def __init__(self):
+        self.server = FakeServer()
+
+def makeSharedObject(*page_ids):
+    so = SharedObject(FakeManager(), 'so1')
+    for page_id in page_ids:
+        so.server.channels[page_id] = FakeChannel()
+        so.subscribed_pages[page_id] = dict(page_id=page_id)
+    return so
+
+def sentChanges(channel):
+    return [m['data']['changes'] for m in channel.messages]
+
+def test_typedJson():
+    catalog = GnrClassCatalog()
+    value = dict(day=datetime.date(2020, 5, 1), amount=Decimal('1.20'), n=3, text=u'a::b', empty='', missing=None)
+    result = typedJson(catalog, value)
+    assert result['n'] == '3::L' and result['missing'] is None
+    decoded = dict([(k, catalog.fromTypedText(v) if v is not None else None) for k, v in result.items()])
+    assert decoded == value
+    assert isinstance(decoded['amount'], Decimal)
+    xml = typedJson(catalog, Bag(dict(a=Decimal('2.5'))))
+    assert xml.endswith('::X') and Bag(xml[:-3])['a'] == Decimal('2.5')
+
+def test_merge_changes():
+    so = makeSharedObject('p1', 'p2')
+    so.queueChange(path='a', value=1, evt='upd', from_page_id='p1')
+    so.queueChange(path='a', value=2, evt='upd', from_page_id='p1')
+    so.queueChange(path='a', value=3, evt='upd', from_page_id='p2')
+    so.queueChange(path='a', value=4, evt='upd', from_page_id='p2')
+    so.queueChange(path='chat', value='x', fired=True, from_page_id='p2')
+    so.queueChange(path='chat', value='y', fired=True, from_page_id='p2')
+    assert [(c['path'], c['value'], c['from_page_id']) for c in so.pending_changes] == \
+           [('a', '2::L', 'p1'), ('a', '4::L', 'p2'), ('chat', 'x', 'p2'), ('chat', 'y', 'p2')]
+    assert len(so.server.io_loop.callbacks) == 1
+
+def test_flush_order():
+    so = makeSharedObject('p1', 'p2')
+    so.queueChange(path='a', value=1, evt='upd', from_page_id='p1')
+    so.queueChange(path='b', value=Bag(), evt='ins', from_page_id='p1')
+    so.queueChange(path='a', value=2, evt='upd', from_page_id='p1')
+    so.queueChange(path='b', evt='del', from_page_id='p1')
+    so.server.io_loop.tick()
+    assert so.pending_changes == []
+    assert sentChanges(so.server.channels['p1']) == []
+    changes = sentChanges(so.server.channels['p2'])
+    assert len(changes) == 1
+    assert [(c['path'], c['evt']) for c in changes[0]] == [('a', 'upd'), ('b', 'ins'), ('a', 'upd'), ('b', 'del')]
+    so.queueChange(path='c', value=1, evt='upd', from_page_id='p2')
+    assert len(so.server.io_loop.callbacks) == 1
+    so.server.io_loop.tick()
+    assert [c['path'] for c in sentChanges(so.server.channels['p1'])[0]] == ['c']
+    so.flushChanges()
+    assert len(so.server.channels['p1'].messages) == 1
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+import os
+import gzip
+import shutil
+import tempfile
+
+from gnr.web.gnrbundler import AssetBundler, BundleManifest
+
+class FakeStatic(object):
+    def __init__(self, base):
+        self.base = base
+
+    def path(self, *args):
+        return os.path.join(self.base, *args)
+
+    def url(self, *args):
+        return '/_site/%s' % '/'.join(args)
+
+class FakeApp(object):
+    packages = {}
+
+class FakeSite(object):
+    gnrapp = FakeApp()
+    resources = {}
+    gnr_path = {}
+    dojo_path = {}
+
+    def __init__(self, site_static_dir):
+        self.site_static_dir = site_static_dir
+
+    def getStatic(self, static_name):
+        return FakeStatic(self.site_static_dir)
+
+def setup_module(module):
+    module.site_static_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(site_static_dir, 'css'))
+
+def teardown_module(module):
+    shutil.rmtree(module.site_static_dir)
+
+def test_bundle_and_manifest():
+    site = FakeSite(site_static_dir)
+    js = os.path.join(site_static_dir, 'a.js')
+    css = os.path.join(site_static_dir, 'css', 'b.css')
+    with open(js, 'w') as f:
+        f.write('var a = 1;  // comment\n')
+    with open(css, 'w') as f:
+        f.write('.b{background:url("img/b.png")} .c{background:url(/c.png)}')
+    bundler = AssetBundler(site)
+    os.makedirs(bundler.folder)
+    js_name = bundler.bundle([js], 'js', name='page')
+    css_name = bundler.bundle([css], 'css', name='page')
+    bundler.writeManifest()
+    assert js_name.startswith('page-') and js_name.endswith('.js')
+    with gzip.open(os.path.join(bundler.folder, '%s.gz' % js_name)) as f:
+        assert f.read() == 'var a=1;'
+    with open(os.path.join(bundler.folder, css_name)) as f:
+        assert f.read() == '.b{background:url(/_site/css/img/b.png)} .c{background:url(/c.png)}'
+    manifest = BundleManifest(site)
+    assert manifest.url([js]) == '/_site/_static/_bundles/%s' % js_name
+    assert manifest.url([js, css]) is None
+    with open(js, 'a') as f:
+        f.write('var b;\n')
+    assert manifest.url([js]) is None
+    bundler = AssetBundler(site)
+    new_name = bundler.bundle([js], 'js', name='page')
+    bundler.writeManifest()
+    assert new_name != js_name
+    assert manifest.url([js]) == '/_site/_static/_bundles/%s' % new_name
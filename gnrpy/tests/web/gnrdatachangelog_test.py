@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+import cPickle as pickle
+
+from gnr.web.gnrwebpage import ClientDataChange, DataChangeLog, PathPrefixIndex
+
+def test_sequence_and_since():
+    log = DataChangeLog()
+    for i in range(5):
+        log.append(ClientDataChange('a.b%i' % i, i))
+    assert [c.change_idx for c in log] == [1, 2, 3, 4, 5]
+    assert [c.value for c in log.since(3)] == [3, 4]
+    log.clear()
+    assert len(log) == 0
+    assert log.append(ClientDataChange('a', 0)).change_idx == 6
+
+def test_replace_and_compact():
+    log = DataChangeLog()
+    log.compactThreshold = 2
+    for i in range(10):
+        log.append(ClientDataChange('thermo.line', i, reason='tl_upd'), replace=True)
+        log.append(ClientDataChange('chat', i, fired=True), replace=True)
+    log.append(ClientDataChange('thermo.line', 'x', reason='other'), replace=True)
+    assert [(c.path, c.value) for c in log] == [('thermo.line', 9), ('chat', 9), ('thermo.line', 'x')]
+    assert len(log.changes) < 20
+    assert [c.value for c in log.since(19)] == [9, 'x']
+    log.drop('thermo')
+    assert [c.path for c in pickle.loads(pickle.dumps(log, 2))] == ['chat']
+
+def test_path_prefix_index():
+    index = PathPrefixIndex(['gnr.batch', 'gnr', 'other.x'])
+    assert sorted(index.match('gnr.batch.b1.thermo')) == ['gnr', 'gnr.batch']
+    assert index.match('othe') == []
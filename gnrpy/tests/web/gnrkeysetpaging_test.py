@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+
+from gnr.core.gnrbag import Bag
+from gnr.sql.gnrsql import GnrSqlDb
+from gnr.web._gnrbasewebpage import GnrBaseWebPage
+from gnr.web.gnrwebpage_proxy.apphandler import GnrWebAppHandler
+
+NAMES = ['b', None, 'a', 'c', 'b', None, 'a', 'd', 'b', 'c', None]
+
+class PageStore(object):
+    def __init__(self):
+        self.bag = Bag()
+
+    def __enter__(self):
+        return self.bag
+
+    def __exit__(self, *args):
+        pass
+
+class Site(object):
+    gnrapp = None
+
+class Page(object):
+    """The page methods used by the grid selections"""
+    page_id = 'page1'
+    locale = 'en'
+    permissionPars = None
+    pageLocalDocument = GnrBaseWebPage.__dict__['pageLocalDocument']
+    freezeSelection = GnrBaseWebPage.__dict__['freezeSelection']
+    freezeSelectionUpdate = GnrBaseWebPage.__dict__['freezeSelectionUpdate']
+    unfreezeSelection = GnrBaseWebPage.__dict__['unfreezeSelection']
+    freezedPkeys = GnrBaseWebPage.__dict__['freezedPkeys']
+
+    def __init__(self, db, connectionFolder):
+        self.db = db
+        self.connectionFolder = connectionFolder
+        self.site = Site()
+        self._pageStore = PageStore()
+        self._userStore = Bag()
+        self.app = GnrWebAppHandler(self)
+
+    def _subscribe_event(self, event, obj):
+        pass
+
+    def pageStore(self, page_id=None):
+        return self._pageStore
+
+    def userStore(self):
+        return self._userStore
+
+def setup_module(module):
+    module.TMPDIR = tempfile.mkdtemp()
+    db = GnrSqlDb(dbname=os.path.join(TMPDIR, 'paging.db'))
+    item = db.packageSrc('ks').table('item', pkey='id')
+    item.column('id', size='4')
+    item.column('name')
+    db.startup()
+    db.checkDb(applyChanges=True)
+    tblobj = db.table('ks.item')
+    for i, name in enumerate(NAMES):
+        tblobj.insert(dict(id='%04i' % i, name=name))
+    db.commit()
+    module.PAGE = Page(db, os.path.join(TMPDIR, 'connections'))
+
+def teardown_module(module):
+    PAGE.db.closeConnection()
+    shutil.rmtree(TMPDIR)
+
+def pkeys(result):
+    return [n.attr['_pkey'] for n in result]
+
+def test_next_pages():
+    page = PAGE
+    fpath = page.pageLocalDocument('grid')
+    result, attributes = page.app.getSelection(table='ks.item', columns='$name', selectionName='*grid',
+                                               order_by='$name', row_start='0', row_count='4',
+                                               numberedRows=False, pagingMode='keyset')
+    assert attributes['pagingMode'] == 'keyset' and attributes['totalrows'] == len(NAMES)
+    expected = page.db.table('ks.item').query(columns='$name', order_by='$name,$id').selection().output('pkeylist')
+    rows = pkeys(result)
+    # the following pages are requested as the virtual store of the grid does
+    for row_start in ('4', '8'):
+        result, attributes = page.app.getSelection(selectionName='grid', row_start=row_start, row_count='4',
+                                                   sortedBy=None, table='ks.item', recordResolver=False,
+                                                   numberedRows=False)
+        assert attributes['debug'] == 'keyset'
+        rows.extend(pkeys(result))
+    assert rows == expected
+    assert not os.path.exists('%s.pik' % fpath)
+    assert page.unfreezeSelection('ks.item', 'grid').output('pkeylist') == expected
+    assert not os.path.exists('%s_paged.pik' % fpath)
+
+def test_new_frozen_selection():
+    page = PAGE
+    fpath = page.pageLocalDocument('grid2')
+    page.app.getSelection(table='ks.item', columns='$name', selectionName='*grid2', order_by='$name',
+                          row_start='0', row_count='4', pagingMode='keyset')
+    assert os.path.exists('%s_paged.pik' % fpath)
+    result, attributes = page.app.getSelection(table='ks.item', columns='$name', selectionName='*grid2',
+                                               where='$name IS NULL', order_by='$id', limit=10,
+                                               row_start='0', row_count='4', pagingMode='keyset')
+    assert attributes['totalrows'] == 3
+    assert not os.path.exists('%s_paged.pik' % fpath)
+    result, attributes = page.app.getSelection(selectionName='grid2', row_start='0', row_count='4',
+                                               table='ks.item', recordResolver=False, pagingMode='keyset')
+    assert attributes['debug'] == 'fromPickle'
+    assert len(result) == 3
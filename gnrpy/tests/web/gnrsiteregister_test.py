@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+import pytest
+
+pytest.importorskip('Pyro4')
+
+from gnr.web.gnrwsgisite_proxy.gnrsiteregister import SiteRegister, ShardedSiteRegister, shardIndex
+
+class FakeDaemon(object):
+    def register(self, obj, name):
+        pass
+
+class FakeServer(object):
+    daemon = FakeDaemon()
+
+def makeRegister(shards=1):
+    registers = []
+    for shard in range(shards):
+        register = SiteRegister(FakeServer(), sitename='test')
+        register.setConfiguration()
+        registers.append(register)
+    if shards == 1:
+        return registers[0]
+    register = ShardedSiteRegister(registers)
+    register.setConfiguration()
+    return register
+
+def populate(register):
+    for u in range(4):
+        user = 'user%i' % u
+        for c in range(2):
+            connection_id = 'c_%i_%i' % (u, c)
+            register.new_connection(connection_id, user=user, user_id=user)
+            for p in range(3):
+                page_id = 'p_%i_%i_%i' % (u, c, p)
+                register.new_page(page_id, pagename='index', connection_id=connection_id, user=user)
+                register.subscribeTable(page_id=page_id, table='pkg.tbl', subscribe=p == 0)
+
+def content(register):
+    return (sorted([p['register_item_id'] for p in register.pages()]),
+            sorted([c['register_item_id'] for c in register.connections()]),
+            sorted([u['register_item_id'] for u in register.users()]))
+
+def test_shardIndex():
+    assert shardIndex('abc', 1) == 0
+    assert shardIndex('abc', 4) == shardIndex(u'abc', 4)
+    assert len(set([shardIndex('page_%i' % i, 4) for i in range(50)])) == 4
+
+def test_sharded_register():
+    single = makeRegister()
+    sharded = makeRegister(3)
+    for register in (single, sharded):
+        populate(register)
+    assert content(single) == content(sharded)
+    assert all([len(shard.pages()) < 24 for shard in sharded.shards])
+    for register in (single, sharded):
+        assert register.refresh('p_0_0_0')['register_item_id'] == 'user0'
+        register.notifyDbEvents({'pkg.tbl': [1]}, register_name='page', origin_page_id='p_0_0_0')
+        envelope = register.handle_ping(page_id='p_1_0_0')
+        assert envelope['dataChanges.sc_0?change_path'] == 'gnr.dbchanges.pkg_tbl'
+        register.change_connection_user('c_3_0', user='user9', user_id='user9')
+        for p in range(3):
+            register.drop_page('p_0_0_%i' % p, cascade=True)
+        register.drop_connection('c_2_0', cascade=True)
+        register.drop_connection('c_2_1', cascade=True)
+    assert content(single) == content(sharded)
+    assert 'c_0_0' not in content(sharded)[1]
+    assert 'user2' not in content(sharded)[2]
+    assert sharded.page('p_3_0_1')['user'] == 'user9'
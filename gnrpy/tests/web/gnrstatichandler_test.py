@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+import os
+import gzip
+import shutil
+import tempfile
+
+from gnr.core.gnrbag import Bag
+from gnr.web.gnrwsgisite_proxy.gnrstatichandler import StaticHandlerManager, StaticHandler, parse_range
+
+CONTENT = ''.join([chr(i % 256) for i in range(100000)])
+
+class FakeSite(object):
+    cache_max_age = 3600
+    site_path = '/'
+
+    def __init__(self):
+        self.config = Bag()
+        self.statics = StaticHandlerManager(self)
+
+    def not_found_exception(self, environ, start_response):
+        start_response('404 Not Found', [])
+        return ['']
+
+class Response(object):
+    def __call__(self, status, headers):
+        self.status = status
+        self.headers = dict(headers)
+
+def serve(environ=None, **kwargs):
+    site = FakeSite()
+    env = {'REQUEST_METHOD': 'GET'}
+    env.update(environ or {})
+    response = Response()
+    body = ''.join(StaticHandler(site).serve(path, env, response, **kwargs))
+    return response, body
+
+def setup_module(module):
+    module.folder = tempfile.mkdtemp()
+    module.path = os.path.join(folder, 'doc.js')
+    with open(path, 'wb') as f:
+        f.write(CONTENT)
+    gz = gzip.GzipFile(path + '.gz', 'wb')
+    gz.write(CONTENT)
+    gz.close()
+
+def teardown_module(module):
+    shutil.rmtree(module.folder)
+
+def test_full_and_not_modified():
+    response, body = serve()
+    assert response.status == '200 OK'
+    assert body == CONTENT
+    assert response.headers['Content-Length'] == str(len(CONTENT))
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    response, body = serve({'HTTP_IF_NONE_MATCH': response.headers['ETag']})
+    assert response.status == '304 Not Modified' and body == ''
+
+def test_precompressed():
+    response, body = serve({'HTTP_ACCEPT_ENCODING': 'br;q=0, gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert body == open(path + '.gz', 'rb').read()
+    response, body = serve({'HTTP_IF_NONE_MATCH': response.headers['ETag']})
+    assert response.status == '304 Not Modified'
+    response, body = serve({'HTTP_ACCEPT_ENCODING': 'gzip'}, download=True)
+    assert 'Content-Encoding' not in response.headers and body == CONTENT
+
+def test_range():
+    response, body = serve({'HTTP_RANGE': 'bytes=100-199', 'HTTP_ACCEPT_ENCODING': 'gzip'})
+    assert response.status == '206 Partial Content'
+    assert response.headers['Content-Range'] == 'bytes 100-199/%i' % len(CONTENT)
+    assert body == CONTENT[100:200]
+    response, body = serve({'HTTP_RANGE': 'bytes=-10'})
+    assert body == CONTENT[-10:]
+    response, body = serve({'HTTP_RANGE': 'bytes=%i-' % len(CONTENT)})
+    assert response.status.startswith('416')
+    response, body = serve({'HTTP_RANGE': 'bytes=0-1', 'HTTP_IF_RANGE': '"stale"'})
+    assert response.status == '200 OK' and body == CONTENT
+
+def test_parse_range():
+    assert parse_range('bytes=0-', 10) == (0, 9)
+    assert parse_range('bytes=5-100', 10) == (5, 9)
+    assert parse_range('bytes=0-1,4-5', 10) is None
+    assert parse_range('bytes=20-30', 10) is False
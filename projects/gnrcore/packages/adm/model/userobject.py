@@ -17,6 +17,27 @@ class Table(object):
         tbl.column('private', 'B', name_long='!!Private')
         tbl.column('quicklist', 'B', name_long='!!Quicklist')
         tbl.column('flags', 'T', name_long='!!Flags')
+
+    def clearFormulaColumns(self,record=None):
+        if record.get('objtype') not in (None,'formulacolumn'):
+            return
+        table = record.get('tbl')
+        site = getattr(self.db.application,'site',None)
+        if site:
+            site.process_cmd.clearVirtualColumns(table=table)
+        else:
+            self.db.clearVirtualColumns(table=table)
+
+    def trigger_onInserted(self,record):
+        self.clearFormulaColumns(record)
+
+    def trigger_onUpdated(self,record,old_record=None):
+        self.clearFormulaColumns(record)
+        if old_record and old_record.get('tbl')!=record.get('tbl'):
+            self.clearFormulaColumns(old_record)
+
+    def trigger_onDeleted(self,record):
+        self.clearFormulaColumns(record)
                 
     def listUserObject(self, objtype=None,pkg=None, tbl=None, userid=None, authtags=None, onlyQuicklist=None, flags=None):
         onlyQuicklist = onlyQuicklist or False